@@ -9,8 +9,10 @@ def download_raw_crsp_data(data_dir, wrds_id):
     # Reference - Assignment Intruction:
     # "This should be the full dataset available on WRDS; do not pre-filter by SHRCD, EXCHCD, or date."
 
-    conn = wrds.Connection(wrds_username=wrds_id)
-    mcrsp_raw = conn.raw_sql("""
+    # The full history is split into date partitions that are fetched concurrently over a bounded pool of
+    # WRDS connections. Every partition is checkpointed, so a rerun after a dropped session only fetches
+    # the missing partitions and the partitions still open when they were fetched.
+    mcrsp_raw = download_partitioned(lambda: wrds.Connection(wrds_username=wrds_id), """
                           select a.permno, a.permco, a.date, b.shrcd, b.exchcd,
                           a.ret, a.retx, a.shrout, a.prc, a.cfacshr, a.cfacpr
                           from crspq.msf as a
@@ -18,11 +20,12 @@ def download_raw_crsp_data(data_dir, wrds_id):
                           on a.permno=b.permno
                           and b.namedt<=a.date
                           and a.date<=b.nameendt
-                          """)
-    conn.close()
+                          where a.date between '{start}' and '{end}'
+                          """, date_partitions(), os.path.join(data_dir, 'checkpoints'), 'mcrsp_raw',
+                          refresh=refresh_download)
     
-    # Store downloaded data in pickle format
-    mcrsp_raw.to_pickle(data_dir + 'mcrsp_raw.pkl')
+    # Store downloaded data in parquet format
+    save_artifact(mcrsp_raw, data_dir, 'mcrsp_raw')
     
     # Download CRSP monthly delisting returns
     conn = wrds.Connection(wrds_username=wrds_id)
@@ -32,8 +35,8 @@ def download_raw_crsp_data(data_dir, wrds_id):
                           """)
     conn.close()
     
-    # Store downloaded data in pickle format
-    dlret_raw.to_pickle(data_dir + 'dlret_raw.pkl')
+    # Store downloaded data in parquet format
+    save_artifact(dlret_raw, data_dir, 'dlret_raw', date_col='dlstdt')
     
 def download_ff3_monthly_data(data_dir):
     # Download and save FF3 monthly data
@@ -42,19 +45,21 @@ def download_ff3_monthly_data(data_dir):
                                                            end=str(datetime.datetime.now().year+1))
     FF_mkt = FF_mkt.read()[0]/100
 
-    FF_mkt['Date'] = pd.to_datetime(FF_mkt.index, format='%Y-%m-%d', errors='ignore')
-    FF_mkt['Year'] = FF_mkt['Date'].dt.year
-    FF_mkt['Month'] = FF_mkt['Date'].dt.month
-    FF_mkt.drop(['Date'], axis=1, inplace=True)
-
-    FF_mkt.columns = ['Market_minus_Rf', 'SMB', 'HML', 'Rf', 'Year', 'Month']
-    FF_mkt = FF_mkt[['Year', 'Month', 'Market_minus_Rf', 'SMB', 'HML', 'Rf']]
+    # Integer month id of the monthly periods, Year and Month are derived from it
+    FF_mkt.columns = ['Market_minus_Rf', 'SMB', 'HML', 'Rf']
+    FF_mkt['month_id'] = month_id(FF_mkt.index)
+    FF_mkt = add_year_month(FF_mkt.reset_index(drop=True))
+    FF_mkt = FF_mkt[['month_id', 'Year', 'Month', 'Market_minus_Rf', 'SMB', 'HML', 'Rf']]
 
-    # Store downloaded data in pickle format
-    FF_mkt.to_pickle(data_dir + 'ff3_monthly.pkl')
+    # Store downloaded data in parquet format
+    save_artifact(FF_mkt, data_dir, 'ff3_monthly', date_col='Year')
     
 # Processes the saved CRSP raw returns and delisted returns data to create a merged dataframe
 def process_raw_crsp_data(data_dir, mcrsp_raw, dlret_raw): 
+    # Track memory usage of each processing stage
+    report = MemoryReport()
+    report.record('mcrsp_raw', mcrsp_raw)
+    report.record('dlret_raw', dlret_raw)
     
     ############################### Process raw CRSP returns ###############################
     
@@ -67,11 +72,11 @@ def process_raw_crsp_data(data_dir, mcrsp_raw, dlret_raw):
     mcrsp_raw = mcrsp_raw[mcrsp_raw['shrcd'].notna() & mcrsp_raw['exchcd'].notna() & mcrsp_raw['shrout'].notna()].copy()
 
     # Reference - Assignment Intruction: PERMNO, SHRCD, EXCHCD and SHROUT variables have type integer
-    int_columns = ['permno', 'permco', 'shrcd', 'exchcd', 'shrout']
-    mcrsp_raw[int_columns] = mcrsp_raw[int_columns].astype(int)
+    # Use the compact schema: int32 ids and shares, int8 codes (optionally float32 prices and shares)
+    mcrsp_raw = apply_schema(mcrsp_raw, CRSP_SCHEMA, float32=float32_prices)
 
     # Reference - Assignment Intruction: Format the date column as a datetime
-    mcrsp_raw['date'] = pd.to_datetime(mcrsp_raw['date'], format='%Y-%m-%d', errors='ignore')
+    mcrsp_raw['date'] = to_dates(mcrsp_raw['date'])
 
     # Sort the data by permno and date and reset index because we dropped rows above
     mcrsp_raw = mcrsp_raw.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
@@ -83,11 +88,11 @@ def process_raw_crsp_data(data_dir, mcrsp_raw, dlret_raw):
     dlret_raw = dlret_raw.sort_values(by=['permno', 'dlstdt']).reset_index(drop=True).copy()
     
     # Reference - Assignment Intruction: PERMNO variable has type integer
-    dlret_raw['permno'] = dlret_raw['permno'].astype(int)
+    dlret_raw = apply_schema(dlret_raw, CRSP_SCHEMA)
 
     # Reference - Assignment Intruction: Format the date column as a datetime
     dlret_raw = dlret_raw.rename(columns={"dlstdt": "date"}).copy()
-    dlret_raw['date'] = pd.to_datetime(dlret_raw['date'], format='%Y-%m-%d', errors='ignore')
+    dlret_raw['date'] = to_dates(dlret_raw['date'])
 
     # Sort the data by permno and date and reset index
     dlret_raw = dlret_raw.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
@@ -97,12 +102,17 @@ def process_raw_crsp_data(data_dir, mcrsp_raw, dlret_raw):
     # Merging non-desliting returns with delisted returns
     mcrsp = mcrsp_raw.merge(dlret_raw, how='outer', on=['date', 'permno'])
     mcrsp = mcrsp.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
+    # The outer merge turns integer columns with missing values into float64, restore the compact schema
+    mcrsp = apply_schema(mcrsp, CRSP_SCHEMA, float32=float32_prices)
+    report.record('mcrsp_ret_dret_merged', mcrsp)
     
-    # Store merged CRSP data in pickle format
-    mcrsp.to_pickle(data_dir + 'mcrsp_ret_dret_merged.pkl')
+    # Store merged CRSP data in parquet format
+    save_artifact(mcrsp, data_dir, 'mcrsp_ret_dret_merged')
+    # Store the memory report of the processing stages
+    report.save(os.path.join(data_dir, 'memory_report_mcrsp_ret_dret_merged.json'))
     
-# Implements Q1 requirements: Inputs - CRSP_Stocks
-def PS1_Q1(CRSP_Stocks):
+# Loads the cleaned CRSP stock panel, cleaning and caching it only if the merged data or the filters changed: Inputs - data_dir
+def load_clean_crsp_stocks(data_dir):
     # Reference - Kenneth R. French:
     # "Rm-Rf, the excess return on the market, value-weight return of all CRSP firms incorporated in the US and
     # listed on the NYSE, AMEX, or NASDAQ that have a CRSP share code of 10 or 11 at the beginning of month t,
@@ -119,123 +129,41 @@ def PS1_Q1(CRSP_Stocks):
     min_date = '1926-01-31'
     max_date = '2023-12-31'
 
-    # Move all dates to last day of the month
-    CRSP_Stocks['date'] = CRSP_Stocks['date'] + MonthEnd(0)
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
-
-    # exchcd/shrcd are nan for delisted returns, so filtering rows on required exchcd/shrcd removes delisted return rows
-    # dlstcd is not-nan for all the delisted return rows, so it has been used as a proxy to identify delisted return rows
-    # Rows with unrequired exchcd/shrcd are removed only if those are non delisted return row
-    CRSP_Stocks = CRSP_Stocks[(CRSP_Stocks['dlstcd'].notna()) |
-                              ((CRSP_Stocks['dlstcd'].isna()) & (CRSP_Stocks['exchcd'].isin(exchcd_set)))]
-
-    CRSP_Stocks = CRSP_Stocks[(CRSP_Stocks['dlstcd'].notna()) |
-                              ((CRSP_Stocks['dlstcd'].isna()) & (CRSP_Stocks['shrcd'].isin(shrcd_set)))]
-
-    # Drop unrequired columns
-    CRSP_Stocks.drop(['exchcd', 'shrcd'], axis=1, inplace=True)
-
-    # Filter dates
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['date'] >= min_date]
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['date'] <= max_date]
-
-    # Calculate market equity (in USD Billions)
-    # Use absolute price because if price is bid/ask average it has a negative sign to indicate so
-    CRSP_Stocks['me'] = CRSP_Stocks['prc'].abs()*CRSP_Stocks['shrout']*1e-6
-    # Drop unrequired columns
-    CRSP_Stocks.drop(['prc', 'shrout'], axis=1, inplace=True)
-
-    # Adjust for Delisting Returns
-    # Use compounded return if both return and delisted return are available
-    CRSP_Stocks['ret'] = np.where(CRSP_Stocks['ret'].notna() & CRSP_Stocks['dlret'].notna(),
-                          (1 + CRSP_Stocks['ret'])*(1 + CRSP_Stocks['dlret']) - 1,
-                          CRSP_Stocks['ret'])
-
-    # Use delisted return if return is not available but delited return is
-    CRSP_Stocks['ret'] = np.where(CRSP_Stocks['ret'].isna() & CRSP_Stocks['dlret'].notna(),
-                          CRSP_Stocks['dlret'],
-                          CRSP_Stocks['ret'])
-
-    # Drop missing returns
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['ret'].notna()].copy()
-    # Reset index
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno','date']).reset_index(drop=True).copy()
-   
-    # Aggregate Market Cap
-    # For a given date and permco, sum me across different permno to find cumulative market-cap for the permco
-    CRSP_Stocks_ME_SUM = CRSP_Stocks.groupby(['date','permco'])['me'].sum().reset_index()
-
-    # For a given date and permco, among multiple market-caps for different permno find the largest one
-    CRSP_Stocks_ME_MAX = CRSP_Stocks.groupby(['date','permco'])['me'].max().reset_index()
-
-    # Merge CRSP_Stocks and CRSP_Stocks_ME_MAX
-    CRSP_Stocks = pd.merge(CRSP_Stocks, CRSP_Stocks_ME_MAX, how='inner', on=['date', 'permco', 'me'])
-
-    # Replace me with cumulative me
-    # Drop existing me
-    CRSP_Stocks = CRSP_Stocks.drop(['me'], axis=1)
-    # Merge CRSP_Stocks and CRSP_Stocks_ME_SUM to use cmumulative market cap
-    CRSP_Stocks = pd.merge(CRSP_Stocks, CRSP_Stocks_ME_SUM, how='inner', on=['date', 'permco'])
-
-    # Sort by permno and date and drop duplicates
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno', 'date']).drop_duplicates()
-
-    # Add column with lagged market cap
-    CRSP_Stocks['lme'] = CRSP_Stocks.groupby(['permno'])['me'].shift(1)
-
-    # If a permno is the first permno, use me/(1+retx) to replace the missing value
-    CRSP_Stocks['1+retx'] = 1 + CRSP_Stocks['retx']
-    CRSP_Stocks['count'] = CRSP_Stocks.groupby(['permno']).cumcount()
-    CRSP_Stocks['lme'] = np.where(CRSP_Stocks['count'] == 0, CRSP_Stocks['me']/CRSP_Stocks['1+retx'], CRSP_Stocks['lme'])
-    
-    # Drop missing lme
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['lme'].notna()].copy()
-    # Reset index
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno','date']).reset_index(drop=True).copy()    
-    
-    # Data integrity checkes
-    assert (CRSP_Stocks['ret'] == -66).any() == False
-    assert (CRSP_Stocks['ret'] == -77).any() == False
-    assert (CRSP_Stocks['ret'] == -88).any() == False
-    assert (CRSP_Stocks['ret'] == -99).any() == False
-    assert CRSP_Stocks['ret'].isna().any() == False
-    assert CRSP_Stocks['lme'].isna().any() == False
-
-    Monthly_CRSP_Stocks = CRSP_Stocks[['date']].groupby(['date']).sum()
-    Monthly_CRSP_Stocks['Date'] = pd.to_datetime(Monthly_CRSP_Stocks.index, format='%Y-%m-%d', errors='ignore')
-    Monthly_CRSP_Stocks['Year'] = Monthly_CRSP_Stocks['Date'].dt.year
-    Monthly_CRSP_Stocks['Month'] = Monthly_CRSP_Stocks['Date'].dt.month
-    Monthly_CRSP_Stocks.drop(['Date'], axis=1, inplace=True)
-
-    Monthly_CRSP_Stocks['Stock_lag_MV'] = CRSP_Stocks[['date', 'lme']].groupby(['date']).sum()
-    Monthly_CRSP_Stocks['Stock_Ew_Ret'] = CRSP_Stocks[['date', 'ret']].groupby(['date']).mean()
-    Monthly_CRSP_Stocks['Stock_Vw_Ret'] = CRSP_Stocks.groupby(['date']).apply(lambda x: np.average(x.ret, weights=x.lme))
+    # Filter, adjust for delisting returns and compute market equity (in USD Billions) and lagged market equity
+    return cached_clean_crsp_stocks(data_dir, ['mcrsp_ret_dret_merged'],
+                                    lambda: load_artifact(data_dir, 'mcrsp_ret_dret_merged'),
+                                    exchcd_set=exchcd_set, shrcd_set=shrcd_set, min_date=min_date, max_date=max_date,
+                                    me_scale=1e-6, drop_cols=['exchcd', 'shrcd', 'prc', 'shrout'])
+
+# Implements Q1 requirements: Inputs - CRSP_Stocks (cleaned CRSP stock panel)
+def PS1_Q1(CRSP_Stocks):
+    # Lagged total market cap, equal-weighted and value-weighted returns from a single grouped pass on the month id
+    Stock_Agg = grouped_weighted_mean(CRSP_Stocks, 'month_id', 'ret', 'lme')
+    Monthly_CRSP_Stocks = add_year_month(Stock_Agg[['month_id']])
+    Monthly_CRSP_Stocks.index = pd.Index(month_end(Stock_Agg['month_id'].values), name='date')
+    Monthly_CRSP_Stocks['Stock_lag_MV'] = Stock_Agg['weight'].values
+    Monthly_CRSP_Stocks['Stock_Ew_Ret'] = Stock_Agg['ew_ret'].values
+    Monthly_CRSP_Stocks['Stock_Vw_Ret'] = Stock_Agg['vw_ret'].values
 
     return Monthly_CRSP_Stocks
 
 # Implements Q2 requirements:: Inputs - Monthly_CRSP_Stocks, FF_mkt
 def PS1_Q2(Monthly_CRSP_Stocks, FF_mkt):
     
-    # Merge Monthly_CRSP_Stocks with FF_mkt
-    df_merged = Monthly_CRSP_Stocks.merge(FF_mkt, how='inner', on=['Year', 'Month'])
+    # Merge Monthly_CRSP_Stocks with FF_mkt on the month id
+    df_merged = Monthly_CRSP_Stocks.merge(FF_mkt.drop(columns=['Year', 'Month']), how='inner', on='month_id')
     
     # Compute Esti_Market_minus_Rf
     df_merged['Esti_Market_minus_Rf'] = df_merged['Stock_Vw_Ret'] - df_merged['Rf']
     
-    # Create dataframe to store required stats
-    df_q2 = pd.DataFrame()
-    
     str_mean = "Annualized Mean"
     str_std = "Annualized Standard Deviation"
     str_sr = "Annualized Sharpe Ratio"
     req_columns = ['Esti_Market_minus_Rf', 'Market_minus_Rf']
     
-    # Compute required stats
-    df_q2[str_mean] = 100*12*df_merged[req_columns].mean(axis=0)
-    df_q2[str_std] = 100*np.sqrt(12)*df_merged[req_columns].std(axis=0)
-    df_q2[str_sr] = df_q2[str_mean]/df_q2[str_std]
-    df_q2["Skewness"] = df_merged[req_columns].skew(axis=0)
-    df_q2["Excess Kurtosis"] = df_merged[req_columns].kurtosis(axis=0)
+    # Compute required stats of both series in one pass
+    df_q2 = performance_stats(df_merged[req_columns])[['mean', 'vol', 'sharpe', 'skew', 'kurtosis']]
+    df_q2.columns = [str_mean, str_std, str_sr, "Skewness", "Excess Kurtosis"]
     
     # Convert dataframe to the desired format
     df_q2 = df_q2.T
@@ -245,8 +173,8 @@ def PS1_Q2(Monthly_CRSP_Stocks, FF_mkt):
 
 # Implements Q3 requirements: Inputs - Monthly_CRSP_Stocks, FF_mkt
 def PS1_Q3(Monthly_CRSP_Stocks, FF_mkt):    
-    # Merge Monthly_CRSP_Stocks with FF_mkt
-    df_merged = Monthly_CRSP_Stocks.merge(FF_mkt, how='inner', on=['Year', 'Month'])
+    # Merge Monthly_CRSP_Stocks with FF_mkt on the month id
+    df_merged = Monthly_CRSP_Stocks.merge(FF_mkt.drop(columns=['Year', 'Month']), how='inner', on='month_id')
     
     # Compute Esti_Market_minus_Rf
     df_merged['Esti_Market_minus_Rf'] = df_merged['Stock_Vw_Ret'] - df_merged['Rf']
@@ -263,41 +191,48 @@ def PS1_Q3(Monthly_CRSP_Stocks, FF_mkt):
 
 # Runs all the functions and prints the required results
 def driver(download_data=False):
+    # Record time, memory and data sizes of every stage in a trace file
+    start_trace('PS1', os.path.join(data_dir, 'trace_PS1.json'))
+
     # Download data only if needed
     if download_data == True:
-        download_raw_crsp_data(data_dir, wrds_id)
-        download_ff3_monthly_data(data_dir)
+        with stage('download'):
+            download_raw_crsp_data(data_dir, wrds_id)
+            download_ff3_monthly_data(data_dir)
     
     # Load stored raw CRSP returns data as a dataframe
-    mcrsp_raw = pd.read_pickle(data_dir + 'mcrsp_raw.pkl')
+    mcrsp_raw = load_artifact(data_dir, 'mcrsp_raw')
 
     # Load stored raw CRSP delisting returns data as a dataframe
-    dlret_raw = pd.read_pickle(data_dir + 'dlret_raw.pkl')
+    dlret_raw = load_artifact(data_dir, 'dlret_raw')
     
     # Load stored FF3 data as a dataframe
-    FF_mkt = pd.read_pickle(data_dir + 'ff3_monthly.pkl')
+    FF_mkt = load_artifact(data_dir, 'ff3_monthly')
     
     # Process raw CRSP returns and delisting returns to create and store a merged dataframe
-    process_raw_crsp_data(data_dir, mcrsp_raw, dlret_raw)
+    run_stage('process', process_raw_crsp_data, data_dir, mcrsp_raw, dlret_raw)
     
-    # Load stored merged CRSP data as a dataframe
-    CRSP_Stocks = pd.read_pickle(data_dir + 'mcrsp_ret_dret_merged.pkl')
+    # Load the cleaned CRSP stock panel (rebuilt only if the merged data changed)
+    CRSP_Stocks = run_stage('clean', load_clean_crsp_stocks, data_dir)
 
     # Calculate value-weighted return, equal-weighted return and lagged total market cap.
-    Monthly_CRSP_Stocks = PS1_Q1(CRSP_Stocks)
+    Monthly_CRSP_Stocks = run_stage('aggregate', PS1_Q1, CRSP_Stocks)
 
     # Compute required return stats for Q2
-    results_ps1_q2 = PS1_Q2(Monthly_CRSP_Stocks, FF_mkt)
+    results_ps1_q2 = run_stage('stats', PS1_Q2, Monthly_CRSP_Stocks, FF_mkt)
     
     # Display Q2 results    
     print(results_ps1_q2)
 
     # Compute required metrics for Q3
-    result_ps1_q3 = PS1_Q3(Monthly_CRSP_Stocks, FF_mkt)
+    result_ps1_q3 = run_stage('stats', PS1_Q3, Monthly_CRSP_Stocks, FF_mkt)
 
     # Display Q3 results
     print("The correlation between the two time series: {:.8f}".format(result_ps1_q3[0]))
     print("The maximum absolute difference between the two time series: {:.8f}".format(result_ps1_q3[1]))
+
+    # Close the trace file
+    stop_trace()
     
 # Import packages
 import pandas as pd
@@ -308,6 +243,14 @@ import wrds
 import os
 from pandas.tseries.offsets import *
 import datetime
+from qam_aggregation import grouped_weighted_mean
+from qam_stats import performance_stats
+from qam_storage import save_artifact, load_artifact
+from qam_crsp import cached_clean_crsp_stocks
+from qam_calendar import to_dates, month_id, month_end, add_year_month
+from qam_schema import apply_schema, MemoryReport, CRSP_SCHEMA
+from qam_wrds import download_partitioned, date_partitions
+from qam_instrument import start_trace, stop_trace, stage, run_stage
 
 # Directory to store the downloaded data
 data_dir = 'data\\'
@@ -315,7 +258,15 @@ data_dir = 'data\\'
 # WRDS login id
 wrds_id = 'smarty_iitian'
 
+# Specify whether prices and shares are stored as float32 to reduce the memory footprint of the CRSP panel
+float32_prices = False
+
 # Specify whether we need to download the raw data or not
 download_data = False
 
-driver(download_data)
\ No newline at end of file
+# Specify whether every downloaded partition is fetched again instead of reusing the final checkpoints
+refresh_download = False
+
+# Run the driver only when the script is executed, so that the functions can be imported by the benchmarks
+if __name__ == "__main__":
+    driver(download_data)
\ No newline at end of file
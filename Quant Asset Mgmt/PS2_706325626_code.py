@@ -9,42 +9,94 @@ def download_raw_crsp_data(data_dir, wrds_id):
     # Download CRSP stock monthly returns
     # Reference - Assignment Instruction:
     # "This should be the full dataset available on WRDS; do not pre-filter by SHRCD, EXCHCD, or date."
-    conn = wrds.Connection(wrds_username=wrds_id)
-    mscrsp_raw = conn.raw_sql("""select a.permno, a.permco, a.date, b.shrcd, b.exchcd, a.ret, a.retx, a.shrout, a.prc
-                                from crspq.msf as a
-                                left join crspq.msenames as b
-                                on a.permno=b.permno and b.namedt<=a.date and a.date<=b.nameendt""")    
-    # Store downloaded data in pickle format
-    mscrsp_raw.to_pickle(data_dir + 'mscrsp_raw.pkl')
+    # The full history is split into date partitions that are fetched concurrently over a bounded pool of
+    # WRDS connections. Every partition is checkpointed, so a rerun after a dropped session only fetches
+    # the missing partitions and the partitions still open when they were fetched.
+    mscrsp_raw = download_partitioned(lambda: wrds.Connection(wrds_username=wrds_id), MSF_QUERY,
+                                      date_partitions(), os.path.join(data_dir, 'checkpoints'), 'mscrsp_raw',
+                                      refresh=refresh_download)
+    # Store downloaded data in parquet format
+    save_artifact(mscrsp_raw, data_dir, 'mscrsp_raw')
 
     # Download CRSP stock monthly delisting returns
-    msdelcrsp_raw = conn.raw_sql("""select permno, dlret, dlstdt, dlstcd from crspq.msedelist""")
-    # Store downloaded data in pickle format
-    msdelcrsp_raw.to_pickle(data_dir + 'msdelcrsp_raw.pkl')
+    conn = wrds.Connection(wrds_username=wrds_id)
+    msdelcrsp_raw = conn.raw_sql(MSEDELIST_QUERY.format(start='1925-01-01', end=datetime.date.today().isoformat()))
+    # Store downloaded data in parquet format
+    save_artifact(msdelcrsp_raw, data_dir, 'msdelcrsp_raw', date_col='dlstdt')
 
-    
+    # Close WRDS API connection
+    conn.close()
+
+    # Download CRSP bond and t-bill data
+    download_raw_crsp_bond_data(data_dir, wrds_id)
+
+# Downloads the CRSP stock months released after the stored raw data: Inputs - data_dir and wrds_id
+# The new months are fetched as one partition from the month after the last stored one to today, and the delisting
+# returns up to the end of the last new month, so the next update starts right after them. The stored raw data is
+# not changed (see update_raw_data).
+def download_raw_crsp_delta(data_dir, wrds_id):
+    # First day of the month after the last stored month
+    last_date = pd.Timestamp(load_artifact(data_dir, 'mscrsp_raw', columns=['date'])['date'].max())
+    start = (last_date + MonthBegin(1)).strftime('%Y-%m-%d')
+
+    # Download the new CRSP stock monthly returns, fetched again on every update as the partition is still open
+    mscrsp_delta = download_partitioned(lambda: wrds.Connection(wrds_username=wrds_id), MSF_QUERY,
+                                        [(start, datetime.date.today().isoformat())],
+                                        os.path.join(data_dir, 'checkpoints'), 'mscrsp_delta', refresh=True)
+    if len(mscrsp_delta) == 0:
+        return mscrsp_delta, None
+
+    # Download the delisting returns of the new months
+    end = (pd.Timestamp(to_dates(mscrsp_delta['date']).max()) + MonthEnd(0)).strftime('%Y-%m-%d')
+    conn = wrds.Connection(wrds_username=wrds_id)
+    msdelcrsp_delta = conn.raw_sql(MSEDELIST_QUERY.format(start=start, end=end))
+    conn.close()
+
+    return mscrsp_delta, msdelcrsp_delta
+
+# Downloads and saves CRSP bond and t-bill raw data
+def download_raw_crsp_bond_data(data_dir, wrds_id):
     ###################################### Download CRSP bond data ######################################
     
+    conn = wrds.Connection(wrds_username=wrds_id)
+
     # Download CRSP bond monthly data
     # Reference - Assignment Instruction:
     # "This should be the full dataset available on WRDS; do not pre-filter by MCALDT."
     mbcrsp_raw = conn.raw_sql("""select kycrspid, mcaldt, tmretnua, tmtotout from crspq.tfz_mth""")
-    # Store downloaded data in pickle format
-    mbcrsp_raw.to_pickle(data_dir + 'mbcrsp_raw.pkl')
+    # Store downloaded data in parquet format
+    save_artifact(mbcrsp_raw, data_dir, 'mbcrsp_raw', date_col='mcaldt')
 
     # Download CRSP t-Bill monthly data
     # Reference - Assignment Instruction:
     # "This should be the full dataset available on WRDS; do not pre-filter by caldt."
     mtbcrsp_raw = conn.raw_sql("""select caldt, t30ret, t90ret from crspq.mcti""")
-    # Store downloaded data in pickle format
-    mtbcrsp_raw.to_pickle(data_dir + 'mtbcrsp_raw.pkl')
+    # Store downloaded data in parquet format
+    save_artifact(mtbcrsp_raw, data_dir, 'mtbcrsp_raw', date_col='caldt')
     
     # Close WRDS API connection
     conn.close()
     
-# Processes and saves raw CRSP stock returns and delisted returns data to create a merged dataframe
-def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
+# Downloads CRSP daily stock and treasury data into memory-mapped columnar panels
+def download_raw_crsp_daily_data(data_dir, wrds_id):
+    # Daily CRSP has about 20 times the rows of the monthly file, so it is written to disk one year at a time
+    # instead of being collected in a dataframe. Ingested years are recorded in the panels, so a rerun resumes.
+    connect = lambda: wrds.Connection(wrds_username=wrds_id)
+    years = date_partitions(end_year=pd.Timestamp(max_date).year, years_per_partition=1)
+    ingest_partitioned(connect, DAILY_STOCK_QUERY, years, os.path.join(data_dir, 'dscrsp_panel'),
+                       DAILY_STOCK_SCHEMA, ['date', 'permno'])
+    ingest_partitioned(connect, DAILY_BOND_QUERY, years, os.path.join(data_dir, 'dbcrsp_panel'),
+                       DAILY_BOND_SCHEMA, ['caldt', 'kytreasno'])
+
+# Processes and saves raw CRSP stock returns and delisted returns data to create a merged dataframe:
+# Inputs - data_dir, raw CRSP stock returns and delisting returns, and whether to store the result
+# (incremental updates process only the new months and append them instead)
+def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw, store=True):
     print("      Processing raw data for stocks ...")
+    # Track memory usage of each processing stage
+    report = MemoryReport()
+    report.record('mscrsp_raw', mscrsp_raw)
+    report.record('msdelcrsp_raw', msdelcrsp_raw)
     
     ############################### Process raw CRSP returns ###############################
     
@@ -58,11 +110,11 @@ def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
                             mscrsp_raw['shrout'].notna()].copy()
 
     # Reference - Assignment Instruction: PERMNO, SHRCD, EXCHCD and SHROUT variables have type integer
-    int_columns = ['permno', 'permco', 'shrcd', 'exchcd', 'shrout']
-    mscrsp_raw[int_columns] = mscrsp_raw[int_columns].astype(int)
+    # Use the compact schema: int32 ids and shares, int8 codes (optionally float32 prices and shares)
+    mscrsp_raw = apply_schema(mscrsp_raw, CRSP_SCHEMA, float32=float32_prices)
 
     # Reference - Assignment Instruction: Format the date column as a datetime
-    mscrsp_raw['date'] = pd.to_datetime(mscrsp_raw['date'], format='%Y-%m-%d', errors='ignore')
+    mscrsp_raw['date'] = to_dates(mscrsp_raw['date'])
 
     # Sort the data by permno and date and reset index because we dropped rows above
     mscrsp_raw = mscrsp_raw.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
@@ -73,11 +125,11 @@ def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
     msdelcrsp_raw = msdelcrsp_raw.sort_values(by=['permno', 'dlstdt']).reset_index(drop=True).copy()
     
     # Reference - Assignment Instruction: PERMNO variable has type integer
-    msdelcrsp_raw['permno'] = msdelcrsp_raw['permno'].astype(int)
+    msdelcrsp_raw = apply_schema(msdelcrsp_raw, CRSP_SCHEMA)
 
     # Reference - Assignment Instruction: Format the date column as a datetime
     msdelcrsp_raw = msdelcrsp_raw.rename(columns={"dlstdt": "date"}).copy()
-    msdelcrsp_raw['date'] = pd.to_datetime(msdelcrsp_raw['date'], format='%Y-%m-%d', errors='ignore')
+    msdelcrsp_raw['date'] = to_dates(msdelcrsp_raw['date'])
 
     # Sort the data by permno and date and reset index
     msdelcrsp_raw = msdelcrsp_raw.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
@@ -89,8 +141,17 @@ def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
     # Sort the data by permno and date and reset index
     mscrsp_processed = mscrsp_processed.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
     
-    # Store Processed merged CRSP data in pickle format
-    mscrsp_processed.to_pickle(data_dir + 'mscrsp_processed.pkl')
+    # The outer merge turns integer columns with missing values into float64, restore the compact schema
+    mscrsp_processed = apply_schema(mscrsp_processed, CRSP_SCHEMA, float32=float32_prices)
+    report.record('mscrsp_processed', mscrsp_processed)
+    
+    if store == True:
+        # Store Processed merged CRSP data in parquet format
+        save_artifact(mscrsp_processed, data_dir, 'mscrsp_processed')
+        # Store the memory report of the processing stages
+        report.save(os.path.join(data_dir, 'memory_report_mscrsp_processed.json'))
+
+    return mscrsp_processed
 
 # Processes and saves raw CRSP bond and t-bill data
 def process_raw_crsp_bond_data(data_dir, mbcrsp_raw, mtbcrsp_raw): 
@@ -102,7 +163,7 @@ def process_raw_crsp_bond_data(data_dir, mbcrsp_raw, mtbcrsp_raw):
     mbcrsp_processed = mbcrsp_raw.sort_values(by=['kycrspid', 'mcaldt']).reset_index(drop=True).copy()    
    
     # Reference - Assignment Instruction: Format the MCALDT column as a datetime    
-    mbcrsp_processed['mcaldt'] = pd.to_datetime(mbcrsp_processed['mcaldt'], format='%Y-%m-%d', errors='ignore')
+    mbcrsp_processed['mcaldt'] = to_dates(mbcrsp_processed['mcaldt'])
     
     # Sort the data by crsp_id and mcaldt and reset index
     mbcrsp_processed = mbcrsp_processed.sort_values(by=['kycrspid', 'mcaldt']).reset_index(drop=True).copy()
@@ -113,18 +174,17 @@ def process_raw_crsp_bond_data(data_dir, mbcrsp_raw, mtbcrsp_raw):
     mtbcrsp_processed = mtbcrsp_raw.sort_values(by=['caldt']).reset_index(drop=True).copy()
 
     # Reference - Assignment Instruction: Format the caldt column as a datetime
-    mtbcrsp_processed['caldt'] = pd.to_datetime(mtbcrsp_processed['caldt'], format='%Y-%m-%d', errors='ignore')
+    mtbcrsp_processed['caldt'] = to_dates(mtbcrsp_processed['caldt'])
 
     # Sort the data by caldt and reset index
     mtbcrsp_processed = mtbcrsp_processed.sort_values(by=['caldt']).reset_index(drop=True).copy()
     
-    # Store processed data in pickle format
-    mbcrsp_processed.to_pickle(data_dir + 'mbcrsp_processed.pkl')
-    mtbcrsp_processed.to_pickle(data_dir + 'mtbcrsp_processed.pkl')
+    # Store processed data in parquet format
+    save_artifact(mbcrsp_processed, data_dir, 'mbcrsp_processed', date_col='mcaldt')
+    save_artifact(mtbcrsp_processed, data_dir, 'mtbcrsp_processed', date_col='caldt')
     
-# Implements PS1-Q1 requirements: Inputs - CRSP_Stocks
-def PS1_Q1(CRSP_Stocks):
-    print("      Recomputing monthly returns for stocks ...")
+# Returns the parameters used to clean the CRSP stock panel
+def clean_crsp_params():
     # Reference - Kenneth R. French:
     # "Rm-Rf, the excess return on the market, value-weight return of all CRSP firms incorporated in the US and
     # listed on the NYSE, AMEX, or NASDAQ that have a CRSP share code of 10 or 11 at the beginning of month t,
@@ -135,94 +195,31 @@ def PS1_Q1(CRSP_Stocks):
     # Filter relevant shrcd - Reference - Kenneth R. French: "that have a CRSP share code of 10 or 11"
     shrcd_set = [10, 11]
 
-    # Move all dates to the last day of the month
-    CRSP_Stocks['date'] = CRSP_Stocks['date'] + MonthEnd(0)
-    # Sort again as we changed date values
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
-
-    # exchcd/shrcd are nan for delisted returns, so filtering rows on required exchcd/shrcd removes delisted return rows
-    # dlstcd is not-nan for all the delisted return rows, so it has been used as a proxy to identify delisted return rows
-    # Rows with unrequired exchcd/shrcd are removed only if those are non delisted return row
-    CRSP_Stocks = CRSP_Stocks[(CRSP_Stocks['dlstcd'].notna()) |
-                              ((CRSP_Stocks['dlstcd'].isna()) & (CRSP_Stocks['exchcd'].isin(exchcd_set)))]
-
-    CRSP_Stocks = CRSP_Stocks[(CRSP_Stocks['dlstcd'].notna()) |
-                              ((CRSP_Stocks['dlstcd'].isna()) & (CRSP_Stocks['shrcd'].isin(shrcd_set)))]
-    # Drop unrequired columns
-    CRSP_Stocks.drop(['exchcd', 'shrcd'], axis=1, inplace=True)
+    # Filter, adjust for delisting returns and compute market equity (in USD millions) and lagged market equity
+    return dict(exchcd_set=exchcd_set, shrcd_set=shrcd_set, min_date=min_date, max_date=max_date,
+                me_scale=1e-3, drop_cols=['exchcd', 'shrcd', 'prc', 'shrout'])
 
-    # Filter dates
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['date'] >= min_date]
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['date'] <= max_date]
+# Loads the cleaned CRSP stock panel, cleaning and caching it only if the processed data or the filters changed:
+# Inputs - data_dir
+def load_clean_crsp_stocks(data_dir):
+    return cached_clean_crsp_stocks(data_dir, ['mscrsp_processed'],
+                                    lambda: load_artifact(data_dir, 'mscrsp_processed'),
+                                    **clean_crsp_params())
 
-    # Calculate market equity in USD millions
-    # Use absolute price because if price is bid/ask average it has a negative sign to indicate so
-    CRSP_Stocks['me'] = CRSP_Stocks['prc'].abs()*CRSP_Stocks['shrout']*1e-3
-    # Drop unrequired columns
-    CRSP_Stocks.drop(['prc', 'shrout'], axis=1, inplace=True)
-
-    # Adjust for Delisting Returns
-    # Use compounded return if both return and delisted return are available
-    CRSP_Stocks['ret'] = np.where(CRSP_Stocks['ret'].notna() & CRSP_Stocks['dlret'].notna(),
-                          (1 + CRSP_Stocks['ret'])*(1 + CRSP_Stocks['dlret']) - 1,
-                          CRSP_Stocks['ret'])
-    # Use delisted return if return is not available but delited return is
-    CRSP_Stocks['ret'] = np.where(CRSP_Stocks['ret'].isna() & CRSP_Stocks['dlret'].notna(),
-                          CRSP_Stocks['dlret'],
-                          CRSP_Stocks['ret'])
-    # Drop missing returns
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['ret'].notna()].copy()
-    # Reset index
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno','date']).reset_index(drop=True).copy()
-   
-    # Aggregate Market Cap. computation
-    # For a given date and permco, sum me across different permno to find cumulative market-cap for the permco
-    CRSP_Stocks_ME_SUM = CRSP_Stocks.groupby(['date','permco'])['me'].sum().reset_index()
-    # For a given date and permco, among multiple market-caps for different permno find the largest one
-    CRSP_Stocks_ME_MAX = CRSP_Stocks.groupby(['date','permco'])['me'].max().reset_index()
-    # Merge CRSP_Stocks and CRSP_Stocks_ME_MAX
-    CRSP_Stocks = pd.merge(CRSP_Stocks, CRSP_Stocks_ME_MAX, how='inner', on=['date', 'permco', 'me'])
-    # Replace me with cumulative me
-    # Drop existing me
-    CRSP_Stocks = CRSP_Stocks.drop(['me'], axis=1)
-    # Merge CRSP_Stocks and CRSP_Stocks_ME_SUM to use cumulative market cap
-    CRSP_Stocks = pd.merge(CRSP_Stocks, CRSP_Stocks_ME_SUM, how='inner', on=['date', 'permco'])
-    # Sort by permno and date and drop duplicates
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno', 'date']).drop_duplicates()
-
-    # lagged Market Cap. computation
-    # Add column with lagged market cap
-    CRSP_Stocks['lme'] = CRSP_Stocks.groupby(['permno'])['me'].shift(1)
-    # If a permno is the first permno, use me/(1+retx) to replace the missing value
-    CRSP_Stocks['1+retx'] = 1 + CRSP_Stocks['retx']
-    CRSP_Stocks['count'] = CRSP_Stocks.groupby(['permno']).cumcount()
-    CRSP_Stocks['lme'] = np.where(CRSP_Stocks['count'] == 0, CRSP_Stocks['me']/CRSP_Stocks['1+retx'], CRSP_Stocks['lme'])    
-    # Drop missing lme
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['lme'].notna()].copy()
-    # Reset index
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno','date']).reset_index(drop=True).copy()
-    
-    # Data integrity checkes
-    assert (CRSP_Stocks['ret'] == -66).any() == False
-    assert (CRSP_Stocks['ret'] == -77).any() == False
-    assert (CRSP_Stocks['ret'] == -88).any() == False
-    assert (CRSP_Stocks['ret'] == -99).any() == False
-    assert CRSP_Stocks['ret'].isna().any() == False
-    assert CRSP_Stocks['lme'].isna().any() == False
-
-    # Compute required monthly values
-    Monthly_CRSP_Stocks = CRSP_Stocks[['date']].groupby(['date']).sum()
-    Monthly_CRSP_Stocks['Date'] = pd.to_datetime(Monthly_CRSP_Stocks.index, format='%Y-%m-%d', errors='ignore')
-    Monthly_CRSP_Stocks['Year'] = Monthly_CRSP_Stocks['Date'].dt.year
-    Monthly_CRSP_Stocks['Month'] = Monthly_CRSP_Stocks['Date'].dt.month
-    Monthly_CRSP_Stocks.drop(['Date'], axis=1, inplace=True)
-
-    Monthly_CRSP_Stocks['Stock_lag_MV'] = CRSP_Stocks[['date', 'lme']].groupby(['date']).sum()
-    Monthly_CRSP_Stocks['Stock_Ew_Ret'] = CRSP_Stocks[['date', 'ret']].groupby(['date']).mean()
-    Monthly_CRSP_Stocks['Stock_Vw_Ret'] = CRSP_Stocks.groupby(['date']).apply(lambda x: np.average(x.ret, weights=x.lme))
-
-    # Store final data in pickle format
-    Monthly_CRSP_Stocks.to_pickle(data_dir + 'Monthly_CRSP_Stocks.pkl')
+# Implements PS1-Q1 requirements: Inputs - CRSP_Stocks (cleaned CRSP stock panel) and whether to store the result
+def PS1_Q1(CRSP_Stocks, store=True):
+    print("      Recomputing monthly returns for stocks ...")
+    # Lagged total market cap, equal-weighted and value-weighted returns from a single grouped pass on the month id
+    Stock_Agg = grouped_weighted_mean(CRSP_Stocks, 'month_id', 'ret', 'lme')
+    Monthly_CRSP_Stocks = add_year_month(Stock_Agg[['month_id']])
+    Monthly_CRSP_Stocks.index = pd.Index(month_end(Stock_Agg['month_id'].values), name='date')
+    Monthly_CRSP_Stocks['Stock_lag_MV'] = Stock_Agg['weight'].values
+    Monthly_CRSP_Stocks['Stock_Ew_Ret'] = Stock_Agg['ew_ret'].values
+    Monthly_CRSP_Stocks['Stock_Vw_Ret'] = Stock_Agg['vw_ret'].values
+
+    if store == True:
+        # Store final data in parquet format
+        save_artifact(Monthly_CRSP_Stocks, data_dir, 'Monthly_CRSP_Stocks')
     
     return Monthly_CRSP_Stocks
     
@@ -235,8 +232,9 @@ def PS2_Q1(CRSP_Bonds):
                                             "tmretnua":"ret",
                                             "tmtotout":"me"}).copy()
 
-    # Move all dates to the last day of the month
-    CRSP_Bonds['date'] = CRSP_Bonds['date'] + MonthEnd(0)
+    # Month id of every row, and all dates moved to the last day of the month
+    CRSP_Bonds['month_id'] = month_id(CRSP_Bonds['date'])
+    CRSP_Bonds['date'] = month_end(CRSP_Bonds['month_id'].values)
     # Sort again as we changed date values
     CRSP_Bonds = CRSP_Bonds.sort_values(by=['crsp_id', 'date']).reset_index(drop=True).copy()
 
@@ -263,19 +261,16 @@ def PS2_Q1(CRSP_Bonds):
     assert CRSP_Bonds['ret'].isna().any() == False
     assert CRSP_Bonds['lme'].isna().any() == False
 
-    # Compute required monthly values
-    Monthly_CRSP_Bonds = CRSP_Bonds[['date']].groupby(['date']).sum()
-    Monthly_CRSP_Bonds['Date'] = pd.to_datetime(Monthly_CRSP_Bonds.index, format='%Y-%m-%d', errors='ignore')
-    Monthly_CRSP_Bonds['Year'] = Monthly_CRSP_Bonds['Date'].dt.year
-    Monthly_CRSP_Bonds['Month'] = Monthly_CRSP_Bonds['Date'].dt.month
-    Monthly_CRSP_Bonds.drop(['Date'], axis=1, inplace=True)
-
-    Monthly_CRSP_Bonds['Bond_lag_MV'] = CRSP_Bonds[['date', 'lme']].groupby(['date']).sum()
-    Monthly_CRSP_Bonds['Bond_Ew_Ret'] = CRSP_Bonds[['date', 'ret']].groupby(['date']).mean()
-    Monthly_CRSP_Bonds['Bond_Vw_Ret'] = CRSP_Bonds.groupby(['date']).apply(lambda x: np.average(x.ret, weights=x.lme))
+    # Lagged total market value, equal-weighted and value-weighted returns from a single grouped pass on the month id
+    Bond_Agg = grouped_weighted_mean(CRSP_Bonds, 'month_id', 'ret', 'lme')
+    Monthly_CRSP_Bonds = add_year_month(Bond_Agg[['month_id']])
+    Monthly_CRSP_Bonds.index = pd.Index(month_end(Bond_Agg['month_id'].values), name='date')
+    Monthly_CRSP_Bonds['Bond_lag_MV'] = Bond_Agg['weight'].values
+    Monthly_CRSP_Bonds['Bond_Ew_Ret'] = Bond_Agg['ew_ret'].values
+    Monthly_CRSP_Bonds['Bond_Vw_Ret'] = Bond_Agg['vw_ret'].values
     
-    # Store final data in pickle format
-    Monthly_CRSP_Bonds.to_pickle(data_dir + 'Monthly_CRSP_Bonds.pkl')
+    # Store final data in parquet format
+    save_artifact(Monthly_CRSP_Bonds, data_dir, 'Monthly_CRSP_Bonds')
 
     return Monthly_CRSP_Bonds
     
@@ -286,8 +281,9 @@ def PS2_Q2_TBILL(Monthly_CRSP_Riskless):
                                                                   "t30ret": "rf30",
                                                                   "t90ret": "rf90"}).copy()
 
-    # Move all dates to the last day of the month
-    Monthly_CRSP_Riskless['date'] = Monthly_CRSP_Riskless['date'] + MonthEnd(0)
+    # Month id of every row, and all dates moved to the last day of the month
+    Monthly_CRSP_Riskless['month_id'] = month_id(Monthly_CRSP_Riskless['date'])
+    Monthly_CRSP_Riskless['date'] = month_end(Monthly_CRSP_Riskless['month_id'].values)
     Monthly_CRSP_Riskless = Monthly_CRSP_Riskless.sort_values(by=['date']).reset_index(drop=True).copy()
 
     # Filter dates
@@ -302,11 +298,8 @@ def PS2_Q2_TBILL(Monthly_CRSP_Riskless):
     # Data integrity checkes    
     assert Monthly_CRSP_Riskless['rf30'].isna().any() == False
 
-    # Compute required monthly values
-    Monthly_CRSP_Riskless['Date'] = pd.to_datetime(Monthly_CRSP_Riskless.date, format='%Y-%m-%d', errors='ignore')
-    Monthly_CRSP_Riskless['Year'] = Monthly_CRSP_Riskless['Date'].dt.year
-    Monthly_CRSP_Riskless['Month'] = Monthly_CRSP_Riskless['Date'].dt.month
-    Monthly_CRSP_Riskless.drop(['date', 'Date'], axis=1, inplace=True)
+    # Monthly values are keyed by the month id only, Year and Month are added back after the merge
+    Monthly_CRSP_Riskless.drop(['date'], axis=1, inplace=True)
 
     return Monthly_CRSP_Riskless
 
@@ -315,11 +308,14 @@ def PS2_Q2(Monthly_CRSP_Stocks, Monthly_CRSP_Bonds, Monthly_CRSP_Riskless):
     # For tbills filter dates, handle missing returns, check data integrity and split date to year and month
     Monthly_CRSP_Riskless = PS2_Q2_TBILL(Monthly_CRSP_Riskless)
 
-    # Merge Monthly_CRSP_Stocks with Monthly_CRSP_Bonds
-    df_merged = Monthly_CRSP_Stocks.merge(Monthly_CRSP_Bonds, how='outer', on=['Year', 'Month'])
+    # Merge Monthly_CRSP_Stocks with Monthly_CRSP_Bonds on the month id
+    df_merged = Monthly_CRSP_Stocks.merge(Monthly_CRSP_Bonds.drop(columns=['Year', 'Month']), how='outer',
+                                          on='month_id')
     
     # Further merge Monthly_CRSP_Riskless with the merged data
-    Monthly_CRSP_Universe = df_merged.merge(Monthly_CRSP_Riskless, how='outer', on=['Year', 'Month'])
+    Monthly_CRSP_Universe = df_merged.merge(Monthly_CRSP_Riskless, how='outer', on='month_id')
+    # Year and Month of every month, including the months missing from the stock returns
+    Monthly_CRSP_Universe = add_year_month(Monthly_CRSP_Universe)
     
     # Drop unrequired columns
     Monthly_CRSP_Universe.drop(['Stock_Ew_Ret', 'Bond_Ew_Ret'], axis=1, inplace=True)
@@ -331,13 +327,17 @@ def PS2_Q2(Monthly_CRSP_Stocks, Monthly_CRSP_Bonds, Monthly_CRSP_Riskless):
     # Drop unrequired columns
     Monthly_CRSP_Universe.drop(['Stock_Vw_Ret', 'Bond_Vw_Ret', 'rf30', 'rf90'], axis=1, inplace=True)
     
-    # Store final data in pickle format
-    Monthly_CRSP_Universe.to_pickle(data_dir + 'Monthly_CRSP_Universe.pkl')
+    # Store final data in parquet format
+    save_artifact(Monthly_CRSP_Universe, data_dir, 'Monthly_CRSP_Universe', date_col='Year')
 
     return Monthly_CRSP_Universe
     
-# Implements PS2-Q3 requirements:: Inputs - Monthly_CRSP_Universe
-def PS2_Q3(Monthly_CRSP_Universe):
+# Implements PS2-Q3 requirements:: Inputs - Monthly_CRSP_Universe, risk parity weights ('inverse_vol' or 'erc'),
+# optionally Daily_Sigma_Hat (volatilities estimated from daily returns, see compute_daily_sigma_hat), the sigma hat
+# and walk-forward estimators, and optionally the estimator state files and the Port_Rets of the run that stored
+# them (without state files every estimator runs over all months and nothing is stored)
+def PS2_Q3(Monthly_CRSP_Universe, rp_weights='inverse_vol', Daily_Sigma_Hat=None, sigma_estimator='rolling',
+           walk_forward_estimator='expanding', sigma_state=None, walk_forward_state=None, Stored_Port_Rets=None):
     # Create a copy of the dataframe to be used locally
     Port_Rets = Monthly_CRSP_Universe.copy()
 
@@ -354,14 +354,48 @@ def PS2_Q3(Monthly_CRSP_Universe):
     # Compute stock and bond inverse sigma hat
     # Reference - Asness et al. (2012)
     # "We estimate sigma_hat(t, i) as the 3-year rolling volatility of monthly excess returns"
-    for i in range(36, len(Port_Rets)):
-        Port_Rets.loc[i, "Stock_inverse_sigma_hat"] = 1/Port_Rets["Stock_Excess_Vw_Ret"][i-36:i].std()
-        Port_Rets.loc[i, "Bond_inverse_sigma_hat"] = 1/Port_Rets["Bond_Excess_Vw_Ret"][i-36:i].std()
+    # Volatility of months i-36 to i-1 for every month i and asset class in one pass over the return columns
+    rolling_sigma_hat = trailing_volatility(Port_Rets, ["Stock_Excess_Vw_Ret", "Bond_Excess_Vw_Ret"], 36)
+    sigma_hat = rolling_sigma_hat
+
+    # Streaming estimators ('ewma', 'expanding' or 'garch') use all months up to i-1 instead of the 36-month window
+    # With a state file a run after an update only feeds the new months to the estimator, the estimates of the
+    # earlier months are read from the stored Port_Rets
+    if sigma_estimator != 'rolling':
+        stored_sigma = None
+        if Stored_Port_Rets is not None and "Stock_online_sigma_hat" in Stored_Port_Rets.columns:
+            stored_sigma = Stored_Port_Rets.set_index('month_id')[["Stock_online_sigma_hat", "Bond_online_sigma_hat"]]
+            stored_sigma.columns = ["Stock_Excess_Vw_Ret", "Bond_Excess_Vw_Ret"]
+        sigma_hat = online_volatility(Port_Rets, ["Stock_Excess_Vw_Ret", "Bond_Excess_Vw_Ret"], sigma_estimator,
+                                      sigma_state, stored_sigma)
+        Port_Rets["Stock_online_sigma_hat"] = sigma_hat["Stock_Excess_Vw_Ret"]
+        Port_Rets["Bond_online_sigma_hat"] = sigma_hat["Bond_Excess_Vw_Ret"]
+    
+    # Volatilities estimated from the daily returns of months i-36 to i-1 replace the monthly estimates when given
+    if Daily_Sigma_Hat is not None:
+        daily_sigma = Port_Rets[['month_id']].merge(Daily_Sigma_Hat, how='left', on='month_id')
+        daily_sigma = daily_sigma[["Stock_sigma_hat", "Bond_sigma_hat"]].values
+        sigma_hat = pd.DataFrame(daily_sigma, index=Port_Rets.index, columns=sigma_hat.columns)
+        
+    Port_Rets["Stock_inverse_sigma_hat"] = 1/sigma_hat["Stock_Excess_Vw_Ret"]
+    Port_Rets["Bond_inverse_sigma_hat"] = 1/sigma_hat["Bond_Excess_Vw_Ret"]
+
+    # Equal risk contribution weights also account for the stock-bond correlation of months i-36 to i-1
+    # With uncorrelated asset classes the ERC weights equal the inverse sigma hat, so they replace them as is
+    if rp_weights == 'erc':
+        cov = trailing_covariance(Port_Rets[["Stock_Excess_Vw_Ret", "Bond_Excess_Vw_Ret"]].values, 36)
+        # With daily or streaming volatilities keep the monthly correlation and rescale the covariance to them
+        scale = sigma_hat.values/rolling_sigma_hat.values
+        cov = cov*scale[:, :, None]*scale[:, None, :]
+        # Each month starts the Newton iterations from the previous month's solution
+        erc = sequential_erc_weights(cov)
+        Port_Rets["Stock_inverse_sigma_hat"] = np.where(sigma_hat["Stock_Excess_Vw_Ret"].notna(), erc[:, 0], np.nan)
+        Port_Rets["Bond_inverse_sigma_hat"] = np.where(sigma_hat["Bond_Excess_Vw_Ret"].notna(), erc[:, 1], np.nan)
     
     # To ensure that we calculate σˆ for both the portfolios for the matching holding period, drop nan rows
     Port_Rets.dropna(inplace=True)
     # Reset index as we dropped rows
-    Port_Rets = Port_Rets.sort_values(by=['Year', 'Month']).reset_index(drop=True).copy()
+    Port_Rets = Port_Rets.sort_values(by=['month_id']).reset_index(drop=True).copy()
 
     # Compute unlevered k
     # Reference - Asness et al. (2012)
@@ -391,94 +425,248 @@ def PS2_Q3(Monthly_CRSP_Universe):
     # Validate that the volatility of this portfolio indeed matches the volatility of the value-weighted portfolio
     assert math.isclose(Port_Rets['Excess_Vw_Ret'].std(), Port_Rets["Excess_Levered_RP_Ret"].std(), rel_tol=1e-6) == True
 
+    # Compute walk-forward Levered k
+    # The levered k above uses the volatilities of the full sample, which are not known in real time. The walk-forward
+    # k matches the volatility of the value-weighted portfolio estimated from months up to i-1 only (NaN for the first
+    # 36 months), and a new month is one update of the estimator: the stored state is continued with the new months
+    stored_k = None
+    if Stored_Port_Rets is not None:
+        stored_k = Stored_Port_Rets.set_index('month_id')["Walk_Forward_k"]
+    Port_Rets["Walk_Forward_k"] = walk_forward_leverage(Port_Rets['Excess_Vw_Ret'].values, port_inv_sigma_wtd_ret.values,
+                                                        walk_forward_estimator, walk_forward_state,
+                                                        Port_Rets['month_id'].values, stored_k, min_periods=36)
+    Port_Rets["Excess_Walk_Forward_RP_Ret"] = port_inv_sigma_wtd_ret.multiply(Port_Rets["Walk_Forward_k"], axis="index")
+
+    # Compute turnover and trading costs of the rebalanced portfolios (positions in the stock and bond indices)
+    # Net return = gross return - trading cost of the month
+    month = Port_Rets['month_id'].values
+    asset_rets = Port_Rets[["Stock_Excess_Vw_Ret", "Bond_Excess_Vw_Ret"]].values
+    inv_sigma = Port_Rets[["Stock_inverse_sigma_hat", "Bond_inverse_sigma_hat"]].values
+    positions = {'60_40': np.tile([0.6, 0.4], (len(Port_Rets), 1)),
+                 'Unlevered_RP': inv_sigma*Port_Rets[["Unlevered_k"]].values,
+                 'Levered_RP': inv_sigma*Port_Rets[["Levered_k"]].values,
+                 'Walk_Forward_RP': inv_sigma*Port_Rets[["Walk_Forward_k"]].values}
+    for name, weights in positions.items():
+        Port_Rets[name + "_Turnover"], Port_Rets[name + "_Cost"] = dense_turnover(month, weights, asset_rets)
+        Port_Rets["Excess_" + name + "_Net_Ret"] = Port_Rets["Excess_" + name + "_Ret"] - Port_Rets[name + "_Cost"]
+
     return Port_Rets
     
 # Implements PS2-Q4 requirements:: Inputs - Port_Rets
 def PS2_Q4(Port_Rets):
     # Filter dates
-    Port_Rets = Port_Rets[(Port_Rets['Year'] > min_report_year) |
-                          ((Port_Rets['Year'] == min_report_year) & (Port_Rets['Month'] >= min_report_month))]
-    Port_Rets = Port_Rets[(Port_Rets['Year'] < max_report_year) |
-                          ((Port_Rets['Year'] == max_report_year) & (Port_Rets['Month'] <= max_report_month))]
-
-    # Create dataframe to store required stats
-    df_ps2_q4 = pd.DataFrame()    
+    Port_Rets = filter_report_dates(Port_Rets)
 
     # List of required potfolios for which we need performance stats
     req_columns = ['Stock_Excess_Vw_Ret', 'Bond_Excess_Vw_Ret',
                    'Excess_Vw_Ret', 'Excess_60_40_Ret',
-                   'Excess_Unlevered_RP_Ret', 'Excess_Levered_RP_Ret']
+                   'Excess_Unlevered_RP_Ret', 'Excess_Levered_RP_Ret', 'Excess_Walk_Forward_RP_Ret']
+
+    # Compute required stats of all portfolios in one pass
+    df_ps2_q4 = performance_stats(Port_Rets[req_columns])[['mean', 'tstat', 'vol', 'sharpe', 'skew', 'kurtosis']]
+    df_ps2_q4.columns = ["Annualized Mean", "t-stat of Annualized Mean", "Annualized Standard Deviation",
+                         "Annualized Sharpe Ratio", "Skewness", "Excess Kurtosis"]
 
-    # Compute required stats
-    df_ps2_q4["Annualized Mean"] = 100*12*Port_Rets[req_columns].mean(axis=0)
-    df_ps2_q4["t-stat of Annualized Mean"] = ttest_1samp(Port_Rets[req_columns], 6*[0], axis=0).statistic
-    df_ps2_q4["Annualized Standard Deviation"] = 100*np.sqrt(12)*Port_Rets[req_columns].std(axis=0)
-    df_ps2_q4["Annualized Sharpe Ratio"] = df_ps2_q4["Annualized Mean"]/df_ps2_q4["Annualized Standard Deviation"]
-    df_ps2_q4["Skewness"] = Port_Rets[req_columns].skew(axis=0)
-    df_ps2_q4["Excess Kurtosis"] = Port_Rets[req_columns].kurtosis(axis=0)
+    # Missing months are skipped, so report the months of every column: the walk-forward levered RP starts once its
+    # volatility estimator has 36 months, the other portfolios cover all report months
+    df_ps2_q4["Months"] = Port_Rets[req_columns].notna().sum().values
+
+    # Add the bootstrap confidence intervals only if needed
+    if bootstrap_ci == True:
+        df_ps2_q4 = df_ps2_q4.join(confidence_interval_columns(Port_Rets[req_columns],
+                                                               {'mean': "Annualized Mean",
+                                                                'sharpe': "Annualized Sharpe Ratio"},
+                                                               n_reps=bootstrap_reps))
 
     # Convert dataframe to the desired format
     df_ps2_q4.index = ['CRSP stocks', 'CRSP bonds',
                        'Value-weighted portfolio', '60/40 portfolio',
-                       'unlevered RP', 'levered RP']
+                       'unlevered RP', 'levered RP', 'walk-forward levered RP']
 
     return df_ps2_q4
     
+# Compares the gross and net of trading cost performance of the rebalanced portfolios: Inputs - Port_Rets
+def PS2_Costs(Port_Rets):
+    # Filter dates
+    Port_Rets = filter_report_dates(Port_Rets)
+
+    # Gross excess returns, trading costs and turnover of every portfolio, in the same column order
+    names = ['60_40', 'Unlevered_RP', 'Levered_RP', 'Walk_Forward_RP']
+    labels = ['60/40 portfolio', 'unlevered RP', 'levered RP', 'walk-forward levered RP']
+    gross = Port_Rets[["Excess_" + name + "_Ret" for name in names]].set_axis(labels, axis=1)
+    cost = Port_Rets[[name + "_Cost" for name in names]].set_axis(labels, axis=1)
+    turnover = Port_Rets[[name + "_Turnover" for name in names]].set_axis(labels, axis=1)
+
+    return net_of_cost_summary(gross, cost, turnover)
+
+# Runs the risk parity backtest over the sweep grids and reports the PS2-Q4 stats of every configuration:
+# Inputs - Monthly_CRSP_Universe
+def PS2_Sweep(Monthly_CRSP_Universe):
+    # Stats over the report months of every window, weighting, rebalance frequency and volatility target
+    df_sweep = risk_parity_sweep(Monthly_CRSP_Universe, sweep_windows, sweep_weightings, sweep_rebalance_months,
+                                 sweep_vol_targets, (min_report_year, min_report_month),
+                                 (max_report_year, max_report_month))
+    return df_sweep.set_index(['window', 'weighting', 'rebalance_months', 'vol_target', 'portfolio'])
+
+# Keeps the months between the first and last report month: Inputs - Port_Rets
+def filter_report_dates(Port_Rets):
+    months = Port_Rets['month_id']
+    return Port_Rets[(months >= year_month_id(min_report_year, min_report_month)) &
+                     (months <= year_month_id(max_report_year, max_report_month))]
+
 # Processes raw CRSP data downloaded from WRDS for each asset class
 def process_raw_data():
     # Load stored raw CRSP stock returns data as a dataframe
-    mscrsp_raw = pd.read_pickle(data_dir + 'mscrsp_raw.pkl')
+    mscrsp_raw = load_artifact(data_dir, 'mscrsp_raw')
 
     # Load stored raw CRSP stock delisting returns data as a dataframe
-    msdelcrsp_raw = pd.read_pickle(data_dir + 'msdelcrsp_raw.pkl')
+    msdelcrsp_raw = load_artifact(data_dir, 'msdelcrsp_raw')
 
     # Load stored raw CRSP bond data as a dataframe
-    mbcrsp_raw = pd.read_pickle(data_dir + 'mbcrsp_raw.pkl')
+    mbcrsp_raw = load_artifact(data_dir, 'mbcrsp_raw')
 
     # Load stored raw CRSP t-bill data as a dataframe
-    mtbcrsp_raw = pd.read_pickle(data_dir + 'mtbcrsp_raw.pkl')
+    mtbcrsp_raw = load_artifact(data_dir, 'mtbcrsp_raw')
 
     # Process and store raw CRSP stock returns and delisting returns
-    process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw)
+    run_stage('process', process_raw_crsp_stock_data, data_dir, mscrsp_raw, msdelcrsp_raw)
 
     # Process and store raw CRSP bond and t-bill data
-    process_raw_crsp_bond_data(data_dir, mbcrsp_raw, mtbcrsp_raw)
+    run_stage('process', process_raw_crsp_bond_data, data_dir, mbcrsp_raw, mtbcrsp_raw)
+
+# Downloads the CRSP months released since the last download and appends them to the stored data and monthly returns
+# instead of downloading and processing the full history again
+def update_raw_data():
+    # Download the new CRSP stock months
+    mscrsp_delta, msdelcrsp_delta = run_stage('download', download_raw_crsp_delta, data_dir, wrds_id)
+
+    if len(mscrsp_delta) == 0:
+        print("      No new months released since the last download")
+    else:
+        # Append the new months to the processed data, the cleaned panel and the monthly stock returns
+        run_stage('update', update_monthly_stock_returns, mscrsp_delta, msdelcrsp_delta)
+
+        # Store the new raw rows last, the next update starts after them
+        append_artifact(mscrsp_delta, data_dir, 'mscrsp_raw')
+        if len(msdelcrsp_delta) > 0:
+            append_artifact(msdelcrsp_delta, data_dir, 'msdelcrsp_raw')
+
+    # Bond and t-bill data are small, so they are downloaded, processed and aggregated again
+    run_stage('download', download_raw_crsp_bond_data, data_dir, wrds_id)
+    run_stage('process', process_raw_crsp_bond_data, data_dir, load_artifact(data_dir, 'mbcrsp_raw'),
+              load_artifact(data_dir, 'mtbcrsp_raw'))
+    run_stage('aggregate', PS2_Q1, load_artifact(data_dir, 'mbcrsp_processed'))
+    
+# Computes stock and bond volatilities from daily value-weighted returns, streaming the daily panels from disk
+# Reference - Asness, Frazzini and Pedersen (2012) estimate volatilities from daily returns
+def compute_daily_sigma_hat():
+    print("Estimating volatilities from daily returns ...")
+    params = clean_crsp_params()
+
+    # Daily value-weighted returns of the monthly index universe (share code 10 or 11 on NYSE, AMEX or NASDAQ)
+    # weighted by the previous day's market cap. Delisting returns are not added to the daily returns.
+    Daily_Stocks = value_weighted_returns(ColumnarPanel(os.path.join(data_dir, 'dscrsp_panel')),
+                                          'permno', 'date', 'ret',
+                                          lambda x: np.abs(x['prc'].astype(np.float64))*x['shrout'],
+                                          lambda x: np.isin(x['exchcd'], params['exchcd_set']) &
+                                                    np.isin(x['shrcd'], params['shrcd_set']))
+
+    # Daily value-weighted returns of the treasuries weighted by the previous day's amount outstanding
+    # CRSP_US_Treasury_Database_Guide: the return is set to -99 when the price is missing
+    Daily_Bonds = value_weighted_returns(ColumnarPanel(os.path.join(data_dir, 'dbcrsp_panel')),
+                                         'kytreasno', 'caldt', 'tdretnua', lambda x: x['tdtotout'],
+                                         lambda x: x['tdretnua'] != -99)
+
+    Daily_Returns = Daily_Stocks[['date', 'Vw_Ret']].rename(columns={'Vw_Ret': 'Stock_Vw_Ret'}).merge(
+        Daily_Bonds[['date', 'Vw_Ret']].rename(columns={'Vw_Ret': 'Bond_Vw_Ret'}), how='outer', on='date')
+    # Filter dates
+    Daily_Returns = Daily_Returns[(Daily_Returns['date'] >= min_date) & (Daily_Returns['date'] <= max_date)]
+
+    # Volatility of the daily returns of months i-36 to i-1 in monthly units, the daily riskless rate barely varies
+    # so the volatility of the index returns is used for the excess returns
+    Daily_Sigma_Hat = monthly_volatility_from_daily(Daily_Returns, ['Stock_Vw_Ret', 'Bond_Vw_Ret'], 36)
+    Daily_Sigma_Hat = Daily_Sigma_Hat.rename(columns={'Stock_Vw_Ret': 'Stock_sigma_hat',
+                                                      'Bond_Vw_Ret': 'Bond_sigma_hat'})
     
+    # Store final data in parquet format
+    save_artifact(Daily_Sigma_Hat, data_dir, 'Daily_Sigma_Hat', date_col='Year')
+
+    return Daily_Sigma_Hat
+
 # Computes monthly returns for each asset class (Stocks, Bonds, T-Bills)
 def compute_monthly_returns(recompute=False):
     # If recumpute is set to true, recompute monthly returns
     if recompute == True:
         print("Recomputing monthly returns for each asset class ...")
 
-        # Load processed CRSP stock and bond data as dataframes
-        CRSP_Stocks = pd.read_pickle(data_dir + 'mscrsp_processed.pkl')
-        CRSP_Bonds = pd.read_pickle(data_dir + 'mbcrsp_processed.pkl')
+        # Load the cleaned CRSP stock panel (rebuilt only if the processed data changed) and processed CRSP bond data
+        CRSP_Stocks = run_stage('clean', load_clean_crsp_stocks, data_dir)
+        CRSP_Bonds = load_artifact(data_dir, 'mbcrsp_processed')
 
         # Calculate stock and bond monthly equal-weighted return, value-weighted return and lagged total market cap.
-        Monthly_CRSP_Stocks = PS1_Q1(CRSP_Stocks)
-        Monthly_CRSP_Bonds = PS2_Q1(CRSP_Bonds)
+        Monthly_CRSP_Stocks = run_stage('aggregate', PS1_Q1, CRSP_Stocks)
+        Monthly_CRSP_Bonds = run_stage('aggregate', PS2_Q1, CRSP_Bonds)
 
-    # Otherwise load pre-computed data from the stored pickle files
+    # Otherwise load pre-computed data from the artifact store
     else:
-        print("Loading asset returns from the pickle files ...")
+        print("Loading asset returns from the artifact store ...")
         
         # Load stored Monthly_CRSP_Stocks data as a dataframe
-        Monthly_CRSP_Stocks = pd.read_pickle(data_dir + 'Monthly_CRSP_Stocks.pkl')
+        Monthly_CRSP_Stocks = load_artifact(data_dir, 'Monthly_CRSP_Stocks')
 
         # Load stored Monthly_CRSP_Bonds data as a dataframe
-        Monthly_CRSP_Bonds = pd.read_pickle(data_dir + 'Monthly_CRSP_Bonds.pkl')
+        Monthly_CRSP_Bonds = load_artifact(data_dir, 'Monthly_CRSP_Bonds')
 
     # Load processed CRSP t-bill data as a dataframe
-    Monthly_CRSP_Riskless = pd.read_pickle(data_dir + 'mtbcrsp_processed.pkl')
+    Monthly_CRSP_Riskless = load_artifact(data_dir, 'mtbcrsp_processed')
         
     return Monthly_CRSP_Stocks, Monthly_CRSP_Bonds, Monthly_CRSP_Riskless
     
+# Appends newly released months of CRSP stock data to the monthly stock returns without reprocessing the history:
+# Inputs - raw CRSP stock returns and delisting returns of the new months only (same columns as the full download)
+# Lagged market cap continues from the state stored with the cleaned panel, so the appended months are identical
+# to the ones a full rebuild would compute. Months after max_date are added to the cleaned panel only.
+def update_monthly_stock_returns(mscrsp_delta, msdelcrsp_delta):
+    print("Updating monthly returns for stocks ...")
+
+    # Process the new months the same way as the full history
+    mscrsp_processed_delta = process_raw_crsp_stock_data(data_dir, mscrsp_delta, msdelcrsp_delta, store=False)
+
+    # The new months must directly follow the stored monthly returns, unless they are all after max_date
+    first_month = month_id(mscrsp_processed_delta['date']).min()
+    last_month = load_artifact(data_dir, 'Monthly_CRSP_Stocks', columns=['month_id'])['month_id'].max()
+    if first_month <= month_id([max_date])[0] and first_month != last_month + 1:
+        raise RuntimeError("Monthly_CRSP_Stocks ends before the new months, run the driver with "
+                           "recompute_monthly_returns=True first")
+
+    # Clean the new months and append them (and the processed rows) to the stored data
+    CRSP_Stocks_New, _ = update_clean_crsp_stocks(data_dir, ['mscrsp_processed'], mscrsp_processed_delta,
+                                                  lambda: append_artifact(mscrsp_processed_delta, data_dir,
+                                                                          'mscrsp_processed'),
+                                                  **clean_crsp_params())
+
+    # Months after max_date are only added to the cleaned panel
+    if len(CRSP_Stocks_New) == 0:
+        print("      The new months are after max_date " + max_date + ", move max_date to add them to the returns")
+        return None
+
+    # Compute monthly values of the new months and append them
+    Monthly_CRSP_Stocks_New = PS1_Q1(CRSP_Stocks_New, store=False)
+    append_artifact(Monthly_CRSP_Stocks_New, data_dir, 'Monthly_CRSP_Stocks')
+
+    return Monthly_CRSP_Stocks_New
+
 # Runs all the functions and prints the required results
-def driver(download_data=False, process_data=False, recompute_monthly_returns=False):
+def driver(download_data=False, process_data=False, recompute_monthly_returns=False, update_data=False):
+    # Record time, memory and data sizes of every stage in a trace file
+    start_trace('PS2', os.path.join(data_dir, 'trace_PS2.json'))
+
     # Download the data only if needed
     if download_data == True:
         print("Downloading data for each asset class ...")
-        download_raw_crsp_data(data_dir, wrds_id)
+        run_stage('download', download_raw_crsp_data, data_dir, wrds_id)
+        if daily_vol == True:
+            run_stage('download', download_raw_crsp_daily_data, data_dir, wrds_id)
     else:
         print("Skipped data downloading!")
     
@@ -488,20 +676,50 @@ def driver(download_data=False, process_data=False, recompute_monthly_returns=Fa
         process_raw_data()
     else:
         print("Skipped raw data processing!")      
+
+    # Append the months released since the last download only if needed
+    if update_data == True:
+        print("Appending newly released months ...")
+        update_raw_data()
     
     # Commpute monthly returns for each asset class (Stocks, Bonds, T-Bills)
     Monthly_CRSP_Stocks, Monthly_CRSP_Bonds, Monthly_CRSP_Riskless = compute_monthly_returns(recompute_monthly_returns)
 
     # Aggregate stock, bond and riskless monthly return datatables
-    Monthly_CRSP_Universe = PS2_Q2(Monthly_CRSP_Stocks, Monthly_CRSP_Bonds, Monthly_CRSP_Riskless)
+    Monthly_CRSP_Universe = run_stage('merge', PS2_Q2, Monthly_CRSP_Stocks, Monthly_CRSP_Bonds, Monthly_CRSP_Riskless)
+    
+    # Estimate the volatilities from daily returns only if needed
+    Daily_Sigma_Hat = None
+    if daily_vol == True:
+        Daily_Sigma_Hat = run_stage('aggregate', compute_daily_sigma_hat)
     
     # Calculate unlevered and levered risk-parity portfolio monthly returns
-    Port_Rets = PS2_Q3(Monthly_CRSP_Universe)
+    # The streaming estimators continue from the states stored by the last run and its stored Port_Rets, unless the
+    # monthly returns were recomputed
+    Stored_Port_Rets = None
+    if recompute_monthly_returns == False and artifact_exists(data_dir, 'Port_Rets'):
+        Stored_Port_Rets = load_artifact(data_dir, 'Port_Rets')
+    Port_Rets = run_stage('stats', PS2_Q3, Monthly_CRSP_Universe, rp_weights, Daily_Sigma_Hat, sigma_estimator,
+                          walk_forward_estimator, os.path.join(data_dir, 'sigma_hat_state.json'),
+                          os.path.join(data_dir, 'walk_forward_state.json'), Stored_Port_Rets)
+    save_artifact(Port_Rets, data_dir, 'Port_Rets', date_col='Year')
     
     # Display Q4 results        
-    result_ps2_q4 = PS2_Q4(Port_Rets)
+    result_ps2_q4 = run_stage('stats', PS2_Q4, Port_Rets)
     
     print(result_ps2_q4)
+
+    # Display gross and net of trading cost results
+    result_ps2_costs = run_stage('stats', PS2_Costs, Port_Rets)
+    print(result_ps2_costs)
+
+    # Display the risk parity parameter sweep
+    if sweep_results == True:
+        result_ps2_sweep = run_stage('stats', PS2_Sweep, Monthly_CRSP_Universe)
+        print(result_ps2_sweep)
+
+    # Close the trace file
+    stop_trace()
     
 
 # Import packages
@@ -513,8 +731,23 @@ import wrds
 import os
 from pandas.tseries.offsets import *
 import datetime
-from scipy.stats import ttest_1samp
 import math
+from qam_aggregation import grouped_weighted_mean
+from qam_rolling import trailing_volatility
+from qam_riskparity import trailing_covariance, sequential_erc_weights
+from qam_online import online_volatility, walk_forward_leverage
+from qam_stats import performance_stats
+from qam_bootstrap import confidence_interval_columns
+from qam_costs import dense_turnover, net_of_cost_summary
+from qam_sweep import risk_parity_sweep
+from qam_storage import save_artifact, load_artifact, append_artifact, artifact_exists
+from qam_crsp import cached_clean_crsp_stocks, update_clean_crsp_stocks
+from qam_calendar import to_dates, month_id, month_end, year_month_id, add_year_month
+from qam_schema import apply_schema, MemoryReport, CRSP_SCHEMA
+from qam_wrds import download_partitioned, date_partitions
+from qam_instrument import start_trace, stop_trace, run_stage
+from qam_daily import ColumnarPanel, ingest_partitioned, value_weighted_returns, monthly_volatility_from_daily
+from qam_daily import DAILY_STOCK_QUERY, DAILY_BOND_QUERY, DAILY_STOCK_SCHEMA, DAILY_BOND_SCHEMA
 
 # Directory to store the downloaded data
 data_dir = 'data\\'
@@ -522,6 +755,9 @@ data_dir = 'data\\'
 # WRDS login id
 wrds_id = 'smarty_iitian'
 
+# Specify whether prices and shares are stored as float32 to reduce the memory footprint of the CRSP panel
+float32_prices = False
+
 # Filter relevant date - Reference - Assignment Instruction:
 # "Your output should be from January 1926 to December 2023, at a monthly frequency"
 min_date = '1926-01-31'
@@ -537,10 +773,59 @@ max_report_month = 6
 # Specify whether we need to download the raw data or not
 download_data = False
 
+# Specify whether every downloaded partition is fetched again instead of reusing the final checkpoints
+refresh_download = False
+
 # Specify whether we need to process the raw data or not
 process_data = True
 
+# Specify whether the months released since the last download are appended to the stored data and monthly returns
+# instead of downloading and processing the full history again (needs one full run first, and is usually run with
+# download_data, process_data and recompute_monthly_returns set to False)
+update_data = False
+
 # Specify whether we need to recompute monthly returns or not
 recompute_monthly_returns = True
 
-driver(download_data, process_data, recompute_monthly_returns)
\ No newline at end of file
+# Specify the risk parity weights: 'inverse_vol' (inverse sigma hat, Asness et al. 2012) or 'erc' (equal risk
+# contribution, uses the 36-month covariance of stock and bond excess returns)
+rp_weights = 'inverse_vol'
+
+# Specify the sigma hat estimator: 'rolling' (36-month window, Asness et al. 2012) or a streaming estimator of
+# qam_online ('ewma' with a 12-month half-life, 'expanding' or 'garch')
+sigma_estimator = 'rolling'
+
+# Specify the estimator of the trailing volatilities of the walk-forward levered RP ('expanding', 'ewma' or 'garch')
+walk_forward_estimator = 'expanding'
+
+# Specify whether the volatilities are estimated from daily returns (the daily panels are downloaded with the data)
+daily_vol = False
+
+# Specify whether the risk parity backtest is swept over a parameter grid: window lengths in months, weights
+# ('inverse_vol', 'erc'), rebalance frequencies in months and volatility targets of the levered RP ('vw' matches the
+# value-weighted portfolio, a number s the s/(1-s) stock/bond mix)
+sweep_results = False
+sweep_windows = (12, 24, 36, 60)
+sweep_weightings = ('inverse_vol', 'erc')
+sweep_rebalance_months = (1, 3, 12)
+sweep_vol_targets = ('vw', 0.6)
+
+# Specify whether the stats tables add block-bootstrap confidence intervals (95%, stationary bootstrap with 12-month
+# mean blocks) of the annualized mean and Sharpe ratio, and the number of bootstrap replications
+bootstrap_ci = False
+bootstrap_reps = 10000
+
+# CRSP stock monthly returns with the share and exchange codes of the month, run once per date partition
+MSF_QUERY = """select a.permno, a.permco, a.date, b.shrcd, b.exchcd, a.ret, a.retx, a.shrout, a.prc
+               from crspq.msf as a
+               left join crspq.msenames as b
+               on a.permno=b.permno and b.namedt<=a.date and a.date<=b.nameendt
+               where a.date between '{start}' and '{end}'"""
+
+# CRSP stock monthly delisting returns with a delisting date between start and end
+MSEDELIST_QUERY = """select permno, dlret, dlstdt, dlstcd from crspq.msedelist
+                     where dlstdt between '{start}' and '{end}'"""
+
+# Run the driver only when the script is executed, so that the functions can be imported by the benchmarks
+if __name__ == "__main__":
+    driver(download_data, process_data, recompute_monthly_returns, update_data)
\ No newline at end of file
@@ -9,22 +9,56 @@ def download_raw_crsp_data(data_dir, wrds_id):
     # Download CRSP stock monthly returns
     # Reference - Assignment Instruction:
     # "This should be the full dataset available on WRDS; do not pre-filter by SHRCD, EXCHCD, or date."
-    conn = wrds.Connection(wrds_username=wrds_id)
-    mscrsp_raw = conn.raw_sql("""select a.permno, a.permco, a.date, b.shrcd, b.exchcd, a.ret, a.retx, a.shrout, a.prc
-                                from crspq.msf as a
-                                left join crspq.msenames as b
-                                on a.permno=b.permno and b.namedt<=a.date and a.date<=b.nameendt""")    
-    # Store downloaded data in pickle format
-    mscrsp_raw.to_pickle(data_dir + 'mscrsp_raw.pkl')
+    # The full history is split into date partitions that are fetched concurrently over a bounded pool of
+    # WRDS connections. Every partition is checkpointed, so a rerun after a dropped session only fetches
+    # the missing partitions and the partitions still open when they were fetched.
+    mscrsp_raw = download_partitioned(lambda: wrds.Connection(wrds_username=wrds_id), MSF_QUERY,
+                                      date_partitions(), os.path.join(data_dir, 'checkpoints'), 'mscrsp_raw',
+                                      refresh=refresh_download)
+    # Store downloaded data in parquet format
+    save_artifact(mscrsp_raw, data_dir, 'mscrsp_raw')
 
     # Download CRSP stock monthly delisting returns
-    msdelcrsp_raw = conn.raw_sql("""select permno, dlret, dlstdt, dlstcd from crspq.msedelist""")
-    # Store downloaded data in pickle format
-    msdelcrsp_raw.to_pickle(data_dir + 'msdelcrsp_raw.pkl')
+    conn = wrds.Connection(wrds_username=wrds_id)
+    msdelcrsp_raw = conn.raw_sql(MSEDELIST_QUERY.format(start='1925-01-01', end=datetime.date.today().isoformat()))
+    # Store downloaded data in parquet format
+    save_artifact(msdelcrsp_raw, data_dir, 'msdelcrsp_raw', date_col='dlstdt')
 
     # Close WRDS API connection
     conn.close()
+
+# Downloads the CRSP stock months released after the stored raw data: Inputs - data_dir and wrds_id
+# The new months are fetched as one partition from the month after the last stored one to today, and the delisting
+# returns up to the end of the last new month, so the next update starts right after them. The stored raw data is
+# not changed (see update_raw_data).
+def download_raw_crsp_delta(data_dir, wrds_id):
+    # First day of the month after the last stored month
+    last_date = pd.Timestamp(load_artifact(data_dir, 'mscrsp_raw', columns=['date'])['date'].max())
+    start = (last_date + MonthBegin(1)).strftime('%Y-%m-%d')
+
+    # Download the new CRSP stock monthly returns, fetched again on every update as the partition is still open
+    mscrsp_delta = download_partitioned(lambda: wrds.Connection(wrds_username=wrds_id), MSF_QUERY,
+                                        [(start, datetime.date.today().isoformat())],
+                                        os.path.join(data_dir, 'checkpoints'), 'mscrsp_delta', refresh=True)
+    if len(mscrsp_delta) == 0:
+        return mscrsp_delta, None
+
+    # Download the delisting returns of the new months
+    end = (pd.Timestamp(to_dates(mscrsp_delta['date']).max()) + MonthEnd(0)).strftime('%Y-%m-%d')
+    conn = wrds.Connection(wrds_username=wrds_id)
+    msdelcrsp_delta = conn.raw_sql(MSEDELIST_QUERY.format(start=start, end=end))
+    conn.close()
+
+    return mscrsp_delta, msdelcrsp_delta
     
+# Downloads CRSP daily stock data into a memory-mapped columnar panel (used by the dynamic WML strategy)
+def download_raw_crsp_daily_data(data_dir, wrds_id):
+    # Daily CRSP is written to disk one year at a time, ingested years are recorded so a rerun resumes
+    connect = lambda: wrds.Connection(wrds_username=wrds_id)
+    years = date_partitions(end_year=max_year, years_per_partition=1)
+    ingest_partitioned(connect, DAILY_STOCK_QUERY, years, os.path.join(data_dir, 'dscrsp_panel'),
+                       DAILY_STOCK_SCHEMA, ['date', 'permno'])
+
 def download_ff3_monthly_data(data_dir):
     # Download and save FF3 monthly data
     FF_mkt = pandas_datareader.famafrench.FamaFrenchReader('F-F_Research_Data_Factors',
@@ -32,24 +66,28 @@ def download_ff3_monthly_data(data_dir):
                                                            end=str(datetime.datetime.now().year+1))
     FF_mkt = FF_mkt.read()[0]/100
 
-    FF_mkt['Date'] = pd.to_datetime(FF_mkt.index, format='%Y-%m-%d', errors='ignore')
-    FF_mkt['Year'] = FF_mkt['Date'].dt.year
-    FF_mkt['Month'] = FF_mkt['Date'].dt.month
-    FF_mkt.drop(['Date'], axis=1, inplace=True)
-
-    FF_mkt.columns = ['Market_minus_Rf', 'SMB', 'HML', 'Rf', 'Year', 'Month']
-    FF_mkt = FF_mkt[['Year', 'Month', 'Market_minus_Rf', 'SMB', 'HML', 'Rf']]
+    # Integer month id of the monthly periods, Year and Month are derived from it
+    FF_mkt.columns = ['Market_minus_Rf', 'SMB', 'HML', 'Rf']
+    FF_mkt['month_id'] = month_id(FF_mkt.index)
+    FF_mkt = add_year_month(FF_mkt.reset_index(drop=True))
+    FF_mkt = FF_mkt[['month_id', 'Year', 'Month', 'Market_minus_Rf', 'SMB', 'HML', 'Rf']]
     
     # Filter dates
     FF_mkt = FF_mkt[FF_mkt['Year'] >= min_year]
     FF_mkt = FF_mkt[FF_mkt['Year'] <= max_year]
 
-    # Store downloaded data in pickle format
-    FF_mkt.to_pickle(data_dir + 'ff3_monthly.pkl')
+    # Store downloaded data in parquet format
+    save_artifact(FF_mkt, data_dir, 'ff3_monthly', date_col='Year')
     
-# Processes and saves raw CRSP stock returns and delisted returns data to create a merged dataframe
-def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
+# Processes and saves raw CRSP stock returns and delisted returns data to create a merged dataframe:
+# Inputs - data_dir, raw CRSP stock returns and delisting returns, and whether to store the result
+# (incremental updates process only the new months and append them instead)
+def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw, store=True):
     print("      Processing raw data for stocks ...")
+    # Track memory usage of each processing stage
+    report = MemoryReport()
+    report.record('mscrsp_raw', mscrsp_raw)
+    report.record('msdelcrsp_raw', msdelcrsp_raw)
     
     ############################### Process raw CRSP returns ###############################
     
@@ -63,11 +101,11 @@ def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
                             mscrsp_raw['shrout'].notna()].copy()
 
     # Reference - Assignment Instruction: PERMNO, SHRCD, EXCHCD and SHROUT variables have type integer
-    int_columns = ['permno', 'permco', 'shrcd', 'exchcd', 'shrout']
-    mscrsp_raw[int_columns] = mscrsp_raw[int_columns].astype(int)
+    # Use the compact schema: int32 ids and shares, int8 codes (optionally float32 prices and shares)
+    mscrsp_raw = apply_schema(mscrsp_raw, CRSP_SCHEMA, float32=float32_prices)
 
     # Reference - Assignment Instruction: Format the date column as a datetime
-    mscrsp_raw['date'] = pd.to_datetime(mscrsp_raw['date'], format='%Y-%m-%d', errors='ignore')
+    mscrsp_raw['date'] = to_dates(mscrsp_raw['date'])
 
     # Sort the data by permno and date and reset index because we dropped rows above
     mscrsp_raw = mscrsp_raw.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
@@ -78,11 +116,11 @@ def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
     msdelcrsp_raw = msdelcrsp_raw.sort_values(by=['permno', 'dlstdt']).reset_index(drop=True).copy()
     
     # Reference - Assignment Instruction: PERMNO variable has type integer
-    msdelcrsp_raw['permno'] = msdelcrsp_raw['permno'].astype(int)
+    msdelcrsp_raw = apply_schema(msdelcrsp_raw, CRSP_SCHEMA)
 
     # Reference - Assignment Instruction: Format the date column as a datetime
     msdelcrsp_raw = msdelcrsp_raw.rename(columns={"dlstdt": "date"}).copy()
-    msdelcrsp_raw['date'] = pd.to_datetime(msdelcrsp_raw['date'], format='%Y-%m-%d', errors='ignore')
+    msdelcrsp_raw['date'] = to_dates(msdelcrsp_raw['date'])
 
     # Sort the data by permno and date and reset index
     msdelcrsp_raw = msdelcrsp_raw.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
@@ -94,8 +132,17 @@ def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
     # Sort the data by permno and date and reset index
     mscrsp_processed = mscrsp_processed.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
     
-    # Store Processed merged CRSP data in pickle format
-    mscrsp_processed.to_pickle(data_dir + 'mscrsp_processed.pkl')
+    # The outer merge turns integer columns with missing values into float64, restore the compact schema
+    mscrsp_processed = apply_schema(mscrsp_processed, CRSP_SCHEMA, float32=float32_prices)
+    report.record('mscrsp_processed', mscrsp_processed)
+    
+    if store == True:
+        # Store Processed merged CRSP data in parquet format
+        save_artifact(mscrsp_processed, data_dir, 'mscrsp_processed')
+        # Store the memory report of the processing stages
+        report.save(os.path.join(data_dir, 'memory_report_mscrsp_processed.json'))
+
+    return mscrsp_processed
     
 # Process and store raw DM and KRF returns
 def process_raw_DM_KRF_returns(data_dir, DM_returns_file, KRF_returns_file):
@@ -111,15 +158,15 @@ def process_raw_DM_KRF_returns(data_dir, DM_returns_file, KRF_returns_file):
     # Convert "date" to datetime
     DM_returns["date"] = pd.to_datetime(DM_returns["date"], format="%Y%m%d")
     
-    # Compute Year and Month
-    DM_returns["Year"] = DM_returns["date"].dt.year
-    DM_returns["Month"] = DM_returns["date"].dt.month
+    # Compute the month id, and Year and Month from it
+    DM_returns["month_id"] = month_id(DM_returns["date"])
+    DM_returns = add_year_month(DM_returns)
     
     # Drop unreqiured columns
     DM_returns.drop(columns=["date", "d", "e"], inplace=True)    
     
-    # Store processed data in pickle format
-    DM_returns.to_pickle(data_dir + 'DM_returns.pkl')
+    # Store processed data in parquet format
+    save_artifact(DM_returns, data_dir, 'DM_returns', date_col='Year')
     
     ############################### Process raw KRF returns ###############################
 
@@ -139,9 +186,9 @@ def process_raw_DM_KRF_returns(data_dir, DM_returns_file, KRF_returns_file):
     # Convert date to datetime
     KRF_returns["date"] = pd.to_datetime(KRF_returns["date"], format="%Y%m")
 
-    # Compute Year and Month
-    KRF_returns["Year"] = KRF_returns["date"].dt.year
-    KRF_returns["Month"] = KRF_returns["date"].dt.month
+    # Compute the month id, and Year and Month from it
+    KRF_returns["month_id"] = month_id(KRF_returns["date"])
+    KRF_returns = add_year_month(KRF_returns)
 
     # Drop unreqiured columns
     KRF_returns.drop(columns=["date"], inplace=True)
@@ -159,12 +206,11 @@ def process_raw_DM_KRF_returns(data_dir, DM_returns_file, KRF_returns_file):
         col_mapping["Decile " + str(i)] = str(i)    
     KRF_returns = KRF_returns.rename(columns=col_mapping)
 
-    # Store processed data in pickle format
-    KRF_returns.to_pickle(data_dir + 'KRF_returns.pkl')
+    # Store processed data in parquet format
+    save_artifact(KRF_returns, data_dir, 'KRF_returns', date_col='Year')
     
-# Implements PS3-Q1 requirements: Inputs - CRSP_Stocks
-def PS3_Q1(CRSP_Stocks):
-    print("Recomputing ranking returns ...")
+# Returns the parameters used to clean the CRSP stock panel
+def clean_crsp_params():
     # Reference - Kenneth R. French:
     # "Rm-Rf, the excess return on the market, value-weight return of all CRSP firms incorporated in the US and
     # listed on the NYSE, AMEX, or NASDAQ that have a CRSP share code of 10 or 11 at the beginning of month t,
@@ -175,97 +221,43 @@ def PS3_Q1(CRSP_Stocks):
     # Filter relevant shrcd - Reference - Kenneth R. French: "that have a CRSP share code of 10 or 11"
     shrcd_set = [10, 11]
 
-    # Move all dates to the last day of the month
-    CRSP_Stocks['date'] = CRSP_Stocks['date'] + MonthEnd(0)
-    # Sort again as we changed date values
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
-
-    # exchcd/shrcd are nan for delisted returns, so filtering rows on required exchcd/shrcd removes delisted return rows
-    # dlstcd is not-nan for all the delisted return rows, so it has been used as a proxy to identify delisted return rows
-    # Rows with unrequired exchcd/shrcd are removed only if those are non delisted return row
-    CRSP_Stocks = CRSP_Stocks[(CRSP_Stocks['dlstcd'].notna()) |
-                              ((CRSP_Stocks['dlstcd'].isna()) & (CRSP_Stocks['exchcd'].isin(exchcd_set)))]
-
-    CRSP_Stocks = CRSP_Stocks[(CRSP_Stocks['dlstcd'].notna()) |
-                              ((CRSP_Stocks['dlstcd'].isna()) & (CRSP_Stocks['shrcd'].isin(shrcd_set)))]
-    # Drop unrequired columns
-    CRSP_Stocks.drop(['shrcd'], axis=1, inplace=True)
-
-    # Calculate market equity in USD millions
-    # Use absolute price because if price is bid/ask average it has a negative sign to indicate so
-    CRSP_Stocks['me'] = CRSP_Stocks['prc'].abs()*CRSP_Stocks['shrout']*1e-3
-    # Drop unrequired columns
-    CRSP_Stocks.drop(['prc', 'shrout'], axis=1, inplace=True)
-
-    # Adjust for Delisting Returns
-    # Use compounded return if both return and delisted return are available
-    CRSP_Stocks['ret'] = np.where(CRSP_Stocks['ret'].notna() & CRSP_Stocks['dlret'].notna(),
-                          (1 + CRSP_Stocks['ret'])*(1 + CRSP_Stocks['dlret']) - 1,
-                          CRSP_Stocks['ret'])
-    # Use delisted return if return is not available but delited return is
-    CRSP_Stocks['ret'] = np.where(CRSP_Stocks['ret'].isna() & CRSP_Stocks['dlret'].notna(),
-                          CRSP_Stocks['dlret'],
-                          CRSP_Stocks['ret'])
-    # Drop missing returns
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['ret'].notna()].copy()
-    # Reset index
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno','date']).reset_index(drop=True).copy()
-   
-    # Aggregate Market Cap. computation
-    # For a given date and permco, sum me across different permno to find cumulative market-cap for the permco
-    CRSP_Stocks_ME_SUM = CRSP_Stocks.groupby(['date','permco'])['me'].sum().reset_index()
-    # For a given date and permco, among multiple market-caps for different permno find the largest one
-    CRSP_Stocks_ME_MAX = CRSP_Stocks.groupby(['date','permco'])['me'].max().reset_index()
-    # Merge CRSP_Stocks and CRSP_Stocks_ME_MAX
-    CRSP_Stocks = pd.merge(CRSP_Stocks, CRSP_Stocks_ME_MAX, how='inner', on=['date', 'permco', 'me'])
-    # Replace me with cumulative me
-    # Drop existing me
-    CRSP_Stocks = CRSP_Stocks.drop(['me'], axis=1)
-    # Merge CRSP_Stocks and CRSP_Stocks_ME_SUM to use cumulative market cap
-    CRSP_Stocks = pd.merge(CRSP_Stocks, CRSP_Stocks_ME_SUM, how='inner', on=['date', 'permco'])
-    # Sort by permno and date and drop duplicates
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno', 'date']).drop_duplicates()
-
-    # lagged Market Cap. computation
-    # Add column with lagged market cap
-    CRSP_Stocks['lme'] = CRSP_Stocks.groupby(['permno'])['me'].shift(1)
-    # If a permno is the first permno, use me/(1+retx) to replace the missing value
-    CRSP_Stocks['1+retx'] = 1 + CRSP_Stocks['retx']
-    CRSP_Stocks['count'] = CRSP_Stocks.groupby(['permno']).cumcount()
-    CRSP_Stocks['lme'] = np.where(CRSP_Stocks['count'] == 0, CRSP_Stocks['me']/CRSP_Stocks['1+retx'], CRSP_Stocks['lme'])    
-    # Drop missing lme
-    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['lme'].notna()].copy()
-    # Reset index
-    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno','date']).reset_index(drop=True).copy()
-    
-    # Data integrity checkes
-    assert (CRSP_Stocks['ret'] == -66).any() == False
-    assert (CRSP_Stocks['ret'] == -77).any() == False
-    assert (CRSP_Stocks['ret'] == -88).any() == False
-    assert (CRSP_Stocks['ret'] == -99).any() == False
-    assert CRSP_Stocks['ret'].isna().any() == False
-    assert CRSP_Stocks['lme'].isna().any() == False
-    
+    # History from January 1926 as in PS2, the ranking returns of the first portfolio months only reach back to
+    # January of min_year-1, and with the same filters PS2 and PS3 load one shared cleaned panel from the cache
+    min_date = '1926-01-31'
+
+    # Filter, adjust for delisting returns and compute market equity (in USD millions) and lagged market equity
+    # exchcd is kept as it is needed for the NYSE break-points
+    return dict(exchcd_set=exchcd_set, shrcd_set=shrcd_set, min_date=min_date, me_scale=1e-3,
+                drop_cols=['shrcd', 'prc', 'shrout'])
+
+# Loads the cleaned CRSP stock panel, cleaning and caching it only if the processed data or the filters changed:
+# Inputs - data_dir
+def load_clean_crsp_stocks(data_dir):
+    return cached_clean_crsp_stocks(data_dir, ['mscrsp_processed'],
+                                    lambda: load_artifact(data_dir, 'mscrsp_processed'),
+                                    **clean_crsp_params())
+
+# Implements PS3-Q1 requirements: Inputs - CRSP_Stocks (cleaned CRSP stock panel) and whether to store the result
+def PS3_Q1(CRSP_Stocks, store=True):
+    print("Recomputing ranking returns ...")
     # Compute Ranking_Ret
-    # create a subset with relevant columns
-    CRSP_Stocks_Subset = CRSP_Stocks[['permno','date','ret']].sort_values(['permno','date']).set_index('date')
+    # Sort by permno and month as the ranking window runs over the previous months of each permno
+    CRSP_Stocks_Momentum = CRSP_Stocks.sort_values(['permno','month_id'], kind='mergesort').reset_index(drop=True).copy()
     # Compute log return
-    CRSP_Stocks_Subset["log_Ret"] = np.log(1 + CRSP_Stocks_Subset["ret"])
-    # Move log retun by 2 months
+    CRSP_Stocks_Momentum["log_Ret"] = np.log(1 + CRSP_Stocks_Momentum["ret"])
+    # Compute cumulative log return for t-12 to t-2 i.e. 11 months skipping the 2 most recent ones
     # Reference - Daniel and Moskowitz (2016)
     # "rank stocks based on their cumulative returns from 12 months before to one month -
     # before the formation date (i.e., the t −12 to t −2 -month returns),"
-    CRSP_Stocks_Subset["lag2_log_ret"] = CRSP_Stocks_Subset.groupby(["permno"])["log_Ret"].shift(2)
-    # Compute cumulative log return for t-12 to t-2
-    CRSP_Stocks_Cum_Ret = CRSP_Stocks_Subset.groupby(["permno"])["lag2_log_ret"].rolling(11).sum().reset_index()
-    # Rename cumulative log return column to Ranking_Ret
-    CRSP_Stocks_Cum_Ret = CRSP_Stocks_Cum_Ret.rename(columns = {"lag2_log_ret" : "Ranking_Ret"})
-    # Merge with CRSP_Stocks and CRSP_Stocks_Cum_Ret to create CRSP_Stocks_Momentum
-    CRSP_Stocks_Momentum = pd.merge(CRSP_Stocks, CRSP_Stocks_Cum_Ret, on=["permno", "date"])
+    # The window covers calendar months, so a stock with missing months in t-12 to t-2 gets a ranking return only if
+    # it has at least ranking_min_months of them. It is summed in a fixed order, so appended months match a full
+    # rebuild exactly
+    CRSP_Stocks_Momentum["Ranking_Ret"] = grouped_month_window_sum(CRSP_Stocks_Momentum, "permno", "month_id", "log_Ret",
+                                                                   11, lag=2, min_periods=ranking_min_months)
+    CRSP_Stocks_Momentum.drop(['log_Ret'], axis=1, inplace=True)
 
     # Compute required monthly values
-    CRSP_Stocks_Momentum['Year'] = CRSP_Stocks_Momentum['date'].dt.year
-    CRSP_Stocks_Momentum['Month'] = CRSP_Stocks_Momentum['date'].dt.month
+    CRSP_Stocks_Momentum['Year'], CRSP_Stocks_Momentum['Month'] = year_month(CRSP_Stocks_Momentum['month_id'].values)
     
     # Drop Unrequired columns
     CRSP_Stocks_Momentum.drop(['permco', 'retx', 'dlret', 'dlstcd', 'me', '1+retx', 'count', 'date'], axis=1, inplace=True)
@@ -277,143 +269,215 @@ def PS3_Q1(CRSP_Stocks):
     CRSP_Stocks_Momentum = CRSP_Stocks_Momentum[CRSP_Stocks_Momentum['Year'] >= min_year]
     CRSP_Stocks_Momentum = CRSP_Stocks_Momentum[CRSP_Stocks_Momentum['Year'] <= max_year]
 
-    # Store final data in pickle format
-    CRSP_Stocks_Momentum.to_pickle(data_dir + 'CRSP_Stocks_Momentum.pkl')
+    if store == True:
+        # Store final data in parquet format
+        save_artifact(CRSP_Stocks_Momentum, data_dir, 'CRSP_Stocks_Momentum', date_col='Year')
     
     return CRSP_Stocks_Momentum
 
-def apply_nyse_breakpoints(df, df_nyse_breakpoints):
-    # Find relevant row in NYSE break-points dataframe    
-    rel_row = df_nyse_breakpoints[(df_nyse_breakpoints.Year == df.Year.values[0]) &
-                                  (df_nyse_breakpoints.Month == df.Month.values[0])]
-    # Extract break-point values
-    break_points = rel_row.values[0][2:]
-    # Append -inf and inf
-    break_points = np.concatenate([[-np.inf], break_points, [np.inf]])
-    # Apply NYSE break-points
-    KRF_deciles = pd.cut(df["Ranking_Ret"], break_points, labels=range(1, 11))
-    
-    return KRF_deciles
-    
 # Implements PS3-Q2 requirements: Input - CRSP_Stocks_Momentum
 def PS3_Q2(CRSP_Stocks_Momentum):
     # Create a copy of the dataframe to be used locally
     CRSP_Stocks_Momentum_decile = CRSP_Stocks_Momentum.copy()
 
-    # Compute DM decile using all the stocks
-    RR_By_YM = CRSP_Stocks_Momentum_decile.groupby(["Year", "Month"])["Ranking_Ret"]
-    CRSP_Stocks_Momentum_decile["DM_decile"] = RR_By_YM.transform(lambda x: pd.qcut(x, 10, labels=range(1, 11)))
+    # Compute DM decile using all the stocks (qcut deciles of every month)
+    CRSP_Stocks_Momentum_decile["DM_decile"] = quantile_portfolios(CRSP_Stocks_Momentum_decile, "month_id",
+                                                                   "Ranking_Ret", 10, range(1, 11))
     
     # Filter NYSE data
     CRSP_Stocks_NYSE = CRSP_Stocks_Momentum_decile[CRSP_Stocks_Momentum_decile['exchcd'] == 1]
     
     # Find NYSE percentiles
     req_percentiles = np.arange(0.1, 1, 0.1)
-    NYSE_RR_By_YM = CRSP_Stocks_NYSE.groupby(["Year", "Month"])["Ranking_Ret"]
-    NYSE_percentiles = NYSE_RR_By_YM.describe(percentiles=req_percentiles).reset_index()
+    NYSE_percentiles = cached_breakpoint_tables(CRSP_Stocks_NYSE, "month_id", {"Ranking_Ret": req_percentiles},
+                                                "nyse", data_dir)
     
     # Find NYSE breakpoints
-    breakpoints_str = [str(x) + "%" for x in range(10, 100, 10)]
-    NYSE_breakpoints = NYSE_percentiles[["Year", "Month"] + breakpoints_str]
+    breakpoints_str = [percentile_label(x) for x in req_percentiles]
+    NYSE_breakpoints = NYSE_percentiles["Ranking_Ret"][["month_id"] + breakpoints_str]
 
-    # Apply NYSE breakpoints
-    KRF_deciles = CRSP_Stocks_Momentum_decile.groupby(["Year", "Month"]).apply(apply_nyse_breakpoints,
-                                                                               NYSE_breakpoints).reset_index([0,1])
-
-    # Add KRF_deciles to CRSP_Stocks_Momentum_decile
-    CRSP_Stocks_Momentum_decile["KRF_decile"] = KRF_deciles["Ranking_Ret"]
+    # Apply NYSE breakpoints and add KRF_deciles to CRSP_Stocks_Momentum_decile
+    CRSP_Stocks_Momentum_decile["KRF_decile"] = apply_breakpoints(CRSP_Stocks_Momentum_decile, "month_id", "Ranking_Ret",
+                                                                  NYSE_breakpoints, range(1, 11))
     
-    # Store final data in pickle format
-    CRSP_Stocks_Momentum_decile.to_pickle(data_dir + 'CRSP_Stocks_Momentum_decile.pkl')
+    # Store final data in parquet format
+    save_artifact(CRSP_Stocks_Momentum_decile, data_dir, 'CRSP_Stocks_Momentum_decile', date_col='Year')
     
     return CRSP_Stocks_Momentum_decile
     
 # Implements PS3-Q3 requirements:: Inputs - CRSP_Stocks_Momentum_decile and FF_mkt
 def PS3_Q3(CRSP_Stocks_Momentum_decile, FF_mkt):
     # Calculate DM_Ret
-    gp_cols_dm = ["Year", "Month", "DM_decile"]
-    group_dm = CRSP_Stocks_Momentum_decile.groupby(gp_cols_dm)
-    DM_Ret = group_dm.apply(lambda x: np.average(x.Ret, weights=x.lag_Mkt_Cap)).reset_index([0,1,2])
-    DM_Ret = DM_Ret.rename(columns = {0 : "DM_Ret"})
+    gp_cols_dm = ["month_id", "DM_decile"]
+    DM_Ret = grouped_weighted_mean(CRSP_Stocks_Momentum_decile, gp_cols_dm, "Ret", "lag_Mkt_Cap")
+    DM_Ret = DM_Ret[gp_cols_dm + ["vw_ret"]].rename(columns = {"vw_ret" : "DM_Ret"})
     
     # Calculate KRF_Ret
-    gp_cols_krf = ["Year", "Month", "KRF_decile"]
-    group_krf = CRSP_Stocks_Momentum_decile.groupby(gp_cols_krf)
-    KRF_Ret = group_krf.apply(lambda x: np.average(x.Ret, weights=x.lag_Mkt_Cap)).reset_index([0,1,2])
-    KRF_Ret = KRF_Ret.rename(columns = {0 : "KRF_Ret"})
+    gp_cols_krf = ["month_id", "KRF_decile"]
+    KRF_Ret = grouped_weighted_mean(CRSP_Stocks_Momentum_decile, gp_cols_krf, "Ret", "lag_Mkt_Cap")
+    KRF_Ret = KRF_Ret[gp_cols_krf + ["vw_ret"]].rename(columns = {"vw_ret" : "KRF_Ret"})
+
+    # Calculate turnover, trading costs and net returns of the DM and KRF deciles
+    DM_Ret = add_decile_costs(DM_Ret, CRSP_Stocks_Momentum_decile, "DM")
+    KRF_Ret = add_decile_costs(KRF_Ret, CRSP_Stocks_Momentum_decile, "KRF")
     
     # Join DM_Ret and KRF_Ret to create CRSP_Stocks_Momentum_returns
-    CRSP_Stocks_Momentum_returns = DM_Ret.join(KRF_Ret["KRF_Ret"])
+    CRSP_Stocks_Momentum_returns = DM_Ret.join(KRF_Ret[["KRF_Ret", "KRF_Turnover", "KRF_Cost", "KRF_Net_Ret"]])
     CRSP_Stocks_Momentum_returns = CRSP_Stocks_Momentum_returns.rename(columns = {"DM_decile" : "decile"})
     
-    # Add famma-french rf data
-    CRSP_Stocks_Momentum_returns = pd.merge(CRSP_Stocks_Momentum_returns, FF_mkt[["Year", "Month", "Rf"]], how='outer')
+    # Add famma-french rf data on the month id, then Year and Month of every month
+    CRSP_Stocks_Momentum_returns = pd.merge(CRSP_Stocks_Momentum_returns, FF_mkt[["month_id", "Rf"]], how='outer',
+                                            on="month_id")
+    CRSP_Stocks_Momentum_returns = add_year_month(CRSP_Stocks_Momentum_returns)
     
-    # Store final data in pickle format
-    CRSP_Stocks_Momentum_returns.to_pickle(data_dir + 'CRSP_Stocks_Momentum_returns.pkl')
+    # Store final data in parquet format
+    save_artifact(CRSP_Stocks_Momentum_returns, data_dir, 'CRSP_Stocks_Momentum_returns', date_col='Year')
     
     return CRSP_Stocks_Momentum_returns
     
+# Adds the turnover, trading cost and net return of every decile and month to the decile returns:
+# Inputs - decile returns (month_id, <Prefix>_decile and <Prefix>_Ret), CRSP_Stocks_Momentum_decile and the
+# decile definition prefix ('DM' or 'KRF')
+def add_decile_costs(Decile_Ret, CRSP_Stocks_Momentum_decile, Prefix):
+    gp_cols = ["month_id", Prefix + "_decile"]
+    Costs = value_weighted_turnover(CRSP_Stocks_Momentum_decile, "month_id", [Prefix + "_decile"], "permno",
+                                    "Ret", "lag_Mkt_Cap", cost_model)
+    Costs = Costs.rename(columns = {"Turnover" : Prefix + "_Turnover", "Cost" : Prefix + "_Cost"})
+    Decile_Ret = Decile_Ret.merge(Costs, how='left', on=gp_cols)
+    Decile_Ret[Prefix + "_Net_Ret"] = Decile_Ret[Prefix + "_Ret"] - Decile_Ret[Prefix + "_Cost"]
+    return Decile_Ret
+
+# Pivots decile excess returns to one row per month and one column per decile and appends the Winner minus loser
+# return: Inputs - decile returns with month_id, decile, Rf and Ex_Ret
+def decile_excess_returns(df):
+    Ex_Ret = df.pivot(index="month_id", columns="decile", values="Ex_Ret")
+    Rf = df.pivot(index="month_id", columns="decile", values="Rf")
+    # Compute Winner and loser returns
+    Ex_Ret["WML"] = Ex_Ret[10] - Ex_Ret[1] + Rf[10]
+    return Ex_Ret
+
 # Implements PS3-Q4/5 requirements:: Inputs - CRSP_Stocks_Momentum_returns, and Return Column Name
 def PS3_Q4_5_Common(CRSP_Stocks_Momentum_returns, Ret_Col):
     # Create a copy of the dataframe to be used locally
     CRSP_Stocks_Momentum_returns = CRSP_Stocks_Momentum_returns.copy()
 
-    # Create dataframe to store required stats
-    df_stats = pd.DataFrame()
-
     # Compute excess return
     CRSP_Stocks_Momentum_returns["Ex_Ret"] = CRSP_Stocks_Momentum_returns[Ret_Col] - CRSP_Stocks_Momentum_returns['Rf']
-    
-    # Compute required stats
-    gp_decile = CRSP_Stocks_Momentum_returns.groupby("decile")
-    df_stats["Excess Return"] = 100*12*gp_decile["Ex_Ret"].mean()
-    df_stats["Volatility"] = 100*np.sqrt(12)*gp_decile["Ex_Ret"].std()
-    df_stats["Sharpe Ratio"] = df_stats["Excess Return"]/df_stats["Volatility"]
-    df_stats["Skewness"] = gp_decile["Ex_Ret"].skew()
-    df_stats["Ex_Ret t-stat-all"] = gp_decile.apply(lambda x: ttest_1samp(x.Ex_Ret, 0, axis=0).statistic)
-    df_stats["Ex_Ret t-stat-5yr"] = gp_decile.apply(lambda x: ttest_1samp(x.Ex_Ret[-60:], 0, axis=0).statistic)
-    
-    # Compute Winner and loser returns
-    WML_Ret = gp_decile.get_group(10)["Ex_Ret"].values - gp_decile.get_group(1)["Ex_Ret"].values
-    WML_Ex_Ret = WML_Ret + gp_decile.get_group(10)["Rf"].values
-    
-    # Append WML stats
-    df_stats.loc["WML", "Excess Return"] = 100*12*WML_Ex_Ret.mean()
-    df_stats.loc["WML", "Volatility"] = 100*np.sqrt(12)*WML_Ex_Ret.std()
-    df_stats.loc["WML", "Sharpe Ratio"] = df_stats.loc["WML", "Excess Return"]/df_stats.loc["WML", "Volatility"]
-    df_stats.loc["WML", "Skewness"] = skew(WML_Ex_Ret)
-    df_stats.loc["WML", "Ex_Ret t-stat-all"] = ttest_1samp(WML_Ex_Ret, [0], axis=0).statistic
-    df_stats.loc["WML", "Ex_Ret t-stat-5yr"] = ttest_1samp(WML_Ex_Ret[-60:], [0], axis=0).statistic
+
+    # Decile and Winner minus loser excess returns, one row per month and one column per portfolio
+    Ex_Ret = decile_excess_returns(CRSP_Stocks_Momentum_returns)
+
+    # Compute required stats of all portfolios in one pass
+    df_stats = performance_stats(Ex_Ret).drop(columns=['kurtosis'])
+    df_stats = df_stats.rename(columns={'mean': "Excess Return", 'vol': "Volatility", 'sharpe': "Sharpe Ratio",
+                                        'skew': "Skewness", 'tstat': "Ex_Ret t-stat-all",
+                                        'tstat_5yr': "Ex_Ret t-stat-5yr"})
+
+    # Add the bootstrap confidence intervals only if needed
+    if bootstrap_ci == True:
+        df_stats = df_stats.join(confidence_interval_columns(Ex_Ret,
+                                                             {'mean': "Excess Return", 'sharpe': "Sharpe Ratio"},
+                                                             n_reps=bootstrap_reps))
     
     return df_stats
 
+# Compares the gross and net of trading cost performance of the momentum deciles and WML:
+# Inputs - CRSP_Stocks_Momentum_returns and decile definition prefix ('DM' or 'KRF')
+def PS3_Costs(CRSP_Stocks_Momentum_returns, Prefix):
+    # Create a copy of the dataframe to be used locally
+    CRSP_Stocks_Momentum_returns = CRSP_Stocks_Momentum_returns.copy()
+
+    # Decile and Winner minus loser excess returns, trading costs and turnover, one column per portfolio
+    CRSP_Stocks_Momentum_returns["Ex_Ret"] = CRSP_Stocks_Momentum_returns[Prefix + "_Ret"] - CRSP_Stocks_Momentum_returns['Rf']
+    Ex_Ret = decile_excess_returns(CRSP_Stocks_Momentum_returns)
+    Cost = CRSP_Stocks_Momentum_returns.pivot(index="month_id", columns="decile", values=Prefix + "_Cost")
+    Turnover = CRSP_Stocks_Momentum_returns.pivot(index="month_id", columns="decile", values=Prefix + "_Turnover")
+    
+    # WML trades both the winner and the loser decile
+    Cost["WML"] = Cost[10] + Cost[1]
+    Turnover["WML"] = Turnover[10] + Turnover[1]
+
+    return net_of_cost_summary(Ex_Ret, Cost, Turnover).T
+
+# Computes the Jegadeesh-Titman winner minus loser returns of every formation (J) and holding (K) period of the
+# grid in one run: Inputs - CRSP_Stocks_Momentum
+# Returns the annualized mean (in %) and Sharpe ratio of every WML, one row per J and one column per K.
+def PS3_Momentum_Grid(CRSP_Stocks_Momentum):
+    # WML return of every month and (J, K), deciles on all stocks and value-weighted like the DM deciles
+    WML = momentum_grid(CRSP_Stocks_Momentum, jt_formation_months, jt_holding_months)
+
+    # Store the WML returns in parquet format, one column per (J, K)
+    WML_store = WML.copy()
+    WML_store.columns = ["WML_J" + str(J) + "_K" + str(K) for J, K in WML.columns]
+    save_artifact(add_year_month(WML_store.reset_index()), data_dir, 'Momentum_Grid_WML', date_col='Year')
+
+    # Compute required stats of all the WML returns in one pass
+    df_stats = performance_stats(WML)
+    return pd.concat({"Annualized Mean": df_stats['mean'].unstack('K'),
+                      "Annualized Sharpe Ratio": df_stats['sharpe'].unstack('K')}, axis=1)
+
+# Stores the months of the dynamic WML strategy in parquet format: Inputs - Dynamic_WML_New and whether they
+# continue the stored months (otherwise they replace them)
+def store_dynamic_wml(Dynamic_WML_New, resumed):
+    Dynamic_WML_New = add_year_month(Dynamic_WML_New)
+    if resumed == True:
+        append_artifact(Dynamic_WML_New, data_dir, 'Dynamic_WML')
+    else:
+        save_artifact(Dynamic_WML_New, data_dir, 'Dynamic_WML', date_col='Year')
+
+# Computes the dynamic WML strategy of Daniel and Moskowitz (2016) on the DM deciles from daily returns:
+# Inputs - CRSP_Stocks_Momentum_decile and whether to rebuild it from the first month
+# Only the months after the last stored month are processed, starting from the stored strategy state, so a monthly
+# run reads the daily rows of the new month only. Returns the stats of the static and the dynamic WML.
+def PS3_Dynamic_WML(CRSP_Stocks_Momentum_decile, rebuild=False):
+    state_file = os.path.join(data_dir, 'dynamic_wml_state.json')
+    stored = artifact_exists(data_dir, 'Dynamic_WML') and os.path.exists(state_file) and rebuild == False
+
+    # The stored months must end at the last month of the state, otherwise rebuild both
+    if stored == True:
+        last_month = load_artifact(data_dir, 'Dynamic_WML', columns=['month_id'])['month_id'].max()
+        stored = last_month == load_dynamic_momentum(state_file).last_month
+    if stored == False and os.path.exists(state_file):
+        os.remove(state_file)
+
+    # Trade the new months, the daily decile returns use the DM deciles and lagged market caps of every month. The
+    # new months are stored before the state (the strategy rebuilds from the first month if the state no longer
+    # matches its parameters or the data)
+    dynamic_momentum(CRSP_Stocks_Momentum_decile, ColumnarPanel(os.path.join(data_dir, 'dscrsp_panel')), state_file,
+                     store_dynamic_wml)
+    Dynamic_WML = load_artifact(data_dir, 'Dynamic_WML')
+
+    # Compute required stats of the static and the dynamic WML over the months both have
+    Dynamic_WML = Dynamic_WML[Dynamic_WML["Dynamic_WML"].notna()]
+    df_stats = performance_stats(Dynamic_WML[["WML", "Dynamic_WML"]]).drop(columns=['kurtosis', 'tstat_5yr'])
+    df_stats = df_stats.rename(columns={'mean': "Excess Return", 'vol': "Volatility", 'sharpe': "Sharpe Ratio",
+                                        'skew': "Skewness", 'tstat': "Ex_Ret t-stat-all"})
+
+    return df_stats.T
+
 # Implements PS3-Q4 requirements:: Inputs - CRSP_Stocks_Momentum_returns and DM_Returns
 def PS3_Q4(CRSP_Stocks_Momentum_returns, DM_Returns):
     # Compute required common stats
     df_ps3_q4 = PS3_Q4_5_Common(CRSP_Stocks_Momentum_returns, "DM_Ret")
     
     # Merge CRSP_Stocks_Momentum_returns and DM_Returns to get common data
-    df_returns = pd.merge(CRSP_Stocks_Momentum_returns, DM_Returns, how='inner', on=["Year", "Month", "decile"])
+    df_returns = pd.merge(CRSP_Stocks_Momentum_returns, DM_Returns.drop(columns=["Year", "Month"]), how='inner',
+                          on=["month_id", "decile"])
     
     # Compute excess returns for the common data
     df_returns["Ex_Ret"] = df_returns["DM_Ret"] - df_returns['Rf']
     df_returns["Ex_Ret_Auth"] = df_returns["DM_Ret_2"] - df_returns['Rf']
     
-    # Create group by deciles for the common data
-    gp_decile = df_returns.groupby("decile")
+    # Compute decile and Winner minus loser returns for the common data
+    Ex_Ret = decile_excess_returns(df_returns)
     
-    # Compute Winner and loser returns for the common data
-    WML_Ret = gp_decile.get_group(10)["Ex_Ret"].values - gp_decile.get_group(1)["Ex_Ret"].values
-    WML_Ex_Ret = WML_Ret + gp_decile.get_group(10)["Rf"].values
+    # Compute Author decile and Winner minus loser returns for the common data
+    Ex_Ret_Auth = df_returns.pivot(index="month_id", columns="decile", values="Ex_Ret_Auth")
+    Rf = df_returns.pivot(index="month_id", columns="decile", values="Rf")
+    Ex_Ret_Auth["WML"] = Ex_Ret_Auth[10] - Ex_Ret_Auth[1] - Rf[10]
     
-    # Compute Author Winner and loser returns for the common data
-    WML_Ret_Auth = gp_decile.get_group(10)["Ex_Ret_Auth"].values - gp_decile.get_group(1)["Ex_Ret_Auth"].values
-    WML_Ex_Ret_Auth = WML_Ret_Auth - gp_decile.get_group(10)["Rf"].values
-    
-    # Compute correlations
-    df_ps3_q4["corr w/ original"] = gp_decile.apply(lambda x: np.corrcoef(x.Ex_Ret, x.Ex_Ret_Auth)[0, 1])
-    df_ps3_q4.loc["WML", "corr w/ original"] = np.corrcoef(WML_Ex_Ret, WML_Ex_Ret_Auth)[0, 1]
+    # Compute correlations of all portfolios in one pass
+    df_ps3_q4["corr w/ original"] = paired_correlation(Ex_Ret.values, Ex_Ret_Auth.values)
     
     return df_ps3_q4.T
  
@@ -427,37 +491,22 @@ def PS3_Q5(CRSP_Stocks_Momentum_returns, KRF_Returns):
     
     # Compute excess returns for CRSP_Stocks_Momentum_returns
     df_returns["Ex_Ret"] = df_returns["DM_Ret"] - df_returns['Rf']    
-    # Create group by deciles for CRSP_Stocks_Momentum_returns
-    gp_decile = df_returns.groupby("decile")
-    # Compute Winner minus loser returns for CRSP_Stocks_Momentum_returns
-    WML_Ret = gp_decile.get_group(10)["Ex_Ret"].values - gp_decile.get_group(1)["Ex_Ret"].values
-    WML_Ex_Ret = WML_Ret + gp_decile.get_group(10)["Rf"].values
-    
-    # Array to store colleation values
-    correlations = np.zeros(11)
-    
-    # Compute correlation for deciles    
-    for i in range(10):
-        Ex_Ret_Self = gp_decile.get_group(i+1)["Ex_Ret"].values
-        Ex_Ret_Auth = KRF_Returns[str(i+1)].values - gp_decile.get_group(i+1)["Rf"].values
-        correlations[i] = np.corrcoef(Ex_Ret_Self, Ex_Ret_Auth)[0, 1]
-    
-    # Compute Author Winner minus loser returns
-    WML_Ret_Auth = KRF_Returns["10"] - KRF_Returns["1"]
-    WML_Ex_Ret_Auth = WML_Ret_Auth - gp_decile.get_group(10)["Rf"].values
+    # Compute decile and Winner minus loser returns for CRSP_Stocks_Momentum_returns
+    Ex_Ret = decile_excess_returns(df_returns)
+    Rf = df_returns.pivot(index="month_id", columns="decile", values="Rf")
     
-    # Compute correlation for WML
-    correlations[10] = np.corrcoef(WML_Ex_Ret, WML_Ex_Ret_Auth)[0, 1]
+    # Compute Author decile and Winner minus loser returns, KRF_Returns has the same months in the same order
+    Ex_Ret_Auth = KRF_Returns[[str(i+1) for i in range(10)]].values - Rf.values
+    WML_Ex_Ret_Auth = (KRF_Returns["10"] - KRF_Returns["1"]).values - Rf[10].values
     
-    # Append correlation to the stats df
-    df_ps3_q5["corr w/ original"] = correlations
+    # Compute correlations of all portfolios in one pass and append them to the stats df
+    df_ps3_q5["corr w/ original"] = paired_correlation(Ex_Ret.values, np.column_stack([Ex_Ret_Auth, WML_Ex_Ret_Auth]))
 
     # PLot returns
-    time_str = KRF_Returns["Year"].astype(str).values + KRF_Returns["Month"].astype(str).values
-    time = pd.to_datetime(time_str, format="%Y%m")
-    dec_10_ex_ret = gp_decile.get_group(10)["Ex_Ret"].values[-120:]
-    dec_1_ex_ret = gp_decile.get_group(1)["Ex_Ret"].values[-120:]
-    wml_ex_ret = WML_Ex_Ret[-120:]
+    time = pd.DatetimeIndex(month_end(KRF_Returns["month_id"].values))
+    dec_10_ex_ret = Ex_Ret[10].values[-120:]
+    dec_1_ex_ret = Ex_Ret[1].values[-120:]
+    wml_ex_ret = Ex_Ret["WML"].values[-120:]
     plt.figure(figsize=(16, 8))
     plt.plot(time.values[-120:], dec_10_ex_ret, "--", label="Decile 10", color="midnightblue")
     plt.plot(time.values[-120:], dec_1_ex_ret, "--", label="Decile 1", color="red")
@@ -487,40 +536,106 @@ def PS3_Q5(CRSP_Stocks_Momentum_returns, KRF_Returns):
  # Processes raw CRSP data downloaded from WRDS for each asset class
 def process_raw_data():
     # Load stored raw CRSP stock returns data as a dataframe
-    mscrsp_raw = pd.read_pickle(data_dir + 'mscrsp_raw.pkl')
+    mscrsp_raw = load_artifact(data_dir, 'mscrsp_raw')
 
     # Load stored raw CRSP stock delisting returns data as a dataframe
-    msdelcrsp_raw = pd.read_pickle(data_dir + 'msdelcrsp_raw.pkl')
+    msdelcrsp_raw = load_artifact(data_dir, 'msdelcrsp_raw')
     
     # Process and store raw CRSP stock returns and delisting returns
-    process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw)
+    run_stage('process', process_raw_crsp_stock_data, data_dir, mscrsp_raw, msdelcrsp_raw)
     
     # Process and store raw DM returns and KRF returns
-    process_raw_DM_KRF_returns(data_dir, DM_returns_file, KRF_returns_file)
+    run_stage('process', process_raw_DM_KRF_returns, data_dir, DM_returns_file, KRF_returns_file)
+
+# Downloads the CRSP months released since the last download and appends them to the stored data and ranking returns
+# instead of downloading and processing the full history again
+def update_raw_data():
+    # Download the new CRSP stock months
+    mscrsp_delta, msdelcrsp_delta = run_stage('download', download_raw_crsp_delta, data_dir, wrds_id)
+
+    if len(mscrsp_delta) == 0:
+        print("      No new months released since the last download")
+    else:
+        # Append the new months to the processed data, the cleaned panel and the ranking returns
+        run_stage('update', update_ranking_returns, mscrsp_delta, msdelcrsp_delta)
+
+        # Store the new raw rows last, the next update starts after them
+        append_artifact(mscrsp_delta, data_dir, 'mscrsp_raw')
+        if len(msdelcrsp_delta) > 0:
+            append_artifact(msdelcrsp_delta, data_dir, 'msdelcrsp_raw')
+
+    # FF3 monthly data is small, so it is downloaded again
+    run_stage('download', download_ff3_monthly_data, data_dir)
     
 # Computes ranking return
 def compute_ranking_returns(recompute=False):
     # If recumpute is set to true, recompute ranking return
     if recompute == True:
-        # Load processed CRSP stock data as dataframe
-        CRSP_Stocks = pd.read_pickle(data_dir + 'mscrsp_processed.pkl')
+        # Load the cleaned CRSP stock panel (rebuilt only if the processed data changed)
+        CRSP_Stocks = run_stage('clean', load_clean_crsp_stocks, data_dir)
         # Calculate ranking return
-        CRSP_Stocks_Momentum = PS3_Q1(CRSP_Stocks)
-    # Otherwise load pre-computed data from the stored pickle files
+        CRSP_Stocks_Momentum = run_stage('aggregate', PS3_Q1, CRSP_Stocks)
+    # Otherwise load pre-computed data from the artifact store
     else:
-        print("Loading ranking returns from the pickle file ...")        
+        print("Loading ranking returns from the artifact store ...")        
         # Load stored CRSP_Stocks_Momentum data as a dataframe
-        CRSP_Stocks_Momentum = pd.read_pickle(data_dir + 'CRSP_Stocks_Momentum.pkl')
+        CRSP_Stocks_Momentum = load_artifact(data_dir, 'CRSP_Stocks_Momentum')
         
     return CRSP_Stocks_Momentum
     
+# Appends newly released months of CRSP stock data to the ranking returns without reprocessing the history:
+# Inputs - raw CRSP stock returns and delisting returns of the new months only (same columns as the full download)
+# Ranking returns of the new months only need the last 12 rows of each permno, which are stored with the cleaned
+# panel, so the appended months are identical to the ones a full rebuild would compute. Months after max_year are
+# added to the cleaned panel only.
+def update_ranking_returns(mscrsp_delta, msdelcrsp_delta):
+    print("Updating ranking returns ...")
+
+    # Process the new months the same way as the full history
+    mscrsp_processed_delta = process_raw_crsp_stock_data(data_dir, mscrsp_delta, msdelcrsp_delta, store=False)
+
+    # The new months must directly follow the stored ranking returns, unless they are all after max_year
+    first_month = month_id(mscrsp_processed_delta['date']).min()
+    last_month = load_artifact(data_dir, 'CRSP_Stocks_Momentum', columns=['month_id'])['month_id'].max()
+    if first_month <= year_month_id(max_year, 12) and first_month != last_month + 1:
+        raise RuntimeError("CRSP_Stocks_Momentum ends before the new months, run the driver with "
+                           "recompute_ranking_returns=True first")
+
+    # Clean the new months and append them (and the processed rows) to the stored data
+    CRSP_Stocks_New, CRSP_Stocks_Tail = update_clean_crsp_stocks(data_dir, ['mscrsp_processed'],
+                                                                 mscrsp_processed_delta,
+                                                                 lambda: append_artifact(mscrsp_processed_delta,
+                                                                                         data_dir, 'mscrsp_processed'),
+                                                                 **clean_crsp_params())
+
+    # Compute ranking returns over the trailing rows and the new months, and keep the new months only
+    CRSP_Stocks_Momentum = PS3_Q1(pd.concat([CRSP_Stocks_Tail, CRSP_Stocks_New], ignore_index=True), store=False)
+    new_months = np.unique(CRSP_Stocks_New['month_id'].values)
+    CRSP_Stocks_Momentum_New = CRSP_Stocks_Momentum[CRSP_Stocks_Momentum['month_id'].isin(new_months)]
+
+    # Months after max_year are only added to the cleaned panel
+    if len(CRSP_Stocks_Momentum_New) == 0:
+        print("      The new months are after max_year " + str(max_year) + ", move max_year to add them to the "
+              "ranking returns")
+        return None
+
+    append_artifact(CRSP_Stocks_Momentum_New, data_dir, 'CRSP_Stocks_Momentum')
+
+    return CRSP_Stocks_Momentum_New
+
  # Runs all the functions and prints the required results
-def driver(download_data=False, process_data=False, recompute_ranking_returns=False):
+def driver(download_data=False, process_data=False, recompute_ranking_returns=False, update_data=False):
+    # Record time, memory and data sizes of every stage in a trace file
+    start_trace('PS3', os.path.join(data_dir, 'trace_PS3.json'))
+
     # Download the data only if needed
     if download_data == True:
         print("Downloading data ...")
-        download_raw_crsp_data(data_dir, wrds_id)
-        download_ff3_monthly_data(data_dir)
+        with stage('download'):
+            download_raw_crsp_data(data_dir, wrds_id)
+            download_ff3_monthly_data(data_dir)
+            if dynamic_wml == True:
+                download_raw_crsp_daily_data(data_dir, wrds_id)
     else:
         print("Skipped data downloading!")
     
@@ -530,30 +645,54 @@ def driver(download_data=False, process_data=False, recompute_ranking_returns=Fa
         process_raw_data()
     else:
         print("Skipped raw data processing!")      
+
+    # Append the months released since the last download only if needed
+    if update_data == True:
+        print("Appending newly released months ...")
+        update_raw_data()
     
     # Commpute ranking return
     CRSP_Stocks_Momentum = compute_ranking_returns(recompute_ranking_returns)
 
     # Define the monthly momentum portfolio decile of each stock    
-    CRSP_Stocks_Momentum_decile = PS3_Q2(CRSP_Stocks_Momentum)
+    CRSP_Stocks_Momentum_decile = run_stage('partition', PS3_Q2, CRSP_Stocks_Momentum)
     
     # Load stored FF3, DM and KRF returns as a dataframe
-    FF_mkt = pd.read_pickle(data_dir + 'ff3_monthly.pkl')    
-    DM_returns = pd.read_pickle(data_dir + 'DM_returns.pkl')    
-    KRF_returns = pd.read_pickle(data_dir + 'KRF_returns.pkl')
+    FF_mkt = load_artifact(data_dir, 'ff3_monthly')    
+    DM_returns = load_artifact(data_dir, 'DM_returns')    
+    KRF_returns = load_artifact(data_dir, 'KRF_returns')
     
     # Calculate the monthly momentum portfolio decile returns -
     # as defined by both Daniel and Moskowitz (2016) and Kenneth R. French    
-    CRSP_Stocks_Momentum_returns = PS3_Q3(CRSP_Stocks_Momentum_decile, FF_mkt)
+    CRSP_Stocks_Momentum_returns = run_stage('aggregate', PS3_Q3, CRSP_Stocks_Momentum_decile, FF_mkt)
 
     # Display Q4 results
     pd.set_option("display.precision", 4)    
-    result_ps3_q4 = PS3_Q4(CRSP_Stocks_Momentum_returns, DM_returns)
+    result_ps3_q4 = run_stage('stats', PS3_Q4, CRSP_Stocks_Momentum_returns, DM_returns)
     print(result_ps3_q4, "\n\n")
 
     # Display Q5 results
-    result_ps3_q5 = PS3_Q5(CRSP_Stocks_Momentum_returns, KRF_returns)
+    result_ps3_q5 = run_stage('stats', PS3_Q5, CRSP_Stocks_Momentum_returns, KRF_returns)
     print(result_ps3_q5, "\n\n")
+
+    # Display gross and net of trading cost results of both decile definitions
+    for Prefix in ["DM", "KRF"]:
+        result_ps3_costs = run_stage('stats', PS3_Costs, CRSP_Stocks_Momentum_returns, Prefix)
+        print(result_ps3_costs, "\n\n")
+
+    # Display the Jegadeesh-Titman J x K momentum grid
+    if momentum_grid_results == True:
+        result_ps3_grid = run_stage('stats', PS3_Momentum_Grid, CRSP_Stocks_Momentum)
+        print(result_ps3_grid, "\n\n")
+
+    # Display the static and dynamic WML (rebuilt from the first month when the ranking returns were recomputed)
+    if dynamic_wml == True:
+        result_ps3_dynamic = run_stage('stats', PS3_Dynamic_WML, CRSP_Stocks_Momentum_decile,
+                                       recompute_ranking_returns)
+        print(result_ps3_dynamic, "\n\n")
+
+    # Close the trace file
+    stop_trace()
     
 # Import packages
 import pandas as pd
@@ -564,9 +703,21 @@ import wrds
 import os
 from pandas.tseries.offsets import *
 import datetime
-from scipy.stats import ttest_1samp
-from scipy.stats import skew
 import math
+from qam_aggregation import grouped_weighted_mean, grouped_month_window_sum
+from qam_stats import performance_stats, paired_correlation
+from qam_bootstrap import confidence_interval_columns
+from qam_costs import value_weighted_turnover, net_of_cost_summary
+from qam_storage import save_artifact, load_artifact, append_artifact, artifact_exists
+from qam_crsp import cached_clean_crsp_stocks, update_clean_crsp_stocks
+from qam_calendar import to_dates, month_id, month_end, year_month, year_month_id, add_year_month
+from qam_breakpoints import apply_breakpoints, quantile_portfolios, cached_breakpoint_tables, percentile_label
+from qam_momentum import momentum_grid
+from qam_dynamic import dynamic_momentum, load_dynamic_momentum
+from qam_daily import ColumnarPanel, ingest_partitioned, DAILY_STOCK_QUERY, DAILY_STOCK_SCHEMA
+from qam_schema import apply_schema, MemoryReport, CRSP_SCHEMA
+from qam_wrds import download_partitioned, date_partitions
+from qam_instrument import start_trace, stop_trace, stage, run_stage
 
 # Directory to store the downloaded data
 data_dir = 'data\\'
@@ -574,6 +725,30 @@ data_dir = 'data\\'
 # WRDS login id
 wrds_id = 'smarty_iitian'
 
+# Specify whether prices and shares are stored as float32 to reduce the memory footprint of the CRSP panel
+float32_prices = False
+
+# Specify the trading cost model of the decile portfolios: 'proportional' (10 bps of every dollar traded) or 'tiered'
+# (by market cap percentile of the month, see qam_costs.COST_TIERS)
+cost_model = 'tiered'
+
+# Minimum number of months with a return in the t-12 to t-2 ranking window (11 requires all of them)
+ranking_min_months = 11
+
+# Specify whether the Jegadeesh-Titman momentum grid is computed, and its formation (J) and holding (K) periods
+momentum_grid_results = False
+jt_formation_months = (3, 6, 9, 12)
+jt_holding_months = (1, 3, 6, 12)
+
+# Specify whether the dynamic WML of Daniel and Moskowitz (2016) is computed from daily returns (the daily stock
+# panel is downloaded with the data)
+dynamic_wml = False
+
+# Specify whether the stats tables add block-bootstrap confidence intervals (95%, stationary bootstrap with 12-month
+# mean blocks) of the annualized mean and Sharpe ratio, and the number of bootstrap replications
+bootstrap_ci = False
+bootstrap_reps = 10000
+
 # DM returns file name
 DM_returns_file = "m_m_pt_tot.txt"
 
@@ -588,10 +763,31 @@ max_year = 2023
 # Specify whether we need to download the raw data or not
 download_data = True
 
+# Specify whether every downloaded partition is fetched again instead of reusing the final checkpoints
+refresh_download = False
+
 # Specify whether we need to process the raw data or not
 process_data = True
 
+# Specify whether the months released since the last download are appended to the stored data and ranking returns
+# instead of downloading and processing the full history again (needs one full run first, and is usually run with
+# download_data, process_data and recompute_ranking_returns set to False)
+update_data = False
+
 # Specify whether we need to recompute ranking returns or not
 recompute_ranking_returns = True
 
-driver(download_data, process_data, recompute_ranking_returns)
\ No newline at end of file
+# CRSP stock monthly returns with the share and exchange codes of the month, run once per date partition
+MSF_QUERY = """select a.permno, a.permco, a.date, b.shrcd, b.exchcd, a.ret, a.retx, a.shrout, a.prc
+               from crspq.msf as a
+               left join crspq.msenames as b
+               on a.permno=b.permno and b.namedt<=a.date and a.date<=b.nameendt
+               where a.date between '{start}' and '{end}'"""
+
+# CRSP stock monthly delisting returns with a delisting date between start and end
+MSEDELIST_QUERY = """select permno, dlret, dlstdt, dlstcd from crspq.msedelist
+                     where dlstdt between '{start}' and '{end}'"""
+
+# Run the driver only when the script is executed, so that the functions can be imported by the benchmarks
+if __name__ == "__main__":
+    driver(download_data, process_data, recompute_ranking_returns, update_data)
\ No newline at end of file
@@ -9,53 +9,85 @@ def download_raw_crsp_data(data_dir, wrds_id):
     # Download CRSP stock monthly returns
     # Reference - Assignment Instruction:
     # "This should be the full dataset available on WRDS; do not pre-filter by SHRCD, EXCHCD, or date."
-    conn = wrds.Connection(wrds_username=wrds_id)
-    mscrsp_raw = conn.raw_sql("""select a.permno, a.permco, a.date, b.shrcd, b.exchcd, b.siccd, b.naics,
-                                a.ret, a.retx, a.shrout, a.prc
-                                from crspq.msf as a
-                                left join crspq.msenames as b
-                                on a.permno=b.permno and b.namedt<=a.date and a.date<=b.nameendt""")
-    # Store downloaded data in pickle format
-    mscrsp_raw.to_pickle(data_dir + 'mscrsp_raw.pkl')
+    # The full history is split into date partitions that are fetched concurrently over a bounded pool of
+    # WRDS connections. Every partition is checkpointed, so a rerun after a dropped session only fetches
+    # the missing partitions and the partitions still open when they were fetched.
+    mscrsp_raw = download_partitioned(lambda: wrds.Connection(wrds_username=wrds_id), MSF_QUERY,
+                                      date_partitions(), os.path.join(data_dir, 'checkpoints'), 'mscrsp_raw',
+                                      refresh=refresh_download)
+    # Store downloaded data in parquet format
+    save_artifact(mscrsp_raw, data_dir, 'mscrsp_raw')
 
     # Download CRSP stock monthly delisting returns
-    msdelcrsp_raw = conn.raw_sql("""select a.permno, a.permco, a.dlret, a.dlretx, a.dlstdt, a.dlstcd,
-                                    b.exchcd as dlexchcd, b.siccd as dlsiccd, b.naics as dlnaics
-                                    from crspq.msedelist as a
-                                    left join crspq.msenames as b
-                                    on a.permno=b.permno and b.namedt<=a.dlstdt and a.dlstdt<=b.nameendt""")
-    # Store downloaded data in pickle format
-    msdelcrsp_raw.to_pickle(data_dir + 'msdelcrsp_raw.pkl')
+    conn = wrds.Connection(wrds_username=wrds_id)
+    msdelcrsp_raw = conn.raw_sql(MSEDELIST_QUERY.format(start='1925-01-01', end=datetime.date.today().isoformat()))
+    # Store downloaded data in parquet format
+    save_artifact(msdelcrsp_raw, data_dir, 'msdelcrsp_raw', date_col='dlstdt')
+
+    # Download Compustat and pension data
+    download_compustat_data(data_dir, wrds_id)
     
+    ############################# Download CRSP-Compustat link table data #############################
+
+    link = conn.raw_sql("""select gvkey, lpermno as permno, lpermco as permco, linktype,
+                           linkprim, liid, linkdt, linkenddt
+                           from crspq.ccmxpf_linktable
+                           where substr(linktype,1,1)='L' and (linkprim ='C' or linkprim='P')""")
+    # Use int32 identifiers and categoricals for the link type strings
+    link = apply_schema(link, LINK_SCHEMA)
+    # Store downloaded data in parquet format
+    save_artifact(link, data_dir, 'link', date_col=None)
+    
+    # Close WRDS API connection
+    conn.close()
+
+# Downloads and saves Compustat raw data
+def download_compustat_data(data_dir, wrds_id):
     ###################################### Download Compustat data ######################################
 
+    conn = wrds.Connection(wrds_username=wrds_id)
     cstat = conn.raw_sql("""select a.gvkey, a.datadate, a.at, a.pstkl, a.txditc, a.fyear, a.ceq, a.lt,
                             a.mib, a.itcb, a.txdb, a.pstkrv, a.seq, a.pstk, b.sic, b.year1, b.naics
                             from comp.funda as a
                             left join comp.names as b
                             on a.gvkey = b.gvkey
                             where indfmt='INDL' and datafmt='STD' and popsrc='D' and consol='C'""")
-    # Store downloaded data in pickle format
-    cstat.to_pickle(data_dir + 'cstat.pkl')
+    # Store downloaded data in parquet format
+    save_artifact(cstat, data_dir, 'cstat', date_col='datadate')
     
     ###################################### Download Pension data ######################################
     
     pension = conn.raw_sql("""select gvkey, datadate, prba from comp.aco_pnfnda
                               where indfmt='INDL' and datafmt='STD' and popsrc='D' and consol='C'""")
-    # Store downloaded data in pickle format
-    pension.to_pickle(data_dir + 'pension.pkl')
-    
-    ############################# Download CRSP-Compustat link table data #############################
-
-    link = conn.raw_sql("""select gvkey, lpermno as permno, lpermco as permco, linktype,
-                           linkprim, liid, linkdt, linkenddt
-                           from crspq.ccmxpf_linktable
-                           where substr(linktype,1,1)='L' and (linkprim ='C' or linkprim='P')""")
-    # Store downloaded data in pickle format
-    link.to_pickle(data_dir + 'link.pkl')
+    # Store downloaded data in parquet format
+    save_artifact(pension, data_dir, 'pension', date_col='datadate')
     
     # Close WRDS API connection
     conn.close()
+
+# Downloads the CRSP stock months released after the stored raw data: Inputs - data_dir and wrds_id
+# The new months are fetched as one partition from the month after the last stored one to today, and the delisting
+# returns up to the end of the last new month, so the next update starts right after them. The stored raw data is
+# not changed (see update_raw_data).
+def download_raw_crsp_delta(data_dir, wrds_id):
+    # First day of the month after the last stored month
+    last_date = pd.Timestamp(load_artifact(data_dir, 'mscrsp_raw', columns=['date'])['date'].max())
+    start = (last_date + MonthBegin(1)).strftime('%Y-%m-%d')
+
+    # Download the new CRSP stock monthly returns, fetched again on every update as the partition is still open
+    mscrsp_delta = download_partitioned(lambda: wrds.Connection(wrds_username=wrds_id), MSF_QUERY,
+                                        [(start, datetime.date.today().isoformat())],
+                                        os.path.join(data_dir, 'checkpoints'), 'mscrsp_delta', refresh=True)
+    if len(mscrsp_delta) == 0:
+        return mscrsp_delta, None
+
+    # Download the delisting returns of the new months
+    end = (pd.Timestamp(to_dates(mscrsp_delta['date']).max()) + MonthEnd(0)).strftime('%Y-%m-%d')
+    conn = wrds.Connection(wrds_username=wrds_id)
+    msdelcrsp_delta = conn.raw_sql(MSEDELIST_QUERY.format(start=start, end=end))
+    conn.close()
+
+    return mscrsp_delta, msdelcrsp_delta
     
 def download_ff3_monthly_data(data_dir):
     # Fama and French 3 Factors
@@ -76,21 +108,27 @@ def download_ff3_monthly_data(data_dir):
     
     # Changing date format and save
     ffm = ffm.reset_index().rename(columns={"Date": "date"})
-    ffm['date'] = pd.DataFrame(ffm[['date']].values.astype('datetime64[ns]')) + MonthEnd(0)
+    ffm.insert(1, 'month_id', month_id(ffm['date']))
+    ffm['date'] = month_end(ffm['month_id'].values)
     
     # Drop unreqiured columns
     ffm.drop(columns=['Mkt-RF'], inplace=True)
 
     # Filter dates
-    ffm = ffm[ffm["date"].dt.year >= min_year]
-    ffm = ffm[ffm["date"].dt.year <= max_year]
+    ffm = ffm[(ffm["month_id"] >= year_month_id(min_year, 1)) & (ffm["month_id"] <= year_month_id(max_year, 12))]
 
-    # Store downloaded data in pickle format
-    ffm.to_pickle(data_dir + 'ffm.pkl')
+    # Store downloaded data in parquet format
+    save_artifact(ffm, data_dir, 'ffm')
     
-# Processes and saves raw CRSP stock returns and delisted returns data to create a merged dataframe
-def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
+# Processes and saves raw CRSP stock returns and delisted returns data to create a merged dataframe:
+# Inputs - data_dir, raw CRSP stock returns and delisting returns, and whether to store the result
+# (incremental updates process only the new months and append them instead)
+def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw, store=True):
     print("      Processing raw data for stocks ...")
+    # Track memory usage of each processing stage
+    report = MemoryReport()
+    report.record('mscrsp_raw', mscrsp_raw)
+    report.record('msdelcrsp_raw', msdelcrsp_raw)
     
     ############################### Process raw CRSP returns ###############################
     
@@ -104,11 +142,11 @@ def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
                             mscrsp_raw['shrout'].notna()].copy()
 
     # Reference - Assignment Instruction: PERMNO, SHRCD, EXCHCD and SHROUT variables have type integer
-    int_columns = ['permno', 'permco', 'shrcd', 'exchcd', 'shrout']
-    mscrsp_raw[int_columns] = mscrsp_raw[int_columns].astype(int)
+    # Use the compact schema: int32 ids and shares, int8 codes (optionally float32 prices and shares)
+    mscrsp_raw = apply_schema(mscrsp_raw, CRSP_SCHEMA, float32=float32_prices)
 
     # Reference - Assignment Instruction: Format the date column as a datetime
-    mscrsp_raw['date'] = pd.to_datetime(mscrsp_raw['date'], format='%Y-%m-%d', errors='ignore')
+    mscrsp_raw['date'] = to_dates(mscrsp_raw['date'])
 
     # Sort the data by permno and date and reset index because we dropped rows above
     mscrsp_raw = mscrsp_raw.sort_values(by=['permco', 'permno', 'date']).reset_index(drop=True).copy()
@@ -119,12 +157,11 @@ def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
     msdelcrsp_raw = msdelcrsp_raw.sort_values(by=['permco', 'permno', 'dlstdt']).reset_index(drop=True).copy()
     
     # Reference - Assignment Instruction: PERMNO variable has type integer
-    msdelcrsp_raw['permno'] = msdelcrsp_raw['permno'].astype(int)
-    msdelcrsp_raw['permco'] = msdelcrsp_raw['permco'].astype(int)
+    msdelcrsp_raw = apply_schema(msdelcrsp_raw, CRSP_SCHEMA)
 
     # Reference - Assignment Instruction: Format the date column as a datetime
     msdelcrsp_raw = msdelcrsp_raw.rename(columns={"dlstdt": "date"}).copy()
-    msdelcrsp_raw['date'] = pd.to_datetime(msdelcrsp_raw['date'], format='%Y-%m-%d', errors='ignore')
+    msdelcrsp_raw['date'] = to_dates(msdelcrsp_raw['date'])
 
     # Sort the data by permno and date and reset index
     msdelcrsp_raw = msdelcrsp_raw.sort_values(by=['permco', 'permno', 'date']).reset_index(drop=True).copy()
@@ -136,11 +173,20 @@ def process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw):
     # Sort the data by permno and date and reset index
     mscrsp_processed = mscrsp_processed.sort_values(by=['permco', 'permno', 'date']).reset_index(drop=True).copy()
     
-    # Store Processed merged CRSP data in pickle format
-    mscrsp_processed.to_pickle(data_dir + 'mscrsp_processed.pkl')
+    # The outer merge turns integer columns with missing values into float64, restore the compact schema
+    mscrsp_processed = apply_schema(mscrsp_processed, CRSP_SCHEMA, float32=float32_prices)
+    report.record('mscrsp_processed', mscrsp_processed)
     
-# Adds CompuStat Link to CRSP Stock Data: Inputs - CRSP_Stocks and Link_Table
-def add_compuStat_link(CRSP_Stocks, Link_Table):
+    if store == True:
+        # Store Processed merged CRSP data in parquet format
+        save_artifact(mscrsp_processed, data_dir, 'mscrsp_processed')
+        # Store the memory report of the processing stages
+        report.save(os.path.join(data_dir, 'memory_report_mscrsp_processed.json'))
+
+    return mscrsp_processed
+    
+# Adds CompuStat Link to CRSP Stock Data: Inputs - CRSP_Stocks, Link_Table and whether to store the result
+def add_compuStat_link(CRSP_Stocks, Link_Table, store=True):
     # Step 1: Merge all links
     CRSP_Stocks = CRSP_Stocks.sort_values(['permco', 'permno', 'date']).reset_index(drop=True).copy()
     CRSP_Stocks = CRSP_Stocks.merge(Link_Table, on=['permno', 'permco'], how='inner')
@@ -175,18 +221,16 @@ def add_compuStat_link(CRSP_Stocks, Link_Table):
     CRSP_Stocks.drop(['keep', 'flag', 'ct_flag'], axis=1, inplace=True)    
 
     # Dropping linktable variable that are no longer needed
-    CRSP_Stocks_Linked = CRSP_Stocks.drop(axis=1, columns=['linktype', 'linkprim', 'liid', 'linkdt', 'linkenddt'])
+    CRSP_Stocks_Linked = CRSP_Stocks.drop(columns=['linktype', 'linkprim', 'liid', 'linkdt', 'linkenddt'])
     
-    # Store final data in pickle format
-    CRSP_Stocks_Linked.to_pickle(data_dir + 'CRSP_Stocks_Linked.pkl')
+    if store == True:
+        # Store final data in parquet format
+        save_artifact(CRSP_Stocks_Linked, data_dir, 'CRSP_Stocks_Linked')
     
     return CRSP_Stocks_Linked
     
-# Cleans linked CRSP stock data to prepare for merger with CompuStat: Inputs - CRSP_Stocks_Linked
-def clean_linked_crsp(CRSP_Stocks_Linked):
-    # Create a copy of the dataframe to be used locally
-    CRSP_Linked = CRSP_Stocks_Linked.copy()
-
+# Returns the parameters used to clean the linked CRSP stock panel
+def clean_linked_crsp_params():
     # Reference - Kenneth R. French:
     # "Rm-Rf, the excess return on the market, value-weight return of all CRSP firms incorporated in the US and
     # listed on the NYSE, AMEX, or NASDAQ that have a CRSP share code of 10 or 11 at the beginning of month t,
@@ -197,87 +241,42 @@ def clean_linked_crsp(CRSP_Stocks_Linked):
     # Filter relevant shrcd - Reference - Kenneth R. French: "that have a CRSP share code of 10 or 11"
     shrcd_set = [10, 11]
 
-    # Move all dates to the last day of the month
-    CRSP_Linked['date'] = CRSP_Linked['date'] + MonthEnd(0)
-    # Sort again as we changed date values
-    CRSP_Linked = CRSP_Linked.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
-
-    # exchcd/shrcd are nan for delisted returns, so filtering rows on required exchcd/shrcd removes delisted return rows
-    # dlstcd is not-nan for all the delisted return rows, so it has been used as a proxy to identify delisted return rows
-    # Rows with unrequired exchcd/shrcd are removed only if those are non delisted return row
-    CRSP_Linked = CRSP_Linked[(CRSP_Linked['dlstcd'].notna()) |
-                              ((CRSP_Linked['dlstcd'].isna()) & (CRSP_Linked['exchcd'].isin(exchcd_set)))]
-
-    CRSP_Linked = CRSP_Linked[(CRSP_Linked['dlstcd'].notna()) |
-                              ((CRSP_Linked['dlstcd'].isna()) & (CRSP_Linked['shrcd'].isin(shrcd_set)))]
-    
-    # Adjust for Delisting Returns
-    # Use compounded return if both return and delisted return are available
-    CRSP_Linked['ret'] = np.where(CRSP_Linked['ret'].notna() & CRSP_Linked['dlret'].notna(),
-                          (1 + CRSP_Linked['ret'])*(1 + CRSP_Linked['dlret']) - 1,
-                          CRSP_Linked['ret'])
-    # Use delisted return if return is not available but delited return is
-    CRSP_Linked['ret'] = np.where(CRSP_Linked['ret'].isna() & CRSP_Linked['dlret'].notna(),
-                          CRSP_Linked['dlret'],
-                          CRSP_Linked['ret'])
-    # Drop missing returns
-    CRSP_Linked = CRSP_Linked[CRSP_Linked['ret'].notna()].copy()
-    # Reset index
-    CRSP_Linked = CRSP_Linked.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
-
-    # Calculate market equity in USD millions
-    # Use absolute price because if price is bid/ask average it has a negative sign to indicate so
-    CRSP_Linked['me'] = CRSP_Linked['prc'].abs()*CRSP_Linked['shrout']*1e-3
-
-    # Aggregate Market Cap. computation
-    # For a given date and permco, sum me across different permno to find cumulative market-cap for the permco
-    CRSP_Linked_ME_SUM = CRSP_Linked.groupby(['date','permco'])['me'].sum().reset_index()
-    # For a given date and permco, among multiple market-caps for different permno find the largest one
-    CRSP_Linked_ME_MAX = CRSP_Linked.groupby(['date','permco'])['me'].max().reset_index()
-    # Merge CRSP_Linked and CRSP_Linked_ME_MAX
-    CRSP_Linked = pd.merge(CRSP_Linked, CRSP_Linked_ME_MAX, how='inner', on=['date', 'permco', 'me'])
-    # Replace me with cumulative me
-    # Drop existing me
-    CRSP_Linked = CRSP_Linked.drop(['me'], axis=1)
-    # Merge CRSP_Linked and CRSP_Linked_ME_SUM to use cumulative market cap
-    CRSP_Linked = pd.merge(CRSP_Linked, CRSP_Linked_ME_SUM, how='inner', on=['date', 'permco'])
-    # Sort by permno and date and drop duplicates
-    CRSP_Linked = CRSP_Linked.sort_values(by=['permno', 'date']).drop_duplicates()
-    
-    # lagged Market Capitalization computation
-    # Add column with lagged market cap
-    CRSP_Linked['lme'] = CRSP_Linked.groupby(['permno'])['me'].shift(1)
-    # If a permno is the first permno, use me/(1+retx) to replace the missing value    
-    CRSP_Linked['1+retx'] = 1 + CRSP_Linked['retx']
-    CRSP_Linked['count'] = CRSP_Linked.groupby(['permno']).cumcount()
-    CRSP_Linked['lme'] = np.where(CRSP_Linked['count'] == 0,
-                                  CRSP_Linked['me']/CRSP_Linked['1+retx'],
-                                  CRSP_Linked['lme'])
-    # Drop missing lme
-    CRSP_Linked = CRSP_Linked[CRSP_Linked['lme'].notna()].copy()
-    
-    # Reset index
-    CRSP_Linked = CRSP_Linked.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
-    
-    # Data integrity checkes
-    assert (CRSP_Linked['ret'] == -66).any() == False
-    assert (CRSP_Linked['ret'] == -77).any() == False
-    assert (CRSP_Linked['ret'] == -88).any() == False
-    assert (CRSP_Linked['ret'] == -99).any() == False
-    assert CRSP_Linked['ret'].isna().any() == False
-    assert CRSP_Linked['lme'].isna().any() == False
-    
+    # Only use the history needed for the July (min_year-1) portfolios: lagged ME and December ME of min_year-2
+    start_date = str(min_year-2) + '-01-01'
+
+    # Filter, adjust for delisting returns and compute market equity (in USD millions) and lagged market equity
+    return dict(exchcd_set=exchcd_set, shrcd_set=shrcd_set, min_date=start_date, me_scale=1e-3, drop_cols=[])
+
+# Loads the cleaned linked CRSP stock panel, linking, cleaning and caching it only if the processed data, the link
+# table or the filters changed: Inputs - data_dir
+def load_clean_linked_crsp(data_dir):
+    params = clean_linked_crsp_params()
+
+    # Add CompuStat Link to CRSP Stock Data
+    def load_linked_crsp():
+        CRSP_Stocks = load_artifact(data_dir, 'mscrsp_processed', start=params['min_date'])
+        Link_Table = load_artifact(data_dir, 'link')
+        return add_compuStat_link(CRSP_Stocks, Link_Table)
+
+    return cached_clean_crsp_stocks(data_dir, ['mscrsp_processed', 'link'], load_linked_crsp, **params)
+
+# Prepares cleaned linked CRSP stock data for merger with CompuStat:
+# Inputs - CRSP_Stocks_Linked (cleaned linked panel) and whether to store the result
+def clean_linked_crsp(CRSP_Stocks_Linked, store=True):
+    # Create a copy of the dataframe to be used locally
+    CRSP_Linked = CRSP_Stocks_Linked.copy()
+
     # Create Calendar Year and Month Columns
-    CRSP_Linked['Year'] = CRSP_Linked['date'].dt.year
-    CRSP_Linked['Month'] = CRSP_Linked['date'].dt.month
+    CRSP_Linked['Year'], CRSP_Linked['Month'] = year_month(CRSP_Linked['month_id'].values)
 
-    # Create Fama-French Portfolio Date, Year and Month Columns
-    CRSP_Linked['port_date'] = CRSP_Linked['date'] + MonthEnd(-6)
-    CRSP_Linked['Port_Year'] = CRSP_Linked['port_date'].dt.year
-    CRSP_Linked['Port_Month'] = CRSP_Linked['port_date'].dt.month 
+    # Create Fama-French Portfolio Year and Month Columns (July is month 1 of the portfolio year)
+    CRSP_Linked['Port_Year'], CRSP_Linked['Port_Month'] = portfolio_year_month(CRSP_Linked['month_id'].values)
 
     # For each permno compute cumulative return for each portfolio year
-    CRSP_Linked['cum_retx'] = CRSP_Linked.groupby(['permno', 'Port_Year'])['1+retx'].cumprod()
+    # The product runs along the months of a dense permno x month panel and restarts every July, months without a
+    # row are skipped like in a groupby cumprod over the rows
+    panel = DensePanel.from_long(CRSP_Linked, ['1+retx'])
+    CRSP_Linked['cum_retx'] = panel.to_rows(panel.cumprod('1+retx', reset_key=portfolio_year_month(panel.months)[0]))
     # For each permno compute lagged cumulative return for each portfolio year
     CRSP_Linked['lcum_retx'] = CRSP_Linked.groupby(['permno'])['cum_retx'].shift(1)
     
@@ -294,18 +293,20 @@ def clean_linked_crsp(CRSP_Stocks_Linked):
     # Drop Unrequired columns
     CRSP_Linked_Clean.drop(['permco', 'siccd', 'naics', 'retx', 'prc', '1+retx', 'shrout', 'cum_retx',
                             'dlret', 'dlretx', 'dlstcd', 'dlexchcd', 'dlsiccd', 'dlnaics',
-                            'lcum_retx', 'base_lme', 'lme', 'port_date', 'Port_Month'], axis=1, inplace=True)
+                            'lcum_retx', 'base_lme', 'lme', 'Port_Month'], axis=1, inplace=True)
     
     # Sort and reset index
-    CRSP_Linked = CRSP_Linked.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
+    CRSP_Linked = CRSP_Linked.sort_values(by=['permno', 'month_id']).reset_index(drop=True).copy()
 
-    # Store final data in pickle format
-    CRSP_Linked_Clean.to_pickle(data_dir + 'CRSP_Linked_Clean.pkl')
+    if store == True:
+        # Store final data in parquet format
+        save_artifact(CRSP_Linked_Clean, data_dir, 'CRSP_Linked_Clean')
 
     return CRSP_Linked_Clean
     
- # Merges CRSP Stock Data with CompuStat Data: Inputs - CRSP_Stocks_Linked_Clean, Compustat
-def merge_crsp_compu(CRSP_Stocks_Linked_Clean, Compustat):
+ # Merges CRSP Stock Data with CompuStat Data: Inputs - CRSP_Stocks_Linked_Clean, Compustat and whether to store the
+# result
+def merge_crsp_compu(CRSP_Stocks_Linked_Clean, Compustat, store=True):
 
     #################################### Prepare CRPS Data For Merger ####################################
     
@@ -315,14 +316,14 @@ def merge_crsp_compu(CRSP_Stocks_Linked_Clean, Compustat):
     # Extract calendar june month data
     CRSP_Clean_June = CRSP_Clean[CRSP_Clean['Month'] == 6]
     
-    # Extract calendar dec month me values
-    DEC_ME = CRSP_Clean[CRSP_Clean['Month'] == 12][['permno', 'Year', 'me']].rename(columns={'me' : 'dec_me'})
-    DEC_ME['Year'] = DEC_ME['Year'] + 1
+    # Extract calendar dec month me values, moved to the following june (6 months later)
+    DEC_ME = CRSP_Clean[CRSP_Clean['Month'] == 12][['permno', 'month_id', 'me']].rename(columns={'me' : 'dec_me'})
+    DEC_ME['month_id'] = DEC_ME['month_id'] + 6
     
     # Merge calendar june month data with calendar dec month me values
-    CRSP_Clean_June = pd.merge(CRSP_Clean_June, DEC_ME, how='inner', on=['permno', 'Year'])    
-    CRSP_Clean_June = CRSP_Clean_June[['permno', 'date', 'exchcd', 'me', 'gvkey', 'dec_me']]
-    CRSP_Clean_June = CRSP_Clean_June.sort_values(by=['permno', 'date']).drop_duplicates()
+    CRSP_Clean_June = pd.merge(CRSP_Clean_June, DEC_ME, how='inner', on=['permno', 'month_id'])    
+    CRSP_Clean_June = CRSP_Clean_June[['permno', 'date', 'month_id', 'exchcd', 'me', 'gvkey', 'dec_me']]
+    CRSP_Clean_June = CRSP_Clean_June.sort_values(by=['permno', 'month_id']).drop_duplicates()
     
     ################################## Prepare Compustat Data For Merger ##################################
     
@@ -330,8 +331,7 @@ def merge_crsp_compu(CRSP_Stocks_Linked_Clean, Compustat):
     Compu = Compustat.sort_values(by=['gvkey', 'datadate']).reset_index(drop=True).copy()
     
     # Format the date column as a datetime
-    Compu['datadate'] = pd.to_datetime(Compu['datadate'])
-    Compu['Year'] = Compu['datadate'].dt.year
+    Compu['datadate'] = to_dates(Compu['datadate'])
 
     # Compute Book value of preferred stock (PS)
     # Reference - Assignment Instruction:
@@ -358,107 +358,102 @@ def merge_crsp_compu(CRSP_Stocks_Linked_Clean, Compustat):
     # For each gvkey compute number of years in Compustat data
     Compu['count'] = Compu.groupby(['gvkey']).cumcount()
     
-    # Push each date by 6 months to create date variable
-    Compu['date'] = Compu['datadate'] + YearEnd(0) + MonthEnd(6)
-    Compu = Compu[['gvkey', 'datadate', 'Year', 'date', 'BE', 'count']]
+    # Fiscal years ending in calendar year t are used from june of year t+1
+    Compu['month_id'] = formation_month(month_id(Compu['datadate']))
+    Compu = Compu[['gvkey', 'datadate', 'month_id', 'BE', 'count']]
     
     # Merge CRPS June Data with Compustat Data
-    CRSP_COMPU = pd.merge(CRSP_Clean_June, Compu, how='inner', on=['gvkey', 'date'])
+    CRSP_COMPU = pd.merge(CRSP_Clean_June, Compu, how='inner', on=['gvkey', 'month_id'])
     
     # Reset index
-    CRSP_COMPU = CRSP_COMPU.sort_values(by=['permno', 'date']).reset_index(drop=True).copy()
+    CRSP_COMPU = CRSP_COMPU.sort_values(by=['permno', 'month_id']).reset_index(drop=True).copy()
     
     # Compute book-to-market values
     CRSP_COMPU['bm'] = CRSP_COMPU['BE']*1000/CRSP_COMPU['dec_me']
     
     # Filter dates
-    CRSP_COMPU = CRSP_COMPU[CRSP_COMPU['date'].dt.year >= min_year-1]
-    CRSP_COMPU = CRSP_COMPU[CRSP_COMPU['date'].dt.year <= max_year]
+    CRSP_COMPU = CRSP_COMPU[(CRSP_COMPU['month_id'] >= year_month_id(min_year-1, 1)) &
+                            (CRSP_COMPU['month_id'] <= year_month_id(max_year, 12))]
     
     # Drop Unrequired columns
-    CRSP_COMPU.drop(['gvkey', 'dec_me', 'datadate', 'Year', 'BE'], axis=1, inplace=True)
+    CRSP_COMPU.drop(['gvkey', 'dec_me', 'datadate', 'BE'], axis=1, inplace=True)
     
-    # Sort by date and reset index
-    CRSP_COMPU = CRSP_COMPU.sort_values(by=['date']).reset_index(drop=True).copy()
+    # Sort by month and reset index
+    CRSP_COMPU = CRSP_COMPU.sort_values(by=['month_id']).reset_index(drop=True).copy()
     
-    # Store final data in pickle format
-    CRSP_COMPU.to_pickle(data_dir + 'CRSP_COMPU.pkl')
+    if store == True:
+        # Store final data in parquet format
+        save_artifact(CRSP_COMPU, data_dir, 'CRSP_COMPU')
 
     return CRSP_COMPU
     
-def apply_nyse_breakpoints(df_row, df_nyse_breakpoints, factor, labels):
-    # Find relevant row in NYSE break-points dataframe    
-    rel_row = df_nyse_breakpoints[df_nyse_breakpoints.date == df_row.date.values[0]]
-    # Extract break-point values    
-    break_points = rel_row.values[0][1:]
-    # Append -inf and inf
-    break_points = np.concatenate([[-np.inf], break_points, [np.inf]])
-    # Apply NYSE break-points    
-    Factor_deciles = pd.cut(df_row[factor], break_points, labels=labels)
-    
-    return Factor_deciles
-    
-def add_nyse_partitions(CRSP_COMPU, factor, req_percentiles, labels, new_col, add_brkpnt_cols=False):
-    # Filter NYSE data
-    CRSP_COMPU_NYSE = CRSP_COMPU[(CRSP_COMPU['exchcd'] == 1) & (CRSP_COMPU['count'] > 1)]
-    
-    # Find NYSE percentiles
-    NYSE_Factor_By_Y = CRSP_COMPU_NYSE.groupby(["date"])[factor]
-    NYSE_percentiles = NYSE_Factor_By_Y.describe(percentiles=req_percentiles).reset_index()
-    
+def add_nyse_partitions(CRSP_COMPU, NYSE_tables, factor, req_percentiles, labels, new_col, add_brkpnt_cols=False):
     # Find NYSE breakpoints
-    breakpoints_str = [str(int(100*x)) + "%" for x in req_percentiles]
-    NYSE_breakpoints = NYSE_percentiles[["date"] + breakpoints_str]
+    breakpoints_str = [percentile_label(x) for x in req_percentiles]
+    NYSE_breakpoints = NYSE_tables[factor][["month_id"] + breakpoints_str]
     
     if add_brkpnt_cols == True:
-        CRSP_COMPU = pd.merge(CRSP_COMPU, NYSE_breakpoints, how='left', on=['date'])
+        CRSP_COMPU = pd.merge(CRSP_COMPU, NYSE_breakpoints, how='left', on=['month_id'])
         
-    # Sort by date and reset index
-    CRSP_COMPU = CRSP_COMPU.sort_values(by=['date']).reset_index(drop=True).copy()
+    # Sort by month and reset index
+    CRSP_COMPU = CRSP_COMPU.sort_values(by=['month_id']).reset_index(drop=True).copy()
 
     # Apply NYSE breakpoints    
-    CRSP_COMPU[new_col] = CRSP_COMPU.groupby(["date"]).apply(apply_nyse_breakpoints,
-                                                             NYSE_breakpoints,
-                                                             factor,
-                                                             labels).reset_index([0,1])[factor]
+    CRSP_COMPU[new_col] = apply_breakpoints(CRSP_COMPU, "month_id", factor, NYSE_breakpoints, labels)
     return CRSP_COMPU
     
-# Defines size and book-to-market decile portfolios as defined in Fama and French (1992), as well as the HML and SMB -
-# factors as defined in Fama and French (1993) : Inputs - CRSP_Stocks_Linked_Clean, CRSP_COMPU
-def define_portfolios(CRSP_Stocks_Linked_Clean, CRSP_COMPU):
-    # Create copy of the dataframes to be used locally
-    CRSP_Clean = CRSP_Stocks_Linked_Clean.copy()   
-    
+# Assigns each permno to its size and book-to-market portfolios for every portfolio year using the June data:
+# Inputs - CRSP_COMPU and whether to store the result. The assignments are stored so that new months can be added
+# without recomputing them.
+def assign_portfolios(CRSP_COMPU, store=True):
     # Filter Unrequired Rows
     CRSP_COMPU = CRSP_COMPU[CRSP_COMPU["count"] >= 1]    
     CRSP_COMPU = CRSP_COMPU[(CRSP_COMPU["bm"] >= 0)]
 
-    # Sort by date and reset index
-    CRSP_COMPU = CRSP_COMPU.sort_values(by=['date']).reset_index(drop=True).copy()
+    # Sort by month and reset index
+    CRSP_COMPU = CRSP_COMPU.sort_values(by=['month_id']).reset_index(drop=True).copy()
+
+    # Find NYSE percentiles of me and bm, every factor is sorted once for all of its partitions below
+    decile_percentiles = list(np.arange(0.1, 1, 0.1))
+    CRSP_COMPU_NYSE = CRSP_COMPU[(CRSP_COMPU['exchcd'] == 1) & (CRSP_COMPU['count'] > 1)]
+    NYSE_tables = cached_breakpoint_tables(CRSP_COMPU_NYSE, "month_id",
+                                           {'me': decile_percentiles + [0.5], 'bm': decile_percentiles + [0.3, 0.7]},
+                                           'nyse', data_dir)
 
     # Add size deciles
-    CRSP_COMPU = add_nyse_partitions(CRSP_COMPU, 'me', np.arange(0.1, 1, 0.1), range(1, 11), "Size_Port")    
+    CRSP_COMPU = add_nyse_partitions(CRSP_COMPU, NYSE_tables, 'me', decile_percentiles, range(1, 11), "Size_Port")
     # Add bm deciles
-    CRSP_COMPU = add_nyse_partitions(CRSP_COMPU, 'bm', np.arange(0.1, 1, 0.1), range(1, 11), "BtM_Port")
-    # Sort by date and reset index
-    CRSP_COMPU = CRSP_COMPU.sort_values(by=['date']).reset_index(drop=True).copy()
+    CRSP_COMPU = add_nyse_partitions(CRSP_COMPU, NYSE_tables, 'bm', decile_percentiles, range(1, 11), "BtM_Port")
+    # Sort by month and reset index
+    CRSP_COMPU = CRSP_COMPU.sort_values(by=['month_id']).reset_index(drop=True).copy()
     
     # Create size SB portfolios
-    CRSP_COMPU = add_nyse_partitions(CRSP_COMPU, 'me', [0.5], ['S', 'B'], "Size_SB", True)
+    CRSP_COMPU = add_nyse_partitions(CRSP_COMPU, NYSE_tables, 'me', [0.5], ['S', 'B'], "Size_SB", True)
     # Create bm LMH portfolios
-    CRSP_COMPU = add_nyse_partitions(CRSP_COMPU, 'bm', [0.3, 0.7], ['L', 'M', 'H'], "BtM_LMH", True)
+    CRSP_COMPU = add_nyse_partitions(CRSP_COMPU, NYSE_tables, 'bm', [0.3, 0.7], ['L', 'M', 'H'], "BtM_LMH", True)
     
-    # Add Portfolio Year
-    CRSP_COMPU['Port_Year'] = CRSP_COMPU['date'].dt.year
+    # Add Portfolio Year, the calendar year of the june formation month
+    CRSP_COMPU['Port_Year'] = year_month(CRSP_COMPU['month_id'].values)[0]
     
-    # Sort by date and reset index
-    CRSP_COMPU = CRSP_COMPU.sort_values(by=['date']).reset_index(drop=True).copy()
+    # Sort by month and reset index
+    CRSP_COMPU = CRSP_COMPU.sort_values(by=['month_id']).reset_index(drop=True).copy()
     
     # Drop Unrequired columns
-    CRSP_COMPU.drop(['date', 'exchcd', 'me', 'count', 'bm', '50%', '30%', '70%'], axis=1, inplace=True)
-    
+    CRSP_COMPU.drop(['date', 'month_id', 'exchcd', 'me', 'count', 'bm', '50%', '30%', '70%'], axis=1, inplace=True)
+
+    if store == True:
+        # Store portfolio assignments in parquet format
+        save_artifact(CRSP_COMPU, data_dir, 'CRSP_PORT_ASSIGN', date_col='Port_Year')
+
+    return CRSP_COMPU
+
+# Adds portfolio assignments to the monthly records: Inputs - CRSP_Stocks_Linked_Clean and CRSP_PORT_ASSIGN
+def merge_portfolios(CRSP_Stocks_Linked_Clean, CRSP_PORT_ASSIGN):
+    # Create copy of the dataframes to be used locally
+    CRSP_Clean = CRSP_Stocks_Linked_Clean.copy()   
+
     # Merge back with monthly records
-    CRSP_PORT = pd.merge(CRSP_Clean, CRSP_COMPU, how='left', on=['permno', 'Port_Year'])
+    CRSP_PORT = pd.merge(CRSP_Clean, CRSP_PORT_ASSIGN, how='left', on=['permno', 'Port_Year'])
 
     # Filter Unrequired Rows
     CRSP_PORT = CRSP_PORT[(CRSP_PORT['vw'] > 0)]
@@ -467,58 +462,161 @@ def define_portfolios(CRSP_Stocks_Linked_Clean, CRSP_COMPU):
     CRSP_PORT = CRSP_PORT[CRSP_PORT.Year >= min_year -1]
     CRSP_PORT = CRSP_PORT[CRSP_PORT.Year <= max_year]
     
-    # Drop Unrequired columns
-    CRSP_PORT.drop(['permno', 'shrcd', 'exchcd', 'gvkey', 'me', 'count'], axis=1, inplace=True)
+    # Drop Unrequired columns, permno identifies the holdings of the turnover computation
+    CRSP_PORT.drop(['shrcd', 'exchcd', 'gvkey', 'me', 'count'], axis=1, inplace=True)
 
-    # Sort and reset index
-    CRSP_PORT = CRSP_PORT.sort_values(by=['date']).reset_index(drop=True).copy()
+    # Sort and reset index, stable sort keeps the permno order within each month
+    CRSP_PORT = CRSP_PORT.sort_values(by=['month_id'], kind='mergesort').reset_index(drop=True).copy()
+
+    return CRSP_PORT
+
+# Defines size and book-to-market decile portfolios as defined in Fama and French (1992), as well as the HML and SMB -
+# factors as defined in Fama and French (1993) : Inputs - CRSP_Stocks_Linked_Clean, CRSP_COMPU
+def define_portfolios(CRSP_Stocks_Linked_Clean, CRSP_COMPU):
+    # Assign portfolios for each portfolio year and merge them back with monthly records
+    CRSP_PORT = merge_portfolios(CRSP_Stocks_Linked_Clean, assign_portfolios(CRSP_COMPU))
     
-    # Store final data in pickle format
-    CRSP_PORT.to_pickle(data_dir + 'CRSP_PORT.pkl')
+    # Store final data in parquet format
+    save_artifact(CRSP_PORT, data_dir, 'CRSP_PORT')
     
     return CRSP_PORT
-    
+
+# Appends newly released months of CRSP stock data to the portfolio records without reprocessing the history:
+# Inputs - raw CRSP stock returns and delisting returns of the new months only (same columns as the full download)
+# Value weights of the new months only need the rows of the current portfolio year, which are part of the trailing
+# rows stored with the cleaned panel, so the appended months are identical to the ones a full rebuild would compute.
+# June forms the portfolios of the next portfolio year, so new June months are assigned first (see
+# update_portfolio_assignments). Months after max_year are added to the cleaned panels only.
+def update_portfolios(mscrsp_delta, msdelcrsp_delta):
+    print("Updating portfolio records ...")
+
+    # Process the new months the same way as the full history
+    mscrsp_processed_delta = process_raw_crsp_stock_data(data_dir, mscrsp_delta, msdelcrsp_delta, store=False)
+
+    # The new months must directly follow the stored portfolio records, unless they are all after max_year
+    first_month = month_id(mscrsp_processed_delta['date']).min()
+    last_month = load_artifact(data_dir, 'CRSP_PORT', columns=['month_id'])['month_id'].max()
+    if first_month <= year_month_id(max_year, 12) and first_month != last_month + 1:
+        raise RuntimeError("CRSP_PORT ends before the new months, run the driver with remerge=True first")
+
+    # Add CompuStat Link to the new months
+    CRSP_Stocks_Linked_Delta = add_compuStat_link(mscrsp_processed_delta, load_artifact(data_dir, 'link'), store=False)
+
+    # Clean the new months and append them (and the processed rows) to the stored data
+    CRSP_Stocks_New, CRSP_Stocks_Tail = update_clean_crsp_stocks(data_dir, ['mscrsp_processed', 'link'],
+                                                                 CRSP_Stocks_Linked_Delta,
+                                                                 lambda: append_artifact(mscrsp_processed_delta,
+                                                                                         data_dir, 'mscrsp_processed'),
+                                                                 **clean_linked_crsp_params())
+
+    # Compute value weights over the trailing rows and the new months, and keep the new months only
+    CRSP_Linked_Clean = clean_linked_crsp(pd.concat([CRSP_Stocks_Tail, CRSP_Stocks_New], ignore_index=True),
+                                          store=False)
+    new_months = np.unique(CRSP_Stocks_New['month_id'])
+    CRSP_Linked_Clean_New = CRSP_Linked_Clean[CRSP_Linked_Clean['month_id'].isin(new_months)]
+    append_artifact(CRSP_Linked_Clean_New, data_dir, 'CRSP_Linked_Clean')
+
+    # Portfolios of the new portfolio years are assigned from the new June months
+    june_months = new_months[year_month(new_months)[1] == 6]
+    if len(june_months) > 0:
+        update_portfolio_assignments(june_months)
+
+    # Add stored portfolio assignments to the new months
+    CRSP_PORT_New = merge_portfolios(CRSP_Linked_Clean_New, load_artifact(data_dir, 'CRSP_PORT_ASSIGN'))
+
+    # Months after max_year are only added to the cleaned panels
+    if len(CRSP_PORT_New) == 0:
+        print("      The new months are after max_year " + str(max_year) + ", move max_year to add them to the "
+              "portfolio records")
+        return None
+
+    append_artifact(CRSP_PORT_New, data_dir, 'CRSP_PORT')
+
+    return CRSP_PORT_New
+
+# Assigns the portfolios of the portfolio years formed in newly released June months and appends them to the stored
+# merged data and assignments: Inputs - month ids of the June months
+# The June rows and the December rows before them are read back from the stored CRSP_Linked_Clean and merged with
+# the stored Compustat data, so the assignments are identical to the ones a full remerge would compute from it.
+def update_portfolio_assignments(june_months):
+    print("      Assigning portfolios of the new portfolio years ...")
+
+    # Linked rows from the end of November before the first June, so the December rows are read whatever their day
+    CRSP_Linked_Window = load_artifact(data_dir, 'CRSP_Linked_Clean', start=month_end(june_months - 7).min())
+
+    # Merge the June rows with Compustat and keep the new June months only (June months after max_year are dropped)
+    CRSP_COMPU_New = merge_crsp_compu(CRSP_Linked_Window, load_artifact(data_dir, 'cstat'), store=False)
+    CRSP_COMPU_New = CRSP_COMPU_New[CRSP_COMPU_New['month_id'].isin(june_months)]
+    if len(CRSP_COMPU_New) == 0:
+        return None
+    append_artifact(CRSP_COMPU_New, data_dir, 'CRSP_COMPU')
+
+    # Assign the portfolios of the new portfolio years and append them
+    CRSP_PORT_ASSIGN_New = assign_portfolios(CRSP_COMPU_New, store=False)
+    append_artifact(CRSP_PORT_ASSIGN_New, data_dir, 'CRSP_PORT_ASSIGN')
+
+    return CRSP_PORT_ASSIGN_New
+    
+# Adds the turnover, trading cost and net return of every portfolio and month to the portfolio returns:
+# Inputs - portfolio returns (month_id, portfolio columns and <Prefix>_Ret), CRSP_PORT, portfolio columns and prefix
+def add_portfolio_costs(Port_Ret, CRSP_PORT, Port_Cols, Prefix):
+    Costs = value_weighted_turnover(CRSP_PORT, "month_id", Port_Cols, "permno", "ret", "vw", cost_model)
+    Costs = Costs.rename(columns = {"Turnover" : Prefix + "_Turnover", "Cost" : Prefix + "_Cost"})
+    Port_Ret = Port_Ret.merge(Costs, how='left', on=["month_id"] + Port_Cols)
+    Port_Ret[Prefix + "_Net_Ret"] = Port_Ret[Prefix + "_Ret"] - Port_Ret[Prefix + "_Cost"]
+    return Port_Ret
+
 # Implements PS4-Q1 requirements: Inputs - CRSP_PORT and ffm
 def PS4_Q1(CRSP_PORT, ffm):
+    # Months of the sample
+    first_month = year_month_id(min_year, 1)
+    last_month = year_month_id(max_year, 12)
 
     # Calculate Size Returns
-    group_sz = CRSP_PORT.groupby(["date", "Size_Port"])
-    Size_Decile_Returns = group_sz.apply(lambda x: np.average(x.ret, weights = x.vw)).reset_index([0, 1])
-    Size_Decile_Returns = Size_Decile_Returns.rename(columns = {0 : "Size_Ret"})
+    Size_Decile_Returns = grouped_weighted_mean(CRSP_PORT, ["month_id", "Size_Port"], "ret", "vw")
+    Size_Decile_Returns = Size_Decile_Returns[["month_id", "Size_Port", "vw_ret"]].rename(columns = {"vw_ret" : "Size_Ret"})
+    Size_Decile_Returns = add_portfolio_costs(Size_Decile_Returns, CRSP_PORT, ["Size_Port"], "Size")
     # Filter dates
-    Size_Decile_Returns = Size_Decile_Returns[Size_Decile_Returns["date"].dt.year >= min_year]
-    Size_Decile_Returns = Size_Decile_Returns[Size_Decile_Returns["date"].dt.year <= max_year]
+    Size_Decile_Returns = Size_Decile_Returns[(Size_Decile_Returns["month_id"] >= first_month) &
+                                              (Size_Decile_Returns["month_id"] <= last_month)]
     
     # Calculate BtM Returns
-    group_btm = CRSP_PORT.groupby(["date", "BtM_Port"])
-    BtM_Decile_Returns = group_btm.apply(lambda x: np.average(x.ret, weights = x.vw)).reset_index([0, 1])
-    BtM_Decile_Returns = BtM_Decile_Returns.rename(columns = {0 : "BtM_Ret"})
+    BtM_Decile_Returns = grouped_weighted_mean(CRSP_PORT, ["month_id", "BtM_Port"], "ret", "vw")
+    BtM_Decile_Returns = BtM_Decile_Returns[["month_id", "BtM_Port", "vw_ret"]].rename(columns = {"vw_ret" : "BtM_Ret"})
+    BtM_Decile_Returns = add_portfolio_costs(BtM_Decile_Returns, CRSP_PORT, ["BtM_Port"], "BtM")
     # Filter dates
-    BtM_Decile_Returns = BtM_Decile_Returns[BtM_Decile_Returns["date"].dt.year >= min_year]
-    BtM_Decile_Returns = BtM_Decile_Returns[BtM_Decile_Returns["date"].dt.year <= max_year]
+    BtM_Decile_Returns = BtM_Decile_Returns[(BtM_Decile_Returns["month_id"] >= first_month) &
+                                            (BtM_Decile_Returns["month_id"] <= last_month)]
     
-    # Add famma-french rf data to both
-    Size_Decile_Returns = pd.merge(Size_Decile_Returns, ffm[["date", "RF"]], how='outer')
-    BtM_Decile_Returns = pd.merge(BtM_Decile_Returns, ffm[["date", "RF"]], how='outer')
+    # Add famma-french rf data to both on the month id, then the month end date of every month
+    Size_Decile_Returns = pd.merge(Size_Decile_Returns, ffm[["month_id", "RF"]], how='outer', on="month_id")
+    Size_Decile_Returns.insert(0, "date", month_end(Size_Decile_Returns["month_id"].values))
+    BtM_Decile_Returns = pd.merge(BtM_Decile_Returns, ffm[["month_id", "RF"]], how='outer', on="month_id")
+    BtM_Decile_Returns.insert(0, "date", month_end(BtM_Decile_Returns["month_id"].values))
     
     # Compute SB and LMH returns
-    group_sz_bm = CRSP_PORT.groupby(['date', 'Size_SB', 'BtM_LMH'])
-    CRSP_Factor_Returns = group_sz_bm.apply(lambda x: np.average(x.ret, weights=x.vw)).reset_index([0, 1, 2])
-    CRSP_Factor_Returns = CRSP_Factor_Returns.rename(columns={0: 'Factor_Ret'})
+    gp_cols_sz_bm = ['month_id', 'Size_SB', 'BtM_LMH']
+    CRSP_Factor_Returns = grouped_weighted_mean(CRSP_PORT, gp_cols_sz_bm, 'ret', 'vw')
+    CRSP_Factor_Returns = CRSP_Factor_Returns[gp_cols_sz_bm + ['vw_ret']].rename(columns={'vw_ret': 'Factor_Ret'})
+    CRSP_Factor_Returns = add_portfolio_costs(CRSP_Factor_Returns, CRSP_PORT, ['Size_SB', 'BtM_LMH'], "Factor")
+    CRSP_Factor_Returns.insert(0, "date", month_end(CRSP_Factor_Returns["month_id"].values))
     # Filter dates
-    CRSP_Factor_Returns = CRSP_Factor_Returns[CRSP_Factor_Returns["date"].dt.year >= min_year]
-    CRSP_Factor_Returns = CRSP_Factor_Returns[CRSP_Factor_Returns["date"].dt.year <= max_year]
+    CRSP_Factor_Returns = CRSP_Factor_Returns[(CRSP_Factor_Returns["month_id"] >= first_month) &
+                                              (CRSP_Factor_Returns["month_id"] <= last_month)]
 
     return Size_Decile_Returns, BtM_Decile_Returns, CRSP_Factor_Returns
     
-# Given a return series, computes and stores required performance stats
-def compute_performance_metrics(df, Ex_Ret, new_col):
-    df.loc[new_col, "Excess Return"] = 100*12*Ex_Ret.mean()
-    df.loc[new_col, "Volatility"] = 100*np.sqrt(12)*Ex_Ret.std()
-    df.loc[new_col, "Sharpe Ratio"] = df.loc[new_col, "Excess Return"]/df.loc[new_col, "Volatility"]
-    df.loc[new_col, "Skewness"] = skew(Ex_Ret)
-    df.loc[new_col, "Ex_Ret t-stat-all"] = ttest_1samp(Ex_Ret, [0], axis=0).statistic
-    df.loc[new_col, "Ex_Ret t-stat-5yr"] = ttest_1samp(Ex_Ret[-60:], [0], axis=0).statistic
+# Given return series (one column per portfolio), computes required performance stats of all of them in one pass:
+# Inputs - Ex_Ret and the author's returns of the same portfolios to add their correlation (optional)
+def compute_performance_metrics(Ex_Ret, Ex_Ret_Auth=None):
+    df = performance_stats(Ex_Ret, reference=Ex_Ret_Auth).drop(columns=['kurtosis'])
+    df = df.rename(columns={'mean': "Excess Return", 'vol': "Volatility", 'sharpe': "Sharpe Ratio", 'skew': "Skewness",
+                            'tstat': "Ex_Ret t-stat-all", 'tstat_5yr': "Ex_Ret t-stat-5yr", 'corr': "corr w/ original"})
+
+    # Add the bootstrap confidence intervals only if needed
+    if bootstrap_ci == True:
+        df = df.join(confidence_interval_columns(Ex_Ret, {'mean': "Excess Return", 'sharpe': "Sharpe Ratio"},
+                                                 n_reps=bootstrap_reps))
     
     return df
     
@@ -527,61 +625,30 @@ def PS4_Q2_3_Common(CRSP_Decile_Returns, ffm, Port_Col, Ret_Col, ffm_prefix):
     # Create a copy of the dataframe to be used locally
     CRSP_Ret = CRSP_Decile_Returns.copy()
 
-    # Create dataframe to store required replication stats
-    df_stats = pd.DataFrame()
-
     # Compute excess return
     CRSP_Ret["Ex_Ret"] = CRSP_Ret[Ret_Col] - CRSP_Ret['RF']    
 
-    # Compute required stats for each decile
-    gp_decile = CRSP_Ret.groupby(Port_Col)
-    df_stats["Excess Return"] = 100*12*gp_decile["Ex_Ret"].mean()
-    df_stats["Volatility"] = 100*np.sqrt(12)*gp_decile["Ex_Ret"].std()
-    df_stats["Sharpe Ratio"] = df_stats["Excess Return"]/df_stats["Volatility"]
-    df_stats["Skewness"] = gp_decile["Ex_Ret"].skew()
-    df_stats["Ex_Ret t-stat-all"] = gp_decile.apply(lambda x: ttest_1samp(x.Ex_Ret, 0, axis=0).statistic)
-    df_stats["Ex_Ret t-stat-5yr"] = gp_decile.apply(lambda x: ttest_1samp(x.Ex_Ret[-60:], 0, axis=0).statistic)
-    
-    # Compute Long and Short excess returns    
-    LS_Ex_Ret = gp_decile.get_group(10)["Ex_Ret"].values - gp_decile.get_group(1)["Ex_Ret"].values
-    # Switch direction if size portfolio
-    if Ret_Col == "Size_Ret":
-        LS_Ex_Ret = -LS_Ex_Ret
-
-    # Append Long and Short stats
-    df_stats = compute_performance_metrics(df_stats, LS_Ex_Ret, "Long_Short")
-    
-    # Create dataframe to store required stats for author's return
-    df_stats_auth = pd.DataFrame()
-    
-    # Array to store colleation values
-    correlations = np.zeros(11)
-
-    # Compute correlation for each decile and performance metrics for author's portfolios
-    for i in range(10):
-        Ex_Ret_Self = gp_decile.get_group(i+1)["Ex_Ret"].values
-        Ex_Ret_Auth = ffm[ffm_prefix + str(i+1)].values - gp_decile.get_group(i+1)["RF"].values
-        correlations[i] = np.corrcoef(Ex_Ret_Self, Ex_Ret_Auth)[0, 1]
-        df_stats_auth = compute_performance_metrics(df_stats_auth, Ex_Ret_Auth, str(i+1))
-    
-    # Compute Author Long and Short returns    
-    LS_Ex_Ret_Auth = ffm[ffm_prefix + "10"] - ffm[ffm_prefix + "1"]
-    # Switch direction if size portfolio
-    if Ret_Col == "Size_Ret":
-        LS_Ex_Ret_Auth = -LS_Ex_Ret_Auth
-    # Append author Long and Short stats
-    df_stats_auth = compute_performance_metrics(df_stats_auth, LS_Ex_Ret_Auth, "Long_Short")
-    
-    # Compute correlation for Long and Short
-    correlations[10] = np.corrcoef(LS_Ex_Ret, LS_Ex_Ret_Auth)[0, 1]
-    
-    # Append correlation to the stats df
-    df_stats["corr w/ original"] = correlations
+    # Decile excess returns, one row per month and one column per decile
+    Ex_Ret = CRSP_Ret.pivot(index='date', columns=Port_Col, values='Ex_Ret')
+    RF = CRSP_Ret.pivot(index='date', columns=Port_Col, values='RF')
+    
+    # Author's decile excess returns in the same layout, ffm has the same months in the same order
+    Ex_Ret_Auth = pd.DataFrame(ffm[[ffm_prefix + str(i+1) for i in range(10)]].values.astype(float) - RF.values,
+                               index=Ex_Ret.index, columns=[str(i+1) for i in range(10)])
+    
+    # Compute Long and Short excess returns, switch direction if size portfolio
+    direction = -1 if Ret_Col == "Size_Ret" else 1
+    Ex_Ret["Long_Short"] = direction*(Ex_Ret[10] - Ex_Ret[1])
+    Ex_Ret_Auth["Long_Short"] = direction*(ffm[ffm_prefix + "10"].values - ffm[ffm_prefix + "1"].values).astype(float)
+
+    # Compute required stats and correlations with the author's portfolios, and the author's stats
+    df_stats = compute_performance_metrics(Ex_Ret, Ex_Ret_Auth)
+    df_stats_auth = compute_performance_metrics(Ex_Ret_Auth)
     
     # PLot returns
-    dec_10_ex_ret = gp_decile.get_group(10)["Ex_Ret"].values[-120:]
-    dec_1_ex_ret = gp_decile.get_group(1)["Ex_Ret"].values[-120:]
-    ls_ex_ret = LS_Ex_Ret[-120:]
+    dec_10_ex_ret = Ex_Ret[10].values[-120:]
+    dec_1_ex_ret = Ex_Ret[1].values[-120:]
+    ls_ex_ret = Ex_Ret["Long_Short"].values[-120:]
     plt.figure(figsize=(16, 8))
     plt.plot(ffm.date.values[-120:], dec_10_ex_ret, "--", label="Decile 10", color="midnightblue")
     plt.plot(ffm.date.values[-120:], dec_1_ex_ret, "--", label="Decile 1", color="red")
@@ -639,68 +706,122 @@ def PS4_Q5(CRSP_Factor_Returns, ffm):
     FF_Factors_Self['S'] = (FF_Factors_Self['SL'] + FF_Factors_Self['SM'] + FF_Factors_Self['SH'])/3
     FF_Factors_Self['SMB'] = FF_Factors_Self['S'] - FF_Factors_Self['B']
  
-    # Create dataframe to store required stats
-    df_ps4_q5 = pd.DataFrame()
-    
-    # Add performance stats for replication
-    df_ps4_q5 = compute_performance_metrics(df_ps4_q5, FF_Factors_Self['HML'], "HML")
-    df_ps4_q5 = compute_performance_metrics(df_ps4_q5, FF_Factors_Self['SMB'], "SMB")
-    df_ps4_q5.loc["HML", "corr w/ original"] = np.corrcoef(FF_Factors_Self['HML'], ffm['HML'].astype(float))[0, 1]    
-    df_ps4_q5.loc["SMB", "corr w/ original"] = np.corrcoef(FF_Factors_Self['SMB'], ffm['SMB'].astype(float))[0, 1]
-    
-    # Create dataframe to store required stats for author's return
-    df_ps4_q5_auth = pd.DataFrame()
+    # Add performance stats and correlations for replication
+    FF_Factors_Self = FF_Factors_Self.rename_axis(None, axis=1)
+    df_ps4_q5 = compute_performance_metrics(FF_Factors_Self[['HML', 'SMB']], ffm[['HML', 'SMB']].astype(float))
     
     # Add performance stats for author's results
-    df_ps4_q5_auth = compute_performance_metrics(df_ps4_q5_auth, ffm['HML'], "HML")
-    df_ps4_q5_auth = compute_performance_metrics(df_ps4_q5_auth, ffm['SMB'], "SMB")
+    df_ps4_q5_auth = compute_performance_metrics(ffm[['HML', 'SMB']].astype(float))
 
     return df_ps4_q5.T, df_ps4_q5_auth.T
  
+# Compares the gross and net of trading cost performance of decile portfolios and their long short portfolio:
+# Inputs - CRSP_Decile_Returns, Portfolio Column Name and prefix of the return columns ('Size' or 'BtM')
+def PS4_Costs(CRSP_Decile_Returns, Port_Col, Prefix):
+    # Decile excess returns, trading costs and turnover, one row per month and one column per decile
+    Ex_Ret = CRSP_Decile_Returns.pivot(index='date', columns=Port_Col, values=Prefix + '_Ret')
+    Ex_Ret = Ex_Ret - CRSP_Decile_Returns.pivot(index='date', columns=Port_Col, values='RF')
+    Cost = CRSP_Decile_Returns.pivot(index='date', columns=Port_Col, values=Prefix + '_Cost')
+    Turnover = CRSP_Decile_Returns.pivot(index='date', columns=Port_Col, values=Prefix + '_Turnover')
+
+    # Long short trades both deciles, switch direction if size portfolio
+    direction = -1 if Prefix == "Size" else 1
+    Ex_Ret["Long_Short"] = direction*(Ex_Ret[10] - Ex_Ret[1])
+    Cost["Long_Short"] = Cost[10] + Cost[1]
+    Turnover["Long_Short"] = Turnover[10] + Turnover[1]
+
+    return net_of_cost_summary(Ex_Ret, Cost, Turnover).T
+
+# Compares the gross and net of trading cost performance of HML and SMB: Inputs - CRSP_Factor_Returns
+def PS4_Factor_Costs(CRSP_Factor_Returns):
+    # Returns, trading costs and turnover of the six size and book-to-market portfolios, one column per portfolio
+    SB_PORT = CRSP_Factor_Returns['Size_SB'].astype(str) + CRSP_Factor_Returns['BtM_LMH'].astype(str)
+    Port_Data = CRSP_Factor_Returns.assign(SB_PORT=SB_PORT)
+    Ret, Cost, Turnover = [Port_Data.pivot(index='date', columns='SB_PORT', values=col)
+                           for col in ['Factor_Ret', 'Factor_Cost', 'Factor_Turnover']]
+
+    # HML and SMB trade every leg with the weight of the leg, so costs and turnover add up over the legs
+    legs = {'HML': (['BH', 'SH'], ['BL', 'SL'], 1/2), 'SMB': (['SL', 'SM', 'SH'], ['BL', 'BM', 'BH'], 1/3)}
+    Ex_Ret = pd.DataFrame({factor: scale*(Ret[long].sum(axis=1, min_count=len(long)) -
+                                          Ret[short].sum(axis=1, min_count=len(short)))
+                           for factor, (long, short, scale) in legs.items()})
+    Factor_Cost = pd.DataFrame({factor: scale*Cost[long + short].sum(axis=1, min_count=len(long + short))
+                                for factor, (long, short, scale) in legs.items()})
+    Factor_Turnover = pd.DataFrame({factor: scale*Turnover[long + short].sum(axis=1, min_count=len(long + short))
+                                    for factor, (long, short, scale) in legs.items()})
+
+    return net_of_cost_summary(Ex_Ret, Factor_Cost, Factor_Turnover).T
+
 # Processes raw CRSP data downloaded from WRDS for each asset class
 def process_raw_data():
     # Load stored raw CRSP stock returns data as a dataframe
-    mscrsp_raw = pd.read_pickle(data_dir + 'mscrsp_raw.pkl')
+    mscrsp_raw = load_artifact(data_dir, 'mscrsp_raw')
 
     # Load stored raw CRSP stock delisting returns data as a dataframe
-    msdelcrsp_raw = pd.read_pickle(data_dir + 'msdelcrsp_raw.pkl')
+    msdelcrsp_raw = load_artifact(data_dir, 'msdelcrsp_raw')
     
     # Process and store raw CRSP stock returns and delisting returns
-    process_raw_crsp_stock_data(data_dir, mscrsp_raw, msdelcrsp_raw)
+    run_stage('process', process_raw_crsp_stock_data, data_dir, mscrsp_raw, msdelcrsp_raw)
+
+# Downloads the CRSP months released since the last download and appends them to the stored data and portfolio
+# records instead of downloading, processing and merging the full history again
+def update_raw_data():
+    # Download the new CRSP stock months
+    mscrsp_delta, msdelcrsp_delta = run_stage('download', download_raw_crsp_delta, data_dir, wrds_id)
+
+    if len(mscrsp_delta) == 0:
+        print("      No new months released since the last download")
+    else:
+        # June assignments use the fiscal years ending in the previous year, so Compustat is downloaded again
+        if (year_month(month_id(mscrsp_delta['date']))[1] == 6).any():
+            run_stage('download', download_compustat_data, data_dir, wrds_id)
+
+        # Append the new months to the processed data, the cleaned panels and the portfolio records
+        run_stage('update', update_portfolios, mscrsp_delta, msdelcrsp_delta)
+
+        # Store the new raw rows last, the next update starts after them
+        append_artifact(mscrsp_delta, data_dir, 'mscrsp_raw')
+        if len(msdelcrsp_delta) > 0:
+            append_artifact(msdelcrsp_delta, data_dir, 'msdelcrsp_raw')
+
+    # FF3 and portfolio monthly data is small, so it is downloaded again
+    run_stage('download', download_ff3_monthly_data, data_dir)
 
 # Links and merges CRSP stock data with CompuStat data
 def link_n_merge_crsp_compu(remerge=False):
     # If remerge is set to true, remerge CRSP stock data with CompuStat data
     if remerge == True:        
-        # Add CompuStat Link to CRSP Stock Data
-        CRSP_Stocks = pd.read_pickle(data_dir + 'mscrsp_processed.pkl')
-        Link_Table = pd.read_pickle(data_dir + 'link.pkl')
-        CRSP_Stocks_Linked = add_compuStat_link(CRSP_Stocks, Link_Table)
+        # Load the linked and cleaned CRSP stock panel (rebuilt only if the processed data or the link table changed)
+        CRSP_Stocks_Linked = run_stage('link', load_clean_linked_crsp, data_dir)
         
-        # Clean linked CRSP stock data
-        CRSP_Linked_Clean = clean_linked_crsp(CRSP_Stocks_Linked)
+        # Prepare linked CRSP stock data for the merger
+        CRSP_Linked_Clean = run_stage('clean', clean_linked_crsp, CRSP_Stocks_Linked)
 
         # Load Compustat stock data as dataframe
-        Compustat = pd.read_pickle(data_dir + 'cstat.pkl')
+        Compustat = load_artifact(data_dir, 'cstat')
         # Merge CRSP stock data with CompuStat data
-        CRSP_COMPU = merge_crsp_compu(CRSP_Linked_Clean, Compustat)
+        CRSP_COMPU = run_stage('merge', merge_crsp_compu, CRSP_Linked_Clean, Compustat)
 
-    # Otherwise load pre-merged data from the stored pickle files
+    # Otherwise load pre-merged data from the artifact store
     else:
-        print("Loading pre-merged data from the pickle file ...")
+        print("Loading pre-merged data from the artifact store ...")
         # Load stored pre-merged data as a dataframe
-        CRSP_Linked_Clean = pd.read_pickle(data_dir + 'CRSP_Linked_Clean.pkl')
-        CRSP_COMPU = pd.read_pickle(data_dir + 'CRSP_COMPU.pkl')
+        CRSP_Linked_Clean = load_artifact(data_dir, 'CRSP_Linked_Clean')
+        CRSP_COMPU = load_artifact(data_dir, 'CRSP_COMPU')
 
     return CRSP_Linked_Clean, CRSP_COMPU
     
 # Runs all the functions and prints the required results
-def driver(download_data=False, process_data=False, remerge=False):
+def driver(download_data=False, process_data=False, remerge=False, update_data=False):
+    # Record time, memory and data sizes of every stage in a trace file
+    start_trace('PS4', os.path.join(data_dir, 'trace_PS4.json'))
+
     # Download the data only if needed
     if download_data == True:
         print("Downloading data ...")
-        download_raw_crsp_data(data_dir, wrds_id)
-        download_ff3_monthly_data(data_dir)
+        with stage('download'):
+            download_raw_crsp_data(data_dir, wrds_id)
+            download_ff3_monthly_data(data_dir)
     else:
         print("Skipped data downloading!")
     
@@ -711,24 +832,32 @@ def driver(download_data=False, process_data=False, remerge=False):
     else:
         print("Skipped raw data processing!")
     
-    # Link and Merge CRSP stock data with CompuStat data
-    CRSP_Linked_Clean, CRSP_COMPU = link_n_merge_crsp_compu(remerge)
+    # Append the months released since the last download to the stored portfolio records only if needed
+    if update_data == True:
+        print("Appending newly released months ...")
+        update_raw_data()
+        CRSP_PORT = load_artifact(data_dir, 'CRSP_PORT')
 
-    # Defines size and book-to-market decile portfolios and book-to-market-LMH and size-SB portfolios    
-    CRSP_PORT = define_portfolios(CRSP_Linked_Clean, CRSP_COMPU)
+    # Otherwise link, merge and define the portfolios of the full history
+    else:
+        # Link and Merge CRSP stock data with CompuStat data
+        CRSP_Linked_Clean, CRSP_COMPU = link_n_merge_crsp_compu(remerge)
+
+        # Defines size and book-to-market decile portfolios and book-to-market-LMH and size-SB portfolios    
+        CRSP_PORT = run_stage('partition', define_portfolios, CRSP_Linked_Clean, CRSP_COMPU)
 
     # Load stored ffm returns as a dataframe
-    ffm = pd.read_pickle(data_dir + 'ffm.pkl')
+    ffm = load_artifact(data_dir, 'ffm')
     
     # Compute returns for size and book-to-market decile portfolios and HML and SMB factors
-    Size_Decile_Returns, BtM_Decile_Returns, CRSP_Factor_Returns = PS4_Q1(CRSP_PORT, ffm)    
+    Size_Decile_Returns, BtM_Decile_Returns, CRSP_Factor_Returns = run_stage('aggregate', PS4_Q1, CRSP_PORT, ffm)
     
     # Set display style
     sty = [dict(selector="caption", props=[("text-align", "center"), ("font-size", "125%"), ("color", 'crimson')])]
 
     # Display Q2 results
     pd.set_option("display.precision", 4)
-    ps4_q2, ps4_q2_auth = PS4_Q2(Size_Decile_Returns, ffm)
+    ps4_q2, ps4_q2_auth = run_stage('stats', PS4_Q2, Size_Decile_Returns, ffm)
     #display(ps4_q2_auth.style.set_caption("Size Decile Portfolios - 1973 to 2023 - Fama-French").set_table_styles(sty))
     print(ps4_q2_auth)
     print("\n")
@@ -737,7 +866,7 @@ def driver(download_data=False, process_data=False, remerge=False):
     print("\n")
     
     # Display Q3 results
-    ps4_q3, ps4_q3_auth = PS4_Q3(BtM_Decile_Returns, ffm)
+    ps4_q3, ps4_q3_auth = run_stage('stats', PS4_Q3, BtM_Decile_Returns, ffm)
     #display(ps4_q3_auth.style.set_caption("BtM Decile Portfolios - 1973 to 2023 - Fama-French").set_table_styles(sty))
     print(ps4_q3_auth)
     print("\n")
@@ -746,7 +875,7 @@ def driver(download_data=False, process_data=False, remerge=False):
     print("\n")
 
     # Display Q5 results
-    ps4_q5, ps4_q5_auth = PS4_Q5(CRSP_Factor_Returns, ffm)    
+    ps4_q5, ps4_q5_auth = run_stage('stats', PS4_Q5, CRSP_Factor_Returns, ffm)
     #display(ps4_q5_auth.style.set_caption("HML & SMB - 1973 to 2023 Fama-French").set_table_styles(sty))
     print(ps4_q5_auth)
     print("\n")
@@ -754,6 +883,17 @@ def driver(download_data=False, process_data=False, remerge=False):
     print(ps4_q5)
     print("\n")
 
+    # Display gross and net of trading cost results
+    print(run_stage('stats', PS4_Costs, Size_Decile_Returns, "Size_Port", "Size"))
+    print("\n")
+    print(run_stage('stats', PS4_Costs, BtM_Decile_Returns, "BtM_Port", "BtM"))
+    print("\n")
+    print(run_stage('stats', PS4_Factor_Costs, CRSP_Factor_Returns))
+    print("\n")
+
+    # Close the trace file
+    stop_trace()
+
 # Import packages
 import pandas as pd
 import numpy as np
@@ -764,10 +904,20 @@ import wrds
 import os
 from pandas.tseries.offsets import *
 import datetime
-from scipy.stats import ttest_1samp
-from scipy.stats import skew
 from scipy import stats
 import math
+from qam_aggregation import grouped_weighted_mean
+from qam_stats import performance_stats
+from qam_bootstrap import confidence_interval_columns
+from qam_costs import value_weighted_turnover, net_of_cost_summary
+from qam_storage import save_artifact, load_artifact, append_artifact
+from qam_crsp import cached_clean_crsp_stocks, update_clean_crsp_stocks
+from qam_calendar import to_dates, month_id, month_end, year_month, year_month_id, portfolio_year_month, formation_month
+from qam_breakpoints import apply_breakpoints, cached_breakpoint_tables, percentile_label
+from qam_panel import DensePanel
+from qam_schema import apply_schema, MemoryReport, CRSP_SCHEMA, LINK_SCHEMA
+from qam_wrds import download_partitioned, date_partitions
+from qam_instrument import start_trace, stop_trace, stage, run_stage
 
 # Directory to store the downloaded data
 data_dir = 'data\\'
@@ -775,6 +925,9 @@ data_dir = 'data\\'
 # WRDS login id
 wrds_id = 'smarty_iitian'
 
+# Specify whether prices and shares are stored as float32 to reduce the memory footprint of the CRSP panel
+float32_prices = False
+
 # Filter relevant date - Reference - Assignment Instruction:
 # "Output should be between January 1973 and December 2023"
 min_year = 1973
@@ -783,10 +936,46 @@ max_year = 2023
 # Specify whether we need to download the raw data or not
 download_data = True
 
+# Specify whether every downloaded partition is fetched again instead of reusing the final checkpoints
+refresh_download = False
+
 # Specify whether we need to process the raw data or not
 process_data = True
 
 # Specify whether we need to Link and Merge CRSP stock data with CompuStat data or not
 remerge = True
 
-driver(download_data, process_data, remerge)
\ No newline at end of file
+# Specify whether the months released since the last download are appended to the stored data and portfolio records
+# instead of downloading, processing and merging the full history again (needs one full run first, and is usually
+# run with download_data and process_data set to False)
+update_data = False
+
+# Specify the trading cost model of the portfolios: 'proportional' (10 bps of every dollar traded) or 'tiered'
+# (by market cap percentile of the month, see qam_costs.COST_TIERS)
+cost_model = 'tiered'
+
+# Specify whether the stats tables add block-bootstrap confidence intervals (95%, stationary bootstrap with 12-month
+# mean blocks) of the annualized mean and Sharpe ratio, and the number of bootstrap replications
+bootstrap_ci = False
+bootstrap_reps = 10000
+
+# CRSP stock monthly returns with the codes and industry of the month, run once per date partition
+MSF_QUERY = """select a.permno, a.permco, a.date, b.shrcd, b.exchcd, b.siccd, b.naics,
+               a.ret, a.retx, a.shrout, a.prc
+               from crspq.msf as a
+               left join crspq.msenames as b
+               on a.permno=b.permno and b.namedt<=a.date and a.date<=b.nameendt
+               where a.date between '{start}' and '{end}'"""
+
+# CRSP stock monthly delisting returns with the codes and industry at delisting, with a delisting date between start
+# and end
+MSEDELIST_QUERY = """select a.permno, a.permco, a.dlret, a.dlretx, a.dlstdt, a.dlstcd,
+                     b.exchcd as dlexchcd, b.siccd as dlsiccd, b.naics as dlnaics
+                     from crspq.msedelist as a
+                     left join crspq.msenames as b
+                     on a.permno=b.permno and b.namedt<=a.dlstdt and a.dlstdt<=b.nameendt
+                     where a.dlstdt between '{start}' and '{end}'"""
+
+# Run the driver only when the script is executed, so that the functions can be imported by the benchmarks
+if __name__ == "__main__":
+    driver(download_data, process_data, remerge, update_data)
\ No newline at end of file
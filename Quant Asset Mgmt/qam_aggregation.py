@@ -0,0 +1,183 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Shared grouped aggregation kernels
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+# Factorizes one or more key columns into a single dense integer group code: Inputs - df and key column names
+# Rows with a missing key get code -1 (same as groupby's default dropna=True behaviour)
+def factorize_keys(df, keys):
+    if isinstance(keys, str):
+        keys = [keys]
+
+    # Factorize each key separately, sorted so that group order matches groupby(sort=True)
+    key_codes = []
+    key_uniques = []
+    for key in keys:
+        codes, uniques = pd.factorize(df[key], sort=True)
+        key_codes.append(codes)
+        key_uniques.append(uniques)
+
+    # Drop rows where any key is missing
+    valid = np.ones(len(df), dtype=bool)
+    for codes in key_codes:
+        valid &= codes >= 0
+
+    # Combine per-key codes into one code in lexicographic (sorted) key order
+    shape = tuple(max(len(uniques), 1) for uniques in key_uniques)
+    combined = np.full(len(df), -1, dtype=np.int64)
+    if valid.any():
+        combined[valid] = np.ravel_multi_index(tuple(codes[valid] for codes in key_codes), shape)
+
+    # Compact the combined code so that only observed groups are kept
+    observed, group_codes = np.unique(combined[valid], return_inverse=True)
+    codes = np.full(len(df), -1, dtype=np.int64)
+    codes[valid] = group_codes
+
+    # Build a frame with one row per observed group holding the key values
+    key_positions = np.unravel_index(observed, shape)
+    groups = pd.DataFrame({key: uniques[pos] for key, uniques, pos in zip(keys, key_uniques, key_positions)})
+
+    return codes, groups
+
+# Computes per-group sums of w*r, w, r and return counts in a single bincount pass: Inputs - group codes, returns,
+# weights. The sum and count of returns only take the finite returns (a NaN return is skipped like in .mean())
+def grouped_sums(codes, ret, weights, n_groups):
+    # Only rows with a valid group code take part in the aggregation
+    valid = codes >= 0
+    codes = codes[valid]
+    ret = np.asarray(ret, dtype=np.float64)[valid]
+    weights = np.asarray(weights, dtype=np.float64)[valid]
+
+    wr_sum = np.bincount(codes, weights=weights*ret, minlength=n_groups)
+    w_sum = np.bincount(codes, weights=weights, minlength=n_groups)
+    finite = np.isfinite(ret)
+    r_sum = np.bincount(codes, weights=np.where(finite, ret, 0), minlength=n_groups)
+    count = np.bincount(codes, weights=finite, minlength=n_groups).astype(np.int64)
+
+    return wr_sum, w_sum, r_sum, count
+
+# Replaces groupby(keys).apply(lambda x: np.average(x[ret_col], weights=x[weight_col])):
+# Inputs - df, key column(s), return column and weight column
+# Returns one row per observed group with the key columns followed by
+# vw_ret (value-weighted mean), ew_ret (equal-weighted mean of the finite returns), weight (sum of weights) and
+# count (number of finite returns)
+def grouped_weighted_mean(df, keys, ret_col, weight_col):
+    if isinstance(keys, str):
+        keys = [keys]
+
+    # Factorize keys into dense integer group codes
+    codes, groups = factorize_keys(df, keys)
+    n_groups = len(groups)
+
+    # Aggregate all the required sums in one pass
+    wr_sum, w_sum, r_sum, count = grouped_sums(codes, df[ret_col].values, df[weight_col].values, n_groups)
+
+    # Compute weighted and equal-weighted means
+    with np.errstate(divide='ignore', invalid='ignore'):
+        groups['vw_ret'] = wr_sum/w_sum
+        groups['ew_ret'] = r_sum/count
+    groups['weight'] = w_sum
+    groups['count'] = count
+
+    return groups
+
+# Sums a column over a trailing window of rows within each group: Inputs - df sorted by key and date, key column,
+# value column, window length and lag (number of most recent rows skipped, lag=2 means rows t-2 back to t-window-1)
+# Replaces groupby(key)[col].shift(lag) followed by groupby(key).rolling(window).sum(). The window is always summed
+# from the oldest to the newest row, so the result only depends on the rows in the window (rolling sums carry
+# rounding from the whole history) and can be reproduced exactly from the last window+lag rows of each group.
+def grouped_window_sum(df, key, col, window, lag=0):
+    values = np.asarray(df[col].values, dtype=np.float64)
+    keys = df[key].values
+    n = len(values)
+
+    # Position of every row within its group
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = keys[1:] != keys[:-1]
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(n), 0))
+    position = np.arange(n) - group_start
+
+    # Only rows with a full window of history get a value (same as rolling with min_periods=window)
+    oldest = lag + window - 1
+    rows = np.flatnonzero(position >= oldest)
+    total = values[rows - oldest].copy()
+    for k in range(oldest - 1, lag - 1, -1):
+        total += values[rows - k]
+
+    result = np.full(n, np.nan)
+    result[rows] = total
+    return result
+
+# Returns the month position of every row, an int64 key increasing with the group and the month id, with the groups
+# spaced far enough apart that a look-back of up to reach months never lands in the previous group: Inputs - df
+# sorted by key and month id (one row per key and month), key column, month id column and reach in months
+# The row of month m - k of the same group is searchsorted(position, position - k) if that row has the key.
+def month_positions(df, key, month_col, reach):
+    keys = df[key].values
+    month = np.asarray(df[month_col].values, dtype=np.int64)
+    n = len(month)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = keys[1:] != keys[:-1]
+    span = month.max() - month.min() + reach + 1
+    position = (np.cumsum(new_group) - 1)*span + month - month.min()
+    if (np.diff(position) <= 0).any():
+        raise ValueError("Rows must be sorted by " + key + " and " + month_col + " with one row per month")
+    return position
+
+# Sums a column over a trailing window of calendar months within each group: Inputs - df sorted by key and month id
+# (one row per key and month), key column, month id column, value column, window length in months, lag (lag=2 means
+# months t-2 back to t-window-1) and minimum number of months with a value in the window (defaults to window, i.e.
+# every month of the window must be present)
+# Unlike grouped_window_sum a gap in the history is a missing month and not the previous row. The window of every row
+# is located in one searchsorted pass over a (group, month id) key and its observations are counted from running sums
+# of the valid values. The rows of the window are summed from the oldest to the newest month, so the result only
+# depends on the months in the window and matches grouped_window_sum bit for bit on histories without gaps. A window
+# without gaps is the lag + window - 1 rows before the row, so those windows are summed from shifted slices of the
+# column and only the windows with gaps or at the start of a group gather their rows.
+# The difference of a running sum (as in qam_momentum.formation_signals) is not used: it depends on every earlier
+# row of the panel, so a ranking return appended for a new month would differ from a full rebuild in the last bits.
+def grouped_month_window_sum(df, key, month_col, col, window, lag=0, min_periods=None):
+    if min_periods is None:
+        min_periods = window
+    values = np.asarray(df[col].values, dtype=np.float64)
+    n = len(values)
+    result = np.full(n, np.nan)
+    if n == 0:
+        return result
+
+    # Month position of every row, no window reaches into the previous group
+    position = month_positions(df, key, month_col, window + lag)
+
+    # First and one past the last row of the months t-lag-window+1 to t-lag
+    start = np.searchsorted(position, position - lag - window + 1, side='left')
+    end = np.searchsorted(position, position - lag, side='right')
+
+    # Months with a value in the window
+    valid = ~np.isnan(values)
+    cum_valid = np.concatenate([[0], np.cumsum(valid)])
+    count = cum_valid[end] - cum_valid[start]
+
+    # A window holds at most window rows, add them oldest first (missing values add zero)
+    filled = np.where(valid, values, 0)
+    oldest = lag + window - 1
+    total = np.zeros(n)
+    if n > oldest:
+        for k in range(window):
+            total[oldest:] += filled[k:n - oldest + k]
+
+    # Windows with a gap, or that start before the group, gather their rows (rows past the window add zero)
+    gaps = np.flatnonzero((start != np.arange(n) - oldest) | (end - start != window))
+    first, last = start[gaps], end[gaps]
+    partial = np.zeros(len(gaps))
+    for k in range(window):
+        partial += np.where(first + k < last, filled[np.minimum(first + k, n - 1)], 0)
+    total[gaps] = partial
+
+    keep = count >= max(min_periods, 1)
+    result[keep] = total[keep]
+    return result
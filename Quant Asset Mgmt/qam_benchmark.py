@@ -0,0 +1,319 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Benchmarks for the data pipeline
+# Akhil Srivastava
+
+import gc
+import importlib
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from qam_breakpoints import breakpoint_tables
+from qam_memory import peak_rss_bytes, current_rss_bytes, reset_peak_rss, max_rss, rss_increase, rss_mb
+from qam_storage import save_artifact, load_artifact
+from qam_synthetic import generate_crsp_compustat
+
+# Problem set scripts benchmarked by the stage suite (imported without running their driver)
+PS_MODULES = {'PS1': 'PS1_706325626_code',
+              'PS2': 'PS2_706325626_code',
+              'PS3': 'PS3_706325626_code',
+              'PS4': 'PS4_706325626_code'}
+
+# Columns of the PS2/PS3 stock and delisting downloads (PS4 downloads more columns of the same tables)
+PS23_STOCK_COLUMNS = ['permno', 'permco', 'date', 'shrcd', 'exchcd', 'ret', 'retx', 'shrout', 'prc']
+PS23_DELIST_COLUMNS = ['permno', 'dlret', 'dlstdt', 'dlstcd']
+
+# Loads one artifact in a fresh process and reports load time and peak memory: Inputs - loader arguments and a queue
+def _timed_load(kind, data_dir, name, columns, start, end, queue):
+    base_rss = peak_rss_bytes()
+    t0 = time.perf_counter()
+    if kind == 'pickle':
+        df = pd.read_pickle(os.path.join(data_dir, name + '.pkl'))
+        # A pickle can only be filtered after the full frame has been read
+        if start is not None:
+            df = df[df['date'] >= start]
+        if end is not None:
+            df = df[df['date'] <= end]
+        if columns is not None:
+            df = df[columns]
+    else:
+        df = load_artifact(data_dir, name, columns=columns, start=start, end=end)
+    elapsed = time.perf_counter() - t0
+    queue.put({'seconds': elapsed,
+               'rows': len(df),
+               'peak_rss_bytes': peak_rss_bytes(),
+               'load_rss_bytes': rss_increase(peak_rss_bytes(), base_rss)})
+
+# Runs target(*args, queue) in a spawned process and returns what it puts on the queue
+# A process that exits without putting anything (killed or crashed outside its error handling) returns an error
+# record instead of blocking the caller.
+def _run_spawned(target, *args):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=target, args=args + (queue,))
+    proc.start()
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except queue_module.Empty:
+            if proc.exitcode is not None:
+                # Anything put just before the exit is still in the pipe
+                try:
+                    result = queue.get(timeout=1)
+                except queue_module.Empty:
+                    result = {'error': "Process exited with code " + str(proc.exitcode) + " without a result"}
+    proc.join()
+    return result
+
+# Runs one load in a spawned process so that peak RSS is not polluted by previous loads
+def _run_isolated(kind, data_dir, name, columns, start, end):
+    result = _run_spawned(_timed_load, kind, data_dir, name, columns, start, end)
+    if 'error' in result:
+        raise RuntimeError("Loading " + name + " failed: " + result['error'])
+    return result
+
+# Compares load time and peak RSS of the legacy pickle against the columnar store for one artifact:
+# Inputs - data_dir, artifact name, projected columns, date range and number of repetitions
+def benchmark_artifact(data_dir, name, columns=None, start=None, end=None, repeat=3):
+    results = []
+    for kind in ['pickle', 'parquet']:
+        runs = [_run_isolated(kind, data_dir, name, columns, start, end) for _ in range(repeat)]
+        results.append({'artifact': name,
+                        'format': kind,
+                        'columns': 'all' if columns is None else ','.join(columns),
+                        'start': start,
+                        'end': end,
+                        'rows': runs[0]['rows'],
+                        'seconds': min(x['seconds'] for x in runs),
+                        'peak_rss_mb': rss_mb(max_rss(*[x['peak_rss_bytes'] for x in runs])),
+                        'load_rss_mb': rss_mb(max_rss(*[x['load_rss_bytes'] for x in runs]))})
+    return pd.DataFrame(results)
+
+# Benchmarks a list of (artifact, columns, start, end) load cases and stores the results as JSON
+def benchmark_artifact_store(data_dir, cases, output_file, repeat=3):
+    df_bench = pd.concat([benchmark_artifact(data_dir, *case, repeat=repeat) for case in cases], ignore_index=True)
+    with open(output_file, 'w') as f:
+        json.dump(df_bench.to_dict(orient='records'), f, indent=2)
+    return df_bench
+
+# Imports a problem set script and points it to its own directory under data_dir: Inputs - PS1 to PS4 and data_dir
+def _load_script(ps, data_dir):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+    module = importlib.import_module(PS_MODULES[ps])
+    module.data_dir = os.path.join(data_dir, ps) + os.sep
+    os.makedirs(module.data_dir, exist_ok=True)
+    return module
+
+# Generates synthetic data and runs the PS1-PS4 pipelines once so that the artifacts every benchmarked stage reads
+# exist: Inputs - data_dir, scale, seed and a queue receiving the raw row counts (or the error of a failed run)
+def _prepare_stage_data(data_dir, scale, seed, queue):
+    try:
+        queue.put({'rows': _prepare_pipelines(data_dir, scale, seed), 'error': None})
+    except Exception as e:
+        queue.put({'rows': None, 'error': repr(e)})
+
+# Writes the synthetic raw files and runs the PS1-PS4 pipelines: Inputs - data_dir, scale and seed
+# Returns the row counts of the raw files.
+def _prepare_pipelines(data_dir, scale, seed):
+    data = generate_crsp_compustat(scale, seed)
+
+    # PS1: raw stock and delisting files, merged file and the cleaned panel cache
+    ps1 = _load_script('PS1', data_dir)
+    save_artifact(data['mcrsp_raw'], ps1.data_dir, 'mcrsp_raw')
+    save_artifact(data['dlret_raw'], ps1.data_dir, 'dlret_raw', date_col='dlstdt')
+    save_artifact(data['ff3_monthly'], ps1.data_dir, 'ff3_monthly', date_col='Year')
+    ps1.process_raw_crsp_data(ps1.data_dir, data['mcrsp_raw'], data['dlret_raw'])
+    ps1.load_clean_crsp_stocks(ps1.data_dir)
+
+    # PS2: stock, bond and t-bill files up to the aggregated monthly universe
+    ps2 = _load_script('PS2', data_dir)
+    save_artifact(data['mscrsp_raw'][PS23_STOCK_COLUMNS], ps2.data_dir, 'mscrsp_raw')
+    save_artifact(data['msdelcrsp_raw'][PS23_DELIST_COLUMNS], ps2.data_dir, 'msdelcrsp_raw', date_col='dlstdt')
+    save_artifact(data['tfz_mth'], ps2.data_dir, 'mbcrsp_raw', date_col='mcaldt')
+    save_artifact(data['mcti'], ps2.data_dir, 'mtbcrsp_raw', date_col='caldt')
+    ps2.process_raw_data()
+    ps2.PS2_Q2(*ps2.compute_monthly_returns(True))
+
+    # PS3: ranking returns
+    ps3 = _load_script('PS3', data_dir)
+    ps3.process_raw_crsp_stock_data(ps3.data_dir, data['mscrsp_raw'][PS23_STOCK_COLUMNS],
+                                    data['msdelcrsp_raw'][PS23_DELIST_COLUMNS])
+    ps3.compute_ranking_returns(True)
+
+    # PS4: stock, Compustat and link files up to the portfolio records
+    ps4 = _load_script('PS4', data_dir)
+    save_artifact(data['mscrsp_raw'], ps4.data_dir, 'mscrsp_raw')
+    save_artifact(data['msdelcrsp_raw'], ps4.data_dir, 'msdelcrsp_raw', date_col='dlstdt')
+    save_artifact(data['cstat'], ps4.data_dir, 'cstat', date_col='datadate')
+    save_artifact(ps4.apply_schema(data['link'], ps4.LINK_SCHEMA), ps4.data_dir, 'link', date_col=None)
+    # The factor download only keeps the PS4 sample years
+    ffm = data['ffm'][(data['ffm']['date'].dt.year >= ps4.min_year) & (data['ffm']['date'].dt.year <= ps4.max_year)]
+    save_artifact(ffm.reset_index(drop=True), ps4.data_dir, 'ffm')
+    ps4.process_raw_data()
+    ps4.define_portfolios(*ps4.link_n_merge_crsp_compu(True))
+
+    return {name: len(df) for name, df in data.items()}
+
+# Inputs of the benchmarked stages: each returns the stage function and its arguments, loaded from the artifacts
+# written by _prepare_stage_data, so that only the stage itself is timed
+def _process_raw_crsp_data_inputs(ps):
+    return ps.process_raw_crsp_data, (ps.data_dir, load_artifact(ps.data_dir, 'mcrsp_raw'),
+                                      load_artifact(ps.data_dir, 'dlret_raw'))
+
+def _ps1_q1_inputs(ps):
+    return ps.PS1_Q1, (ps.load_clean_crsp_stocks(ps.data_dir),)
+
+def _ps2_q3_inputs(ps):
+    return ps.PS2_Q3, (load_artifact(ps.data_dir, 'Monthly_CRSP_Universe'),)
+
+def _ps3_q2_inputs(ps):
+    return ps.PS3_Q2, (load_artifact(ps.data_dir, 'CRSP_Stocks_Momentum'),)
+
+def _add_compustat_link_inputs(ps):
+    start = ps.clean_linked_crsp_params()['min_date']
+    return ps.add_compuStat_link, (load_artifact(ps.data_dir, 'mscrsp_processed', start=start),
+                                   load_artifact(ps.data_dir, 'link'))
+
+def _add_nyse_partitions_inputs(ps):
+    # Size deciles on the June records and NYSE breakpoints, filtered the same way as in assign_portfolios
+    CRSP_COMPU = load_artifact(ps.data_dir, 'CRSP_COMPU')
+    CRSP_COMPU = CRSP_COMPU[(CRSP_COMPU['count'] >= 1) & (CRSP_COMPU['bm'] >= 0)]
+    CRSP_COMPU = CRSP_COMPU.sort_values(by=['month_id']).reset_index(drop=True)
+    decile_percentiles = list(np.arange(0.1, 1, 0.1))
+    CRSP_COMPU_NYSE = CRSP_COMPU[(CRSP_COMPU['exchcd'] == 1) & (CRSP_COMPU['count'] > 1)]
+    NYSE_tables = breakpoint_tables(CRSP_COMPU_NYSE, 'month_id', {'me': decile_percentiles})
+    return ps.add_nyse_partitions, (CRSP_COMPU, NYSE_tables, 'me', decile_percentiles, range(1, 11), 'Size_Port')
+
+def _ps4_q1_inputs(ps):
+    return ps.PS4_Q1, (load_artifact(ps.data_dir, 'CRSP_PORT'), load_artifact(ps.data_dir, 'ffm'))
+
+# Benchmarked stages in pipeline order: stage name to (script, inputs)
+STAGES = {'process_raw_crsp_data': ('PS1', _process_raw_crsp_data_inputs),
+          'PS1_Q1': ('PS1', _ps1_q1_inputs),
+          'PS2_Q3': ('PS2', _ps2_q3_inputs),
+          'PS3_Q2': ('PS3', _ps3_q2_inputs),
+          'add_compuStat_link': ('PS4', _add_compustat_link_inputs),
+          'add_nyse_partitions': ('PS4', _add_nyse_partitions_inputs),
+          'PS4_Q1': ('PS4', _ps4_q1_inputs)}
+
+# Returns the number of rows of a stage input or output (first frame of a tuple), None if it is not a frame
+def _rows(value):
+    if isinstance(value, tuple) and len(value) > 0:
+        value = value[0]
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+# Runs one stage in a fresh process and reports time and memory: Inputs - data_dir, stage name and a queue
+# The peak RSS is reset after the inputs are loaded, so stage_rss_mb is the memory the stage itself needs.
+def _timed_stage(data_dir, stage, queue):
+    try:
+        ps, inputs = STAGES[stage]
+        func, args = inputs(_load_script(ps, data_dir))
+        gc.collect()
+        peak_reset = reset_peak_rss()
+        base_rss = current_rss_bytes()
+        t0 = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - t0
+        queue.put({'seconds': elapsed,
+                   'rows_in': next((_rows(x) for x in args if _rows(x) is not None), None),
+                   'rows_out': _rows(result),
+                   'peak_rss_bytes': peak_rss_bytes(),
+                   'stage_rss_bytes': rss_increase(peak_rss_bytes(), base_rss),
+                   'peak_reset': peak_reset,
+                   'error': None})
+    except Exception as e:
+        queue.put({'error': repr(e)})
+
+# Times and memory-profiles the pipeline stages on synthetic data of each scale:
+# Inputs - working directory for the synthetic artifacts, scales (1 is about the full CRSP history), seed,
+# stage names (defaults to all of STAGES), repetitions per stage and output JSON file
+# Each stage runs in a fresh process; a stage that fails is recorded with its error instead of stopping the suite.
+def benchmark_stages(data_dir, scales=(1, 5, 20), seed=0, stages=None, repeat=1, output_file=None):
+    if stages is None:
+        stages = list(STAGES)
+
+    results = []
+    for scale in scales:
+        scale_dir = os.path.join(data_dir, 'synthetic_x{:g}'.format(scale))
+        print("Preparing synthetic data at scale {:g} in {} ...".format(scale, scale_dir))
+        prepared = _run_spawned(_prepare_stage_data, scale_dir, scale, seed)
+
+        for stage in stages:
+            # Without the prepared artifacts every stage of the scale is recorded with the preparation error
+            if prepared['error'] is not None:
+                runs = [{'error': "Preparing synthetic data failed: " + prepared['error']}]
+            else:
+                print("Benchmarking {} at scale {:g} ...".format(stage, scale))
+                runs = [_run_spawned(_timed_stage, scale_dir, stage) for _ in range(repeat)]
+            record = {'scale': scale,
+                      'seed': seed,
+                      'stage': stage,
+                      'script': STAGES[stage][0],
+                      'crsp_rows': prepared['rows']['mcrsp_raw'] if prepared['error'] is None else None,
+                      'python': platform.python_version(),
+                      'pandas': pd.__version__,
+                      'numpy': np.__version__}
+            errors = [x['error'] for x in runs if x['error'] is not None]
+            if len(errors) > 0:
+                record.update({'seconds': None, 'rows_in': None, 'rows_out': None, 'peak_rss_mb': None,
+                               'stage_rss_mb': None, 'peak_reset': None, 'error': errors[0]})
+            else:
+                record.update({'seconds': min(x['seconds'] for x in runs),
+                               'rows_in': runs[0]['rows_in'],
+                               'rows_out': runs[0]['rows_out'],
+                               'peak_rss_mb': rss_mb(max_rss(*[x['peak_rss_bytes'] for x in runs])),
+                               'stage_rss_mb': rss_mb(max_rss(*[x['stage_rss_bytes'] for x in runs])),
+                               'peak_reset': all(x['peak_reset'] for x in runs),
+                               'error': None})
+            results.append(record)
+
+    df_bench = pd.DataFrame(results)
+    if output_file is not None:
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=2)
+    return df_bench
+
+# Compares a stage benchmark against a baseline run: Inputs - baseline and new JSON files written by
+# benchmark_stages and the time/memory ratio above which a stage is flagged as a regression
+def compare_stage_benchmarks(baseline_file, results_file, max_ratio=1.2):
+    with open(baseline_file) as f:
+        baseline = pd.DataFrame(json.load(f))
+    with open(results_file) as f:
+        results = pd.DataFrame(json.load(f))
+
+    cols = ['scale', 'stage', 'seconds', 'stage_rss_mb']
+    df = pd.merge(baseline[cols], results[cols], how='outer', on=['scale', 'stage'], suffixes=('_base', '_new'))
+    df['seconds_ratio'] = df['seconds_new']/df['seconds_base']
+    df['rss_ratio'] = df['stage_rss_mb_new']/df['stage_rss_mb_base']
+    # Missing or failed stages in the new run are regressions as well
+    df['regression'] = ((df['seconds_ratio'] > max_ratio) | (df['rss_ratio'] > max_ratio) |
+                        (df['seconds_new'].isna() & df['seconds_base'].notna()))
+    return df
+
+if __name__ == '__main__':
+    # Directory with both the legacy pickles and the columnar artifacts
+    data_dir = 'data\\'
+
+    # python qam_benchmark.py stages [scale ...] benchmarks the pipeline stages on synthetic data (default 1, 5, 20)
+    if len(sys.argv) > 1 and sys.argv[1] == 'stages':
+        scales = [float(x) for x in sys.argv[2:]] or [1, 5, 20]
+        print(benchmark_stages(data_dir + 'synthetic', scales, output_file=data_dir + 'bench_stages.json'))
+        sys.exit()
+
+    # Typical load cases: full reload and a PS4 style projected 1972-2023 reload
+    cases = [('mscrsp_processed', None, None, None),
+             ('mscrsp_processed', ['permno', 'permco', 'date', 'ret', 'retx', 'prc', 'shrout'],
+              '1972-01-01', '2023-12-31'),
+             ('CRSP_PORT', None, '1972-01-01', '2023-12-31')]
+
+    print(benchmark_artifact_store(data_dir, cases, data_dir + 'bench_artifact_store.json'))
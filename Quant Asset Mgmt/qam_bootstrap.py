@@ -0,0 +1,105 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Block-bootstrap confidence intervals for the performance statistics of monthly returns
+# Akhil Srivastava
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from qam_stats import STATISTICS, return_statistics
+
+# Draws block-bootstrap month indices: Inputs - number of months, replications, block length (mean block length
+# for the stationary bootstrap), method ('stationary' or 'circular') and numpy random generator
+# Returns a (replications, months) integer array. Blocks wrap around the end of the sample in both methods.
+#   circular   - blocks of fixed length starting at uniformly drawn months (Politis and Romano 1992)
+#   stationary - every month starts a new block with probability 1/block_length (Politis and Romano 1994)
+def bootstrap_indices(n_months, n_reps, block_length, method='stationary', rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+    if method == 'circular':
+        n_blocks = -(-n_months//block_length)
+        starts = rng.integers(0, n_months, size=(n_reps, n_blocks))
+        idx = (starts[:, :, None] + np.arange(block_length)).reshape(n_reps, -1)[:, :n_months]
+        return idx % n_months
+    if method == 'stationary':
+        new_block = rng.random((n_reps, n_months)) < 1/block_length
+        new_block[:, 0] = True
+        starts = rng.integers(0, n_months, size=(n_reps, n_months))
+        # Position where the block of every month started, the month is that many months after the block's start
+        block_pos = np.maximum.accumulate(np.where(new_block, np.arange(n_months), 0), axis=1)
+        idx = np.take_along_axis(starts, block_pos, axis=1) + np.arange(n_months) - block_pos
+        return idx % n_months
+    raise ValueError("Unknown bootstrap method " + repr(method) + ", expected 'stationary' or 'circular'")
+
+# Bootstraps one chunk of replications (one pool task): Inputs - (months, series) returns, replications,
+# block length, method and the chunk's seed sequence. Returns a dict of (replications, series) arrays.
+def _bootstrap_chunk(returns, n_reps, block_length, method, seed):
+    idx = bootstrap_indices(returns.shape[0], n_reps, block_length, method, np.random.default_rng(seed))
+    # The same months are drawn for every series, which keeps the cross-correlation of the portfolios
+    return return_statistics(returns[idx])
+
+# Bootstraps the statistics of many return series at once: Inputs - (months, series) monthly excess returns,
+# replications, block length in months, method ('stationary' or 'circular'), seed, number of worker processes
+# (1 runs in this process) and replications per chunk
+# Replications are split into chunks with independent seeds spawned from seed, so the draws depend only on seed
+# and chunk_size and not on the number of processes. Each chunk is one (replications, months, series) array op.
+# Returns a dict of (replications, series) arrays keyed by STATISTICS.
+def block_bootstrap(returns, n_reps=10000, block_length=12, method='stationary', seed=0, processes=None,
+                    chunk_size=250):
+    returns = np.asarray(returns, dtype=np.float64)
+    if returns.ndim == 1:
+        returns = returns[:, None]
+    sizes = [min(chunk_size, n_reps - start) for start in range(0, n_reps, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(returns, size, block_length, method, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+
+    if processes is None:
+        processes = min(len(tasks), os.cpu_count() or 1)
+    if processes <= 1:
+        chunks = [_bootstrap_chunk(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            chunks = list(pool.map(_bootstrap_chunk, *zip(*tasks)))
+
+    return {stat: np.concatenate([chunk[stat] for chunk in chunks]) for stat in STATISTICS}
+
+# Returns block-bootstrap confidence intervals of the performance statistics of every return series:
+# Inputs - returns dataframe (one row per month, one column per portfolio), replications, block length, method,
+#          confidence level, seed and number of worker processes
+# Returns a tidy dataframe with one row per series and statistic: the point estimate, the bootstrap standard error
+# and the percentile interval.
+#   returns = CRSP_Decile_Returns.pivot(index=['Year', 'Month'], columns='decile', values='Ex_Ret')
+#   intervals = bootstrap_confidence_intervals(returns, n_reps=10000)
+def bootstrap_confidence_intervals(returns, n_reps=10000, block_length=12, method='stationary', confidence=0.95,
+                                   seed=0, processes=None):
+    values = returns.values.astype(np.float64)
+    estimates = return_statistics(values)
+    samples = block_bootstrap(values, n_reps, block_length, method, seed, processes)
+
+    tail = 100*(1 - confidence)/2
+    result = []
+    for stat in STATISTICS:
+        with np.errstate(invalid='ignore'):
+            lower, upper = np.nanpercentile(samples[stat], [tail, 100 - tail], axis=0)
+        result.append(pd.DataFrame({'series': returns.columns,
+                                    'statistic': stat,
+                                    'estimate': estimates[stat],
+                                    'std_error': np.nanstd(samples[stat], axis=0, ddof=1),
+                                    'lower': lower,
+                                    'upper': upper}))
+    return pd.concat(result, ignore_index=True)
+
+# Bootstrap confidence intervals in the layout of the stats tables: Inputs - returns dataframe (one column per
+# portfolio), labels of the reported statistics keyed by STATISTICS (e.g. {'mean': "Excess Return"}) and the
+# bootstrap_confidence_intervals parameters
+# Returns a dataframe with one row per portfolio (the columns of returns) and '<label> CI lower' and
+# '<label> CI upper' columns for every statistic, to be joined to the point estimates.
+#   df_stats = df_stats.join(confidence_interval_columns(Ex_Ret, {'sharpe': "Sharpe Ratio"}))
+def confidence_interval_columns(returns, labels, **params):
+    intervals = bootstrap_confidence_intervals(returns, **params).set_index(['statistic', 'series'])
+    result = pd.DataFrame(index=returns.columns)
+    for stat, label in labels.items():
+        result[label + " CI lower"] = intervals.loc[stat, 'lower'].reindex(returns.columns).values
+        result[label + " CI upper"] = intervals.loc[stat, 'upper'].reindex(returns.columns).values
+    return result
@@ -0,0 +1,213 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Per-period quantiles and breakpoint-based portfolio assignment
+# Akhil Srivastava
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from qam_aggregation import factorize_keys
+from qam_storage import artifact_exists, load_artifact, save_artifact
+
+# Version of the breakpoint computation, bump it whenever breakpoint_tables changes so that cached tables are rebuilt
+BREAKPOINT_VERSION = 1
+
+# Index of the cached breakpoint tables (table configuration and last use) kept in data_dir, and the number of
+# tables kept
+BREAKPOINT_CACHE_INDEX = 'breakpoint_cache.json'
+BREAKPOINT_CACHE_SIZE = 16
+
+# Sorts values within periods with one lexsort: Inputs - values, period code of every value (-1 excludes the
+# value) and number of periods. Missing values are ignored.
+# Returns the sorted values and the first position and number of values of every period (as columns).
+def _sort_periods(values, period, n_periods):
+    values = np.asarray(values, dtype=np.float64)
+    period = np.asarray(period, dtype=np.int64)
+    valid = (period >= 0) & ~np.isnan(values)
+    order = np.lexsort((values[valid], period[valid]))
+    count = np.bincount(period[valid], minlength=n_periods)
+    return values[valid][order], (np.cumsum(count) - count)[:, None], count[:, None]
+
+# Interpolates between the sorted values below and above a position of every period: Inputs - output of
+# _sort_periods, integer position below and weight of the value above ((periods, quantiles) arrays)
+# Same interpolation as np.quantile's linear method, NaN for periods without values.
+def _interpolate(sorted_values, start, count, below, gamma):
+    if len(sorted_values) == 0:
+        return np.full(below.shape, np.nan)
+    last = np.maximum(count - 1, 0)
+    below = np.clip(below, 0, last)
+    above = np.minimum(below + 1, last)
+    a = sorted_values[np.minimum(start + below, len(sorted_values) - 1)]
+    b = sorted_values[np.minimum(start + above, len(sorted_values) - 1)]
+    diff = b - a
+    result = np.where(gamma >= 0.5, b - diff*(1 - gamma), a + diff*gamma)
+    return np.where(count > 0, result, np.nan)
+
+# Computes quantiles of every period from one sort of all the values: Inputs - values, period code of every value
+# (-1 excludes the value), number of periods and quantiles (fractions between 0 and 1)
+# Same result as np.quantile (and so the bins of pd.qcut), floating point positions included. Missing values are
+# ignored. Returns a (periods, quantiles) array, NaN for periods without values.
+def period_quantiles(values, period, n_periods, quantiles):
+    sorted_values, start, count = _sort_periods(values, period, n_periods)
+    q = np.asarray(quantiles, dtype=np.float64)[None, :]
+    # Virtual index of np.quantile's linear method, (n - 1)*q written the same way so that the positions agree
+    index = (count - 1)*q
+    below = np.floor(index)
+    return _interpolate(sorted_values, start, count, below.astype(np.int64), index - below)
+
+# Computes whole-percent percentiles of every period from one sort of all the values: Inputs - values, period code
+# of every value (-1 excludes the value), number of periods and percents (integers between 0 and 100)
+# The position percent*(n-1)/100 is computed in integers, so a percentile that falls on a value is exactly that
+# value (a value equal to a breakpoint is always in the lower portfolio). Returns a (periods, percents) array.
+def period_percentiles(values, period, n_periods, percents):
+    sorted_values, start, count = _sort_periods(values, period, n_periods)
+    position = np.asarray(percents, dtype=np.int64)[None, :]*np.maximum(count - 1, 0)
+    return _interpolate(sorted_values, start, count, position//100, (position % 100)/100)
+
+# Assigns every value to the interval of its period's breakpoints in one vectorized binary search: Inputs - values,
+# period code of every value (-1 for none), (periods, breakpoints) array with ascending breakpoints per row and the
+# labels of the len(breakpoints) + 1 intervals
+# Intervals are closed on the right like pd.cut with -inf and inf added at the ends, but repeated breakpoints leave
+# an empty interval instead of raising. Missing values, values without a period and periods with a missing
+# breakpoint get no label.
+# Returns an ordered categorical with the labels as categories (the output of pd.cut).
+def assign_breakpoints(values, period, breakpoints, labels):
+    values = np.asarray(values, dtype=np.float64)
+    period = np.asarray(period, dtype=np.int64)
+    breakpoints = np.asarray(breakpoints, dtype=np.float64)
+    labels = list(labels)
+    n_breaks = breakpoints.shape[1]
+    if len(labels) != n_breaks + 1:
+        raise ValueError("Need " + str(n_breaks + 1) + " labels for " + str(n_breaks) + " breakpoints")
+
+    # Position = number of breakpoints of the period strictly below the value, searched for all values at once
+    row = np.maximum(period, 0)
+    lo = np.zeros(len(values), dtype=np.int64)
+    hi = np.full(len(values), n_breaks, dtype=np.int64)
+    for _ in range(int(np.ceil(np.log2(n_breaks + 1)))):
+        mid = (lo + hi)//2
+        active = lo < hi
+        below = breakpoints[row, np.minimum(mid, n_breaks - 1)] < values
+        lo = np.where(active & below, mid + 1, lo)
+        hi = np.where(active & ~below, mid, hi)
+
+    missing = (period < 0) | np.isnan(values)
+    if len(breakpoints) > 0:
+        missing |= np.isnan(breakpoints).any(axis=1)[row]
+    codes = np.where(missing, -1, lo)
+    return pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+
+# Assigns the rows of a dataframe to portfolios with per-period breakpoints: Inputs - df, period column, value
+# column, breakpoint table (the period column followed by the breakpoint columns in ascending order) and labels
+# Replaces groupby(period).apply(pd.cut(values, [-inf] + breakpoints of the period + [inf], labels=labels)).
+#   CRSP_COMPU['Size_Port'] = apply_breakpoints(CRSP_COMPU, 'month_id', 'me', NYSE_breakpoints, range(1, 11))
+def apply_breakpoints(df, period_col, value_col, breakpoints, labels):
+    codes, groups = factorize_keys(df, period_col)
+    table = breakpoints.set_index(period_col).reindex(groups[period_col].values)
+    return assign_breakpoints(df[value_col].values, codes, table.values, labels)
+
+# Assigns the rows of a dataframe to equally populated portfolios of every period: Inputs - df, period column,
+# value column, number of portfolios and labels
+# Replaces groupby(period)[value].transform(lambda x: pd.qcut(x, n_portfolios, labels=labels)), the interior
+# quantiles of every period come from one sort of all the values and the rows are labelled by assign_breakpoints.
+def quantile_portfolios(df, period_col, value_col, n_portfolios, labels):
+    codes, groups = factorize_keys(df, period_col)
+    values = df[value_col].values
+    quantiles = np.linspace(0, 1, n_portfolios + 1)[1:-1]
+    return assign_breakpoints(values, codes, period_quantiles(values, codes, len(groups), quantiles), labels)
+
+# Returns the breakpoint column name of a percentile, the name describe() uses ('30%' for 0.3): Inputs - percentile
+def percentile_label(percentile):
+    return str(int(round(100*percentile))) + '%'
+
+# Percentiles as whole percents, unique and ascending, so that np.arange(0.1, 1, 0.1)[2] and 0.3 are both the 30%
+# breakpoint: Inputs - percentiles (fractions)
+def _percent_set(percentiles):
+    return sorted(set(int(round(100*x)) for x in percentiles))
+
+# Computes breakpoint tables of several characteristics: Inputs - df holding the rows of the breakpoint universe
+# (e.g. the NYSE stocks), period column and dict of characteristic column to percentiles
+# Every characteristic is sorted once within all periods and all its percentiles are read off the sorted values, so
+# the size deciles and the size median come from the same pass instead of one groupby describe each. Percentiles are
+# whole percents (the breakpoints of describe up to the last bit).
+# Returns a dict of characteristic to table: the period column followed by one column per percentile (named by
+# percentile_label, ascending), one row per period of the universe.
+#   tables = breakpoint_tables(CRSP_COMPU_NYSE, 'month_id', {'me': [0.1, ..., 0.9], 'bm': [0.3, 0.7]})
+def breakpoint_tables(df, period_col, percentiles):
+    codes, groups = factorize_keys(df, period_col)
+    tables = {}
+    for characteristic, char_percentiles in percentiles.items():
+        percents = _percent_set(char_percentiles)
+        values = period_percentiles(df[characteristic].values, codes, len(groups), percents)
+        table = groups.copy()
+        for j, percent in enumerate(percents):
+            table[str(percent) + '%'] = values[:, j]
+        tables[characteristic] = table
+    return tables
+
+# Computes the cache name of a breakpoint table: Inputs - universe rows, period column, characteristic, percentiles
+# and name of the universe filter. The key hashes the period and characteristic values of the universe rows, so a
+# table is reused only for the same data.
+def breakpoint_cache_name(df, period_col, characteristic, percentiles, universe):
+    digest = hashlib.sha1(json.dumps({'version': BREAKPOINT_VERSION,
+                                      'universe': universe,
+                                      'period': period_col,
+                                      'percents': _percent_set(percentiles)}, sort_keys=True).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df[[period_col, characteristic]], index=False).values.tobytes())
+    return 'breakpoints_' + universe + '_' + characteristic + '_' + digest.hexdigest()[:16]
+
+# Records the use of cached breakpoint tables and evicts the tables that are no longer needed: Inputs - data_dir,
+# dict of cache name to table configuration (universe, characteristic, period column and percentiles) and names of
+# the tables computed in this call. A table is evicted when a newer table of the same configuration was computed
+# (the universe data changed), when it is not in the index (computed by an older version), or when more than
+# BREAKPOINT_CACHE_SIZE tables are cached (least recently used first).
+def _touch_breakpoint_cache(data_dir, configs, built):
+    index_file = os.path.join(data_dir, BREAKPOINT_CACHE_INDEX)
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+
+    now = time.time()
+    replaced = set(configs[x] for x in built)
+    index = {x: index[x] for x in index if index[x]['config'] not in replaced}
+    for name in configs:
+        index[name] = {'config': configs[name], 'version': BREAKPOINT_VERSION, 'used': now}
+    index = {x: index[x] for x in index if index[x]['version'] == BREAKPOINT_VERSION}
+    keep = sorted(index, key=lambda x: index[x]['used'], reverse=True)[:BREAKPOINT_CACHE_SIZE]
+    index = {x: index[x] for x in keep}
+
+    for entry in os.listdir(data_dir):
+        if re.match(r'^breakpoints_.+_[0-9a-f]{16}$', entry) is not None and entry not in index:
+            print("      Evicting cached breakpoints " + entry + " ...")
+            shutil.rmtree(os.path.join(data_dir, entry))
+
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(index_file + '.tmp', index_file)
+
+# Returns the breakpoint tables of several characteristics from the cache, computing and storing only the missing
+# ones: Inputs - universe rows, period column, dict of characteristic to percentiles, name of the universe filter
+# (e.g. 'nyse') and data_dir. Same tables as breakpoint_tables.
+def cached_breakpoint_tables(df, period_col, percentiles, universe, data_dir):
+    names = {x: breakpoint_cache_name(df, period_col, x, percentiles[x], universe) for x in percentiles}
+    missing = {x: percentiles[x] for x in percentiles if not artifact_exists(data_dir, names[x])}
+
+    tables = breakpoint_tables(df, period_col, missing) if len(missing) > 0 else {}
+    for characteristic in percentiles:
+        if characteristic in missing:
+            print("      Computing breakpoints " + names[characteristic] + " ...")
+            save_artifact(tables[characteristic], data_dir, names[characteristic], date_col=None)
+        else:
+            print("      Loading breakpoints " + names[characteristic] + " from the cache ...")
+            tables[characteristic] = load_artifact(data_dir, names[characteristic])
+
+    configs = {names[x]: json.dumps([universe, x, period_col, _percent_set(percentiles[x])]) for x in percentiles}
+    _touch_breakpoint_cache(data_dir, configs, [names[x] for x in missing])
+    return tables
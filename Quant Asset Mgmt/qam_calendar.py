@@ -0,0 +1,64 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Integer month-id calendar used for all monthly alignment, joins and lags
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+# Month id 0 is December 1925, so the first CRSP month (January 1926) is 1. Ids of consecutive months differ by 1,
+# so lags are id - k, and joins on the id are int64 joins instead of datetime (or year and month) joins.
+ORIGIN = np.datetime64('1925-12', 'M')
+
+# Month id column added to the monthly data when it is ingested
+MONTH_ID = 'month_id'
+
+# Converts values to datetime64 once, values already stored as datetime64 are returned as they are:
+# Inputs - dates (datetime64, date objects or strings)
+def to_dates(values):
+    if hasattr(values, 'dtype') and pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values
+    return pd.to_datetime(values)
+
+# Returns the month id of dates: Inputs - dates (datetime64 values, a Series, DatetimeIndex, monthly periods, date
+# objects or strings). Missing dates are not allowed.
+def month_id(dates):
+    if isinstance(getattr(dates, 'dtype', None), pd.PeriodDtype):
+        dates = pd.PeriodIndex(dates).to_timestamp()
+    months = np.asarray(to_dates(dates)).astype('datetime64[M]')
+    if np.isnat(months).any():
+        raise ValueError("Month ids need dates without missing values")
+    return (months - ORIGIN).astype(np.int64)
+
+# Returns the month id of calendar years and months: Inputs - years and months (1 to 12)
+def year_month_id(year, month):
+    return (np.asarray(year, dtype=np.int64) - 1925)*12 + np.asarray(month, dtype=np.int64) - 12
+
+# Returns the calendar year and month (1 to 12) of month ids: Inputs - month ids
+def year_month(ids):
+    months = np.asarray(ids, dtype=np.int64) + 1925*12 + 11
+    return months//12, months % 12 + 1
+
+# Returns the month end dates (datetime64[ns]) of month ids: Inputs - month ids
+def month_end(ids):
+    next_month = ORIGIN + np.asarray(ids, dtype=np.int64) + 1
+    return (next_month.astype('datetime64[D]') - np.timedelta64(1, 'D')).astype('datetime64[ns]')
+
+# Returns the Fama-French portfolio year and month (1 for July to 12 for June) of month ids: Inputs - month ids
+# Portfolios formed in June of year t are held from July of year t to June of year t+1, i.e. portfolio year t.
+def portfolio_year_month(ids):
+    return year_month(np.asarray(ids, dtype=np.int64) - 6)
+
+# Returns the month id of the June in which accounting data of a fiscal year is first used: Inputs - month ids of
+# the fiscal year end dates (Compustat datadate). Fiscal years ending in calendar year t are used from June of t+1.
+def formation_month(fiscal_year_end_ids):
+    return year_month_id(year_month(fiscal_year_end_ids)[0] + 1, 6)
+
+# Adds (or overwrites) the Year and Month columns of a frame from its month id column: Inputs - df
+# The columns are placed right after the month id, the order the monthly tables use (month_id, Year, Month, ...).
+def add_year_month(df, col=MONTH_ID):
+    year, month = year_month(df[col].values)
+    df = df.drop(columns=[x for x in ['Year', 'Month'] if x in df.columns])
+    pos = df.columns.get_loc(col) + 1
+    df.insert(pos, 'Year', year)
+    df.insert(pos + 1, 'Month', month)
+    return df
@@ -0,0 +1,162 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Turnover, trading costs and net-of-cost returns of portfolio backtests
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+from qam_aggregation import factorize_keys
+from qam_stats import return_statistics
+
+# Proportional trading cost, fraction of every dollar traded (10 bps)
+COST_RATE = 0.001
+
+# Market-cap-tiered trading costs: (upper market cap percentile of the month, cost per dollar traded), smallest first
+# The cost falls with size, from 80 bps for the smallest fifth of stocks to 10 bps for the largest fifth.
+COST_TIERS = ((0.2, 0.0080), (0.4, 0.0050), (0.6, 0.0030), (0.8, 0.0020), (1.0, 0.0010))
+
+# Returns the trading cost per dollar traded of every row: Inputs - month index, asset id and market cap of every
+# row, cost model ('proportional' or 'tiered'), proportional rate and tiers
+#   proportional - rate for every row
+#   tiered       - rate of the tier of the stock's market cap percentile among all stocks of the month (a stock in
+#                  several portfolios counts once); rows without a market cap get the highest rate
+def cost_rates(month, asset, market_cap, model='proportional', rate=COST_RATE, tiers=COST_TIERS):
+    if model == 'proportional':
+        return np.full(len(month), rate, dtype=np.float64)
+    if model != 'tiered':
+        raise ValueError("Unknown cost model " + repr(model) + ", expected 'proportional' or 'tiered'")
+
+    month = np.asarray(month, dtype=np.int64)
+    asset = np.asarray(asset, dtype=np.int64)
+    market_cap = np.asarray(market_cap, dtype=np.float64)
+    thresholds = np.array([tier[0] for tier in tiers])
+    tier_rates = np.array([tier[1] for tier in tiers])
+
+    # One row per stock and month
+    pairs, first, inverse = np.unique((month - month.min())*(asset.max() + 1) + asset - asset.min(),
+                                      return_index=True, return_inverse=True)
+    pair_month = month[first]
+    pair_cap = market_cap[first]
+
+    # Percentile of the market cap within the month (missing caps sort last and are not counted)
+    order = np.lexsort((pair_cap, pair_month))
+    months, month_start = np.unique(pair_month[order], return_index=True)
+    month_pos = np.searchsorted(months, pair_month[order])
+    n_valid = np.bincount(month_pos, ~np.isnan(pair_cap[order]), len(months))
+    percentile = np.empty(len(pairs))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentile[order] = (np.arange(len(pairs)) - month_start[month_pos] + 1)/n_valid[month_pos]
+
+    tier = np.minimum(np.searchsorted(thresholds, percentile, side='left'), len(tiers) - 1)
+    pair_rate = np.where(np.isnan(pair_cap), tier_rates.max(), tier_rates[tier])
+    return pair_rate[inverse.ravel()]
+
+# Computes the turnover and trading cost of every portfolio and month from holdings: Inputs - portfolio code,
+# month index (consecutive months differ by 1), asset id, weight, return and cost per dollar traded of every holding
+# The holdings of the previous month drift with their returns to w*(1+r)/(1+portfolio return) and the trades are the
+# differences to the new weights, matched by one sort of (portfolio, month, asset) instead of a loop over months.
+# The first month of a portfolio (or the first after a gap) buys all its holdings. Missing returns count as zero.
+# Returns a dataframe with portfolio, month, Turnover (one-way, half the sum of absolute trades) and Cost (sum of
+# absolute trades times their cost).
+def portfolio_turnover(portfolio, month, asset, weight, ret, rate):
+    portfolio = np.asarray(portfolio, dtype=np.int64)
+    month = np.asarray(month, dtype=np.int64)
+    asset = np.asarray(asset, dtype=np.int64)
+    weight = np.asarray(weight, dtype=np.float64)
+    ret = np.nan_to_num(np.asarray(ret, dtype=np.float64))
+    rate = np.asarray(rate, dtype=np.float64)
+
+    # Portfolio-month key, leaving room for the month after the last one
+    first_month = month.min()
+    month = month - first_month
+    span = month.max() + 2
+    key = portfolio*span + month
+    held_keys, held = np.unique(key, return_inverse=True)
+    held = held.ravel()
+
+    # Drifted weights of every holding at the start of the next month, kept only if the portfolio exists then
+    port_ret = np.bincount(held, weight*ret, len(held_keys))
+    drifted = weight*(1 + ret)/(1 + port_ret[held])
+    next_key = key + 1
+    carried = np.isin(next_key, held_keys)
+
+    # Trades: new weights minus drifted weights, summed over the rows of each (portfolio, month, asset)
+    # New holdings sort first, so a trade is charged the cost of the holding it trades into when there is one
+    trade_key = np.concatenate([key, next_key[carried]])
+    trade_asset = np.concatenate([asset, asset[carried]])
+    new = np.concatenate([np.zeros(len(key), dtype=np.int8), np.ones(carried.sum(), dtype=np.int8)])
+    order = np.lexsort((new, trade_asset, trade_key))
+    signed = np.concatenate([weight, -drifted[carried]])[order]
+    trade_rate = np.concatenate([rate, rate[carried]])[order]
+    trade_key = trade_key[order]
+    trade_asset = trade_asset[order]
+
+    start = np.flatnonzero(np.concatenate([[True], (trade_key[1:] != trade_key[:-1]) |
+                                                   (trade_asset[1:] != trade_asset[:-1])]))
+    traded = np.abs(np.add.reduceat(signed, start))
+    group = np.searchsorted(held_keys, trade_key[start])
+
+    return pd.DataFrame({'portfolio': held_keys//span,
+                         'month': held_keys % span + first_month,
+                         'Turnover': np.bincount(group, traded, len(held_keys))/2,
+                         'Cost': np.bincount(group, traded*trade_rate[start], len(held_keys))})
+
+# Turnover and trading costs of value-weighted portfolios given as a stock panel (the layout grouped_weighted_mean
+# aggregates): Inputs - df, month id column, portfolio column(s), stock id, return and weight columns, cost model,
+# proportional rate and tiers (the tiers rank the weight column, the lagged market cap, within every month)
+# Returns one row per month and portfolio with the month id and portfolio columns, Turnover and Cost.
+#   costs = value_weighted_turnover(CRSP_PORT, 'month_id', ['Size_Port'], 'permno', 'ret', 'vw', 'tiered')
+def value_weighted_turnover(df, month_col, port_cols, id_col, ret_col, weight_col, cost_model='proportional',
+                            cost_rate=COST_RATE, cost_tiers=COST_TIERS):
+    codes, groups = factorize_keys(df, [month_col] + list(port_cols))
+    port_codes, _ = factorize_keys(df, port_cols)
+    mv = df[weight_col].values.astype(np.float64)
+    valid = (codes >= 0) & (mv > 0)
+
+    # Value weights within every date and portfolio
+    w_sum = np.bincount(codes[valid], mv[valid], len(groups))
+    month = df[month_col].values.astype(np.int64)[valid]
+    asset = df[id_col].values.astype(np.int64)[valid]
+    rate = cost_rates(month, asset, mv[valid], cost_model, cost_rate, cost_tiers)
+    costs = portfolio_turnover(port_codes[valid], month, asset, mv[valid]/w_sum[codes[valid]],
+                               df[ret_col].values[valid], rate)
+
+    # Back to the month and portfolio columns
+    groups['_port'] = -1
+    groups['_month'] = -1
+    groups.loc[codes[valid], '_port'] = port_codes[valid]
+    groups.loc[codes[valid], '_month'] = month
+    costs = costs.rename(columns={'portfolio': '_port', 'month': '_month'})
+    return groups.merge(costs, how='left', on=['_port', '_month']).drop(columns=['_port', '_month'])
+
+# Turnover and trading costs of a portfolio of a few assets given as a weight matrix, e.g. the stock and bond
+# positions of the risk parity portfolios: Inputs - month index of every row, weights and returns (months x assets)
+# and cost per dollar traded. Assets with a missing weight are not held.
+# Returns the Turnover and Cost of every row.
+def dense_turnover(month, weights, returns, rate=COST_RATE):
+    month = np.asarray(month, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    rows, assets = np.nonzero(~np.isnan(weights))
+    costs = portfolio_turnover(np.zeros(len(rows)), month[rows], assets, weights[rows, assets],
+                               np.asarray(returns, dtype=np.float64)[rows, assets], np.full(len(rows), rate))
+    turnover = np.full(len(month), np.nan)
+    cost = np.full(len(month), np.nan)
+    pos = pd.Index(month).get_indexer(costs['month'].values)
+    turnover[pos] = costs['Turnover'].values
+    cost[pos] = costs['Cost'].values
+    return turnover, cost
+
+# Gross and net of cost performance of portfolios side by side: Inputs - gross excess returns, trading costs and
+# one-way turnover (months x portfolios dataframes with the same columns)
+# Returns one row per portfolio with the annualized gross and net excess returns and Sharpe ratios, the average
+# monthly turnover and the annual trading cost, returns and costs in %.
+def net_of_cost_summary(gross, cost, turnover):
+    gross_stats = return_statistics(gross.values)
+    net_stats = return_statistics(gross.values - cost.values)
+    return pd.DataFrame({'Gross Excess Return': gross_stats['mean'],
+                         'Net Excess Return': net_stats['mean'],
+                         'Gross Sharpe Ratio': gross_stats['sharpe'],
+                         'Net Sharpe Ratio': net_stats['sharpe'],
+                         'Monthly Turnover': 100*np.nanmean(turnover.values, axis=0),
+                         'Annual Cost': 100*12*np.nanmean(cost.values, axis=0)},
+                        index=gross.columns)
@@ -0,0 +1,306 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Shared CRSP stock cleaning engine
+# Akhil Srivastava
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from qam_calendar import month_id, month_end
+from qam_storage import (append_artifact, artifact_columns, artifact_exists, artifact_fingerprint, artifact_path,
+                         load_artifact, save_artifact)
+
+# Version of the cleaning logic, bump it whenever clean_crsp_stocks changes so that cached panels are rebuilt
+CLEAN_VERSION = 5
+
+# Parameters applied when a cached panel is loaded instead of when it is cleaned. The date cap and the dropped
+# columns do not change the rows up to the cap (every cleaning step only looks back), so they are not part of the
+# cache key: scripts that only differ in them share one cached panel, and moving the cap keeps the cache valid.
+REPORT_PARAMS = ['max_date', 'drop_cols']
+
+# Index of the cached panels (cache key inputs and last use) kept in data_dir, and the number of panels kept
+CLEAN_CACHE_INDEX = 'crsp_clean_cache.json'
+CLEAN_CACHE_SIZE = 4
+
+# Columns of the lag state: last consolidated row of every permno
+LAG_STATE_COLUMNS = ['permno', 'date', 'me', 'count']
+
+# Number of trailing cleaned rows per permno kept for incremental updates
+# (t-12 to t-2 momentum ranking returns and one Fama-French portfolio year of value weights)
+TAIL_ROWS = 12
+
+# Consolidates multi-class firms in a single sorted pass: Inputs - CRSP_Stocks with month_id, permco, permno and me
+# For every month and permco the permno with the largest me is kept (lowest permno on ties) and its me is replaced
+# by the sum of me across all the permnos of the permco. Rows without a permco are dropped.
+def consolidate_permco_me(CRSP_Stocks):
+    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['permco'].notna()]
+
+    month = CRSP_Stocks['month_id'].values
+    permco = CRSP_Stocks['permco'].to_numpy(dtype=np.int64)
+    me = CRSP_Stocks['me'].values.astype(np.float64)
+
+    # Sort by month, permco, descending me (missing me last) and permno, so the first row of a group has the largest me
+    me_desc = np.where(np.isnan(me), np.inf, -me)
+    order = np.lexsort((CRSP_Stocks['permno'].values, me_desc, permco, month))
+
+    # Group boundaries are the rows where month or permco changes
+    month = month[order]
+    permco = permco[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (month[1:] != month[:-1]) | (permco[1:] != permco[:-1])
+    starts = np.flatnonzero(first)
+
+    # Sum me over each group (missing me counts as zero, same as groupby sum)
+    me_sum = np.add.reduceat(np.nan_to_num(me[order]), starts) if len(starts) > 0 else np.empty(0)
+
+    # Keep the representative row of each group with the cumulative me as the last column
+    CRSP_Stocks = CRSP_Stocks.iloc[order[starts]].drop(['me'], axis=1)
+    CRSP_Stocks['me'] = me_sum
+
+    return CRSP_Stocks.sort_values(by=['permno', 'month_id']).reset_index(drop=True)
+
+# Cleans merged CRSP stock returns and delisting returns: Inputs - CRSP_Stocks (processed msf + msedelist merge)
+#   exchcd_set, shrcd_set - exchange and share codes to keep (delisting rows are always kept)
+#   min_date, max_date    - optional month-end date range
+#   me_scale              - multiplier applied to |prc|*shrout (1e-3 for USD millions, 1e-6 for USD billions)
+#   delisting             - 'compound' to compound ret with dlret (dlret alone if ret is missing), 'ignore' to use ret only
+#   drop_cols             - columns dropped once market equity has been computed
+# Returns one row per permno and month with the delisting-adjusted ret, permco aggregated me and lagged me (lme)
+def clean_crsp_stocks(CRSP_Stocks, exchcd_set, shrcd_set, min_date=None, max_date=None, me_scale=1e-3,
+                      delisting='compound', drop_cols=None):
+    return _clean_crsp_stocks(CRSP_Stocks, None, exchcd_set, shrcd_set, min_date, max_date, me_scale,
+                              delisting, drop_cols)[0]
+
+# Cleaning steps shared by full builds and incremental updates: Inputs - CRSP_Stocks, lag_state and the
+# clean_crsp_stocks parameters. Returns the cleaned rows and the updated lag state
+def _clean_crsp_stocks(CRSP_Stocks, lag_state, exchcd_set, shrcd_set, min_date=None, max_date=None, me_scale=1e-3,
+                       delisting='compound', drop_cols=None):
+    # Month id of every row (the key of all monthly joins and lags), dates moved to the last day of the month
+    # Rows without a date never pass the date filters, drop them before computing the month ids
+    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['date'].notna()].copy()
+    CRSP_Stocks['month_id'] = month_id(CRSP_Stocks['date'])
+    CRSP_Stocks['date'] = month_end(CRSP_Stocks['month_id'].values)
+    # Sort again as we changed date values
+    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno', 'month_id']).reset_index(drop=True).copy()
+
+    # exchcd/shrcd are nan for delisted returns, so filtering rows on required exchcd/shrcd removes delisted return rows
+    # dlstcd is not-nan for all the delisted return rows, so it has been used as a proxy to identify delisted return rows
+    # Rows with unrequired exchcd/shrcd are removed only if those are non delisted return row
+    CRSP_Stocks = CRSP_Stocks[(CRSP_Stocks['dlstcd'].notna()) |
+                              ((CRSP_Stocks['dlstcd'].isna()) & (CRSP_Stocks['exchcd'].isin(exchcd_set)))]
+
+    CRSP_Stocks = CRSP_Stocks[(CRSP_Stocks['dlstcd'].notna()) |
+                              ((CRSP_Stocks['dlstcd'].isna()) & (CRSP_Stocks['shrcd'].isin(shrcd_set)))]
+
+    # Filter dates
+    if min_date is not None:
+        CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['date'] >= min_date]
+    if max_date is not None:
+        CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['date'] <= max_date]
+    CRSP_Stocks = CRSP_Stocks.copy()
+
+    # Calculate market equity
+    # Use absolute price because if price is bid/ask average it has a negative sign to indicate so
+    # Computed in float64 even if prices and shares are stored in a compact (or nullable integer) dtype
+    CRSP_Stocks['me'] = CRSP_Stocks['prc'].abs().astype(np.float64)*CRSP_Stocks['shrout'].astype(np.float64)*me_scale
+
+    # Drop unrequired columns
+    if drop_cols is not None and len(drop_cols) > 0:
+        CRSP_Stocks.drop(drop_cols, axis=1, inplace=True)
+
+    # Adjust for Delisting Returns
+    if delisting == 'compound':
+        # Use compounded return if both return and delisted return are available
+        CRSP_Stocks['ret'] = np.where(CRSP_Stocks['ret'].notna() & CRSP_Stocks['dlret'].notna(),
+                                      (1 + CRSP_Stocks['ret'])*(1 + CRSP_Stocks['dlret']) - 1,
+                                      CRSP_Stocks['ret'])
+        # Use delisted return if return is not available but delited return is
+        CRSP_Stocks['ret'] = np.where(CRSP_Stocks['ret'].isna() & CRSP_Stocks['dlret'].notna(),
+                                      CRSP_Stocks['dlret'],
+                                      CRSP_Stocks['ret'])
+    elif delisting != 'ignore':
+        raise ValueError("Unknown delisting policy: " + str(delisting))
+
+    # Drop missing returns
+    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['ret'].notna()].copy()
+    # Reset index
+    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno', 'month_id']).reset_index(drop=True).copy()
+
+    # Aggregate Market Cap. computation
+    # Keep one row per date and permco holding the permco's cumulative market-cap
+    CRSP_Stocks = consolidate_permco_me(CRSP_Stocks)
+
+    # lagged Market Cap. computation
+    CRSP_Stocks, lag_state = add_lagged_me(CRSP_Stocks, lag_state)
+
+    return CRSP_Stocks, lag_state
+
+# Adds lagged market cap (lme) to a consolidated panel: Inputs - CRSP_Stocks (one row per permno and month) and
+# lag_state (last consolidated row of every permno seen so far, None for a full build)
+# Returns the panel without rows missing lme and the updated lag state
+def add_lagged_me(CRSP_Stocks, lag_state=None):
+    # Add column with lagged market cap
+    CRSP_Stocks['lme'] = CRSP_Stocks.groupby(['permno'])['me'].shift(1)
+    # If a permno is the first permno, use me/(1+retx) to replace the missing value
+    CRSP_Stocks['1+retx'] = 1 + CRSP_Stocks['retx']
+    CRSP_Stocks['count'] = CRSP_Stocks.groupby(['permno']).cumcount()
+    if lag_state is not None:
+        # Permnos already in the state continue from their last known me and row count
+        state = lag_state.set_index('permno')
+        known = (CRSP_Stocks['count'] == 0) & CRSP_Stocks['permno'].isin(state.index)
+        CRSP_Stocks.loc[known, 'lme'] = CRSP_Stocks.loc[known, 'permno'].map(state['me']).values
+        CRSP_Stocks['count'] = CRSP_Stocks['count'] + \
+            CRSP_Stocks['permno'].map(state['count'] + 1).fillna(0).astype(np.int64)
+    CRSP_Stocks['lme'] = np.where(CRSP_Stocks['count'] == 0, CRSP_Stocks['me']/CRSP_Stocks['1+retx'], CRSP_Stocks['lme'])
+
+    # Keep the last row of every permno (before dropping missing lme, its me is the next month's lme)
+    lag_state_new = CRSP_Stocks.groupby(['permno']).tail(1)[LAG_STATE_COLUMNS]
+    if lag_state is not None:
+        lag_state_new = pd.concat([lag_state[~lag_state['permno'].isin(lag_state_new['permno'])], lag_state_new])
+    lag_state_new = lag_state_new.sort_values(by=['permno']).reset_index(drop=True)
+
+    # Drop missing lme
+    CRSP_Stocks = CRSP_Stocks[CRSP_Stocks['lme'].notna()].copy()
+    # Reset index
+    CRSP_Stocks = CRSP_Stocks.sort_values(by=['permno', 'month_id']).reset_index(drop=True).copy()
+
+    # Data integrity checkes
+    assert (CRSP_Stocks['ret'] == -66).any() == False
+    assert (CRSP_Stocks['ret'] == -77).any() == False
+    assert (CRSP_Stocks['ret'] == -88).any() == False
+    assert (CRSP_Stocks['ret'] == -99).any() == False
+    assert CRSP_Stocks['ret'].isna().any() == False
+    assert CRSP_Stocks['lme'].isna().any() == False
+
+    return CRSP_Stocks, lag_state_new
+
+# Splits the clean_crsp_stocks parameters into the cleaning parameters and the report parameters: Inputs - params
+def _split_params(params):
+    clean_params = {x: params[x] for x in params if x not in REPORT_PARAMS}
+    report_params = {x: params.get(x) for x in REPORT_PARAMS}
+    return clean_params, report_params
+
+# Hashes a json-serializable cache key: Inputs - key
+def _hash_key(key):
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+# Computes the cache key of a cleaned panel: Inputs - data_dir, source artifact names and cleaning parameters
+# (report parameters are ignored)
+def clean_cache_key(data_dir, source_names, params):
+    key = {'version': CLEAN_VERSION,
+           'sources': {x: artifact_fingerprint(data_dir, x) for x in source_names},
+           'params': _split_params(params)[0]}
+    return _hash_key(key)
+
+# Returns the cache name of a cleaned panel: Inputs - data_dir, source artifact names and cleaning parameters
+def clean_cache_name(data_dir, source_names, params):
+    return 'crsp_clean_' + clean_cache_key(data_dir, source_names, params)
+
+# Applies the report parameters to cleaned rows: Inputs - cleaned rows and report parameters
+def _report_rows(CRSP_Clean, max_date=None, drop_cols=None):
+    if max_date is not None:
+        CRSP_Clean = CRSP_Clean[CRSP_Clean['date'] <= max_date].reset_index(drop=True)
+    if drop_cols is not None and len(drop_cols) > 0:
+        CRSP_Clean = CRSP_Clean.drop(drop_cols, axis=1)
+    return CRSP_Clean
+
+# Records the use of a cached panel and evicts the panels that are no longer needed: Inputs - data_dir, cache name,
+# source artifact names and cleaning parameters. A panel is evicted when a newer panel was built from the same
+# sources and parameters (the source data changed), when it is not in the index (built by an older version), or
+# when more than CLEAN_CACHE_SIZE panels are cached (least recently used first).
+def _touch_clean_cache(data_dir, name, source_names, params, built=False):
+    index_file = os.path.join(data_dir, CLEAN_CACHE_INDEX)
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+
+    config = _hash_key({'sources': sorted(source_names), 'params': _split_params(params)[0]})
+    if built == True:
+        index = {x: index[x] for x in index if index[x]['config'] != config}
+    index[name] = {'config': config, 'version': CLEAN_VERSION, 'used': time.time()}
+    index = {x: index[x] for x in index if index[x]['version'] == CLEAN_VERSION}
+    keep = sorted(index, key=lambda x: index[x]['used'], reverse=True)[:CLEAN_CACHE_SIZE]
+    index = {x: index[x] for x in keep}
+
+    # Remove the evicted panels with their lag state and trailing rows
+    for entry in os.listdir(data_dir):
+        match = re.match(r'^(crsp_clean_[0-9a-f]{16})(_lag|_tail)?$', entry)
+        if match is not None and match.group(1) not in index:
+            print("      Evicting cached CRSP panel " + entry + " ...")
+            shutil.rmtree(os.path.join(data_dir, entry))
+
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(index_file + '.tmp', index_file)
+
+# Returns the last TAIL_ROWS rows of every permno: Inputs - cleaned panel sorted by permno and date
+def tail_rows(CRSP_Clean):
+    return CRSP_Clean.groupby(['permno']).tail(TAIL_ROWS).reset_index(drop=True)
+
+# Returns the cleaned CRSP panel from the cache, rebuilding it only if the sources or the parameters changed:
+# Inputs - data_dir, names of the source artifacts the panel depends on,
+#          load_source (callable returning the frame to clean, only called on a cache miss)
+#          and the clean_crsp_stocks parameters
+# The cache holds every month and column of the sources, max_date and drop_cols are applied when the panel is loaded.
+# The lag state and the trailing rows of every permno are stored next to the panel for update_clean_crsp_stocks.
+def cached_clean_crsp_stocks(data_dir, source_names, load_source, **params):
+    name = clean_cache_name(data_dir, source_names, params)
+    clean_params, report_params = _split_params(params)
+
+    if artifact_exists(data_dir, name):
+        print("      Loading cleaned CRSP panel " + name + " from the cache ...")
+        _touch_clean_cache(data_dir, name, source_names, params)
+        drop_cols = report_params['drop_cols'] or []
+        columns = [x for x in artifact_columns(data_dir, name) if x not in drop_cols]
+        return load_artifact(data_dir, name, columns=columns, end=report_params['max_date'])
+
+    print("      Cleaning CRSP panel " + name + " ...")
+    CRSP_Clean, lag_state = _clean_crsp_stocks(load_source(), None, **clean_params)
+    save_artifact(CRSP_Clean, data_dir, name)
+    save_artifact(lag_state, data_dir, name + '_lag', date_col=None)
+    save_artifact(tail_rows(CRSP_Clean), data_dir, name + '_tail', date_col=None)
+    _touch_clean_cache(data_dir, name, source_names, params, built=True)
+
+    return _report_rows(CRSP_Clean, **report_params)
+
+# Cleans newly arrived rows and appends them to the cached cleaned panel without reprocessing the history:
+# Inputs - data_dir, names of the source artifacts, delta (new rows in the format returned by load_source),
+#          append_sources (callable appending the new raw rows to the source artifacts) and the cleaning parameters
+# Returns the new cleaned rows and the trailing rows of every permno before the update, so that callers can
+# recompute row window statistics (ranking returns, value weights) of the new rows exactly as a full rebuild would.
+# The cached panel takes every new month, the returned rows are capped at max_date like a loaded panel.
+def update_clean_crsp_stocks(data_dir, source_names, delta, append_sources, **params):
+    name = clean_cache_name(data_dir, source_names, params)
+    clean_params, report_params = _split_params(params)
+    if not artifact_exists(data_dir, name + '_lag'):
+        raise RuntimeError("Cleaned CRSP panel " + name + " is not cached, run a full build first")
+
+    # Clean only the new rows, continuing from the state of the cached panel
+    lag_state = load_artifact(data_dir, name + '_lag')
+    tail = load_artifact(data_dir, name + '_tail')
+    CRSP_New, lag_state = _clean_crsp_stocks(delta, lag_state, **clean_params)
+
+    # Append the raw rows to the sources, which changes the cache key of the panel
+    append_sources()
+    new_name = clean_cache_name(data_dir, source_names, params)
+    print("      Appending {} rows to cleaned CRSP panel {} ...".format(len(CRSP_New), new_name))
+
+    # Move the cached panel to its new key and append the new rows and the updated state
+    for suffix in ['', '_lag', '_tail']:
+        if os.path.exists(artifact_path(data_dir, new_name + suffix)):
+            shutil.rmtree(artifact_path(data_dir, new_name + suffix))
+        os.replace(artifact_path(data_dir, name + suffix), artifact_path(data_dir, new_name + suffix))
+    append_artifact(CRSP_New, data_dir, new_name)
+    save_artifact(lag_state, data_dir, new_name + '_lag', date_col=None)
+    new_tail = pd.concat([tail, CRSP_New], ignore_index=True).sort_values(by=['permno', 'month_id'], kind='mergesort')
+    save_artifact(tail_rows(new_tail), data_dir, new_name + '_tail', date_col=None)
+    _touch_clean_cache(data_dir, new_name, source_names, params, built=True)
+
+    return _report_rows(CRSP_New, **report_params), _report_rows(tail, **report_params)
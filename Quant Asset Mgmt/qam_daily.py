@@ -0,0 +1,237 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Memory-mapped columnar panel for daily CRSP data and out-of-core daily index returns
+# Akhil Srivastava
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from qam_calendar import month_id, year_month
+
+# Daily CRSP stock file with the share and exchange codes valid on each day (same join as the monthly msf query)
+DAILY_STOCK_QUERY = """select a.permno, a.date, b.shrcd, b.exchcd, a.ret, a.shrout, a.prc
+                       from crspq.dsf as a
+                       left join crspq.dsenames as b
+                       on a.permno=b.permno and b.namedt<=a.date and a.date<=b.nameendt
+                       where a.date between '{start}' and '{end}'"""
+
+# Daily CRSP treasury file, kytreasno is the integer id of the issue (one-to-one with kycrspid)
+DAILY_BOND_QUERY = """select kytreasno, caldt, tdretnua, tdtotout from crspq.tfz_dly
+                      where caldt between '{start}' and '{end}'"""
+
+# Column dtypes of the daily panels. Integer codes are stored as -1 when missing, dates as datetime64[D].
+DAILY_STOCK_SCHEMA = {'permno': 'int32', 'date': 'datetime64[D]', 'shrcd': 'int8', 'exchcd': 'int8',
+                      'ret': 'float64', 'shrout': 'float32', 'prc': 'float32'}
+DAILY_BOND_SCHEMA = {'kytreasno': 'int32', 'caldt': 'datetime64[D]', 'tdretnua': 'float64', 'tdtotout': 'float64'}
+
+# Rows per block when streaming a panel (the stock index needs about 200 bytes of working memory per block row)
+BLOCK_ROWS = 1000000
+
+# Metadata file of a panel (schema, number of rows and ingested partitions)
+META_FILE = '_panel.json'
+
+# Converts a dataframe column to the panel dtype of the column: Inputs - column values and dtype
+def _to_column(values, dtype):
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'M':
+        return pd.to_datetime(values).values.astype(dtype)
+    if dtype.kind in 'iu':
+        return pd.Series(values).fillna(-1).values.astype(dtype)
+    return np.asarray(values, dtype=dtype)
+
+# Append-only columnar panel stored as one raw binary file per column plus a metadata file, read back as numpy
+# memory maps, so a panel much larger than RAM can be streamed block by block: Inputs - panel directory
+# Rows are appended in the order they will be read (the daily panels are sorted by date, then id).
+#   panel = ColumnarPanel.create(os.path.join(data_dir, 'dscrsp_panel'), DAILY_STOCK_SCHEMA)
+#   panel.append(df)
+#   for block in panel.blocks(['permno', 'ret']): ...
+class ColumnarPanel:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.schema = meta['schema']
+        self.rows = meta['rows']
+        self.partitions = meta['partitions']
+
+    # Creates an empty panel: Inputs - panel directory and schema (column to dtype)
+    @classmethod
+    def create(cls, path, schema):
+        os.makedirs(path, exist_ok=True)
+        for col in schema:
+            open(cls._column_file(path, col), 'wb').close()
+        cls._write_meta(path, {'schema': dict(schema), 'rows': 0, 'partitions': []})
+        return cls(path)
+
+    # Opens the panel at path, or creates it if it does not exist yet: Inputs - panel directory and schema
+    @classmethod
+    def open_or_create(cls, path, schema):
+        if os.path.exists(os.path.join(path, META_FILE)):
+            panel = cls(path)
+            if panel.schema != dict(schema):
+                raise ValueError("Panel " + path + " was created with a different schema")
+            return panel
+        return cls.create(path, schema)
+
+    @staticmethod
+    def _column_file(path, col):
+        return os.path.join(path, col + '.bin')
+
+    # The metadata is replaced atomically, so the panel is always described by the last finished append
+    @staticmethod
+    def _write_meta(path, meta):
+        tmp_file = os.path.join(path, META_FILE + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_file, os.path.join(path, META_FILE))
+
+    # Appends the rows of a dataframe: Inputs - df with every schema column and the name of the ingested partition
+    # Column files are written first and the row count last, so rows written by an append that did not finish are
+    # ignored and overwritten by the next append.
+    def append(self, df, partition=None):
+        for col, dtype in self.schema.items():
+            values = _to_column(df[col], dtype)
+            with open(self._column_file(self.path, col), 'r+b') as f:
+                f.truncate(self.rows*values.dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+                values.tofile(f)
+        self.rows += len(df)
+        if partition is not None:
+            self.partitions.append(partition)
+        self._write_meta(self.path, {'schema': self.schema, 'rows': self.rows, 'partitions': self.partitions})
+
+    # Returns a read-only memory map of rows [start, end) of a column: Inputs - column name and row range
+    def column(self, col, start=0, end=None):
+        end = self.rows if end is None else min(end, self.rows)
+        dtype = np.dtype(self.schema[col])
+        if end <= start:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._column_file(self.path, col), dtype=dtype, mode='r', offset=start*dtype.itemsize,
+                         shape=(end - start,))
+
+    # Yields dicts of column name to the in-memory values of consecutive row blocks: Inputs - columns and block rows
+    # Every block is mapped, copied and unmapped, so pages of blocks already read do not stay in the resident memory.
+    def blocks(self, columns, block_rows=BLOCK_ROWS):
+        for start in range(0, self.rows, block_rows):
+            yield {col: np.array(self.column(col, start, start + block_rows)) for col in columns}
+
+# Downloads a query partition by partition straight into a columnar panel: Inputs - connection factory,
+# query template with {start} and {end} placeholders, list of (start, end) partitions in date order, panel
+# directory, schema and sort columns (date first)
+# Only one partition is held in memory. Ingested partitions are recorded in the panel, so a rerun after a dropped
+# WRDS session continues with the first missing partition.
+def ingest_partitioned(connect, query, partitions, panel_dir, schema, sort_cols):
+    panel = ColumnarPanel.open_or_create(panel_dir, schema)
+    date_col = sort_cols[0]
+    last_date = panel.column(date_col, panel.rows - 1)[0] if panel.rows > 0 else None
+    conn = None
+    try:
+        for start, end in partitions:
+            key = start + ':' + end
+            if key in panel.partitions:
+                continue
+            if conn is None:
+                conn = connect()
+            df = conn.raw_sql(query.format(start=start, end=end))
+            df = df.sort_values(by=sort_cols).reset_index(drop=True)
+            dates = _to_column(df[date_col], schema[date_col])
+            # Readers rely on the panel being sorted by date
+            if last_date is not None and len(dates) > 0 and dates[0] < last_date:
+                raise ValueError("Partition " + key + " starts before the last date already in " + panel_dir)
+            panel.append(df, key)
+            if len(dates) > 0:
+                last_date = dates[-1]
+    finally:
+        if conn is not None:
+            conn.close()
+    return panel
+
+# Computes daily equal- and value-weighted returns of a date-sorted panel one block at a time:
+# Inputs - panel, id, date and return columns, function returning the market value of every row of a block,
+#          function returning the rows of a block included in the index (None includes all) and block rows
+# Weights are the market value of the previous row of the same id (the previous trading day it traded), carried
+# from block to block in an array indexed by id, so memory is bounded by the block size whatever the panel size.
+# Returns a dataframe with date, lag_MV (sum of weights), Ew_Ret and Vw_Ret, one row per date.
+def value_weighted_returns(panel, id_col, date_col, ret_col, market_value, include=None, block_rows=BLOCK_ROWS):
+    columns = list(dict.fromkeys([id_col, date_col, ret_col] + [col for col in panel.schema]))
+    last_me = np.zeros(0)
+    partial = []
+    for block in panel.blocks(columns, block_rows):
+        ids = block[id_col].astype(np.int64)
+        me = np.asarray(market_value(block), dtype=np.float64)
+        if len(ids) > 0 and ids.max() >= len(last_me):
+            last_me = np.concatenate([last_me, np.full(ids.max() + 1 - len(last_me), np.nan)])
+
+        # Previous market value of every row: rows of the same id are consecutive after a stable sort by id
+        order = np.argsort(ids, kind='stable')
+        sorted_ids = ids[order]
+        sorted_me = me[order]
+        first = np.ones(len(ids), dtype=bool)
+        first[1:] = sorted_ids[1:] != sorted_ids[:-1]
+        last = np.ones(len(ids), dtype=bool)
+        last[:-1] = first[1:]
+        sorted_lme = np.empty(len(ids))
+        sorted_lme[1:] = sorted_me[:-1]
+        sorted_lme[first] = last_me[sorted_ids[first]]
+        last_me[sorted_ids[last]] = sorted_me[last]
+        lme = np.empty(len(ids))
+        lme[order] = sorted_lme
+
+        ret = block[ret_col].astype(np.float64)
+        keep = ~np.isnan(ret) & ~np.isnan(lme)
+        if include is not None:
+            keep &= include(block)
+        dates, day = np.unique(block[date_col][keep], return_inverse=True)
+        partial.append(pd.DataFrame({'date': dates,
+                                     'lag_MV': np.bincount(day, lme[keep], len(dates)),
+                                     'wret': np.bincount(day, lme[keep]*ret[keep], len(dates)),
+                                     'ret': np.bincount(day, ret[keep], len(dates)),
+                                     'n': np.bincount(day, minlength=len(dates))}))
+
+    # A date can span two blocks, add up its partial sums
+    daily = pd.concat(partial, ignore_index=True).groupby('date', sort=True).sum().reset_index()
+    daily['Ew_Ret'] = daily['ret']/daily['n']
+    daily['Vw_Ret'] = daily['wret']/daily['lag_MV']
+    daily['date'] = pd.to_datetime(daily['date'])
+    return daily[['date', 'lag_MV', 'Ew_Ret', 'Vw_Ret']]
+
+# Computes the volatility of daily returns over trailing windows of calendar months, in monthly units:
+# Inputs - daily dataframe (date column and return columns), return columns, window in months, lag (lag=1 uses the
+#          days of months i-window to i-1 for month i), trading days per month and minimum days in the window
+# Returns one row per month (month_id, Year, Month and one column per return column), daily std*sqrt(days_per_month), NaN
+# while the window reaches back before the first month of daily data. Works on per-month sums, so it is linear in
+# the number of days.
+def monthly_volatility_from_daily(daily, columns, window=36, lag=1, days_per_month=21, min_days=20):
+    month = month_id(daily['date'])
+    first_month = month.min()
+    month_pos = month - first_month
+    n_months = month_pos.max() + 1
+
+    months = first_month + np.arange(n_months)
+    year, month_of_year = year_month(months)
+    result = pd.DataFrame({'month_id': months, 'Year': year, 'Month': month_of_year})
+    for col in columns:
+        values = daily[col].values.astype(np.float64)
+        valid = ~np.isnan(values)
+        # Center on the full-sample mean so that the sums of squares do not lose precision
+        x = np.where(valid, values - values[valid].mean(), 0)
+        zeros = np.zeros(1)
+        cum_n = np.concatenate([zeros, np.cumsum(np.bincount(month_pos, valid, n_months))])
+        cum_x = np.concatenate([zeros, np.cumsum(np.bincount(month_pos, x, n_months))])
+        cum_xx = np.concatenate([zeros, np.cumsum(np.bincount(month_pos, x*x, n_months))])
+
+        sigma = np.full(n_months, np.nan)
+        rows = np.arange(window + lag - 1, n_months)
+        end = rows - lag + 1
+        start = end - window
+        w_n = cum_n[end] - cum_n[start]
+        w_x = cum_x[end] - cum_x[start]
+        w_xx = cum_xx[end] - cum_xx[start]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var = (w_xx - w_x*w_x/w_n)/(w_n - 1)
+        sigma[rows] = np.where(w_n >= min_days, np.sqrt(np.maximum(var, 0)*days_per_month), np.nan)
+        result[col] = sigma
+
+    return result
@@ -0,0 +1,319 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Daniel-Moskowitz dynamic momentum strategy as a month by month streaming pipeline over daily returns
+# Akhil Srivastava
+
+import hashlib
+import json
+import os
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from qam_aggregation import grouped_weighted_mean
+from qam_calendar import month_end
+
+# Trading days of the variance windows, Daniel and Moskowitz (2016) use the 126 days before the month
+VARIANCE_DAYS = 126
+
+# Months of market returns of the bear market indicator (cumulative market return of the past 24 months below zero)
+BEAR_MONTHS = 24
+
+# Variance of a rolling window of the last n observations kept as a buffer and running sums, so that adding an
+# observation is O(1) and the window never has to be recomputed from the history: Inputs - window length
+class RollingVariance:
+    def __init__(self, window=VARIANCE_DAYS):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    # Adds observations (missing values are skipped) and drops the ones that left the window: Inputs - values
+    def update(self, values):
+        for x in np.asarray(values, dtype=np.float64):
+            if np.isnan(x):
+                continue
+            # A full window drops its oldest value when the new one is appended
+            old = self.values[0] if len(self.values) == self.window else None
+            self.values.append(float(x))
+            self.total += x
+            self.total_sq += x*x
+            if old is not None:
+                self.total -= old
+                self.total_sq -= old*old
+
+    # Returns the sample variance (ddof=1) of the window, NaN until the window is full
+    def variance(self):
+        n = len(self.values)
+        if n < self.window:
+            return np.nan
+        return max((self.total_sq - self.total*self.total/n)/(n - 1), 0.0)
+
+    # Returns the state as plain python values, and rebuilds a window from it
+    def state(self):
+        return {'window': self.window, 'values': list(self.values), 'total': self.total, 'total_sq': self.total_sq}
+
+    @classmethod
+    def from_state(cls, state):
+        rolling = cls(state['window'])
+        rolling.values = deque(state['values'], maxlen=rolling.window)
+        rolling.total = state['total']
+        rolling.total_sq = state['total_sq']
+        return rolling
+
+# Dynamic winner minus loser strategy of Daniel and Moskowitz (2016), "Momentum Crashes", section 5:
+#   w(t) = mu(t)/(2*risk_aversion*sigma2(t))
+#   mu(t)     - expanding-window OLS forecast of WML(t) from I_B(t-1)*sigma2_m(t-1), the bear market indicator times
+#               the market variance of the 126 days before month t
+#   sigma2(t) - variance of the 126 daily WML returns before month t, in monthly units
+# The state (daily windows, last 24 monthly market returns and the regression sums) is updated once per month, so
+# a monthly production run stores it and the next month continues without recomputing the history. The paper
+# scales the weights in-sample to a 19% annual volatility, here the risk aversion is a fixed parameter so that
+# every weight only uses earlier data.
+#   strategy = DynamicMomentum()
+#   row = strategy.update(month_id, daily_wml, daily_market, wml, market)
+class DynamicMomentum:
+    def __init__(self, risk_aversion=1.0, variance_days=VARIANCE_DAYS, bear_months=BEAR_MONTHS, days_per_month=21,
+                 min_months=BEAR_MONTHS):
+        self.risk_aversion = risk_aversion
+        self.variance_days = variance_days
+        self.bear_months = bear_months
+        self.days_per_month = days_per_month
+        self.min_months = min_months
+        self.wml_variance = RollingVariance(variance_days)
+        self.market_variance = RollingVariance(variance_days)
+        # Gross market returns of the last bear_months months
+        self.market_months = []
+        # Regression sums of (x, WML) pairs: n, sum x, sum y, sum x^2, sum xy
+        self.sums = [0, 0.0, 0.0, 0.0, 0.0]
+        # Predictor I_B*sigma2_m at the end of the last month and the last month processed
+        self.predictor = None
+        self.last_month = None
+
+    # Parameters passed to the constructor, stored with the state
+    def params(self):
+        return {'risk_aversion': self.risk_aversion, 'variance_days': self.variance_days,
+                'bear_months': self.bear_months, 'days_per_month': self.days_per_month,
+                'min_months': self.min_months}
+
+    # Returns the forecast mean, variance and weight of WML for the next month, NaN until min_months months of the
+    # regression and a full daily window are available
+    def forecast(self):
+        n, sum_x, sum_y, sum_xx, sum_xy = self.sums
+        sigma2 = self.wml_variance.variance()*self.days_per_month
+        if self.predictor is None or n < max(self.min_months, 2) or np.isnan(sigma2) or sigma2 <= 0:
+            return np.nan, sigma2, np.nan
+
+        # Without a bear market month in the sample the predictor is always zero and mu is the mean WML
+        denominator = n*sum_xx - sum_x*sum_x
+        slope = (n*sum_xy - sum_x*sum_y)/denominator if denominator > 0 else 0.0
+        intercept = (sum_y - slope*sum_x)/n
+        mu = intercept + slope*self.predictor
+        return mu, sigma2, mu/(2*self.risk_aversion*sigma2)
+
+    # Trades one month and updates the state with it: Inputs - month id, daily WML and market returns of the month,
+    # monthly WML and market returns
+    # Returns a dict with the month id, the forecasts and weight set before the month, WML and the dynamic WML return.
+    def update(self, month, daily_wml, daily_market, wml, market):
+        if self.last_month is not None and month <= self.last_month:
+            raise ValueError("Month " + str(month) + " was already processed (last month " +
+                             str(self.last_month) + ")")
+        mu, sigma2, weight = self.forecast()
+        row = {'month_id': month, 'mu': mu, 'sigma2': sigma2, 'weight': weight, 'WML': wml,
+               'Dynamic_WML': weight*wml}
+
+        # The month's WML is the outcome of the predictor known at the end of the previous month
+        if self.predictor is not None and not np.isnan(wml):
+            x = self.predictor
+            self.sums = [self.sums[0] + 1, self.sums[1] + x, self.sums[2] + wml, self.sums[3] + x*x,
+                         self.sums[4] + x*wml]
+
+        self.wml_variance.update(daily_wml)
+        self.market_variance.update(daily_market)
+        if not np.isnan(market):
+            self.market_months = (self.market_months + [1 + float(market)])[-self.bear_months:]
+
+        # Bear market: cumulative market return of the past bear_months months below zero (not bear before that)
+        bear = len(self.market_months) == self.bear_months and np.prod(self.market_months) < 1
+        market_sigma2 = self.market_variance.variance()*self.days_per_month
+        if np.isnan(market_sigma2):
+            self.predictor = None
+        else:
+            self.predictor = float(market_sigma2) if bear else 0.0
+        self.last_month = int(month)
+        return row
+
+    # Returns the strategy state as plain python values
+    def state(self):
+        return {'params': self.params(),
+                'wml_variance': self.wml_variance.state(),
+                'market_variance': self.market_variance.state(),
+                'market_months': self.market_months,
+                'sums': self.sums,
+                'predictor': self.predictor,
+                'last_month': self.last_month}
+
+    # Rebuilds a strategy from state(): Inputs - state dict
+    @classmethod
+    def from_state(cls, state):
+        strategy = cls(**state['params'])
+        strategy.wml_variance = RollingVariance.from_state(state['wml_variance'])
+        strategy.market_variance = RollingVariance.from_state(state['market_variance'])
+        strategy.market_months = list(state['market_months'])
+        strategy.sums = list(state['sums'])
+        strategy.predictor = state['predictor']
+        strategy.last_month = state['last_month']
+        return strategy
+
+# Stores the state of a strategy as JSON: Inputs - strategy, file and optionally a fingerprint of the data of the
+# processed months (see dynamic_momentum). The file is written under a temporary name and renamed, so an
+# interrupted run leaves the previous state.
+def save_dynamic_momentum(strategy, state_file, fingerprint=None):
+    state = strategy.state()
+    if fingerprint is not None:
+        state['fingerprint'] = fingerprint
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+# Loads a strategy stored by save_dynamic_momentum: Inputs - file and whether the stored fingerprint is returned as
+# well. Returns the strategy, or the strategy and its fingerprint (None if it was stored without one).
+def load_dynamic_momentum(state_file, fingerprint=False):
+    with open(state_file) as f:
+        state = json.load(f)
+    strategy = DynamicMomentum.from_state(state)
+    if fingerprint == True:
+        return strategy, state.get('fingerprint')
+    return strategy
+
+# Fingerprint of the data a strategy has processed up to a month: Inputs - monthly returns (month id, WML and Market
+# columns), daily panel, date column and last month
+# Covers the monthly WML and market returns of the months and the number of daily rows up to the end of the month.
+def _fingerprint(monthly, panel, date_col, month, month_col='month_id'):
+    monthly = monthly[monthly[month_col] <= month]
+    digest = hashlib.sha1(np.ascontiguousarray(monthly[month_col].values, dtype=np.int64).tobytes())
+    for col in ['WML', 'Market']:
+        digest.update(np.ascontiguousarray(monthly[col].values, dtype=np.float64).tobytes())
+    digest.update(str(month_rows(panel, date_col, month)[1]).encode())
+    return digest.hexdigest()
+
+# Returns the first and one past the last row of a month in a date-sorted daily panel: Inputs - panel, date column
+# and month id. Two binary searches over the memory-mapped date column, nothing else is read.
+def month_rows(panel, date_col, month):
+    dates = panel.column(date_col)
+    first = (month_end(month - 1) + np.timedelta64(1, 'D')).astype(dates.dtype)
+    last = month_end(month).astype(dates.dtype)
+    return int(np.searchsorted(dates, first, side='left')), int(np.searchsorted(dates, last, side='right'))
+
+# Computes the daily winner, loser and market returns of one month from the daily panel: Inputs - daily panel,
+# month id, the month's portfolio assignments (ids, portfolio and weight of every stock, e.g. the DM decile and
+# lagged market cap of PS3_Q2), winner and loser portfolios and panel column names
+# Stocks keep the weights of the monthly assignment on every day of the month; the market is all assigned stocks.
+# Returns a dataframe with date, Winner, Loser and Market, one row per trading day (empty if the panel has no rows
+# of the month yet).
+def daily_portfolio_returns(panel, month, ids, portfolio, weight, winner=10, loser=1, id_col='permno',
+                            date_col='date', ret_col='ret'):
+    start, end = month_rows(panel, date_col, month)
+    if end <= start or len(ids) == 0:
+        return pd.DataFrame({'date': [], 'Winner': [], 'Loser': [], 'Market': []})
+    day_ids = np.array(panel.column(id_col, start, end)).astype(np.int64)
+    day_dates = np.array(panel.column(date_col, start, end))
+    day_ret = np.array(panel.column(ret_col, start, end)).astype(np.float64)
+
+    # Assignment of every daily row, looked up in the month's assignments sorted by id
+    order = np.argsort(ids, kind='stable')
+    ids = np.asarray(ids, dtype=np.int64)[order]
+    portfolio = np.asarray(portfolio)[order]
+    weight = np.asarray(weight, dtype=np.float64)[order]
+    pos = np.minimum(np.searchsorted(ids, day_ids), len(ids) - 1)
+    w = weight[pos]
+    assigned = (ids[pos] == day_ids) & ~np.isnan(day_ret) & (w > 0)
+
+    dates, day = np.unique(day_dates, return_inverse=True)
+    day = day.ravel()
+    result = pd.DataFrame({'date': pd.to_datetime(dates)})
+    for col, keep in [('Winner', assigned & (portfolio[pos] == winner)),
+                      ('Loser', assigned & (portfolio[pos] == loser)),
+                      ('Market', assigned)]:
+        w_sum = np.bincount(day[keep], w[keep], len(dates))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result[col] = np.bincount(day[keep], w[keep]*day_ret[keep], len(dates))/w_sum
+    return result
+
+# Runs the dynamic strategy over the months of the portfolio assignments not processed yet, one month at a time:
+# Inputs - portfolio assignments (id, month id, portfolio, monthly return and weight columns, one row per stock and
+#          month), daily panel (qam_daily.ColumnarPanel), state file (None keeps the state in memory only), function
+#          that stores the new rows (called with the rows and whether they continue the stored months), winner and
+#          loser portfolios, column names of the assignments, date and return columns of the daily panel (its id
+#          column is id_col) and the DynamicMomentum parameters
+# The monthly WML and market returns are the value-weighted returns of the assignments. The state file holds the
+# strategy after the last processed month with its parameters and a fingerprint of the monthly returns and of the
+# daily rows up to that month. A state with other parameters or data (recomputed assignments, revised daily
+# returns) is discarded and the strategy is rebuilt from the first month, otherwise a monthly run only reads the
+# daily rows of the new month. The new rows are stored before the state is written, so an interrupted run never
+# leaves a state ahead of the stored rows. Stops at the first month whose daily data is not complete (the panel
+# does not reach the last weekday of the month), which is picked up by the next run.
+# Returns a dataframe with one row per processed month (see DynamicMomentum.update).
+#   New_Rows = dynamic_momentum(CRSP_Stocks_Momentum_decile, ColumnarPanel(panel_dir), state_file, store_rows)
+def dynamic_momentum(assignments, panel, state_file=None, store=None, winner=10, loser=1, port_col='DM_decile',
+                     id_col='permno', month_col='month_id', ret_col='Ret', weight_col='lag_Mkt_Cap', date_col='date',
+                     daily_ret_col='ret', **params):
+    # Monthly value-weighted returns of the winner and loser portfolios and of all assigned stocks
+    assignments = assignments[assignments[port_col].notna()]
+    port = np.asarray(assignments[port_col].values, dtype=np.float64)
+    history = grouped_weighted_mean(assignments, [month_col], ret_col, weight_col)[[month_col]]
+    for col, rows in [('WML_W', port == winner), ('WML_L', port == loser), ('Market', np.ones(len(port), bool))]:
+        vw = grouped_weighted_mean(assignments[rows], [month_col], ret_col, weight_col)
+        history = history.merge(vw[[month_col, 'vw_ret']].rename(columns={'vw_ret': col}), how='left', on=month_col)
+    history['WML'] = history['WML_W'] - history['WML_L']
+
+    # Continue the stored strategy only if it was run with the same parameters on the same data
+    strategy = DynamicMomentum(**params)
+    resumed = False
+    if state_file is not None and os.path.exists(state_file):
+        stored, fingerprint = load_dynamic_momentum(state_file, fingerprint=True)
+        if (stored.params() == strategy.params() and stored.last_month is not None and
+                fingerprint == _fingerprint(history, panel, date_col, stored.last_month, month_col)):
+            strategy = stored
+            resumed = True
+
+    # Assignments and monthly returns of the months not processed yet, in month order
+    monthly = history
+    if strategy.last_month is not None:
+        assignments = assignments[assignments[month_col] > strategy.last_month]
+        monthly = history[history[month_col] > strategy.last_month].reset_index(drop=True)
+    assignments = assignments.sort_values([month_col], kind='mergesort')
+    month_values = assignments[month_col].values
+    bounds = np.searchsorted(month_values, monthly[month_col].values, side='left')
+    bounds = np.append(bounds, len(month_values))
+
+    # Last date of the daily panel
+    if panel.rows == 0:
+        monthly = monthly.iloc[:0]
+    else:
+        last_date = panel.column(date_col, panel.rows - 1)[0].astype('datetime64[D]')
+
+    rows = []
+    for i, month in enumerate(monthly[month_col].values):
+        if np.busday_offset(month_end(month).astype('datetime64[D]'), 0, roll='backward') > last_date:
+            break
+        current = assignments.iloc[bounds[i]:bounds[i + 1]]
+        daily = daily_portfolio_returns(panel, month, current[id_col].values,
+                                        np.asarray(current[port_col].values, dtype=np.float64),
+                                        current[weight_col].values, winner, loser, id_col, date_col, daily_ret_col)
+        if len(daily) == 0:
+            break
+        rows.append(strategy.update(int(month), (daily['Winner'] - daily['Loser']).values, daily['Market'].values,
+                                    monthly['WML'].values[i], monthly['Market'].values[i]))
+    rows = pd.DataFrame(rows, columns=['month_id', 'mu', 'sigma2', 'weight', 'WML', 'Dynamic_WML'])
+
+    # Store the rows first, then the state of the strategy after them
+    if store is not None:
+        store(rows, resumed)
+    if state_file is not None:
+        fingerprint = None
+        if strategy.last_month is not None:
+            fingerprint = _fingerprint(history, panel, date_col, strategy.last_month, month_col)
+        save_dynamic_momentum(strategy, state_file, fingerprint)
+    return rows
@@ -0,0 +1,192 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Stage-level instrumentation of the driver pipelines
+# Akhil Srivastava
+
+import contextlib
+import json
+import os
+import time
+
+import pandas as pd
+
+from qam_memory import peak_rss_bytes, reset_peak_rss, max_rss, rss_mb
+
+# Returns the number of rows and the in-memory bytes of the dataframes among values (tuples are searched one level)
+# Bytes are counted without inspecting python objects (deep=False), so this is cheap even for large frames.
+def frame_sizes(values):
+    rows = 0
+    size = 0
+    found = False
+    for value in values:
+        for x in (value if isinstance(value, (tuple, list)) else [value]):
+            if isinstance(x, pd.DataFrame):
+                rows += len(x)
+                size += int(x.memory_usage(index=True, deep=False).sum())
+                found = True
+            elif isinstance(x, pd.Series):
+                rows += len(x)
+                size += int(x.memory_usage(index=True, deep=False))
+                found = True
+    return (rows, size) if found else (None, None)
+
+# Measurements of one running stage, the stage body reports its outputs with output()
+class StageRecord:
+    def __init__(self, name, label, depth, inputs):
+        self.name = name
+        self.label = label
+        self.depth = depth
+        self.rows_in, self.bytes_in = frame_sizes(inputs)
+        self.rows_out = None
+        self.bytes_out = None
+        self.peak_rss_bytes = None
+
+    # Records the output dataframes of the stage
+    def output(self, *outputs):
+        self.rows_out, self.bytes_out = frame_sizes(outputs)
+
+# Records wall time, CPU time, peak RSS and input/output sizes of the stages of one pipeline run:
+# Inputs - pipeline name and trace file (None keeps the records in memory only)
+# Every stage is written to the trace file when it starts and when it ends, so the file shows which stage was
+# running even if the process is killed (for example out of memory). The file uses the Chrome trace event format
+# and can be opened in chrome://tracing or https://ui.perfetto.dev, load_trace reads it back as a dataframe.
+class PipelineTrace:
+    def __init__(self, pipeline, output_file=None):
+        self.pipeline = pipeline
+        self.output_file = output_file
+        self.stages = []
+        self._stack = []
+        self._t0 = time.perf_counter()
+        self._pid = os.getpid()
+        self._file = None
+        if output_file is not None:
+            self._file = open(output_file, 'w')
+            self._file.write('[' + json.dumps({'name': 'process_name', 'ph': 'M', 'pid': self._pid, 'tid': 0,
+                                               'args': {'name': pipeline}}))
+            self._file.flush()
+
+    def _emit(self, event):
+        if self._file is not None:
+            self._file.write(',\n' + json.dumps(event))
+            self._file.flush()
+
+    def _timestamp(self):
+        return (time.perf_counter() - self._t0)*1e6
+
+    # Times a stage: Inputs - stage name (download, process, clean, link, merge, partition, aggregate, stats),
+    # input dataframes and label (usually the function running in the stage)
+    # Stages can be nested, the peak RSS of a stage includes the peaks of its nested stages.
+    @contextlib.contextmanager
+    def stage(self, name, *inputs, label=None):
+        record = StageRecord(name, label, len(self._stack), inputs)
+        # Keep the peak reached so far by the enclosing stage before the peak is reset for this stage
+        if len(self._stack) > 0:
+            self._stack[-1].peak_rss_bytes = max_rss(self._stack[-1].peak_rss_bytes, peak_rss_bytes())
+        reset_peak_rss()
+        self._stack.append(record)
+
+        event_name = name if label is None else name + ':' + label
+        self._emit({'name': event_name, 'cat': name, 'ph': 'B', 'ts': self._timestamp(), 'pid': self._pid,
+                    'tid': 0, 'args': {'rows_in': record.rows_in, 'bytes_in': record.bytes_in}})
+        start = self._timestamp()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        error = None
+        try:
+            yield record
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            record.peak_rss_bytes = max_rss(record.peak_rss_bytes, peak_rss_bytes())
+            self._stack.pop()
+            if len(self._stack) > 0:
+                self._stack[-1].peak_rss_bytes = max_rss(self._stack[-1].peak_rss_bytes, record.peak_rss_bytes)
+
+            result = {'pipeline': self.pipeline,
+                      'stage': name,
+                      'label': label,
+                      'depth': record.depth,
+                      'start_seconds': start/1e6,
+                      'wall_seconds': wall,
+                      'cpu_seconds': cpu,
+                      'peak_rss_mb': rss_mb(record.peak_rss_bytes),
+                      'rows_in': record.rows_in,
+                      'bytes_in': record.bytes_in,
+                      'rows_out': record.rows_out,
+                      'bytes_out': record.bytes_out,
+                      'error': error}
+            self.stages.append(result)
+            self._emit({'name': event_name, 'cat': name, 'ph': 'E', 'ts': self._timestamp(), 'pid': self._pid,
+                        'tid': 0, 'args': result})
+
+    # Returns one row per finished stage
+    def to_frame(self):
+        return pd.DataFrame(self.stages)
+
+    # Closes the trace file
+    def close(self):
+        if self._file is not None:
+            self._file.write('\n]\n')
+            self._file.close()
+            self._file = None
+
+# Trace the module level stage helpers record into, None when no pipeline is traced
+_active_trace = None
+
+# Starts tracing a pipeline run and makes it the trace used by stage and run_stage:
+# Inputs - pipeline name and trace file
+def start_trace(pipeline, output_file=None):
+    global _active_trace
+    stop_trace()
+    _active_trace = PipelineTrace(pipeline, output_file)
+    return _active_trace
+
+# Stops the active trace and closes its file, returns the trace
+def stop_trace():
+    global _active_trace
+    trace = _active_trace
+    if trace is not None:
+        trace.close()
+    _active_trace = None
+    return trace
+
+# Times a stage in the active trace, does nothing but run the body if no trace is active:
+# Inputs - stage name, input dataframes and label
+@contextlib.contextmanager
+def stage(name, *inputs, label=None):
+    if _active_trace is None:
+        yield StageRecord(name, label, 0, ())
+    else:
+        with _active_trace.stage(name, *inputs, label=label) as record:
+            yield record
+
+# Runs func(*args, **kwargs) as a stage of the active trace, dataframe arguments are the stage inputs and the
+# returned dataframes its outputs: Inputs - stage name, function and its arguments
+def run_stage(name, func, *args, **kwargs):
+    with stage(name, *args, label=func.__name__) as record:
+        result = func(*args, **kwargs)
+        record.output(result)
+    return result
+
+# Reads a trace file written by PipelineTrace, including the file of a run that did not finish: Inputs - trace file
+# Returns one row per finished stage, and one row with wall_seconds NaN for each stage that never ended
+def load_trace(trace_file):
+    with open(trace_file) as f:
+        text = f.read().strip()
+    if not text.endswith(']'):
+        text = text.rstrip(',') + ']'
+    events = json.loads(text)
+
+    ended = [x['args'] for x in events if x['ph'] == 'E']
+    open_stages = []
+    for x in events:
+        if x['ph'] == 'B':
+            open_stages.append(x)
+        elif x['ph'] == 'E':
+            open_stages.pop()
+    unfinished = [{'stage': x['cat'], 'label': x['name'].partition(':')[2] or None,
+                   'start_seconds': x['ts']/1e6, 'rows_in': x['args']['rows_in'],
+                   'bytes_in': x['args']['bytes_in'], 'error': 'unfinished'} for x in open_stages]
+    return pd.DataFrame(ended + unfinished)
@@ -0,0 +1,64 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Process memory (resident set size) probes
+# Akhil Srivastava
+
+import os
+import sys
+
+# Returns the peak resident set size of the current process in bytes, None if it cannot be measured
+# On Windows the peak comes from psutil, which is optional: without it memory is simply not reported.
+def peak_rss_bytes():
+    # On Linux VmHWM is reset on exec, unlike ru_maxrss which a spawned child inherits from its parent
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+        return peak if sys.platform == 'darwin' else peak*1024
+    except ImportError:
+        # resource is not available on Windows
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset
+
+# Returns the current resident set size of the process in bytes, None if it cannot be measured
+def current_rss_bytes():
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])*1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+# Resets the peak resident set size of the process so that it only covers what runs next (Linux only):
+# Returns False if the peak cannot be reset, the peak then also covers everything that ran before
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+# Returns the largest of the byte counts that are available, None if none is: Inputs - byte counts
+def max_rss(*values):
+    values = [x for x in values if x is not None]
+    return max(values) if len(values) > 0 else None
+
+# Returns the increase of a byte count over a base, None if either is not available: Inputs - byte count and base
+def rss_increase(value, base):
+    return None if value is None or base is None else value - base
+
+# Converts a byte count to MB, None stays None: Inputs - byte count
+def rss_mb(value):
+    return None if value is None else value/2**20
@@ -0,0 +1,108 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Jegadeesh-Titman momentum portfolios for a grid of formation and holding periods in one run
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+from qam_aggregation import month_positions
+from qam_breakpoints import assign_breakpoints, period_quantiles
+
+# Formation and holding periods of the Jegadeesh and Titman (1993) grid, in months
+FORMATION_MONTHS = (3, 6, 9, 12)
+HOLDING_MONTHS = (1, 3, 6, 12)
+
+# Computes the formation returns of every row for several formation periods from one running sum of log returns:
+# Inputs - log returns of a panel sorted by id and month, month positions (qam_aggregation.month_positions),
+#          formation periods, skipped months and minimum months with a return (None requires every month)
+# The signal of month t is the cumulative log return of months t-skip-J to t-skip-1, the difference of the running
+# sum at the two ends of the window. A -100% return (log return -inf) is counted separately so that it does not
+# poison the running sum, the signal of a window holding one is -inf (same as summing the window).
+# Returns a dict of formation period to signal, NaN without enough months.
+def formation_signals(log_ret, position, formation_months, skip=1, min_months=None):
+    valid = ~np.isnan(log_ret)
+    wiped_out = log_ret == -np.inf
+    cum_ret = np.concatenate([[0], np.cumsum(np.where(valid & ~wiped_out, log_ret, 0))])
+    cum_valid = np.concatenate([[0], np.cumsum(valid)])
+    cum_wiped_out = np.concatenate([[0], np.cumsum(wiped_out)])
+
+    signals = {}
+    for J in formation_months:
+        start = np.searchsorted(position, position - skip - J, side='left')
+        end = np.searchsorted(position, position - skip - 1, side='right')
+        count = cum_valid[end] - cum_valid[start]
+        required = J if min_months is None else min(min_months, J)
+        signal = np.where(cum_wiped_out[end] > cum_wiped_out[start], -np.inf, cum_ret[end] - cum_ret[start])
+        signals[J] = np.where(count >= max(required, 1), signal, np.nan)
+    return signals
+
+# Computes the Jegadeesh-Titman winner minus loser returns of every formation period J and holding period K:
+# Inputs - stock panel (one row per id and month with the month id, return and weight), formation periods,
+#          holding periods, skipped months between formation and holding, number of portfolios, weighting ('vw'
+#          uses the weight column, the lagged market cap, 'ew' weights stocks equally), minimum months with a
+#          return in the formation window (None requires all J) and the column names
+# Stocks are sorted into portfolios on all stocks of the formation month (pd.qcut breakpoints). The portfolio formed
+# in month s is held in months s to s+K-1 and the J x K portfolio of month m is the equally weighted average of the
+# K cohorts formed in months m-K+1 to m (NaN until all K exist). Signals come from one running sum of log returns,
+# portfolios are assigned once per J and every cohort return is a bincount, so each K reuses the cohorts of the
+# largest K. J=11 with skip=1 and K=1 ranks on the PS3 t-12 to t-2 return (the DM decile WML).
+# Returns a dataframe indexed by month_id with one WML column per (J, K).
+#   WML = momentum_grid(CRSP_Stocks_Momentum, formation_months=(3, 6, 9, 12), holding_months=(1, 3, 6, 12))
+def momentum_grid(df, formation_months=FORMATION_MONTHS, holding_months=HOLDING_MONTHS, skip=1, n_portfolios=10,
+                  weighting='vw', min_months=None, id_col='permno', month_col='month_id', ret_col='Ret',
+                  weight_col='lag_Mkt_Cap'):
+    if weighting not in ('vw', 'ew'):
+        raise ValueError("Unknown weighting " + repr(weighting) + ", expected 'vw' or 'ew'")
+    df = df.sort_values([id_col, month_col], kind='mergesort').reset_index(drop=True)
+    max_K = max(holding_months)
+    position = month_positions(df, id_col, month_col, max(formation_months) + skip + max_K)
+
+    # Months of the output and month codes of the rows
+    month = df[month_col].values.astype(np.int64)
+    months, month_code = np.unique(month, return_inverse=True)
+    month_code = month_code.ravel()
+    n_months = len(months)
+
+    # Holding-month returns and weights, rows without both are not held
+    ret = df[ret_col].values.astype(np.float64)
+    weight = df[weight_col].values.astype(np.float64) if weighting == 'vw' else np.ones(len(df))
+    held = ~np.isnan(ret) & (weight > 0)
+
+    # Row of the same id k months earlier (-1 if the id has no row then), the formation row of cohort k
+    cohort_rows = []
+    for k in range(max_K):
+        row = np.searchsorted(position, position - k)
+        row = np.minimum(row, len(position) - 1)
+        cohort_rows.append(np.where(position[row] == position - k, row, -1))
+
+    with np.errstate(divide='ignore'):
+        log_ret = np.log(1 + ret)
+    signals = formation_signals(log_ret, position, formation_months, skip, min_months)
+    quantiles = np.linspace(0, 1, n_portfolios + 1)[1:-1]
+    columns = {}
+    for J in formation_months:
+        # Portfolio of every row in its formation month, assigned once per J
+        breakpoints = period_quantiles(signals[J], month_code, n_months, quantiles)
+        portfolio = np.asarray(assign_breakpoints(signals[J], month_code, breakpoints, range(n_portfolios)).codes)
+
+        # Winner minus loser return of the cohort formed k months before every month
+        cohort_wml = np.empty((max_K, n_months))
+        for k in range(max_K):
+            row = cohort_rows[k]
+            port = np.where(row >= 0, portfolio[np.maximum(row, 0)], -1)
+            port_ret = []
+            for p in (n_portfolios - 1, 0):
+                keep = held & (port == p)
+                w_sum = np.bincount(month_code[keep], weight[keep], n_months)
+                wr_sum = np.bincount(month_code[keep], weight[keep]*ret[keep], n_months)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    port_ret.append(wr_sum/w_sum)
+            cohort_wml[k] = port_ret[0] - port_ret[1]
+
+        # Overlapping portfolios: average of the K most recent cohorts
+        for K in holding_months:
+            columns[(J, K)] = cohort_wml[:K].mean(axis=0)
+
+    result = pd.DataFrame(columns, index=pd.Index(months, name=month_col))
+    result.columns = pd.MultiIndex.from_tuples(result.columns, names=['J', 'K'])
+    return result
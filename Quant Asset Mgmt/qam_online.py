@@ -0,0 +1,283 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Streaming volatility estimators with O(1) updates per observation
+# Akhil Srivastava
+
+import hashlib
+import json
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+import pandas as pd
+
+# Base class of the streaming estimators: Inputs - number of series and minimum number of observations
+# An estimator holds a few numbers per series, update() folds in one row of returns (one value per series, NaN for
+# a missing observation) and volatility() is the estimate from all rows seen so far, i.e. the forecast for the next
+# row. The state is a dict of lists, so a monthly production run can store it and continue next month:
+#   estimator = make_estimator('ewma', 2, halflife=12)
+#   for row in returns: estimator.update(row)
+#   save_estimator(estimator, state_file)  ...  estimator = load_estimator(state_file)
+class OnlineEstimator(ABC):
+    name = None
+    # Names of the per-series state arrays
+    state_arrays = ()
+
+    def __init__(self, n_series, min_periods=2):
+        self.n_series = n_series
+        self.min_periods = min_periods
+        self.nobs = np.zeros(n_series)
+
+    # Folds in one observation of every series: Inputs - values (n_series,)
+    @abstractmethod
+    def update(self, values):
+        pass
+
+    # Returns the current volatility estimate of every series, NaN before min_periods observations
+    @abstractmethod
+    def volatility(self):
+        pass
+
+    # Runs the estimator over rows of returns: Inputs - values (n rows x n_series)
+    # Returns the estimate available before every row (row i uses rows 0 to i-1), like a trailing window with lag=1
+    def run(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        result = np.empty(values.shape)
+        for i in range(len(values)):
+            result[i] = self.volatility()
+            self.update(values[i])
+        return result
+
+    # Parameters passed to the constructor, stored with the state
+    def params(self):
+        return {'min_periods': self.min_periods}
+
+    # Returns the estimator state as plain python values
+    def state(self):
+        arrays = {key: getattr(self, key).tolist() for key in ('nobs',) + self.state_arrays}
+        return {'name': self.name, 'n_series': self.n_series, 'params': self.params(), 'arrays': arrays}
+
+    # Rebuilds an estimator from state(): Inputs - state dict
+    @classmethod
+    def from_state(cls, state):
+        estimator = cls(state['n_series'], **state['params'])
+        for key, values in state['arrays'].items():
+            setattr(estimator, key, np.array(values, dtype=np.float64))
+        return estimator
+
+# Expanding-window sample volatility (ddof=1) updated with Welford's algorithm
+class ExpandingVolatility(OnlineEstimator):
+    name = 'expanding'
+    state_arrays = ('mean', 'm2')
+
+    def __init__(self, n_series, min_periods=2):
+        super().__init__(n_series, min_periods)
+        self.mean = np.zeros(n_series)
+        self.m2 = np.zeros(n_series)
+
+    def update(self, values):
+        valid = ~np.isnan(values)
+        x = np.where(valid, values, 0)
+        self.nobs = self.nobs + valid
+        delta = x - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.mean = np.where(valid, self.mean + delta/self.nobs, self.mean)
+        self.m2 = np.where(valid, self.m2 + delta*(x - self.mean), self.m2)
+
+    def volatility(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sigma = np.sqrt(self.m2/(self.nobs - 1))
+        return np.where(self.nobs >= max(self.min_periods, 2), sigma, np.nan)
+
+# Exponentially weighted volatility with a half-life in observations: the weight of an observation halves every
+# halflife rows. Same estimate as pandas ewm(halflife=halflife, min_periods=min_periods).std() (bias corrected,
+# missing rows still age the earlier observations).
+class EWMAVolatility(OnlineEstimator):
+    name = 'ewma'
+    state_arrays = ('weight', 'weight2', 'mean', 'm2')
+
+    def __init__(self, n_series, halflife=12, min_periods=2):
+        super().__init__(n_series, min_periods)
+        self.halflife = halflife
+        self.decay = 0.5**(1/halflife)
+        # Sum of weights, sum of squared weights, weighted mean and weighted sum of squared deviations
+        self.weight = np.zeros(n_series)
+        self.weight2 = np.zeros(n_series)
+        self.mean = np.zeros(n_series)
+        self.m2 = np.zeros(n_series)
+
+    def params(self):
+        return {'halflife': self.halflife, 'min_periods': self.min_periods}
+
+    def update(self, values):
+        valid = ~np.isnan(values)
+        x = np.where(valid, values, 0)
+        # Age every observation by one row, then add the new one with weight 1
+        self.weight = self.weight*self.decay
+        self.weight2 = self.weight2*self.decay**2
+        self.m2 = self.m2*self.decay
+        self.nobs = self.nobs + valid
+        weight = self.weight + valid
+        delta = x - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(valid, self.mean + delta/weight, self.mean)
+        self.m2 = np.where(valid, self.m2 + delta*(x - mean), self.m2)
+        self.mean = mean
+        self.weight = weight
+        self.weight2 = self.weight2 + valid
+
+    def volatility(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var = self.m2/(self.weight - self.weight2/self.weight)
+        return np.where(self.nobs >= max(self.min_periods, 2), np.sqrt(np.maximum(var, 0)), np.nan)
+
+# GARCH(1,1) variance filter with fixed parameters and variance targeting:
+#   sigma2(t+1) = (1 - alpha - beta)*long-run variance + alpha*(r(t) - mean)^2 + beta*sigma2(t)
+# The long-run variance and the mean are the expanding sample moments, so nothing is fitted and every update is
+# O(1). The filter starts from the sample variance once min_periods observations have been seen.
+class GarchVolatility(OnlineEstimator):
+    name = 'garch'
+    state_arrays = ('mean', 'm2', 'variance')
+
+    def __init__(self, n_series, alpha=0.1, beta=0.85, min_periods=12):
+        super().__init__(n_series, min_periods)
+        if alpha < 0 or beta < 0 or alpha + beta >= 1:
+            raise ValueError("GARCH parameters need alpha, beta >= 0 and alpha + beta < 1")
+        self.alpha = alpha
+        self.beta = beta
+        self.mean = np.zeros(n_series)
+        self.m2 = np.zeros(n_series)
+        self.variance = np.full(n_series, np.nan)
+
+    def params(self):
+        return {'alpha': self.alpha, 'beta': self.beta, 'min_periods': self.min_periods}
+
+    def update(self, values):
+        valid = ~np.isnan(values)
+        x = np.where(valid, values, 0)
+        shock = (x - self.mean)**2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            long_run = self.m2/(self.nobs - 1)
+        garch = (1 - self.alpha - self.beta)*long_run + self.alpha*shock + self.beta*self.variance
+
+        # Expanding moments (Welford)
+        self.nobs = self.nobs + valid
+        delta = x - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.mean = np.where(valid, self.mean + delta/self.nobs, self.mean)
+            self.m2 = np.where(valid, self.m2 + delta*(x - self.mean), self.m2)
+            sample = self.m2/(self.nobs - 1)
+
+        # Start the filter from the sample variance, then filter; missing observations keep the variance
+        started = ~np.isnan(self.variance)
+        self.variance = np.where(valid & started, garch, self.variance)
+        self.variance = np.where(valid & ~started & (self.nobs >= self.min_periods), sample, self.variance)
+
+    def volatility(self):
+        return np.sqrt(self.variance)
+
+# Streaming estimators selectable by name
+ESTIMATORS = {cls.name: cls for cls in (ExpandingVolatility, EWMAVolatility, GarchVolatility)}
+
+# Creates a streaming estimator by name: Inputs - name ('expanding', 'ewma' or 'garch'), number of series and the
+# estimator parameters (e.g. halflife=12 for 'ewma', alpha and beta for 'garch')
+def make_estimator(name, n_series, **params):
+    if name not in ESTIMATORS:
+        raise ValueError("Unknown volatility estimator " + repr(name) + ", expected one of " + str(list(ESTIMATORS)))
+    return ESTIMATORS[name](n_series, **params)
+
+# Checksum of the last row an estimator has processed: Inputs - month id and values of the row
+def _checksum(month, values):
+    digest = hashlib.sha1(np.int64(month).tobytes())
+    digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+# Runs an estimator over the monthly rows after the ones it has already processed: Inputs - values (n rows x
+# n_series), month ids (increasing), estimator name, state file, last month of the caller's stored estimates (None if
+# there are none) and estimator parameters
+# The state file holds only the estimator after the last processed month, that month and a checksum of its row, so
+# its size and the work of a new month do not grow with the history: the estimates of the processed months are kept
+# in the caller's stored output. The estimator continues if the stored output ends at the stored month, that row has
+# the same values and the estimator and parameters are unchanged. Otherwise (another estimator, returns recomputed
+# or a revised last month) it is rebuilt from the first month, earlier revisions need a rebuild by the caller.
+# Returns the first row fed to the estimator and the estimates of the rows from there on, as in OnlineEstimator.run.
+def resume_estimator(values, months, estimator, state_file, last_stored=None, **params):
+    values = np.asarray(values, dtype=np.float64)
+    months = np.asarray(months, dtype=np.int64)
+    if (np.diff(months) <= 0).any():
+        raise ValueError("Months of a stored estimator must be increasing")
+    est = make_estimator(estimator, values.shape[1], **params)
+
+    # Continue from the stored state only if it was computed from the same estimator up to the same last row
+    start = 0
+    if last_stored is not None and os.path.exists(state_file):
+        stored, last_row = load_estimator(state_file, last_row=True)
+        row = np.searchsorted(months, last_stored)
+        if (last_row is not None and stored.name == est.name and stored.n_series == est.n_series and
+                stored.params() == est.params() and last_row['month'] == last_stored and row < len(months) and
+                months[row] == last_stored and last_row['checksum'] == _checksum(last_stored, values[row])):
+            est = stored
+            start = row + 1
+
+    estimates = est.run(values[start:])
+    if len(months) > 0:
+        save_estimator(est, state_file, {'month': int(months[-1]), 'checksum': _checksum(months[-1], values[-1])})
+    return start, estimates
+
+# Streaming volatility of several return columns of a dataframe: Inputs - df, column names, estimator name, state
+# file (None runs over all rows without storing anything), estimates of the previous run (dataframe indexed by month
+# id with the same columns, e.g. read from its stored output), month column and estimator parameters
+# Row i uses rows 0 to i-1 (same alignment as qam_rolling.trailing_volatility with lag=1). With a state file only the
+# months after the last stored one are fed to the estimator (see resume_estimator) and the earlier rows are taken
+# from the stored estimates (NaN for months missing from them).
+# Returns a dataframe with the same index and columns.
+def online_volatility(df, columns, estimator, state_file=None, stored=None, month_col='month_id', **params):
+    if state_file is None:
+        sigma = make_estimator(estimator, len(columns), **params).run(df[columns].values)
+    else:
+        months = df[month_col].values
+        last_stored = stored.index.max() if stored is not None and len(stored) > 0 else None
+        start, sigma = resume_estimator(df[columns].values, months, estimator, state_file, last_stored, **params)
+        if start > 0:
+            sigma = np.vstack([stored.reindex(months[:start])[columns].values, sigma])
+    return pd.DataFrame(sigma, index=df.index, columns=columns)
+
+# Walk-forward leverage that matches the volatility of a portfolio to the volatility of a target using only earlier
+# months: Inputs - target and portfolio returns (1-d, same length), estimator name, state file (None runs over all
+# rows without storing anything), month ids of the rows (needed with a state file), leverage of the previous run
+# (series indexed by month id, e.g. read from its stored output) and estimator parameters
+# Returns k for every row, the ratio of the two volatilities estimated from rows 0 to i-1 (NaN before min_periods).
+# The estimator state is two series wide, so extending the series by a month is one update: with a state file only
+# the months after the last stored one are fed to the estimator (see resume_estimator).
+def walk_forward_leverage(target, portfolio, estimator='expanding', state_file=None, months=None, stored=None,
+                          **params):
+    values = np.column_stack([target, portfolio])
+    if state_file is None:
+        sigma = make_estimator(estimator, 2, **params).run(values)
+        return sigma[:, 0]/sigma[:, 1]
+
+    last_stored = stored.index.max() if stored is not None and len(stored) > 0 else None
+    start, sigma = resume_estimator(values, months, estimator, state_file, last_stored, **params)
+    previous = stored.reindex(np.asarray(months)[:start]).values if start > 0 else np.empty(0)
+    return np.concatenate([previous, sigma[:, 0]/sigma[:, 1]])
+
+# Stores the state of an estimator as JSON: Inputs - estimator, file and optionally the month and checksum of the
+# last processed row (see resume_estimator). The file is written under a temporary name and renamed, so an
+# interrupted run leaves the previous state.
+def save_estimator(estimator, state_file, last_row=None):
+    state = estimator.state()
+    if last_row is not None:
+        state['last_row'] = last_row
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+# Loads an estimator stored by save_estimator: Inputs - file and whether the last processed row is returned as well
+# Returns the estimator, or the estimator and its last row (None if it was stored without one).
+def load_estimator(state_file, last_row=False):
+    with open(state_file) as f:
+        state = json.load(f)
+    estimator = ESTIMATORS[state['name']].from_state(state)
+    if last_row == True:
+        return estimator, state.get('last_row')
+    return estimator
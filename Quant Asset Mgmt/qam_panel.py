@@ -0,0 +1,152 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Dense permno x month array panel for lags, rolling windows and cumulative products
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+from qam_calendar import to_dates, month_id, month_end, year_month
+
+# Dense panel with one row per id (factorized permno) and one column per calendar month, months without an
+# observation hold NaN. Lags and windows move along calendar months, so a gap in the data is a missing value and
+# not the previous row (groupby shift/rolling on the long frame look at the previous row whatever its date).
+# The panel remembers the long rows it was built from, so results can be assigned back to the long frame:
+#   panel = DensePanel.from_long(CRSP_Stocks, ['me'])
+#   CRSP_Stocks['lme'] = panel.to_rows(panel.shift('me', 1))
+class DensePanel:
+    def __init__(self, ids, months, id_col='permno', date_col='date', date_dtype='datetime64[ns]'):
+        self.ids = ids
+        self.months = months
+        self.id_col = id_col
+        self.date_col = date_col
+        self.values = {}
+        # Original dates of the observations (NaT where missing) and positions of the long rows in the panel
+        self.dates = np.full(self.shape, np.datetime64('NaT'), dtype=date_dtype)
+        self.row_id = np.zeros(0, dtype=np.int64)
+        self.row_month = np.zeros(0, dtype=np.int64)
+
+    @property
+    def shape(self):
+        return (len(self.ids), len(self.months))
+
+    # Builds a panel from a long frame: Inputs - df, value columns, id column, date column and value dtype
+    # Raises ValueError if an id has more than one row in a month
+    @classmethod
+    def from_long(cls, df, columns, id_col='permno', date_col='date', dtype=np.float64):
+        row_id, ids = pd.factorize(df[id_col], sort=True)
+        if (row_id < 0).any():
+            raise ValueError("Column " + id_col + " has missing values")
+        dates = np.asarray(to_dates(df[date_col]))
+        month = month_id(dates)
+        first_month = month.min() if len(month) > 0 else 0
+        last_month = month.max() if len(month) > 0 else -1
+        row_month = month - first_month
+
+        panel = cls(np.asarray(ids), np.arange(first_month, last_month + 1), id_col, date_col, dates.dtype)
+
+        # Each (id, month) cell can hold only one observation
+        cell = row_id.astype(np.int64)*len(panel.months) + row_month
+        if len(np.unique(cell)) != len(cell):
+            raise ValueError("Duplicate " + id_col + " x month rows, the panel needs one row per id and month")
+
+        panel.row_id = row_id.astype(np.int64)
+        panel.row_month = row_month
+        panel.dates[row_id, row_month] = dates
+        for col in columns:
+            panel.assign(col, panel.from_rows(df[col].values, dtype=dtype))
+        return panel
+
+    # Returns the dense array of a value column
+    def __getitem__(self, col):
+        return self.values[col]
+
+    # Stores a dense array as a value column: Inputs - column name and (n_ids, n_months) array
+    def assign(self, col, values):
+        if values.shape != self.shape:
+            raise ValueError("Expected an array of shape " + str(self.shape) + ", got " + str(values.shape))
+        self.values[col] = values
+
+    # Scatters values aligned with the long rows into a dense array: Inputs - row values and dtype
+    def from_rows(self, row_values, dtype=np.float64):
+        values = np.full(self.shape, np.nan, dtype=dtype)
+        values[self.row_id, self.row_month] = row_values
+        return values
+
+    # Gathers a dense array back to the long rows the panel was built from (same order): Inputs - dense array
+    def to_rows(self, values):
+        return values[self.row_id, self.row_month]
+
+    # Returns True for the (id, month) cells with an observation
+    def present(self):
+        return ~np.isnat(self.dates)
+
+    # Converts the panel to a long frame with one row per observed cell sorted by id and date:
+    # Inputs - value columns (defaults to all) and dates (original dates or month end dates of every cell)
+    def to_long(self, columns=None, month_end_dates=False):
+        if columns is None:
+            columns = list(self.values)
+        if month_end_dates:
+            id_pos, month_pos = np.divmod(np.arange(self.shape[0]*self.shape[1]), self.shape[1])
+            dates = month_end(self.months)[month_pos]
+        else:
+            id_pos, month_pos = np.nonzero(self.present())
+            dates = self.dates[id_pos, month_pos]
+
+        df = pd.DataFrame({self.id_col: self.ids[id_pos], self.date_col: dates})
+        for col in columns:
+            df[col] = self.values[col][id_pos, month_pos]
+        return df
+
+    # Lags a value column by k months (k < 0 leads), months before the first month are NaN: Inputs - column and k
+    def shift(self, col, k=1):
+        values = self.values[col]
+        result = np.full(self.shape, np.nan, dtype=values.dtype)
+        if k == 0:
+            result[:] = values
+        elif abs(k) < self.shape[1]:
+            if k > 0:
+                result[:, k:] = values[:, :-k]
+            else:
+                result[:, :k] = values[:, -k:]
+        return result
+
+    # Sums a value column over the months t-lag-window+1 to t-lag: Inputs - column, window length and lag
+    # The window is summed from the oldest to the newest month, so any missing month inside the window gives NaN
+    # and the result matches qam_aggregation.grouped_window_sum on gap-free histories bit for bit.
+    def rolling_sum(self, col, window, lag=0):
+        values = self.values[col]
+        n_months = self.shape[1]
+        oldest = lag + window - 1
+        result = np.full(self.shape, np.nan, dtype=values.dtype)
+        if oldest >= n_months:
+            return result
+
+        total = values[:, :n_months - oldest].copy()
+        for k in range(oldest - 1, lag - 1, -1):
+            total += values[:, oldest - k:n_months - k]
+        result[:, oldest:] = total
+        return result
+
+    # Cumulative product of a value column along the months, restarting at every change of reset_key:
+    # Inputs - column and reset key per month (for example the portfolio year of every month), None for no reset
+    # Missing values are skipped like pandas cumprod (they stay NaN and do not break the product).
+    def cumprod(self, col, reset_key=None):
+        values = self.values[col]
+        missing = np.isnan(values)
+        filled = np.where(missing, 1, values)
+
+        if reset_key is None:
+            bounds = [0, self.shape[1]]
+        else:
+            reset_key = np.asarray(reset_key)
+            bounds = [0] + list(np.flatnonzero(reset_key[1:] != reset_key[:-1]) + 1) + [self.shape[1]]
+
+        result = np.empty(self.shape, dtype=values.dtype)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            result[:, start:end] = np.cumprod(filled[:, start:end], axis=1)
+        result[missing] = np.nan
+        return result
+
+    # Returns the calendar year and month of every panel month
+    def year_month(self):
+        return year_month(self.months)
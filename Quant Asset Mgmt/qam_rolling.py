@@ -0,0 +1,52 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Trailing-window moments of return series
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+# Computes trailing-window standard deviations of every column in O(n) with cumulative sums:
+# Inputs - values (n rows x k columns, or one series), window length, lag (lag=1 means the window of row i covers rows
+# i-window to i-1), ddof and minimum number of non-missing values in the window
+# Missing values are skipped like pandas .std(). Rows without a full window (i < window+lag-1) are NaN, so the result
+# matches slicing rows i-window-lag+1 to i-lag and calling .std() on them, up to floating point rounding.
+def trailing_std(values, window, lag=1, ddof=1, min_periods=2):
+    values = np.asarray(values, dtype=np.float64)
+    one_column = values.ndim == 1
+    if one_column:
+        values = values[:, None]
+    n = values.shape[0]
+
+    # Center each column on its mean so that the cumulative sums of squares do not lose precision
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=0)
+    center = np.where(valid, values, 0).sum(axis=0)/np.maximum(count, 1)
+    x = np.where(valid, values - center, 0)
+
+    # Cumulative sums with a leading row of zeros, so the sum over rows [a, b) is cum[b] - cum[a]
+    zeros = np.zeros((1, values.shape[1]))
+    cum_n = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    cum_x = np.concatenate([zeros, np.cumsum(x, axis=0)])
+    cum_xx = np.concatenate([zeros, np.cumsum(x*x, axis=0)])
+
+    result = np.full(values.shape, np.nan)
+    rows = np.arange(window + lag - 1, n)
+    end = rows - lag + 1
+    start = end - window
+    w_n = cum_n[end] - cum_n[start]
+    w_x = cum_x[end] - cum_x[start]
+    w_xx = cum_xx[end] - cum_xx[start]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (w_xx - w_x*w_x/w_n)/(w_n - ddof)
+    # Rounding can make the variance of a constant window slightly negative
+    std = np.sqrt(np.maximum(var, 0))
+    result[rows] = np.where(w_n >= max(min_periods, ddof + 1), std, np.nan)
+
+    return result[:, 0] if one_column else result
+
+# Trailing-window volatility of several return columns of a dataframe: Inputs - df, column names, window length and
+# lag (lag=1 uses months i-window to i-1 for month i). Returns a dataframe with the same index and columns.
+def trailing_volatility(df, columns, window, lag=1, min_periods=2):
+    return pd.DataFrame(trailing_std(df[columns].values, window, lag=lag, min_periods=min_periods),
+                        index=df.index, columns=columns)
@@ -0,0 +1,94 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Compact dtype schema and memory-budget report for the CRSP panels
+# Akhil Srivastava
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from qam_memory import peak_rss_bytes, rss_mb
+
+# Compact integer types of the CRSP identifiers and codes (permno < 100000, codes fit in a signed byte)
+CRSP_SCHEMA = {'permno': 'int32',
+               'permco': 'int32',
+               'shrcd': 'int8',
+               'exchcd': 'int8',
+               'shrout': 'int32',
+               'siccd': 'int16',
+               'dlstcd': 'int16',
+               'dlexchcd': 'int8',
+               'dlsiccd': 'int16'}
+
+# Price and share columns stored as float32 when the float32 option is turned on
+CRSP_FLOAT32_COLUMNS = ['prc', 'shrout', 'cfacpr', 'cfacshr']
+
+# CRSP-Compustat link table: integer identifiers and low cardinality strings as categoricals
+LINK_SCHEMA = {'permno': 'int32',
+               'permco': 'int32',
+               'linktype': 'category',
+               'linkprim': 'category',
+               'liid': 'category'}
+
+# Applies a dtype schema to the columns of df that are present: Inputs - df, schema (column to dtype),
+# float32 (cast float32_columns to float32) and float32_columns
+# Integer columns with missing values (for example permco of delisting-only rows after the outer merge) use the
+# pandas nullable integer type of the same width (Int32, Int8, ...), so identifiers stay integers.
+def apply_schema(df, schema, float32=False, float32_columns=CRSP_FLOAT32_COLUMNS):
+    df = df.copy()
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if dtype != 'category' and np.issubdtype(np.dtype(dtype), np.integer):
+            # Casting silently wraps around on overflow, so check the range of the non-missing values first
+            info = np.iinfo(dtype)
+            values = df[col].dropna()
+            if len(values) > 0 and (values.min() < info.min or values.max() > info.max):
+                raise ValueError("Column " + col + " does not fit in " + dtype)
+            if df[col].isna().any():
+                dtype = dtype.capitalize()
+        df[col] = df[col].astype(dtype)
+
+    if float32:
+        for col in float32_columns:
+            if col in df.columns:
+                df[col] = df[col].astype('float32')
+
+    return df
+
+# Collects per-stage memory usage (bytes per column, total bytes and process peak RSS) of the pipeline dataframes
+# The peak RSS is None on platforms where it cannot be measured (Windows without psutil)
+class MemoryReport:
+    def __init__(self):
+        self.stages = []
+
+    # Records the memory usage of df after a stage: Inputs - stage name and dataframe
+    def record(self, stage, df):
+        col_bytes = df.memory_usage(index=False, deep=True)
+        self.stages.append({'stage': stage,
+                            'rows': len(df),
+                            'total_bytes': int(col_bytes.sum() + df.index.memory_usage(deep=True)),
+                            'peak_rss_bytes': peak_rss_bytes(),
+                            'columns': {col: {'dtype': str(df[col].dtype), 'bytes': int(col_bytes[col])}
+                                        for col in df.columns}})
+        peak_rss_mb = rss_mb(self.stages[-1]['peak_rss_bytes'])
+        print("      {}: {} rows, {:.1f} MB, peak RSS {}".format(
+            stage, len(df), self.stages[-1]['total_bytes']/2**20,
+            'n/a' if peak_rss_mb is None else '{:.1f} MB'.format(peak_rss_mb)))
+
+    # Returns one row per stage with rows, total MB and peak RSS MB
+    def to_frame(self):
+        return pd.DataFrame([{'stage': x['stage'],
+                              'rows': x['rows'],
+                              'total_mb': x['total_bytes']/2**20,
+                              'peak_rss_mb': rss_mb(x['peak_rss_bytes'])} for x in self.stages])
+
+    # Returns one row per stage and column with dtype and MB
+    def columns_frame(self):
+        return pd.DataFrame([{'stage': x['stage'], 'column': col, 'dtype': info['dtype'], 'mb': info['bytes']/2**20}
+                             for x in self.stages for col, info in x['columns'].items()])
+
+    # Stores the report as JSON: Inputs - output file
+    def save(self, output_file):
+        with open(output_file, 'w') as f:
+            json.dump(self.stages, f, indent=2)
@@ -0,0 +1,79 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Performance statistics of many monthly return series in one vectorized pass
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+# Statistics computed for every series and the columns of the problem set tables they correspond to
+#   mean      - annualized mean return in % (Annualized Mean, Excess Return)
+#   vol       - annualized standard deviation in % (Annualized Standard Deviation, Volatility)
+#   sharpe    - annualized Sharpe ratio (Annualized Sharpe Ratio, Sharpe Ratio)
+#   skew      - skewness (Skewness)
+#   kurtosis  - excess kurtosis (Excess Kurtosis)
+#   tstat     - t-stat of the mean over all months (t-stat of Annualized Mean, Ex_Ret t-stat-all)
+#   tstat_5yr - t-stat of the mean over the last 60 months (Ex_Ret t-stat-5yr)
+STATISTICS = ['mean', 'vol', 'sharpe', 'skew', 'kurtosis', 'tstat', 'tstat_5yr']
+
+# Correlation of every column of a with the same column of b over the months both have: Inputs - (..., months,
+# series) arrays a and b. Returns a (..., series) array, same values as np.corrcoef(a[:, i], b[:, i])[0, 1].
+def paired_correlation(a, b):
+    valid = ~np.isnan(a) & ~np.isnan(b)
+    n = valid.sum(axis=-2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xa = np.where(valid, a - (np.where(valid, a, 0).sum(axis=-2)/n)[..., None, :], 0)
+        xb = np.where(valid, b - (np.where(valid, b, 0).sum(axis=-2)/n)[..., None, :], 0)
+        return (xa*xb).sum(axis=-2)/np.sqrt((xa*xa).sum(axis=-2)*(xb*xb).sum(axis=-2))
+
+# Computes the statistics of every series along the month axis: Inputs - returns (..., months, series) array,
+# whether skewness and kurtosis are the biased moment estimators (scipy skew/kurtosis defaults) or the
+# bias-adjusted ones of pandas skew()/kurtosis() (a bool or one bool per series) and months of the trailing t-stat
+# Missing months are skipped, the trailing t-stat uses the last trailing non-missing months of each series.
+# Returns a dict of (..., series) arrays keyed by STATISTICS.
+def return_statistics(returns, bias=False, trailing=60):
+    returns = np.asarray(returns, dtype=np.float64)
+    valid = ~np.isnan(returns)
+    n = valid.sum(axis=-2)
+    bias = np.asarray(bias)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(valid, returns, 0).sum(axis=-2)/n
+        x = np.where(valid, returns - mean[..., None, :], 0)
+        x2 = x*x
+        m2 = x2.sum(axis=-2)/n
+        m3 = (x2*x).sum(axis=-2)/n
+        m4 = (x2*x2).sum(axis=-2)/n
+        std = np.sqrt(m2*n/(n - 1))
+
+        skew = m3/m2**1.5
+        kurtosis = m4/m2**2 - 3
+        skew = np.where(bias, skew, np.sqrt(n*(n - 1))/(n - 2)*skew)
+        kurtosis = np.where(bias, kurtosis, (n - 1)/((n - 2)*(n - 3))*((n + 1)*(kurtosis + 3) - 3*(n - 1)))
+
+        # Trailing t-stat: months counted backwards from the last month, missing months are not counted
+        from_end = np.flip(np.cumsum(np.flip(valid, axis=-2), axis=-2), axis=-2)
+        last = valid & (from_end <= trailing)
+        n_last = last.sum(axis=-2)
+        mean_last = np.where(last, returns, 0).sum(axis=-2)/n_last
+        std_last = np.sqrt((np.where(last, returns - mean_last[..., None, :], 0)**2).sum(axis=-2)/(n_last - 1))
+
+        return {'mean': 100*12*mean,
+                'vol': 100*np.sqrt(12)*std,
+                'sharpe': np.sqrt(12)*mean/std,
+                'skew': skew,
+                'kurtosis': kurtosis,
+                'tstat': mean/(std/np.sqrt(n)),
+                'tstat_5yr': mean_last/(std_last/np.sqrt(n_last))}
+
+# Performance statistics of every column of a return matrix: Inputs - returns (months x series dataframe or array),
+# reference returns of the same shape (adds the correlation of every series with its reference as 'corr'), bias of
+# skewness and kurtosis (see return_statistics) and months of the trailing t-stat
+# Returns a dataframe with one row per series (the columns of returns) and one column per statistic.
+#   stats = performance_stats(Port_Rets[req_columns])
+#   stats = performance_stats(Ex_Ret, reference=Ex_Ret_Auth)
+def performance_stats(returns, reference=None, bias=False, trailing=60):
+    values = np.asarray(returns, dtype=np.float64)
+    stats = pd.DataFrame(return_statistics(values, bias, trailing),
+                         index=returns.columns if isinstance(returns, pd.DataFrame) else None)
+    if reference is not None:
+        stats['corr'] = paired_correlation(values, np.asarray(reference, dtype=np.float64))
+    return stats
@@ -0,0 +1,289 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Columnar artifact store (Parquet, partitioned by year)
+# Akhil Srivastava
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Hive partition column holding the calendar year of each row
+PARTITION_COL = 'part_year'
+
+# Column used to restore the original row order after a partitioned read
+ROW_COL = 'part_row'
+
+# Number of rows per parquet row group (about one month of the CRSP monthly panel)
+ROW_GROUP_SIZE = 8192
+
+# Metadata file stored next to the parquet files (pyarrow ignores files starting with '_')
+META_FILE = '_artifact.json'
+
+# Returns the directory of an artifact: Inputs - data_dir and artifact name
+def artifact_path(data_dir, name):
+    return os.path.join(data_dir, name)
+
+# Returns True if the artifact exists either in the columnar store or as a legacy pickle file
+def artifact_exists(data_dir, name):
+    return (os.path.exists(os.path.join(artifact_path(data_dir, name), META_FILE)) or
+            os.path.exists(os.path.join(data_dir, name + '.pkl')))
+
+# Returns the column names stored in an artifact saved by save_artifact (index columns first): Inputs - data_dir, name
+def artifact_columns(data_dir, name):
+    with open(os.path.join(artifact_path(data_dir, name), META_FILE)) as f:
+        return json.load(f)['columns']
+
+# Returns a fingerprint of the contents of an artifact: Inputs - data_dir and name
+# Used to key caches of derived artifacts without reading the source artifact itself. Artifacts saved by save_artifact
+# carry a hash of their rows, so rewriting the same data keeps the fingerprint. Legacy pickles and artifacts without
+# a stored hash fall back to the file names, sizes and modification times.
+def artifact_fingerprint(data_dir, name):
+    path = artifact_path(data_dir, name)
+    meta_file = os.path.join(path, META_FILE)
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            content_hash = json.load(f).get('content_hash')
+        if content_hash is not None:
+            return content_hash
+
+    if os.path.isdir(path):
+        files = []
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, x) for x in names)
+    else:
+        files = [os.path.join(data_dir, name + '.pkl')]
+
+    fingerprint = []
+    for file in sorted(files):
+        stat = os.stat(file)
+        fingerprint.append([os.path.relpath(file, data_dir), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+# Returns a hash of the column names, dtypes and values of a frame (not of its index): Inputs - df
+# Returns None for frames holding values pandas cannot hash (for example lists)
+def _content_hash(df):
+    digest = hashlib.sha1(json.dumps([[str(x), str(y)] for x, y in df.dtypes.items()]).encode('utf-8'))
+    try:
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    except TypeError:
+        return None
+    return digest.hexdigest()
+
+# Writes the metadata file of an artifact: Inputs - artifact directory and metadata dict
+def _write_meta(path, meta):
+    with open(os.path.join(path, META_FILE + '.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(path, META_FILE + '.tmp'), os.path.join(path, META_FILE))
+
+# Extracts the year of every row from a date-like or year column: Inputs - column values, artifact and column name
+# Every row needs a year, a missing or unparseable date has no partition and is rejected
+def _row_years(values, name, date_col):
+    # Year columns are already integers
+    if pd.api.types.is_integer_dtype(values) or pd.api.types.is_float_dtype(values):
+        years = pd.Series(values).astype('Int16')
+    # Dates can be datetime64 or python date objects/strings depending on the source
+    else:
+        years = pd.to_datetime(pd.Series(values), errors='coerce').dt.year.astype('Int16')
+
+    missing = int(years.isna().sum())
+    if missing > 0:
+        raise ValueError(name + ": " + str(missing) + " rows have a missing or invalid " + date_col +
+                         ", drop them or save the artifact with date_col=None")
+    return years.to_numpy(dtype=np.int16)
+
+# Saves a dataframe as a year-partitioned parquet dataset: Inputs - df, data_dir, artifact name and date column
+# date_col can be a datetime column, a python date column, an integer year column or the name of the index.
+# If date_col is None the artifact is stored as a single unpartitioned file.
+def save_artifact(df, data_dir, name, date_col='date'):
+    path = artifact_path(data_dir, name)
+    tmp_path = path + '.tmp'
+
+    # Named indices (for example date indexed monthly series) are stored as regular columns
+    index_cols = [x for x in df.index.names if x is not None]
+    if len(index_cols) > 0:
+        df = df.reset_index()
+
+    # Partition only if the date column exists in the frame
+    if date_col is not None and date_col not in df.columns:
+        date_col = None
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column(ROW_COL, pa.array(np.arange(len(df), dtype=np.int64)))
+    if date_col is not None:
+        table = table.append_column(PARTITION_COL, pa.array(_row_years(df[date_col].values, name, date_col)))
+
+    # Write into a temporary directory and swap, so a failed write never leaves a half-written artifact
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    if date_col is not None:
+        # Sort by year and date so that every row group covers a narrow date range (enables row group skipping)
+        table = table.sort_by([(PARTITION_COL, 'ascending'), (date_col, 'ascending')])
+        partitioning = ds.partitioning(pa.schema([(PARTITION_COL, pa.int16())]), flavor='hive')
+        ds.write_dataset(table, tmp_path, format='parquet', partitioning=partitioning,
+                         basename_template='part-{i}.parquet', existing_data_behavior='overwrite_or_ignore',
+                         min_rows_per_group=ROW_GROUP_SIZE, max_rows_per_group=ROW_GROUP_SIZE)
+    else:
+        ds.write_dataset(table, tmp_path, format='parquet', basename_template='part-{i}.parquet',
+                         min_rows_per_group=ROW_GROUP_SIZE, max_rows_per_group=ROW_GROUP_SIZE)
+
+    # Store artifact metadata used by the loader and the content hash used by artifact_fingerprint
+    meta = {'date_col': date_col, 'index_cols': index_cols, 'columns': list(df.columns),
+            'content_hash': _content_hash(df)}
+    _write_meta(tmp_path, meta)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+# Appends rows to an artifact saved by save_artifact: Inputs - df with the same columns, data_dir and artifact name
+# Only the year partitions touched by the new rows are rewritten, so appending one month does not rewrite the history.
+# Appended rows are loaded after all the existing rows.
+def append_artifact(df, data_dir, name):
+    path = artifact_path(data_dir, name)
+    with open(os.path.join(path, META_FILE)) as f:
+        meta = json.load(f)
+    date_col = meta['date_col']
+
+    # Unpartitioned artifacts are small, simply rewrite them
+    if date_col is None:
+        save_artifact(pd.concat([load_artifact(data_dir, name), df]), data_dir, name, date_col=None)
+        return
+
+    if len(meta['index_cols']) > 0:
+        df = df.reset_index()
+    df = df[meta['columns']]
+    years = _row_years(df[date_col].values, name, date_col)
+
+    # New rows are numbered after the existing ones so that the original order is kept on load
+    partitioning = ds.partitioning(pa.schema([(PARTITION_COL, pa.int16())]), flavor='hive')
+    dataset = ds.dataset(path, format='parquet', partitioning=partitioning)
+    row_order = dataset.to_table(columns=[ROW_COL])[ROW_COL]
+    first_row = 0 if len(row_order) == 0 else pa.compute.max(row_order).as_py() + 1
+
+    # Arrow schema of the stored files (without the hive partition column)
+    schema = pa.schema([x for x in dataset.schema if x.name != PARTITION_COL])
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column(ROW_COL, pa.array(np.arange(first_row, first_row + len(df), dtype=np.int64)))
+    table = table.cast(schema)
+
+    for year in pd.unique(years):
+        year_path = os.path.join(path, PARTITION_COL + '=' + str(year))
+        new_rows = table.filter(pa.array(years == year))
+        if os.path.exists(year_path):
+            new_rows = pa.concat_tables([ds.dataset(year_path, format='parquet').to_table().cast(schema), new_rows])
+        new_rows = new_rows.sort_by([(date_col, 'ascending')])
+
+        # Write the partition into a temporary directory and swap
+        tmp_path = year_path + '.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        pq.write_table(new_rows, os.path.join(tmp_path, 'part-0.parquet'), row_group_size=ROW_GROUP_SIZE)
+        if os.path.exists(year_path):
+            shutil.rmtree(year_path)
+        os.replace(tmp_path, year_path)
+
+    # Chain the content hash with the hash of the appended rows
+    new_hash = _content_hash(df)
+    if meta.get('content_hash') is not None and new_hash is not None:
+        meta['content_hash'] = hashlib.sha1((meta['content_hash'] + new_hash).encode('utf-8')).hexdigest()
+    else:
+        meta['content_hash'] = None
+    _write_meta(path, meta)
+
+# Converts a date bound to a pyarrow scalar comparable with the stored date column: Inputs - value and arrow type
+def _date_scalar(value, arrow_type):
+    value = pd.Timestamp(value)
+    if pa.types.is_date(arrow_type):
+        return pa.scalar(value.date(), type=arrow_type)
+    if pa.types.is_timestamp(arrow_type):
+        return pa.scalar(value.to_pydatetime(), type=pa.timestamp('us')).cast(arrow_type)
+    if pa.types.is_integer(arrow_type):
+        return pa.scalar(value.year, type=arrow_type)
+    return pa.scalar(value.strftime('%Y-%m-%d'), type=arrow_type)
+
+# Builds the pyarrow filter expression for a date range: Inputs - dataset, date column, start and end dates
+def _date_filter(dataset, date_col, start, end):
+    expr = None
+    arrow_type = dataset.schema.field(date_col).type
+    if start is not None:
+        # Partition pruning on the year, then row group pruning on the date itself
+        cond = (ds.field(PARTITION_COL) >= pd.Timestamp(start).year) & \
+               (ds.field(date_col) >= _date_scalar(start, arrow_type))
+        expr = cond
+    if end is not None:
+        cond = (ds.field(PARTITION_COL) <= pd.Timestamp(end).year) & \
+               (ds.field(date_col) <= _date_scalar(end, arrow_type))
+        expr = cond if expr is None else expr & cond
+    return expr
+
+# Loads an artifact saved by save_artifact: Inputs - data_dir, artifact name, required columns and date range
+# Only the requested columns are read and, for partitioned artifacts, only the years/row groups in [start, end].
+# Falls back to the legacy pickle file if the artifact has not been migrated to the columnar store yet.
+def load_artifact(data_dir, name, columns=None, start=None, end=None):
+    path = artifact_path(data_dir, name)
+    meta_file = os.path.join(path, META_FILE)
+
+    if not os.path.exists(meta_file):
+        return _load_legacy_pickle(data_dir, name, columns, start, end)
+
+    with open(meta_file) as f:
+        meta = json.load(f)
+    date_col = meta['date_col']
+    index_cols = meta['index_cols']
+
+    if date_col is not None:
+        partitioning = ds.partitioning(pa.schema([(PARTITION_COL, pa.int16())]), flavor='hive')
+        dataset = ds.dataset(path, format='parquet', partitioning=partitioning)
+    else:
+        dataset = ds.dataset(path, format='parquet')
+
+    # Column projection: always keep the index columns and the row order column
+    if columns is None:
+        read_cols = list(meta['columns'])
+    else:
+        read_cols = [x for x in index_cols if x not in columns] + list(columns)
+    read_cols = read_cols + [ROW_COL]
+
+    # Predicate pushdown on the date range
+    row_filter = None
+    if date_col is not None and (start is not None or end is not None):
+        row_filter = _date_filter(dataset, date_col, start, end)
+
+    table = dataset.to_table(columns=read_cols, filter=row_filter)
+
+    # Restore the original row order (rows are stored sorted by year and date) and convert to pandas
+    order = np.argsort(table[ROW_COL].to_numpy(), kind='stable')
+    table = table.take(order).drop_columns([ROW_COL])
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+
+    # Restore the index
+    if len(index_cols) > 0:
+        df = df.set_index(index_cols)
+
+    return df
+
+# Loads a legacy pickle artifact and applies the same column/date selection in memory
+def _load_legacy_pickle(data_dir, name, columns, start, end):
+    df = pd.read_pickle(os.path.join(data_dir, name + '.pkl'))
+    has_date = ('date' in df.columns) or ('date' in df.index.names)
+    if has_date and (start is not None or end is not None):
+        dates = df['date'] if 'date' in df.columns else df.index.get_level_values('date')
+        dates = pd.to_datetime(pd.Series(dates, index=df.index))
+        keep = pd.Series(True, index=df.index)
+        if start is not None:
+            keep &= dates >= pd.Timestamp(start)
+        if end is not None:
+            keep &= dates <= pd.Timestamp(end)
+        df = df[keep.values]
+    if columns is not None:
+        df = df[[x for x in columns if x in df.columns]]
+    return df
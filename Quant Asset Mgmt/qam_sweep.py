@@ -0,0 +1,110 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Parameter-grid sweeps of the PS2 risk parity backtest
+# Akhil Srivastava
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from qam_calendar import year_month_id
+from qam_riskparity import trailing_covariance, erc_weights
+from qam_rolling import trailing_std
+from qam_stats import return_statistics
+
+# Stat columns of the sweep results, same names as the PS2-Q4 table
+STAT_COLUMNS = {'mean': 'Annualized Mean', 'tstat': 't-stat of Annualized Mean', 'vol': 'Annualized Standard Deviation',
+                'sharpe': 'Annualized Sharpe Ratio', 'skew': 'Skewness', 'kurtosis': 'Excess Kurtosis'}
+
+# Risk parity weights of every month for one window length: Inputs - (months x 2) stock and bond excess returns,
+# weighting rule ('inverse_vol' or 'erc') and window length. Weights are unnormalized (inverse sigma hat for
+# 'inverse_vol'), NaN for months without a full window of both asset classes.
+def risk_parity_weights(returns, weighting, window):
+    sigma = trailing_std(returns, window)
+    if weighting == 'inverse_vol':
+        return 1/sigma
+    if weighting == 'erc':
+        weights = erc_weights(trailing_covariance(returns, window))
+        weights[np.isnan(sigma)] = np.nan
+        return weights
+    raise ValueError("Unknown risk parity weighting " + repr(weighting) + ", expected 'inverse_vol' or 'erc'")
+
+# Evaluates every weighting, rebalance frequency and volatility target of one window length (one sweep task):
+# Inputs - month ids, (months x 2) stock and bond excess returns, value-weighted excess
+# return, report mask, window length and the grids. Returns one row per configuration and RP portfolio.
+def _sweep_window(month, returns, vw_returns, report, window, weightings, rebalance_months, vol_targets):
+    rows = []
+    columns = []
+    for weighting in weightings:
+        weights = risk_parity_weights(returns, weighting, window)
+        # PS2-Q3 keeps the months with both weights, both returns and the value-weighted return
+        valid = np.isfinite(weights).all(axis=1) & np.isfinite(returns).all(axis=1) & np.isfinite(vw_returns)
+        positions = np.flatnonzero(valid)
+
+        for rebalance in rebalance_months:
+            # Hold the weights of the latest rebalance month (months since January 1926 divisible by the frequency,
+            # so quarterly, semi-annual and annual rebalances fall in January)
+            rebalanced = (month[positions] - 1) % rebalance == 0
+            latest = np.maximum.accumulate(np.where(rebalanced, np.arange(len(positions)), -1))
+            held = positions[latest >= 0]
+            w = weights[positions[latest[latest >= 0]]]
+
+            port = np.full(len(month), np.nan)
+            port[held] = (w*returns[held]).sum(axis=1)
+            unlevered = np.full(len(month), np.nan)
+            unlevered[held] = port[held]/w.sum(axis=1)
+            rows.append((window, weighting, rebalance, None, 'unlevered RP'))
+            columns.append(unlevered)
+
+            # Levered k matches the volatility of the target over all held months, as in PS2-Q3
+            for vol_target in vol_targets:
+                if vol_target == 'vw':
+                    target = vw_returns
+                else:
+                    target = vol_target*returns[:, 0] + (1 - vol_target)*returns[:, 1]
+                k = np.std(target[held], ddof=1)/np.std(port[held], ddof=1)
+                rows.append((window, weighting, rebalance, vol_target, 'levered RP'))
+                columns.append(k*port)
+
+    returns = np.column_stack(columns)[report]
+    stats = return_statistics(returns)
+    result = pd.DataFrame(rows, columns=['window', 'weighting', 'rebalance_months', 'vol_target', 'portfolio'])
+    for stat, col in STAT_COLUMNS.items():
+        result[col] = stats[stat]
+    result['Months'] = (~np.isnan(returns)).sum(axis=0)
+    return result
+
+# Runs the PS2 risk parity backtest for every combination of the grids and returns the PS2-Q4 stats of each:
+# Inputs - Monthly_CRSP_Universe (PS2-Q2 output), window lengths in months, weighting rules ('inverse_vol', 'erc'),
+#          rebalance frequencies in months, volatility targets of the levered RP ('vw' matches the value-weighted
+#          portfolio, a number s matches the s/(1-s) stock/bond mix, e.g. 0.6 for the 60/40 portfolio),
+#          first and last reported (year, month) and number of worker processes (1 runs in this process)
+# Returns a tidy dataframe with one row per configuration and portfolio (the unlevered RP does not depend on the
+# volatility target, its vol_target is missing). window=36, 'inverse_vol', rebalance 1 and 'vw' reproduce
+# PS2_Q3 and PS2_Q4. Window lengths are spread over a process pool, everything else of a window is vectorized.
+def risk_parity_sweep(Monthly_CRSP_Universe, windows=(36,), weightings=('inverse_vol',), rebalance_months=(1,),
+                      vol_targets=('vw',), report_start=None, report_end=None, processes=None):
+    universe = Monthly_CRSP_Universe.sort_values(by=['month_id']).reset_index(drop=True)
+    month = universe['month_id'].values.astype(np.int64)
+    returns = universe[['Stock_Excess_Vw_Ret', 'Bond_Excess_Vw_Ret']].values.astype(np.float64)
+    vw_returns = np.average(returns, weights=universe[['Stock_lag_MV', 'Bond_lag_MV']].values, axis=1)
+
+    report = np.ones(len(month), dtype=bool)
+    if report_start is not None:
+        report &= month >= year_month_id(*report_start)
+    if report_end is not None:
+        report &= month <= year_month_id(*report_end)
+
+    tasks = [(month, returns, vw_returns, report, window, tuple(weightings), tuple(rebalance_months),
+              tuple(vol_targets)) for window in windows]
+    if processes is None:
+        processes = min(len(tasks), os.cpu_count() or 1)
+    if processes <= 1:
+        results = list(itertools.starmap(_sweep_window, tasks))
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_sweep_window, *zip(*tasks)))
+
+    return pd.concat(results, ignore_index=True)
@@ -0,0 +1,350 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Seeded synthetic CRSP/Compustat data with the shapes of the WRDS downloads
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+from qam_calendar import year_month_id, month_end
+
+# Number of permnos and Treasury issues at scale 1 (about the size of the full CRSP monthly history)
+BASE_PERMNOS = 30000
+BASE_BONDS = 3000
+
+# Mean listing length in months of a permno and a Treasury issue
+MEAN_PERMNO_MONTHS = 130
+MEAN_BOND_MONTHS = 60
+
+# Share of permnos that are an additional share class of another permno's permco
+MULTI_CLASS_SHARE = 0.04
+
+# Share of permnos already listed (on the NYSE) in the first month, CRSP starts with about 500 NYSE stocks
+INITIAL_SHARE = 0.02
+
+# First years of AMEX and NASDAQ coverage in CRSP
+AMEX_START_YEAR = 1962
+NASDAQ_START_YEAR = 1972
+
+# CRSP delisting codes of firms that stop trading before the end of the sample (mergers, exchanges, dropped)
+DELIST_CODES = [231, 233, 241, 331, 500, 520, 551, 552, 560, 574, 580, 584]
+DELIST_CODE_PROBS = [0.25, 0.05, 0.1, 0.05, 0.05, 0.1, 0.05, 0.1, 0.05, 0.05, 0.05, 0.1]
+
+# Returns the last trading day of every month (month end moved back to Friday on weekends): Inputs - month index
+def _trading_month_end(months):
+    dates = pd.DatetimeIndex(pd.to_datetime({'year': months//12, 'month': months % 12 + 1, 'day': 1}) +
+                             pd.offsets.MonthEnd(0))
+    weekend_days = np.maximum(dates.dayofweek.values - 4, 0)
+    return (dates - pd.to_timedelta(weekend_days, unit='D')).values
+
+# Expands per-unit start months and lengths into long (unit, month) rows: Inputs - start months and lengths
+# Returns the unit position and month index of every row, and the position of the row within its unit
+def _expand(starts, lengths):
+    unit = np.repeat(np.arange(len(starts)), lengths)
+    first_row = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    age = np.arange(len(unit)) - first_row
+    return unit, starts[unit] + age, age
+
+# Draws listing start months and lengths of n units over [first_month, last_month]: Inputs - rng, n, month range,
+# mean length and growth (listings become more frequent over time, like the CRSP universe)
+def _listings(rng, n, first_month, last_month, mean_months, growth=3.0):
+    n_months = last_month - first_month + 1
+    weights = 1 + growth*np.arange(n_months)/n_months
+    starts = first_month + rng.choice(n_months, size=n, p=weights/weights.sum())
+    lengths = np.maximum(rng.geometric(1/mean_months, size=n), 1)
+    lengths = np.minimum(lengths, last_month - starts + 1)
+    return starts, lengths
+
+# Returns 6 digit code strings (SIC/NAICS like) with a share of missing values: Inputs - rng, values and missing share
+def _codes(rng, values, missing=0.0):
+    codes = pd.Series(values).astype(str).str.zfill(6).astype(object)
+    codes[rng.random(len(values)) < missing] = None
+    return codes.values
+
+# Generates the stock universe: Inputs - rng, scale, first and last month index
+# Returns a dict of per-permno attributes (identifiers, listing months, codes and return model parameters)
+def _stock_universe(rng, scale, first_month, last_month):
+    n_permno = max(int(round(BASE_PERMNOS*scale)), 10)
+    starts, lengths = _listings(rng, n_permno, first_month, last_month, MEAN_PERMNO_MONTHS)
+    initial = rng.random(n_permno) < INITIAL_SHARE
+    starts[initial] = first_month
+    lengths[initial] = np.minimum(4*lengths[initial], last_month - first_month + 1)
+
+    # Exchange at listing: only NYSE before the AMEX and NASDAQ coverage starts
+    exchcd = rng.choice([1, 2, 3, 4, 0], size=n_permno, p=[0.3, 0.15, 0.5, 0.03, 0.02])
+    before_nasdaq = starts < NASDAQ_START_YEAR*12
+    exchcd[before_nasdaq] = rng.choice([1, 2], size=before_nasdaq.sum(), p=[0.7, 0.3])
+    exchcd[starts < AMEX_START_YEAR*12] = 1
+
+    # Permnos are unique 5 digit (and wider at large scales) identifiers
+    permno = 10000 + np.sort(rng.choice(max(90000, 3*n_permno), size=n_permno, replace=False))
+
+    # Permnos are grouped into permcos: a share of them is another class of a firm listed around the same time
+    order = np.argsort(starts, kind='stable')
+    permco = np.empty(n_permno, dtype=np.int64)
+    permco[order] = 50000 + np.arange(n_permno)
+    extra_class = rng.random(n_permno) < MULTI_CLASS_SHARE
+    extra_class[order[0]] = False
+    previous = np.empty(n_permno, dtype=np.int64)
+    previous[order[1:]] = order[:-1]
+    permco[extra_class] = permco[previous[extra_class]]
+
+    firms = {'permno': permno,
+             'permco': permco,
+             'start': starts,
+             'length': lengths,
+             'shrcd': rng.choice([10, 11, 12, 31, 73], size=n_permno, p=[0.25, 0.6, 0.05, 0.05, 0.05]),
+             'exchcd': exchcd,
+             'siccd': rng.integers(100, 9999, size=n_permno),
+             'naics': rng.integers(111110, 928120, size=n_permno),
+             'beta': rng.normal(1.0, 0.4, size=n_permno),
+             'vol': np.exp(rng.normal(np.log(0.1), 0.5, size=n_permno)),
+             'price0': np.exp(rng.normal(3.0, 1.0, size=n_permno)),
+             'shrout0': np.exp(rng.normal(9.0, 1.5, size=n_permno)),
+             'div_payer': rng.random(n_permno) < 0.4,
+             'delisted': starts + lengths - 1 < last_month}
+    return firms
+
+# Generates the monthly market excess return and risk-free rate: Inputs - rng and number of months
+def _market(rng, n_months):
+    # Fat tailed market with occasional crash months
+    mkt = 0.006 + 0.045*rng.standard_t(5, size=n_months)/np.sqrt(5/3)
+    mkt[rng.random(n_months) < 0.01] -= 0.15
+    rf = np.maximum(0.003 + 0.002*rng.standard_normal(n_months), 0)
+    return mkt, rf
+
+# Generates the raw monthly stock file (crspq.msf joined with crspq.msenames): Inputs - rng, firms, market returns,
+# trading dates and first month index
+def _msf(rng, firms, mkt, rf, trading_dates, first_month):
+    unit, month, age = _expand(firms['start'], firms['length'])
+    n = len(unit)
+    t = month - first_month
+
+    # Returns from a one factor model with firm specific fat tailed noise
+    idio = firms['vol'][unit]*rng.standard_t(4, size=n)/np.sqrt(2)
+    ret = np.maximum(rf[t] + firms['beta'][unit]*mkt[t] + idio, -0.95)
+    dividend = np.where(firms['div_payer'][unit] & (month % 3 == 2), np.abs(rng.normal(0.005, 0.002, size=n)), 0)
+    retx = ret - dividend
+
+    # Prices follow the ex-dividend returns within each permno
+    log_growth = np.log1p(retx)
+    cum_growth = np.cumsum(log_growth)
+    first_row = np.repeat(np.cumsum(firms['length']) - firms['length'], firms['length'])
+    log_price = np.log(firms['price0'][unit]) + cum_growth - cum_growth[first_row] + log_growth[first_row]
+    prc = np.round(np.exp(log_price), 4)
+    # Negative prices are bid/ask averages of months without a closing price
+    prc[rng.random(n) < 0.05] *= -1
+
+    # Shares outstanding (in thousands) grow in steps every two years
+    shrout = np.round(firms['shrout0'][unit]*(1 + 0.02*(age//24)))
+
+    msf = pd.DataFrame({'permno': firms['permno'][unit],
+                        'permco': firms['permco'][unit],
+                        'date': trading_dates[t],
+                        'shrcd': firms['shrcd'][unit].astype(float),
+                        'exchcd': firms['exchcd'][unit].astype(float),
+                        'siccd': firms['siccd'][unit].astype(float),
+                        'naics': _codes(rng, firms['naics'][unit]),
+                        'ret': ret,
+                        'retx': retx,
+                        'shrout': shrout,
+                        'prc': prc,
+                        'cfacshr': 1.0,
+                        'cfacpr': 1.0})
+
+    # The first month of a permno usually has no return, and a few months have missing data
+    no_ret = ((age == 0) & (rng.random(n) < 0.3)) | (rng.random(n) < 0.002)
+    msf.loc[no_ret, ['ret', 'retx']] = np.nan
+    msf.loc[rng.random(n) < 0.001, 'prc'] = np.nan
+    # Months without a matching msenames record have no share or exchange code
+    no_names = rng.random(n) < 0.005
+    msf.loc[no_names, ['shrcd', 'exchcd', 'siccd', 'naics']] = np.nan
+    msf.loc[rng.random(n) < 0.001, 'shrout'] = np.nan
+
+    return msf
+
+# Generates the raw delisting file (crspq.msedelist joined with crspq.msenames): Inputs - rng, firms, trading dates
+# and first/last month index. Active permnos get code 100 at the end of the sample like in CRSP.
+def _msedelist(rng, firms, trading_dates, first_month, last_month):
+    n = len(firms['permno'])
+    last = firms['start'] + firms['length'] - 1
+    delisted = firms['delisted']
+
+    # Delisting dates fall on the last trading day, some in the month after the last monthly record
+    late = delisted & (rng.random(n) < 0.1) & (last < last_month)
+    dl_month = np.where(late, last + 1, last)
+    dlstdt = trading_dates[dl_month - first_month]
+
+    dlstcd = np.where(delisted, rng.choice(DELIST_CODES, size=n, p=DELIST_CODE_PROBS), 100)
+    performance = (dlstcd >= 500)
+    dlret = np.where(performance, np.maximum(rng.normal(-0.3, 0.3, size=n), -1.0), rng.normal(0.0, 0.05, size=n))
+    # Active permnos have no delisting return, and a share of performance delistings miss it
+    dlret[(dlstcd == 100) | (performance & (rng.random(n) < 0.3))] = np.nan
+
+    return pd.DataFrame({'permno': firms['permno'],
+                         'permco': firms['permco'],
+                         'dlret': dlret,
+                         'dlretx': dlret,
+                         'dlstdt': dlstdt,
+                         'dlstcd': dlstcd,
+                         'dlexchcd': firms['exchcd'].astype(float),
+                         'dlsiccd': firms['siccd'].astype(float),
+                         'dlnaics': _codes(rng, firms['naics'])})
+
+# Generates the Compustat annual fundamentals (comp.funda joined with comp.names) and the CRSP-Compustat link table
+# (crspq.ccmxpf_linktable, L* link types with primary links only): Inputs - rng, firms, trading dates and month range
+def _compustat(rng, firms, trading_dates, first_month, last_month):
+    permco, first = np.unique(firms['permco'], return_index=True)
+    permco_start = pd.Series(firms['start']).groupby(firms['permco']).min().values
+    permco_end = pd.Series(firms['start'] + firms['length'] - 1).groupby(firms['permco']).max().values
+
+    # Most operating companies are covered by Compustat, coverage starts in 1950
+    covered = (rng.random(len(permco)) < 0.85) & (permco_end >= 1950*12)
+    gvkey_num = 1000 + np.arange(len(permco))
+    gvkey = pd.Series(gvkey_num).astype(str).str.zfill(6).values
+
+    # One annual record per fiscal year, fiscal years end in December for most firms
+    cov = np.flatnonzero(covered)
+    first_year = np.maximum(permco_start[cov]//12 - rng.integers(0, 3, size=len(cov)), 1950)
+    last_year = np.minimum(permco_end[cov]//12, last_month//12)
+    n_years = np.maximum(last_year - first_year + 1, 1)
+    fyr = rng.choice([12, 6, 9, 3], size=len(cov), p=[0.7, 0.1, 0.1, 0.1])
+    unit, year, _ = _expand(first_year, n_years)
+    n = len(unit)
+
+    datadate = pd.to_datetime({'year': year, 'month': fyr[unit], 'day': 1}) + pd.offsets.MonthEnd(0)
+    at = np.round(np.exp(rng.normal(5.0, 2.0, size=len(cov)))[unit]*np.exp(rng.normal(0, 0.2, size=n)), 3)
+    seq = np.round(at*rng.uniform(-0.05, 0.6, size=n), 3)
+    pstk = np.where(rng.random(n) < 0.8, 0.0, np.round(at*rng.uniform(0, 0.05, size=n), 3))
+    txditc = np.round(at*rng.uniform(0, 0.03, size=n), 3)
+
+    cstat = pd.DataFrame({'gvkey': gvkey[cov][unit],
+                          'datadate': datadate.values,
+                          'at': at,
+                          'pstkl': pstk,
+                          'txditc': txditc,
+                          'fyear': np.where(fyr[unit] >= 6, year, year - 1).astype(float),
+                          'ceq': seq - pstk,
+                          'lt': at - seq,
+                          'mib': np.round(at*rng.uniform(0, 0.02, size=n), 3),
+                          'itcb': np.round(txditc*0.1, 3),
+                          'txdb': np.round(txditc*0.9, 3),
+                          'pstkrv': pstk,
+                          'seq': seq,
+                          'pstk': pstk,
+                          'sic': _codes(rng, rng.integers(100, 9999, size=len(cov)))[unit],
+                          'year1': first_year[unit].astype(float),
+                          'naics': _codes(rng, rng.integers(111110, 928120, size=len(cov)), 0.2)[unit]})
+    # Missing items exercise the preferred stock and deferred tax fallbacks
+    cstat.loc[rng.random(n) < 0.3, 'pstkrv'] = np.nan
+    cstat.loc[rng.random(n) < 0.4, 'pstkl'] = np.nan
+    cstat.loc[rng.random(n) < 0.2, 'txditc'] = np.nan
+    cstat.loc[rng.random(n) < 0.05, 'seq'] = np.nan
+
+    # One link per permno of a covered permco, the first permno of a multi-class permco is the primary link
+    linked = covered[np.searchsorted(permco, firms['permco'])]
+    idx = np.flatnonzero(linked)
+    co = np.searchsorted(permco, firms['permco'][idx])
+    primary = np.isin(idx, first)
+    start = firms['start'][idx]
+    end = firms['start'][idx] + firms['length'][idx] - 1
+    link = pd.DataFrame({'gvkey': gvkey[co],
+                         'permno': firms['permno'][idx],
+                         'permco': firms['permco'][idx],
+                         'linktype': rng.choice(['LC', 'LU', 'LS'], size=len(idx), p=[0.75, 0.2, 0.05]).astype(object),
+                         'linkprim': np.where(primary, 'P', 'C').astype(object),
+                         'liid': np.where(primary, '01', '02').astype(object),
+                         'linkdt': trading_dates[np.maximum(start - rng.integers(0, 24, size=len(idx)), first_month) -
+                                                 first_month],
+                         'linkenddt': trading_dates[end - first_month]})
+    # Links of active permnos are open ended
+    link.loc[end == last_month, 'linkenddt'] = pd.NaT
+
+    # Some permnos have an older LU link overlapping the LC link for a few months (the link cleaning keeps LC)
+    overlap = (rng.random(len(link)) < 0.05) & (link['linktype'] == 'LC').values
+    old_link = link[overlap].copy()
+    old_link['linktype'] = 'LU'
+    old_link['linkenddt'] = trading_dates[np.minimum(start[overlap] + rng.integers(1, 12, size=overlap.sum()),
+                                                     last_month) - first_month]
+    link = pd.concat([link, old_link], ignore_index=True)
+
+    return cstat, link
+
+# Generates the CRSP Treasury monthly file (crspq.tfz_mth) and the t-bill index file (crspq.mcti):
+# Inputs - rng, scale, risk-free rate, trading dates and month range
+def _treasury(rng, scale, rf, trading_dates, first_month, last_month):
+    n_bonds = max(int(round(BASE_BONDS*scale)), 10)
+    starts, lengths = _listings(rng, n_bonds, first_month, last_month, MEAN_BOND_MONTHS, growth=1.0)
+    unit, month, _ = _expand(starts, lengths)
+    n = len(unit)
+
+    maturity = trading_dates[np.minimum(starts + lengths, last_month) - first_month]
+    coupon = rng.integers(100, 1500, size=n_bonds)*0.0005
+    kycrspid = (pd.Series(pd.DatetimeIndex(maturity).strftime('%Y%m%d')) + '.' +
+                pd.Series(np.round(coupon*100, 4)).map('{:07.4f}'.format).str.replace('.', '', regex=False)).values
+
+    tfz = pd.DataFrame({'kycrspid': kycrspid[unit],
+                        'mcaldt': trading_dates[month - first_month],
+                        'tmretnua': rf[month - first_month] + rng.normal(0.001, 0.015, size=n),
+                        'tmtotout': np.round(np.exp(rng.normal(8.0, 1.0, size=n_bonds))[unit])})
+    tfz.loc[rng.random(n) < 0.02, 'tmretnua'] = np.nan
+
+    mcti = pd.DataFrame({'caldt': trading_dates,
+                         't30ret': rf,
+                         't90ret': rf + np.abs(rng.normal(0.0003, 0.0002, size=len(rf)))})
+    return tfz, mcti
+
+# Generates Fama-French style factor files from the synthetic market: Inputs - rng, market and risk-free returns,
+# and month range. Returns the PS1-PS3 layout (ff3_monthly) and the PS4 layout with decile portfolios (ffm).
+def _fama_french(rng, mkt, rf, first_month, last_month):
+    months = np.arange(first_month, last_month + 1)
+    n = len(months)
+    smb = 0.002 + 0.03*rng.standard_normal(n)
+    hml = 0.003 + 0.03*rng.standard_normal(n)
+
+    ids = year_month_id(months//12, months % 12 + 1)
+
+    ff3 = pd.DataFrame({'month_id': ids, 'Year': months//12, 'Month': months % 12 + 1, 'Market_minus_Rf': mkt,
+                        'SMB': smb, 'HML': hml, 'Rf': rf})
+
+    ffm = pd.DataFrame({'date': month_end(ids), 'month_id': ids, 'SMB': smb, 'HML': hml, 'RF': rf})
+    for i in range(1, 11):
+        ffm['BM' + str(i)] = rf + mkt + (i - 5.5)/4.5*hml/2 + 0.01*rng.standard_normal(n)
+    for i in range(1, 11):
+        ffm['ME' + str(i)] = rf + mkt - (i - 5.5)/4.5*smb/2 + 0.01*rng.standard_normal(n)
+    return ff3, ffm
+
+# Generates a synthetic CRSP/Compustat dataset with the columns of the WRDS downloads of PS1-PS4:
+# Inputs - scale (1 is about the full CRSP monthly history, 5 and 20 for stress tests), seed and year range
+# Returns a dict of frames:
+#   mcrsp_raw, dlret_raw         - PS1 stock and delisting files
+#   mscrsp_raw, msdelcrsp_raw    - PS2-PS4 stock and delisting files (PS4 columns, PS2/PS3 use a subset)
+#   tfz_mth, mcti                - PS2 Treasury and t-bill files
+#   cstat, link                  - PS4 Compustat fundamentals and CRSP-Compustat link table
+#   ff3_monthly, ffm             - Fama-French factors in the PS1-PS3 and PS4 layouts
+# The same seed and scale always give the same data.
+def generate_crsp_compustat(scale=1.0, seed=0, start_year=1926, end_year=2023):
+    rng = np.random.default_rng(seed)
+    first_month = start_year*12
+    last_month = end_year*12 + 11
+    trading_dates = _trading_month_end(np.arange(first_month, last_month + 1))
+
+    mkt, rf = _market(rng, last_month - first_month + 1)
+    firms = _stock_universe(rng, scale, first_month, last_month)
+    msf = _msf(rng, firms, mkt, rf, trading_dates, first_month)
+    msedelist = _msedelist(rng, firms, trading_dates, first_month, last_month)
+    cstat, link = _compustat(rng, firms, trading_dates, first_month, last_month)
+    tfz_mth, mcti = _treasury(rng, scale, rf, trading_dates, first_month, last_month)
+    ff3_monthly, ffm = _fama_french(rng, mkt, rf, first_month, last_month)
+
+    return {'mcrsp_raw': msf[['permno', 'permco', 'date', 'shrcd', 'exchcd', 'ret', 'retx', 'shrout', 'prc',
+                              'cfacshr', 'cfacpr']],
+            'dlret_raw': msedelist[['permno', 'dlret', 'dlstdt', 'dlstcd']],
+            'mscrsp_raw': msf[['permno', 'permco', 'date', 'shrcd', 'exchcd', 'siccd', 'naics', 'ret', 'retx',
+                               'shrout', 'prc']],
+            'msdelcrsp_raw': msedelist,
+            'tfz_mth': tfz_mth,
+            'mcti': mcti,
+            'cstat': cstat,
+            'link': link,
+            'ff3_monthly': ff3_monthly,
+            'ffm': ffm}
@@ -0,0 +1,187 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Partitioned, parallel and resumable WRDS extraction
+# Akhil Srivastava
+
+import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# Splits the calendar into [start, end] date partitions of years_per_partition years each:
+# Inputs - first year, last year (defaults to the current year) and partition length in years
+def date_partitions(start_year=1925, end_year=None, years_per_partition=5):
+    if end_year is None:
+        end_year = datetime.date.today().year
+
+    partitions = []
+    for year in range(start_year, end_year + 1, years_per_partition):
+        last_year = min(year + years_per_partition - 1, end_year)
+        partitions.append((str(year) + '-01-01', str(last_year) + '-12-31'))
+
+    return partitions
+
+# Bounded pool of database connections shared by the download threads: Inputs - connection factory and pool size
+# Connections are created lazily, and a connection that raised an error is closed instead of being reused,
+# because the most common failure is a dropped WRDS session.
+class ConnectionPool:
+    def __init__(self, connect, size):
+        self.connect = connect
+        self.idle = queue.Queue()
+        self.slots = threading.Semaphore(size)
+
+    def acquire(self):
+        self.slots.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = self.connect()
+        except Exception:
+            self.slots.release()
+            raise
+        return conn
+
+    def release(self, conn, broken=False):
+        if broken:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        else:
+            self.idle.put(conn)
+        self.slots.release()
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+# Returns the checkpoint file of one partition: Inputs - checkpoint directory, artifact name and partition bounds
+def _checkpoint_file(checkpoint_dir, name, partition):
+    return os.path.join(checkpoint_dir, name, partition[0] + '_' + partition[1] + '.pkl')
+
+# Returns the date a checkpoint was fetched: Inputs - checkpoint file
+# The date is stored next to the checkpoint, older checkpoints without it fall back to the file modification date
+def _fetch_date(checkpoint_file):
+    try:
+        with open(checkpoint_file + '.json') as f:
+            return datetime.date.fromisoformat(json.load(f)['fetched'])
+    except (OSError, ValueError, KeyError):
+        return datetime.date.fromtimestamp(os.path.getmtime(checkpoint_file))
+
+# Returns True if a partition has to be fetched again: Inputs - checkpoint file and partition bounds
+# A checkpoint is only final if it was fetched after the end of its partition. The partition holding the current
+# date is still receiving new months, so its checkpoint expires and it is fetched again on the next run.
+def _is_stale(checkpoint_file, partition):
+    if not os.path.exists(checkpoint_file):
+        return True
+    return _fetch_date(checkpoint_file) <= datetime.date.fromisoformat(partition[1])
+
+# Fetches one partition and checkpoints it to disk: Inputs - pool, query template, partition and retry count
+# Failures to connect and failed queries are both retried, a connection is only dropped after it raised an error
+def _fetch_partition(pool, query, partition, checkpoint_file, retries):
+    sql = query.format(start=partition[0], end=partition[1])
+    last_error = None
+    for _ in range(retries + 1):
+        conn = None
+        try:
+            conn = pool.acquire()
+            df = conn.raw_sql(sql)
+        except Exception as e:
+            if conn is not None:
+                pool.release(conn, broken=True)
+            last_error = e
+            continue
+        pool.release(conn)
+
+        # Write to a temporary file first, so that an interrupted write is never mistaken for a finished partition
+        fetched = datetime.date.today()
+        df.to_pickle(checkpoint_file + '.tmp')
+        os.replace(checkpoint_file + '.tmp', checkpoint_file)
+        with open(checkpoint_file + '.json', 'w') as f:
+            json.dump({'fetched': fetched.isoformat(), 'rows': len(df)}, f)
+        return len(df)
+
+    raise last_error
+
+# Runs a query template once per partition over a bounded pool of connections and returns the combined result:
+# Inputs - connection factory (for example lambda: wrds.Connection(wrds_username=wrds_id)),
+#          query template with {start} and {end} placeholders, list of (start, end) partitions,
+#          checkpoint directory, artifact name, number of concurrent connections, retries per partition and
+#          whether every partition is fetched again (refresh=True, for example after a CRSP annual revision)
+# Every finished partition is stored under checkpoint_dir/name, so a rerun only fetches missing or failed partitions
+# and the partitions that were still open (ending on or after the fetch date) when they were checkpointed.
+def download_partitioned(connect, query, partitions, checkpoint_dir, name, max_workers=4, retries=2,
+                         refresh=False):
+    os.makedirs(os.path.join(checkpoint_dir, name), exist_ok=True)
+
+    # Only fetch partitions that have no final checkpoint from a previous run
+    pending = [x for x in partitions if refresh == True or _is_stale(_checkpoint_file(checkpoint_dir, name, x), x)]
+    print("      {}: {} of {} partitions to download ...".format(name, len(pending), len(partitions)))
+
+    failed = {}
+    pool = ConnectionPool(connect, max_workers)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {x: executor.submit(_fetch_partition, pool, query, x,
+                                          _checkpoint_file(checkpoint_dir, name, x), retries) for x in pending}
+            for partition, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    failed[partition] = repr(e)
+    finally:
+        pool.close()
+
+    # Record the state of the last run next to the checkpoints
+    manifest = {'partitions': [list(x) for x in partitions],
+                'failed': {x[0] + '_' + x[1]: failed[x] for x in failed}}
+    with open(os.path.join(checkpoint_dir, name, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    if len(failed) > 0:
+        raise RuntimeError("{}: {} partitions failed, rerun to fetch only the missing ones: {}".format(
+            name, len(failed), sorted(failed)))
+
+    # Combine partitions in calendar order, empty partitions are skipped so they do not turn columns into objects
+    chunks = [pd.read_pickle(_checkpoint_file(checkpoint_dir, name, x)) for x in partitions]
+    non_empty = [x for x in chunks if len(x) > 0]
+    if len(non_empty) == 0:
+        return chunks[0]
+    return pd.concat(non_empty, ignore_index=True)
+
+# Local stand-in for wrds.Connection serving the same schema-qualified tables (crspq.msf, crspq.msenames, ...)
+# from SQLite files: Inputs - dict of schema name to SQLite file path
+class SQLiteConnection:
+    def __init__(self, schema_files):
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        for schema, path in schema_files.items():
+            self.conn.execute("attach database ? as " + schema, (path,))
+
+    def raw_sql(self, sql):
+        return pd.read_sql_query(sql, self.conn)
+
+    def close(self):
+        self.conn.close()
+
+# Writes dataframes as tables of a SQLite stand-in schema: Inputs - SQLite file path and dict of table name to df
+# Dates are stored as ISO strings so that the same date predicates work as on WRDS
+def create_sqlite_standin(path, tables):
+    conn = sqlite3.connect(path)
+    for table_name, df in tables.items():
+        df = df.copy()
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = df[col].dt.strftime('%Y-%m-%d')
+        df.to_sql(table_name, conn, if_exists='replace', index=False)
+    conn.commit()
+    conn.close()
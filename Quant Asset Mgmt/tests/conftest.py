@@ -0,0 +1,41 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Shared fixtures of the regression tests
+# Akhil Srivastava
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qam_synthetic import generate_crsp_compustat
+
+# Small seeded synthetic CRSP/Compustat data set (about 300 permnos from 1926 to 2023)
+@pytest.fixture(scope='session')
+def synthetic():
+    return generate_crsp_compustat(scale=0.01, seed=0)
+
+# CRSP monthly stock rows sorted by permno and date with a month id
+@pytest.fixture(scope='session')
+def crsp_panel(synthetic):
+    from qam_calendar import month_id
+    panel = synthetic['mscrsp_raw'].sort_values(['permno', 'date']).reset_index(drop=True)
+    panel['month_id'] = month_id(panel['date'])
+    return panel
+
+# CRSP monthly stock rows merged with the delisting returns (the layout of mscrsp_processed)
+@pytest.fixture(scope='session')
+def crsp_processed(synthetic):
+    msf = synthetic['mscrsp_raw'].drop(columns=['siccd', 'naics'])
+    msf = msf[msf['shrcd'].notna() & msf['exchcd'].notna() & msf['shrout'].notna()]
+    delist = synthetic['msdelcrsp_raw'][['permno', 'dlret', 'dlstdt', 'dlstcd']].rename(columns={'dlstdt': 'date'})
+    merged = msf.merge(delist, how='outer', on=['date', 'permno'])
+    return merged.sort_values(by=['permno', 'date']).reset_index(drop=True)
+
+# Equal-weighted monthly returns of the NYSE, AMEX and NASDAQ stocks, one column per exchange code and one row per
+# month with all three
+@pytest.fixture(scope='session')
+def exchange_returns(crsp_panel):
+    df = crsp_panel[crsp_panel['exchcd'].isin([1, 2, 3])]
+    return df.groupby(['month_id', 'exchcd'])['ret'].mean().unstack().dropna()
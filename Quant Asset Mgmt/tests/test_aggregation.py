@@ -0,0 +1,69 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the grouped aggregation kernels against the pandas groupby implementations
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+from qam_aggregation import grouped_weighted_mean, grouped_window_sum, grouped_month_window_sum
+
+# Value-weighted and equal-weighted means match groupby.apply(np.average) and groupby.mean()
+def test_grouped_weighted_mean_matches_groupby(crsp_panel):
+    df = crsp_panel.copy()
+    df['me'] = df['prc'].abs()*df['shrout']
+    df = df[df['ret'].notna()]
+
+    result = grouped_weighted_mean(df, 'month_id', 'ret', 'me').set_index('month_id')
+    expected_vw = df.groupby('month_id').apply(lambda x: np.average(x['ret'], weights=x['me']))
+    expected_ew = df.groupby('month_id')['ret'].mean()
+
+    np.testing.assert_allclose(result['vw_ret'], expected_vw, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(result['ew_ret'], expected_ew, rtol=1e-12, atol=1e-15)
+    np.testing.assert_array_equal(result['count'], df.groupby('month_id').size())
+
+# NaN returns are skipped by the equal-weighted mean and not counted
+def test_grouped_weighted_mean_skips_nan_returns(crsp_panel):
+    df = crsp_panel[['month_id', 'ret', 'shrout']].copy()
+    df.loc[df.index[::7], 'ret'] = np.nan
+
+    result = grouped_weighted_mean(df, 'month_id', 'ret', 'shrout').set_index('month_id')
+    np.testing.assert_allclose(result['ew_ret'], df.groupby('month_id')['ret'].mean(), rtol=1e-12, atol=1e-15)
+    np.testing.assert_array_equal(result['count'], df.groupby('month_id')['ret'].count())
+
+# The 11-month ranking window matches groupby shift(2) followed by rolling(11).sum() on histories without gaps
+def test_window_sums_match_rolling(crsp_panel):
+    df = crsp_panel[['permno', 'month_id', 'ret']].copy()
+    df['log_ret'] = np.log1p(df['ret'].fillna(0))
+
+    shifted = df.groupby('permno')['log_ret'].shift(2)
+    expected = shifted.groupby(df['permno']).rolling(11).sum().reset_index(level=0, drop=True)
+
+    by_row = grouped_window_sum(df, 'permno', 'log_ret', 11, lag=2)
+    by_month = grouped_month_window_sum(df, 'permno', 'month_id', 'log_ret', 11, lag=2)
+    np.testing.assert_allclose(by_row, expected, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(by_month, expected, rtol=1e-10, atol=1e-12)
+
+# A missing month is a gap of the calendar window, not the previous row
+def test_month_window_sum_respects_gaps():
+    df = pd.DataFrame({'permno': [1]*5, 'month_id': [1, 2, 4, 5, 6], 'x': [1.0, 2.0, 4.0, 5.0, 6.0]})
+    result = grouped_month_window_sum(df, 'permno', 'month_id', 'x', 3, min_periods=2)
+    np.testing.assert_array_equal(result, [np.nan, 3.0, 6.0, 9.0, 15.0])
+
+# With gaps the calendar window matches a rolling sum over the months of a dense month grid, and the sums of the
+# last months computed from the trailing rows only equal those of the full history bit for bit
+def test_month_window_sum_with_gaps_matches_dense_rolling(crsp_panel):
+    df = crsp_panel[['permno', 'month_id', 'ret']].copy()
+    df = df[df['month_id'] % 17 != 5].reset_index(drop=True)
+    df['log_ret'] = np.log1p(df['ret'])
+    result = grouped_month_window_sum(df, 'permno', 'month_id', 'log_ret', 11, lag=2, min_periods=8)
+
+    dense = df.set_index(['permno', 'month_id'])['log_ret'].unstack().T
+    dense = dense.reindex(np.arange(dense.index.min(), dense.index.max() + 1))
+    expected = dense.shift(2).rolling(11, min_periods=8).sum().stack().rename('expected').reset_index()
+    expected = df.merge(expected, how='left', on=['month_id', 'permno'])['expected']
+    np.testing.assert_allclose(result, expected, rtol=1e-10, atol=1e-12)
+
+    tail = df[df['month_id'] >= df['month_id'].max() - 24].reset_index(drop=True)
+    tail_result = grouped_month_window_sum(tail, 'permno', 'month_id', 'log_ret', 11, lag=2, min_periods=8)
+    last = (df['month_id'] >= df['month_id'].max() - 12).values
+    np.testing.assert_array_equal(tail_result[(tail['month_id'] >= tail['month_id'].max() - 12).values], result[last])
@@ -0,0 +1,21 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Smoke test of the stage benchmark suite on a tiny synthetic data set
+# Akhil Srivastava
+
+import pytest
+
+# The problem set scripts import these at the top
+pytest.importorskip('matplotlib')
+pytest.importorskip('pandas_datareader')
+pytest.importorskip('wrds')
+
+from qam_benchmark import benchmark_stages, STAGES
+
+# Every stage of PS1-PS4 runs on the prepared synthetic artifacts without an error
+def test_benchmark_stages_smoke(tmp_path):
+    df = benchmark_stages(str(tmp_path), scales=(0.005,))
+
+    assert list(df['stage']) == list(STAGES)
+    assert df['error'].isna().all(), df.loc[df['error'].notna(), ['stage', 'error']].to_string()
+    assert (df['seconds'] > 0).all()
+    assert (df['rows_in'] > 0).all()
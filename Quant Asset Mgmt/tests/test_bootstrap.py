@@ -0,0 +1,41 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the vectorized block bootstrap against pandas statistics of the resampled months
+# Akhil Srivastava
+
+import numpy as np
+
+from qam_bootstrap import bootstrap_indices, block_bootstrap, bootstrap_confidence_intervals
+from qam_bootstrap import confidence_interval_columns
+
+# Every replication's stats are the pandas stats of the months it draws
+def test_block_bootstrap_matches_pandas_resample(exchange_returns):
+    samples = block_bootstrap(exchange_returns.values, n_reps=5, block_length=12, seed=3, processes=1, chunk_size=5)
+    idx = bootstrap_indices(len(exchange_returns), 5, 12, 'stationary',
+                            np.random.default_rng(np.random.SeedSequence(3).spawn(1)[0]))
+
+    for rep in range(5):
+        resampled = exchange_returns.iloc[idx[rep]]
+        np.testing.assert_allclose(samples['mean'][rep], 100*12*resampled.mean().values, rtol=1e-10)
+        np.testing.assert_allclose(samples['vol'][rep], 100*np.sqrt(12)*resampled.std().values, rtol=1e-10)
+        np.testing.assert_allclose(samples['skew'][rep], resampled.skew().values, rtol=1e-8)
+
+# Circular blocks are runs of consecutive months that wrap around the end of the sample
+def test_circular_blocks_are_consecutive():
+    idx = bootstrap_indices(50, 20, 6, 'circular', np.random.default_rng(0))
+    steps = np.diff(idx.reshape(20, -1)[:, :48].reshape(20, 8, 6), axis=2) % 50
+
+    assert idx.shape == (20, 50)
+    assert (steps == 1).all()
+
+# Table columns hold the percentile intervals of the tidy result, in the order of the portfolios
+def test_confidence_interval_columns(exchange_returns):
+    tidy = bootstrap_confidence_intervals(exchange_returns, n_reps=200, processes=1)
+    labels = {'mean': "Excess Return", 'sharpe': "Sharpe Ratio"}
+    wide = confidence_interval_columns(exchange_returns, labels, n_reps=200, processes=1)
+
+    sharpe = tidy[tidy['statistic'] == 'sharpe'].set_index('series')
+    assert list(wide.index) == list(exchange_returns.columns)
+    np.testing.assert_array_equal(wide["Sharpe Ratio CI lower"], sharpe['lower'].values)
+    np.testing.assert_array_equal(wide["Sharpe Ratio CI upper"], sharpe['upper'].values)
+    mean = tidy[tidy['statistic'] == 'mean']['estimate'].values
+    assert ((wide["Excess Return CI lower"].values < mean) & (mean < wide["Excess Return CI upper"].values)).all()
@@ -0,0 +1,94 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the vectorized breakpoint portfolios against pandas qcut, cut and describe
+# Akhil Srivastava
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import qam_breakpoints
+from qam_breakpoints import assign_breakpoints, apply_breakpoints, quantile_portfolios, period_quantiles
+from qam_breakpoints import breakpoint_tables, breakpoint_cache_name, cached_breakpoint_tables, BREAKPOINT_CACHE_INDEX
+
+# Market equity of every stock and month of the synthetic panel, months with at least 20 stocks
+@pytest.fixture(scope='module')
+def market_equity(crsp_panel):
+    df = crsp_panel[['permno', 'month_id', 'exchcd']].copy()
+    df['me'] = crsp_panel['prc'].abs()*crsp_panel['shrout']
+    df = df[df['me'].notna() & (df['me'] > 0)]
+    return df[df.groupby('month_id')['me'].transform('size') >= 20].reset_index(drop=True)
+
+# Equally populated portfolios match groupby transform with pd.qcut
+def test_quantile_portfolios_match_qcut(market_equity):
+    df = market_equity
+    result = quantile_portfolios(df, 'month_id', 'me', 10, range(1, 11))
+
+    expected = df.groupby('month_id')['me'].transform(lambda x: pd.qcut(x, 10, labels=range(1, 11)))
+    np.testing.assert_array_equal(np.asarray(result, dtype=float), expected.astype(float).values)
+
+# Portfolios on NYSE breakpoints match groupby apply with pd.cut on the breakpoints of the month
+def test_apply_breakpoints_matches_cut(market_equity):
+    df = market_equity
+    nyse = df[df['exchcd'] == 1]
+    breakpoints = nyse.groupby('month_id')['me'].quantile([0.3, 0.7]).unstack().reset_index()
+    result = apply_breakpoints(df, 'month_id', 'me', breakpoints, [1, 2, 3])
+
+    table = breakpoints.set_index('month_id')
+    expected = df.groupby('month_id')['me'].transform(
+        lambda x: pd.cut(x, [-np.inf] + list(table.loc[x.name]) + [np.inf], labels=[1, 2, 3]).astype(float)
+        if x.name in table.index else np.nan)
+    np.testing.assert_array_equal(np.asarray(result, dtype=float), expected.values)
+
+# Values on a breakpoint fall in the lower interval, missing values and breakpoints get no label
+def test_assign_breakpoints_edges():
+    result = assign_breakpoints([1.0, 2.0, 2.5, np.nan, 1.0, 5.0], [0, 0, 0, 0, 1, -1],
+                                [[2.0, 3.0], [np.nan, 3.0]], ['L', 'M', 'H'])
+    assert list(result.astype(object)) == ['L', 'L', 'M', np.nan, np.nan, np.nan]
+
+# Per-period quantiles match np.quantile of every period bit for bit
+def test_period_quantiles_match_numpy(market_equity):
+    codes, months = pd.factorize(market_equity['month_id'])
+    quantiles = np.linspace(0, 1, 11)[1:-1]
+    result = period_quantiles(market_equity['me'].values, codes, len(months), quantiles)
+
+    expected = np.vstack([np.quantile(market_equity['me'].values[codes == i], quantiles) for i in range(len(months))])
+    np.testing.assert_array_equal(result, expected)
+
+# Breakpoint tables match groupby describe, and a cached table is reused only for the same universe data
+def test_breakpoint_tables_match_describe(market_equity, tmp_path):
+    nyse = market_equity[market_equity['exchcd'] == 1]
+    percentiles = {'me': list(np.arange(0.1, 1, 0.1))}
+    table = breakpoint_tables(nyse, 'month_id', percentiles)['me']
+
+    expected = nyse.groupby('month_id')['me'].describe(percentiles=percentiles['me']).reset_index()
+    pd.testing.assert_frame_equal(table, expected[table.columns], check_exact=False, rtol=1e-12)
+    cached = cached_breakpoint_tables(nyse, 'month_id', percentiles, 'nyse', str(tmp_path))['me']
+    pd.testing.assert_frame_equal(cached_breakpoint_tables(nyse, 'month_id', percentiles, 'nyse', str(tmp_path))['me'],
+                                  cached)
+    revised = nyse.assign(me=nyse['me']*1.01)
+    assert (breakpoint_cache_name(revised, 'month_id', 'me', percentiles['me'], 'nyse') !=
+            breakpoint_cache_name(nyse, 'month_id', 'me', percentiles['me'], 'nyse'))
+
+# A table computed from revised universe data replaces the table of the same configuration, and the least recently
+# used tables are evicted once more than BREAKPOINT_CACHE_SIZE are cached
+def test_breakpoint_cache_eviction(market_equity, tmp_path, monkeypatch):
+    monkeypatch.setattr(qam_breakpoints, 'BREAKPOINT_CACHE_SIZE', 2)
+    nyse = market_equity[market_equity['exchcd'] == 1]
+    name = lambda df, percentiles: breakpoint_cache_name(df, 'month_id', 'me', percentiles, 'nyse')
+
+    cached_breakpoint_tables(nyse, 'month_id', {'me': [0.5]}, 'nyse', str(tmp_path))
+    revised = nyse.assign(me=nyse['me']*1.01)
+    cached_breakpoint_tables(revised, 'month_id', {'me': [0.5]}, 'nyse', str(tmp_path))
+    assert not os.path.exists(os.path.join(tmp_path, name(nyse, [0.5])))
+    assert os.path.exists(os.path.join(tmp_path, name(revised, [0.5])))
+
+    cached_breakpoint_tables(revised, 'month_id', {'me': [0.3, 0.7]}, 'nyse', str(tmp_path))
+    cached_breakpoint_tables(revised, 'month_id', {'me': [0.5]}, 'nyse', str(tmp_path))
+    cached_breakpoint_tables(revised, 'month_id', {'me': [0.2, 0.8]}, 'nyse', str(tmp_path))
+    cached = sorted(x for x in os.listdir(tmp_path) if x.startswith('breakpoints_'))
+    assert cached == sorted([name(revised, [0.5]), name(revised, [0.2, 0.8])])
+    with open(os.path.join(tmp_path, BREAKPOINT_CACHE_INDEX)) as f:
+        assert sorted(json.load(f)) == cached
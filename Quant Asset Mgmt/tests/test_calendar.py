@@ -0,0 +1,64 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Round-trip and edge tests of the integer month-id calendar against pandas periods
+# Akhil Srivastava
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qam_calendar import month_id, year_month_id, year_month, month_end, portfolio_year_month, formation_month
+from qam_calendar import add_year_month
+
+# Every month end from 1925 to 2030
+MONTH_ENDS = pd.date_range('1925-12-31', '2030-12-31', freq='ME')
+
+# January 1926 is month 1 and consecutive months differ by 1, across every December/January
+def test_month_id_counts_months_from_1926():
+    ids = month_id(MONTH_ENDS)
+    np.testing.assert_array_equal(ids, np.arange(len(MONTH_ENDS)))
+    assert month_id(pd.Series(pd.to_datetime(['1926-01-01', '1926-01-31', '1999-12-31', '2000-01-01']))).tolist() == \
+        [1, 1, 888, 889]
+    assert month_id(['2023-12-15', datetime.date(2024, 1, 2)]).tolist() == [1176, 1177]
+    assert month_id(pd.Series(MONTH_ENDS).dt.to_period('M')).tolist() == ids.tolist()
+
+    with pytest.raises(ValueError):
+        month_id(pd.Series(pd.to_datetime(['1999-12-31', None])))
+
+# Month ids, calendar years and months and month end dates round trip
+def test_year_month_and_month_end_round_trip():
+    ids = np.arange(-24, 1300)
+    year, month = year_month(ids)
+    periods = pd.period_range('1923-12', periods=len(ids), freq='M')
+    np.testing.assert_array_equal(year, periods.year)
+    np.testing.assert_array_equal(month, periods.month)
+    np.testing.assert_array_equal(year_month_id(year, month), ids)
+    np.testing.assert_array_equal(month_end(ids), periods.to_timestamp(how='end').normalize().values)
+    np.testing.assert_array_equal(month_id(month_end(ids)), ids)
+    # December to January
+    assert year_month(year_month_id(1999, 12) + 1) == (2000, 1)
+    assert month_end([year_month_id(2000, 2)])[0] == np.datetime64('2000-02-29')
+
+# Portfolio years start in July: June of year t is month 12 of portfolio year t-1, July is month 1 of year t
+def test_portfolio_year_starts_in_july():
+    ids = year_month_id([2000, 2000, 2000, 2000, 2001], [1, 6, 7, 12, 6])
+    year, month = portfolio_year_month(ids)
+    assert year.tolist() == [1999, 1999, 2000, 2000, 2000]
+    assert month.tolist() == [7, 12, 1, 6, 12]
+
+# Accounting data is first used in June of the calendar year after the fiscal year end, so December and June fiscal
+# year ends of the same calendar year form in the same June
+def test_formation_month_of_fiscal_years():
+    fiscal_year_ends = month_id(['1999-12-31', '2000-06-30', '2000-12-31', '2001-01-31'])
+    year, month = year_month(formation_month(fiscal_year_ends))
+    assert year.tolist() == [2000, 2001, 2001, 2002]
+    assert month.tolist() == [6, 6, 6, 6]
+
+# Year and Month are placed right after the month id and replace existing columns
+def test_add_year_month():
+    df = pd.DataFrame({'Month': 0, 'month_id': year_month_id([1926, 2023], [1, 12]), 'ret': [0.1, 0.2]})
+    df = add_year_month(df)
+    assert list(df.columns) == ['month_id', 'Year', 'Month', 'ret']
+    assert df['Year'].tolist() == [1926, 2023]
+    assert df['Month'].tolist() == [1, 12]
@@ -0,0 +1,135 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the vectorized turnover and trading costs against a loop over portfolios, months and stocks
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qam_costs import cost_rates, portfolio_turnover, value_weighted_turnover, dense_turnover, net_of_cost_summary
+from qam_costs import COST_TIERS
+
+# Value-weighted size terciles of the last 120 months of the synthetic panel, so that stocks move between portfolios
+# and some returns are missing
+@pytest.fixture(scope='module')
+def holdings(crsp_panel):
+    df = crsp_panel[['permno', 'month_id']].copy()
+    df['ret'] = pd.to_numeric(crsp_panel['ret'], errors='coerce')
+    me = crsp_panel['prc'].abs()*crsp_panel['shrout']
+    df['lag_me'] = me.groupby(crsp_panel['permno']).shift(1)
+    df = df[(df['lag_me'] > 0) & (df['month_id'] > df['month_id'].max() - 120)].copy()
+    df['port'] = df.groupby('month_id')['lag_me'].transform(lambda x: pd.qcut(x, 3, labels=False))
+    df['weight'] = df['lag_me']/df.groupby(['month_id', 'port'])['lag_me'].transform('sum')
+    return df.reset_index(drop=True)
+
+# Turnover and cost of every portfolio and month from the holdings of the month and the drifted holdings of the month
+# before: Inputs - dataframe of portfolio, month, asset, weight, ret and rate (one row per portfolio, month and asset)
+def loop_turnover(df):
+    by_key = {key: rows.set_index('asset') for key, rows in df.groupby(['portfolio', 'month'])}
+    result = []
+    for (portfolio, month), new in by_key.items():
+        old = by_key.get((portfolio, month - 1))
+        rate = new['rate']
+        drifted = pd.Series(dtype=float)
+        if old is not None:
+            ret = old['ret'].fillna(0)
+            drifted = old['weight']*(1 + ret)/(1 + (old['weight']*ret).sum())
+        assets = new.index.union(drifted.index)
+        trades = (new['weight'].reindex(assets, fill_value=0) - drifted.reindex(assets, fill_value=0)).abs()
+        if old is not None:
+            # A stock that is sold out is charged the rate of the month before
+            rate = rate.reindex(assets).fillna(old['rate'].reindex(assets))
+        result.append((portfolio, month, trades.sum()/2, (trades*rate).sum()))
+    return pd.DataFrame(result, columns=['portfolio', 'month', 'Turnover', 'Cost'])
+
+# Tiered rates match the tier of every stock's market cap rank within its month, once per stock and month
+def test_cost_rates_tiered_match_rank(holdings):
+    df = holdings
+    rates = cost_rates(df['month_id'], df['permno'], df['lag_me'], 'tiered')
+    # The same stock listed in two portfolios of a month gets the same rate
+    doubled = cost_rates(np.tile(df['month_id'], 2), np.tile(df['permno'], 2), np.tile(df['lag_me'], 2), 'tiered')
+    np.testing.assert_array_equal(doubled, np.tile(rates, 2))
+
+    by_month = df.groupby('month_id')['lag_me']
+    percentile = by_month.rank(method='first')/by_month.transform('size')
+    expected = np.full(len(df), np.nan)
+    for threshold, rate in reversed(COST_TIERS):
+        expected[(percentile <= threshold).values] = rate
+    np.testing.assert_array_equal(rates, expected)
+    np.testing.assert_array_equal(cost_rates(df['month_id'], df['permno'], df['lag_me']), 0.001)
+
+# Drifted-weight turnover and tiered costs of the size terciles match the loop
+def test_portfolio_turnover_matches_loop(holdings):
+    df = pd.DataFrame({'portfolio': holdings['port'], 'month': holdings['month_id'], 'asset': holdings['permno'],
+                       'weight': holdings['weight'], 'ret': holdings['ret'],
+                       'rate': cost_rates(holdings['month_id'], holdings['permno'], holdings['lag_me'], 'tiered')})
+    result = portfolio_turnover(df['portfolio'], df['month'], df['asset'], df['weight'], df['ret'], df['rate'])
+
+    expected = loop_turnover(df)
+    pd.testing.assert_frame_equal(result[['portfolio', 'month']], expected[['portfolio', 'month']], check_dtype=False)
+    np.testing.assert_allclose(result['Turnover'], expected['Turnover'], rtol=1e-10, atol=1e-14)
+    np.testing.assert_allclose(result['Cost'], expected['Cost'], rtol=1e-10, atol=1e-16)
+
+# A stock that leaves a portfolio is sold at its drifted weight and bought again when it re-enters, a month without
+# the portfolio makes the next month buy all its holdings
+def test_portfolio_turnover_leave_and_reenter():
+    df = pd.DataFrame({'portfolio': 0,
+                       'month': [0, 0, 1, 1, 2, 3, 3, 5],
+                       'asset': [1, 2, 1, 2, 2, 1, 2, 2],
+                       'weight': [0.5, 0.5, 0.4, 0.6, 1.0, 0.5, 0.5, 1.0],
+                       'ret': [0.1, -0.1, 0.05, 0.02, 0.03, 0.0, 0.1, 0.0],
+                       'rate': [0.002, 0.001, 0.002, 0.001, 0.001, 0.003, 0.001, 0.001]})
+    result = portfolio_turnover(df['portfolio'], df['month'], df['asset'], df['weight'], df['ret'], df['rate'])
+
+    expected = loop_turnover(df)
+    np.testing.assert_allclose(result[['Turnover', 'Cost']].values, expected[['Turnover', 'Cost']].values, rtol=1e-12)
+    # Month 2 sells asset 1 at its drifted weight 0.4*1.05/1.032 and month 5 buys everything
+    np.testing.assert_allclose(result['Turnover'].values, [0.5, 0.15, 0.4*1.05/1.032, 0.5, 0.5], rtol=1e-12)
+    assert result.loc[2, 'Cost'] == pytest.approx(0.4*1.05/1.032*(0.002 + 0.001))
+
+# Turnover of value-weighted portfolios given as a stock panel matches the loop over the value weights
+def test_value_weighted_turnover_matches_loop(holdings):
+    result = value_weighted_turnover(holdings, 'month_id', ['port'], 'permno', 'ret', 'lag_me', 'tiered')
+
+    df = pd.DataFrame({'portfolio': holdings['port'], 'month': holdings['month_id'], 'asset': holdings['permno'],
+                       'weight': holdings['weight'], 'ret': holdings['ret'],
+                       'rate': cost_rates(holdings['month_id'], holdings['permno'], holdings['lag_me'], 'tiered')})
+    expected = loop_turnover(df).rename(columns={'portfolio': 'port', 'month': 'month_id'})
+    merged = result.merge(expected, on=['month_id', 'port'], suffixes=('', '_loop'))
+    assert len(merged) == len(result) == len(expected)
+    np.testing.assert_allclose(merged['Turnover'], merged['Turnover_loop'], rtol=1e-10, atol=1e-14)
+    np.testing.assert_allclose(merged['Cost'], merged['Cost_loop'], rtol=1e-10, atol=1e-16)
+
+# Turnover of a weight matrix matches the loop, assets with a missing weight are not held
+def test_dense_turnover_matches_loop(exchange_returns):
+    returns = exchange_returns.values[:200]
+    month = exchange_returns.index.values[:200]
+    weights = np.abs(returns)/np.abs(returns).sum(axis=1, keepdims=True)
+    weights[10:13, 0] = np.nan
+    weights[50] = np.nan
+    turnover, cost = dense_turnover(month, weights, returns, 0.002)
+
+    rows, assets = np.nonzero(~np.isnan(weights))
+    expected = loop_turnover(pd.DataFrame({'portfolio': 0, 'month': month[rows], 'asset': assets,
+                                           'weight': weights[rows, assets], 'ret': returns[rows, assets],
+                                           'rate': 0.002})).set_index('month')
+    expected = expected.reindex(month)
+    np.testing.assert_allclose(turnover, expected['Turnover'].values, rtol=1e-10)
+    np.testing.assert_allclose(cost, expected['Cost'].values, rtol=1e-10)
+    assert np.isnan(turnover[50])
+
+# The summary reports the annualized gross and net means and Sharpe ratios, monthly turnover and annual cost
+def test_net_of_cost_summary_matches_pandas(exchange_returns):
+    gross = exchange_returns.copy()
+    cost = 0.001*gross.abs()
+    turnover = 10*cost
+    turnover.iloc[:5] = np.nan
+    summary = net_of_cost_summary(gross, cost, turnover)
+
+    net = gross - cost
+    np.testing.assert_allclose(summary['Gross Excess Return'], 100*12*gross.mean(), rtol=1e-12)
+    np.testing.assert_allclose(summary['Net Excess Return'], 100*12*net.mean(), rtol=1e-12)
+    np.testing.assert_allclose(summary['Gross Sharpe Ratio'], np.sqrt(12)*gross.mean()/gross.std(), rtol=1e-12)
+    np.testing.assert_allclose(summary['Net Sharpe Ratio'], np.sqrt(12)*net.mean()/net.std(), rtol=1e-12)
+    np.testing.assert_allclose(summary['Monthly Turnover'], 100*turnover.mean(), rtol=1e-12)
+    np.testing.assert_allclose(summary['Annual Cost'], 100*12*cost.mean(), rtol=1e-12)
@@ -0,0 +1,115 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the cached CRSP cleaning engine against a direct clean_crsp_stocks call
+# Akhil Srivastava
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from qam_crsp import (cached_clean_crsp_stocks, update_clean_crsp_stocks, clean_crsp_stocks, clean_cache_name,
+                      consolidate_permco_me, CLEAN_CACHE_INDEX)
+from qam_storage import save_artifact, append_artifact, load_artifact, artifact_exists
+
+PARAMS = dict(exchcd_set=[1, 2, 3], shrcd_set=[10, 11], min_date='1926-01-31', max_date='2020-12-31',
+              me_scale=1e-3, drop_cols=['shrcd', 'prc', 'shrout'])
+
+# Loads the cleaned panel and counts how often the source is read
+class Source:
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.loads = 0
+
+    def __call__(self):
+        self.loads += 1
+        return load_artifact(self.data_dir, 'mscrsp_processed')
+
+# The cached panel (built and loaded) matches a direct cleaning of the source
+def test_cached_panel_matches_direct_cleaning(tmp_path, crsp_processed):
+    save_artifact(crsp_processed, tmp_path, 'mscrsp_processed')
+    expected = clean_crsp_stocks(crsp_processed, **PARAMS)
+
+    source = Source(tmp_path)
+    built = cached_clean_crsp_stocks(tmp_path, ['mscrsp_processed'], source, **PARAMS)
+    loaded = cached_clean_crsp_stocks(tmp_path, ['mscrsp_processed'], source, **PARAMS)
+    pd.testing.assert_frame_equal(built, expected)
+    pd.testing.assert_frame_equal(loaded, expected)
+    assert source.loads == 1
+
+# Rewriting identical source data and changing only the report parameters keep the cache
+def test_cache_is_keyed_on_content_and_cleaning_params(tmp_path, crsp_processed):
+    save_artifact(crsp_processed, tmp_path, 'mscrsp_processed')
+    source = Source(tmp_path)
+    cached_clean_crsp_stocks(tmp_path, ['mscrsp_processed'], source, **PARAMS)
+
+    save_artifact(crsp_processed.copy(), tmp_path, 'mscrsp_processed')
+    other = dict(PARAMS, max_date=None, drop_cols=['prc'])
+    result = cached_clean_crsp_stocks(tmp_path, ['mscrsp_processed'], source, **other)
+    assert source.loads == 1
+    pd.testing.assert_frame_equal(result, clean_crsp_stocks(crsp_processed, **other))
+
+# A panel built from changed source data replaces the panel of the old data
+def test_stale_panels_are_evicted(tmp_path, crsp_processed):
+    save_artifact(crsp_processed, tmp_path, 'mscrsp_processed')
+    source = Source(tmp_path)
+    cached_clean_crsp_stocks(tmp_path, ['mscrsp_processed'], source, **PARAMS)
+    old_name = clean_cache_name(tmp_path, ['mscrsp_processed'], PARAMS)
+
+    save_artifact(crsp_processed.iloc[:-100], tmp_path, 'mscrsp_processed')
+    cached_clean_crsp_stocks(tmp_path, ['mscrsp_processed'], source, **PARAMS)
+    new_name = clean_cache_name(tmp_path, ['mscrsp_processed'], PARAMS)
+
+    assert source.loads == 2
+    assert not os.path.exists(os.path.join(tmp_path, old_name + '_lag'))
+    assert artifact_exists(tmp_path, new_name)
+    with open(os.path.join(tmp_path, CLEAN_CACHE_INDEX)) as f:
+        assert list(json.load(f)) == [new_name]
+
+# Appending the last months matches a full rebuild bit for bit
+def test_update_matches_full_rebuild(tmp_path, crsp_processed):
+    params = dict(PARAMS, max_date=None)
+    cut = crsp_processed['date'] > '2023-09-30'
+    old, delta = crsp_processed[~cut].reset_index(drop=True), crsp_processed[cut].reset_index(drop=True)
+    save_artifact(old, tmp_path, 'mscrsp_processed')
+    cached_clean_crsp_stocks(tmp_path, ['mscrsp_processed'], Source(tmp_path), **params)
+
+    new_rows, _ = update_clean_crsp_stocks(tmp_path, ['mscrsp_processed'], delta,
+                                           lambda: append_artifact(delta, tmp_path, 'mscrsp_processed'), **params)
+    expected = clean_crsp_stocks(crsp_processed, **params)
+    assert len(new_rows) == (expected['date'] > '2023-09-30').sum()
+
+    updated = cached_clean_crsp_stocks(tmp_path, ['mscrsp_processed'], None, **params)
+    sort = ['permno', 'month_id']
+    pd.testing.assert_frame_equal(updated.sort_values(sort).reset_index(drop=True), expected, check_exact=True)
+
+# Permco market caps of the original PS1 cleaning: the rows with the largest me of every month and permco (a merge on
+# the max, so every tied permno is kept) with me replaced by the permco sum (a second merge)
+def merge_permco_me(CRSP_Stocks):
+    me_sum = CRSP_Stocks.groupby(['month_id', 'permco'])['me'].sum().reset_index()
+    me_max = CRSP_Stocks.groupby(['month_id', 'permco'])['me'].max().reset_index()
+    CRSP_Stocks = pd.merge(CRSP_Stocks, me_max, how='inner', on=['month_id', 'permco', 'me'])
+    CRSP_Stocks = CRSP_Stocks.drop(['me'], axis=1)
+    CRSP_Stocks = pd.merge(CRSP_Stocks, me_sum, how='inner', on=['month_id', 'permco'])
+    return CRSP_Stocks.sort_values(by=['permno', 'month_id']).drop_duplicates()
+
+# The sorted pass matches the two merges, and of two permnos tied on the largest me only the lowest is kept
+def test_consolidate_permco_me_matches_merges(crsp_panel):
+    df = crsp_panel[['permno', 'permco', 'month_id', 'ret']].copy()
+    df['me'] = crsp_panel['prc'].abs()*crsp_panel['shrout']
+    df = df[df['me'].notna()].reset_index(drop=True)
+
+    # Tie the two permnos of the first multi-class permco month
+    groups = df.groupby(['month_id', 'permco']).groups
+    tied = next(rows for rows in groups.values() if len(rows) == 2)
+    df.loc[tied, 'me'] = df.loc[tied, 'me'].max()
+    result = consolidate_permco_me(df)
+
+    expected = merge_permco_me(df)
+    assert len(expected) == len(result) + 1
+    expected = expected.sort_values(['month_id', 'permco', 'permno']).drop_duplicates(['month_id', 'permco'])
+    expected = expected.sort_values(['permno', 'month_id']).reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected)
+    month, permco = df.loc[tied[0], ['month_id', 'permco']]
+    assert result.loc[(result['month_id'] == month) & (result['permco'] == permco), 'permno'].tolist() == \
+        [df.loc[tied, 'permno'].min()]
@@ -0,0 +1,153 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the columnar daily panel and the out-of-core daily returns against pandas, with blocks small
+# enough that every computation crosses block boundaries
+# Akhil Srivastava
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qam_calendar import month_end, month_id
+from qam_daily import ColumnarPanel, ingest_partitioned, value_weighted_returns, monthly_volatility_from_daily
+from qam_daily import DAILY_STOCK_SCHEMA
+
+# Daily rows of the last 24 months of the synthetic panel: five days per month, prices and shares that change every
+# day and some missing returns and share codes, sorted by date and permno
+@pytest.fixture(scope='module')
+def daily(crsp_panel):
+    df = crsp_panel[crsp_panel['month_id'] > crsp_panel['month_id'].max() - 24]
+    rng = np.random.default_rng(0)
+    days = 5
+    n = len(df)
+    first_day = (month_end(df['month_id'].values - 1) + np.timedelta64(1, 'D')).astype('datetime64[D]')
+    rows = pd.DataFrame({'permno': np.repeat(df['permno'].values, days),
+                         'date': np.repeat(first_day, days) + np.tile(3*np.arange(days), n),
+                         'shrcd': np.repeat(df['shrcd'].values, days),
+                         'exchcd': np.repeat(df['exchcd'].values, days),
+                         'ret': rng.normal(0, 0.02, n*days),
+                         'shrout': np.repeat(df['shrout'].values, days),
+                         'prc': np.repeat(df['prc'].values, days)*np.exp(rng.normal(0, 0.01, n*days))})
+    rows.loc[rng.random(len(rows)) < 0.02, 'ret'] = np.nan
+    return rows.sort_values(['date', 'permno']).reset_index(drop=True)
+
+# All rows of a panel read back block by block: Inputs - panel and block rows
+def read_panel(panel, block_rows):
+    blocks = list(panel.blocks(list(panel.schema), block_rows))
+    return pd.DataFrame({col: np.concatenate([block[col] for block in blocks]) for col in panel.schema})
+
+# Query results of a dataframe by date partition, failing on a given call like a dropped WRDS session
+class FrameConnection:
+    def __init__(self, df, queries, fail_on=None):
+        self.df = df
+        self.queries = queries
+        self.fail_on = fail_on
+
+    def raw_sql(self, query):
+        self.queries.append(query)
+        if len(self.queries) == self.fail_on:
+            raise ConnectionError("Connection dropped")
+        start, end = query.split(':')
+        return self.df[(self.df['date'] >= start) & (self.df['date'] <= end)].sample(frac=1, random_state=0)
+
+    def close(self):
+        pass
+
+# Yearly date partitions of the daily rows
+def year_partitions(daily):
+    years = range(daily['date'].dt.year.min(), daily['date'].dt.year.max() + 1)
+    return [(str(year) + '-01-01', str(year) + '-12-31') for year in years]
+
+# Rows read back in blocks equal the appended rows, and rows of an append that did not finish are overwritten
+def test_columnar_panel_append_and_recovery(daily, tmp_path):
+    path = str(tmp_path / 'panel')
+    panel = ColumnarPanel.create(path, DAILY_STOCK_SCHEMA)
+    half = len(daily)//2
+    panel.append(daily[:half], 'first')
+
+    # An append that wrote part of the columns but not the row count
+    with open(os.path.join(path, 'ret.bin'), 'ab') as f:
+        np.arange(10, dtype=np.float64).tofile(f)
+    panel = ColumnarPanel(path)
+    assert panel.rows == half
+    panel.append(daily[half:], 'second')
+
+    result = read_panel(ColumnarPanel(path), 997)
+    assert ColumnarPanel(path).partitions == ['first', 'second']
+    np.testing.assert_array_equal(result['permno'], daily['permno'])
+    np.testing.assert_array_equal(result['date'], daily['date'].values.astype('datetime64[D]'))
+    np.testing.assert_array_equal(result['ret'], daily['ret'])
+    np.testing.assert_array_equal(result['prc'], daily['prc'].astype(np.float32))
+    np.testing.assert_array_equal(result['shrcd'], daily['shrcd'].fillna(-1).astype(np.int8))
+    assert os.path.getsize(os.path.join(path, 'ret.bin')) == 8*len(daily)
+
+# An existing panel is opened as is, a different schema is an error
+def test_open_or_create_checks_schema(daily, tmp_path):
+    path = str(tmp_path / 'panel')
+    ColumnarPanel.open_or_create(path, DAILY_STOCK_SCHEMA).append(daily[:100])
+    assert ColumnarPanel.open_or_create(path, DAILY_STOCK_SCHEMA).rows == 100
+
+    with pytest.raises(ValueError):
+        ColumnarPanel.open_or_create(path, dict(DAILY_STOCK_SCHEMA, ret='float32'))
+
+# A rerun after a dropped connection continues with the first missing partition and gives the rows of one run
+def test_ingest_partitioned_resumes(daily, tmp_path):
+    path = str(tmp_path / 'panel')
+    partitions = year_partitions(daily)
+    queries = []
+    with pytest.raises(ConnectionError):
+        ingest_partitioned(lambda: FrameConnection(daily, queries, fail_on=2), '{start}:{end}', partitions, path,
+                           DAILY_STOCK_SCHEMA, ['date', 'permno'])
+    assert ColumnarPanel(path).partitions == [partitions[0][0] + ':' + partitions[0][1]]
+
+    queries.clear()
+    panel = ingest_partitioned(lambda: FrameConnection(daily, queries), '{start}:{end}', partitions, path,
+                               DAILY_STOCK_SCHEMA, ['date', 'permno'])
+    assert len(queries) == len(partitions) - 1
+    result = read_panel(panel, 1000)
+    np.testing.assert_array_equal(result['permno'], daily['permno'])
+    np.testing.assert_array_equal(result['ret'], daily['ret'])
+
+# A partition that starts before the last date of the panel is rejected
+def test_ingest_partitioned_rejects_out_of_order(daily, tmp_path):
+    partitions = year_partitions(daily)
+    with pytest.raises(ValueError):
+        ingest_partitioned(lambda: FrameConnection(daily, []), '{start}:{end}', partitions[::-1],
+                           str(tmp_path / 'panel'), DAILY_STOCK_SCHEMA, ['date', 'permno'])
+
+# Daily equal- and value-weighted returns match a pandas groupby with the market value of the previous row of the
+# permno, carried across blocks
+@pytest.mark.parametrize('block_rows', [101, 10**7])
+def test_value_weighted_returns_match_pandas(daily, tmp_path, block_rows):
+    panel = ColumnarPanel.create(str(tmp_path / 'panel'), DAILY_STOCK_SCHEMA)
+    panel.append(daily)
+    result = value_weighted_returns(panel, 'permno', 'date', 'ret',
+                                    lambda block: np.abs(block['prc'].astype(np.float64))*block['shrout'],
+                                    lambda block: np.isin(block['shrcd'], [10, 11]), block_rows)
+
+    df = read_panel(panel, len(daily))
+    df['me'] = np.abs(df['prc'].astype(np.float64))*df['shrout'].astype(np.float64)
+    df['lag_me'] = df.groupby('permno')['me'].shift(1)
+    df = df[df['ret'].notna() & df['lag_me'].notna() & df['shrcd'].isin([10, 11])]
+    df['wret'] = df['lag_me']*df['ret']
+    grouped = df.groupby('date')
+    np.testing.assert_array_equal(result['date'].values, grouped.size().index.values.astype('datetime64[ns]'))
+    np.testing.assert_allclose(result['lag_MV'], grouped['lag_me'].sum(), rtol=1e-12)
+    np.testing.assert_allclose(result['Ew_Ret'], grouped['ret'].mean(), rtol=1e-10)
+    np.testing.assert_allclose(result['Vw_Ret'], grouped['wret'].sum()/grouped['lag_me'].sum(), rtol=1e-10)
+
+# Monthly volatilities match the std of the days of months i-window to i-1 in a loop over the months
+@pytest.mark.parametrize('window,lag', [(3, 1), (6, 2)])
+def test_monthly_volatility_from_daily_matches_loop(daily, window, lag):
+    days = daily.groupby('date')['ret'].agg(['mean', 'std']).reset_index()
+    days.loc[::7, 'std'] = np.nan
+    result = monthly_volatility_from_daily(days, ['mean', 'std'], window, lag, min_days=10)
+
+    month = month_id(days['date'])
+    for i, row in result.iterrows():
+        in_window = (month >= row['month_id'] - window - lag + 1) & (month <= row['month_id'] - lag)
+        for col in ['mean', 'std']:
+            values = days.loc[in_window, col]
+            expected = values.std()*np.sqrt(21) if i >= window + lag - 1 and values.count() >= 10 else np.nan
+            np.testing.assert_allclose(row[col], expected, rtol=1e-9)
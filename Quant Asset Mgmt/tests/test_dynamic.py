@@ -0,0 +1,114 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the streaming dynamic WML strategy: daily returns against pandas and monthly runs against a
+# rebuild from the first month
+# Akhil Srivastava
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qam_calendar import month_end
+from qam_daily import ColumnarPanel, DAILY_STOCK_SCHEMA
+from qam_dynamic import RollingVariance, daily_portfolio_returns, dynamic_momentum, load_dynamic_momentum
+
+# Portfolio assignments of the last 150 months of the synthetic panel (ten portfolios by permno, equal weights) and
+# daily rows that split every monthly return into 20 days starting on the first of the month
+@pytest.fixture(scope='module')
+def dynamic_data(crsp_panel):
+    df = crsp_panel[crsp_panel['ret'].notna() & (crsp_panel['month_id'] > crsp_panel['month_id'].max() - 150)]
+    assignments = pd.DataFrame({'permno': df['permno'].values, 'month_id': df['month_id'].values,
+                                'DM_decile': df['permno'].values % 10 + 1, 'Ret': df['ret'].values,
+                                'lag_Mkt_Cap': 1.0})
+
+    rng = np.random.default_rng(0)
+    days = 20
+    n = len(assignments)
+    first_day = (month_end(assignments['month_id'].values - 1) + np.timedelta64(1, 'D')).astype('datetime64[D]')
+    log_ret = np.repeat(np.log1p(assignments['Ret'].values)/days, days) + rng.normal(0, 0.01, n*days)
+    daily = pd.DataFrame({'permno': np.repeat(assignments['permno'].values, days),
+                          'date': np.repeat(first_day, days) + np.tile(np.arange(days), n),
+                          'shrcd': 10, 'exchcd': 1, 'ret': np.expm1(log_ret), 'shrout': 1.0, 'prc': 1.0})
+    return assignments, daily.sort_values(['date', 'permno']).reset_index(drop=True)
+
+# Daily panel of the rows before a date: Inputs - directory, daily rows and end date (None keeps all rows)
+def daily_panel(path, daily, end=None):
+    panel = ColumnarPanel.create(str(path), DAILY_STOCK_SCHEMA)
+    panel.append(daily if end is None else daily[daily['date'] < end])
+    return panel
+
+# Winner, loser and market returns of every day match a pandas weighted mean of the day's assigned stocks
+def test_daily_portfolio_returns_match_pandas(dynamic_data, tmp_path):
+    assignments, daily = dynamic_data
+    panel = daily_panel(tmp_path / 'panel', daily)
+    month = assignments['month_id'].max() - 5
+    current = assignments[assignments['month_id'] == month]
+    result = daily_portfolio_returns(panel, month, current['permno'].values, current['DM_decile'].values,
+                                     current['lag_Mkt_Cap'].values)
+
+    rows = daily[(daily['date'] > month_end(month - 1)) & (daily['date'] <= month_end(month))]
+    rows = rows.merge(current[['permno', 'DM_decile']], on='permno')
+    np.testing.assert_allclose(result['Market'], rows.groupby('date')['ret'].mean(), rtol=1e-12)
+    np.testing.assert_allclose(result['Winner'], rows[rows['DM_decile'] == 10].groupby('date')['ret'].mean(),
+                               rtol=1e-12)
+
+# A run continued month by month from the stored state gives the rows of a single run over all months, and the new
+# rows are stored before the state
+def test_stored_state_matches_single_run(dynamic_data, tmp_path):
+    assignments, daily = dynamic_data
+    full = dynamic_momentum(assignments, daily_panel(tmp_path / 'full', daily))
+    state_file = str(tmp_path / 'state.json')
+    stored = []
+    flags = []
+    state_months = []
+
+    # The state file still holds the previous run when the rows are stored
+    def store(rows, resumed):
+        state_months.append(load_dynamic_momentum(state_file).last_month if os.path.exists(state_file) else None)
+        stored.append(rows)
+        flags.append(resumed)
+
+    cut = daily['date'].values[int(len(daily)*0.8)]
+    panel = daily_panel(tmp_path / 'panel', daily, cut)
+    dynamic_momentum(assignments, panel, state_file, store)
+    panel.append(daily[daily['date'] >= cut])
+    dynamic_momentum(assignments, panel, state_file, store)
+
+    assert 0 < len(stored[1]) < len(full)
+    assert flags == [False, True] and state_months == [None, stored[0]['month_id'].max()]
+    pd.testing.assert_frame_equal(pd.concat(stored, ignore_index=True), full)
+
+# Revised monthly returns or other parameters rebuild the strategy from the first month
+def test_state_rebuilds_on_mismatch(dynamic_data, tmp_path):
+    assignments, daily = dynamic_data
+    panel = daily_panel(tmp_path / 'panel', daily)
+    state_file = str(tmp_path / 'state.json')
+    dynamic_momentum(assignments, panel, state_file)
+
+    revised = assignments.copy()
+    revised.loc[revised['month_id'] == revised['month_id'].min() + 3, 'Ret'] += 0.01
+    resumed = []
+    rows = dynamic_momentum(revised, panel, state_file, lambda rows, flag: resumed.append(flag))
+    pd.testing.assert_frame_equal(rows, dynamic_momentum(revised, panel))
+    rows = dynamic_momentum(revised, panel, state_file, lambda rows, flag: resumed.append(flag), risk_aversion=2.0)
+    pd.testing.assert_frame_equal(rows, dynamic_momentum(revised, panel, risk_aversion=2.0))
+    assert resumed == [False, False]
+
+# The rolling window variance matches pandas rolling var of the non-missing values, also after a state round trip
+def test_rolling_variance_matches_pandas():
+    values = np.random.default_rng(1).normal(0, 0.01, 1000)
+    values[::17] = np.nan
+    rolling = RollingVariance(126)
+    variance = []
+    for x in values:
+        rolling.update([x])
+        variance.append(rolling.variance())
+
+    expected = pd.Series(values).dropna().rolling(126).var()
+    np.testing.assert_allclose(np.array(variance)[~np.isnan(values)], expected.values, rtol=1e-9)
+    assert len(rolling.values) == 126
+    restored = RollingVariance.from_state(rolling.state())
+    restored.update(values[:50])
+    rolling.update(values[:50])
+    assert restored.variance() == rolling.variance()
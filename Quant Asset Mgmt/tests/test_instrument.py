@@ -0,0 +1,31 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the pipeline stage instrumentation
+# Akhil Srivastava
+
+import qam_instrument
+from qam_aggregation import grouped_weighted_mean
+from qam_instrument import start_trace, stop_trace, stage, run_stage, load_trace
+
+# Nested stages are written to the trace file with their input and output sizes
+def test_trace_round_trip(tmp_path, crsp_panel):
+    trace_file = str(tmp_path / 'trace.json')
+    start_trace('test', trace_file)
+    with stage('aggregate', crsp_panel):
+        result = run_stage('stats', grouped_weighted_mean, crsp_panel, 'month_id', 'ret', 'shrout')
+    stop_trace()
+
+    trace = load_trace(trace_file)
+    assert list(trace['stage']) == ['stats', 'aggregate']
+    assert list(trace['depth']) == [1, 0]
+    assert trace['rows_in'].iloc[0] == len(crsp_panel)
+    assert trace['rows_out'].iloc[0] == len(result)
+    assert (trace['peak_rss_mb'] > 0).all()
+
+# Stages are still recorded where the peak RSS cannot be measured
+def test_trace_without_rss(monkeypatch, crsp_panel):
+    monkeypatch.setattr(qam_instrument, 'peak_rss_bytes', lambda: None)
+    trace = start_trace('test')
+    with stage('aggregate'):
+        run_stage('stats', grouped_weighted_mean, crsp_panel, 'month_id', 'ret', 'shrout')
+    stop_trace()
+    assert trace.to_frame()['peak_rss_mb'].isna().all()
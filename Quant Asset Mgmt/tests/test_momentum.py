@@ -0,0 +1,54 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the momentum grid against pandas rolling sums and qcut deciles
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qam_aggregation import month_positions
+from qam_momentum import formation_signals, momentum_grid
+
+# Stock returns and lagged market caps of the synthetic panel, rows without a return or market cap dropped
+@pytest.fixture(scope='module')
+def momentum_panel(crsp_panel):
+    df = crsp_panel[['permno', 'month_id']].copy()
+    df['Ret'] = pd.to_numeric(crsp_panel['ret'], errors='coerce')
+    df['Mkt_Cap'] = crsp_panel['prc'].abs()*crsp_panel['shrout']
+    df['lag_Mkt_Cap'] = df.groupby('permno')['Mkt_Cap'].shift(1)
+    df = df[df['Ret'].notna() & (df['Ret'] > -1) & df['Mkt_Cap'].notna()]
+    return df.drop(columns='Mkt_Cap').reset_index(drop=True)
+
+# Formation returns of month t from the t-skip-J to t-skip-1 rolling sum of log returns on a dense month grid
+def pandas_signals(df, J, skip=1):
+    log_ret = np.log(1 + df.pivot(index='month_id', columns='permno', values='Ret'))
+    log_ret = log_ret.reindex(range(log_ret.index.min(), log_ret.index.max() + 1))
+    signal = log_ret.shift(skip + 1).rolling(J, min_periods=J).sum()
+    return signal.stack().rename('signal')
+
+# Running-sum signals match the pandas rolling sums, with and without a minimum number of months
+def test_formation_signals_match_rolling_sum(momentum_panel):
+    df = momentum_panel
+    position = month_positions(df, 'permno', 'month_id', 15)
+    signals = formation_signals(np.log(1 + df['Ret'].values), position, (3, 11))
+
+    for J in (3, 11):
+        expected = pandas_signals(df, J).reindex(pd.MultiIndex.from_frame(df[['month_id', 'permno']]))
+        np.testing.assert_allclose(signals[J], expected.values, rtol=0, atol=1e-10)
+
+# The J=11, skip=1, K=1 grid column matches the value-weighted pd.qcut decile 10 minus decile 1 return
+def test_momentum_grid_matches_qcut_deciles(momentum_panel):
+    df = momentum_panel
+    result = momentum_grid(df, formation_months=(11,), holding_months=(1,))
+
+    signal = pandas_signals(df, 11).reset_index()
+    ranked = df.merge(signal, on=['month_id', 'permno'])
+    ranked = ranked[ranked.groupby('month_id')['signal'].transform('size') >= 10]
+    ranked['decile'] = ranked.groupby('month_id')['signal'].transform(lambda x: pd.qcut(x, 10, labels=False))
+    held = ranked[ranked['lag_Mkt_Cap'] > 0].copy()
+    held['weighted'] = held['Ret']*held['lag_Mkt_Cap']
+    sums = held.groupby(['month_id', 'decile'])[['weighted', 'lag_Mkt_Cap']].sum()
+    decile_ret = (sums['weighted']/sums['lag_Mkt_Cap']).unstack()
+    expected = (decile_ret[9] - decile_ret[0]).reindex(ranked['month_id'].unique())
+
+    np.testing.assert_allclose(result.loc[expected.index, (11, 1)].values, expected.values, rtol=1e-10, atol=1e-12)
@@ -0,0 +1,107 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the streaming volatility estimators against pandas expanding and ewm estimates
+# Akhil Srivastava
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qam_online import OnlineEstimator, make_estimator, resume_estimator, load_estimator, online_volatility
+from qam_online import walk_forward_leverage
+
+# Exchange returns with missing months at the start of one column and in the middle of another
+def gappy_returns(exchange_returns):
+    returns = exchange_returns.copy()
+    returns.iloc[:24, 0] = np.nan
+    returns.iloc[100:106, 1] = np.nan
+    return returns
+
+# The expanding estimator matches pandas expanding std of the earlier months
+def test_expanding_matches_pandas(exchange_returns):
+    returns = gappy_returns(exchange_returns)
+    sigma = make_estimator('expanding', 3).run(returns.values)
+
+    np.testing.assert_allclose(sigma, returns.expanding(min_periods=2).std().shift(1).values, rtol=1e-10)
+
+# The EWMA estimator matches pandas ewm std of the earlier months, missing months still age the observations
+def test_ewma_matches_pandas(exchange_returns):
+    returns = gappy_returns(exchange_returns)
+    sigma = make_estimator('ewma', 3, halflife=12).run(returns.values)
+
+    expected = returns.ewm(halflife=12, min_periods=2).std().shift(1)
+    np.testing.assert_allclose(sigma, expected.values, rtol=1e-10)
+
+# The base class only defines the interface
+def test_online_estimator_is_abstract():
+    with pytest.raises(TypeError):
+        OnlineEstimator(2)
+
+# A stored estimator fed only the new months gives the estimates of a run over all months, and its state does not
+# grow with the months
+@pytest.mark.parametrize('estimator', ['expanding', 'ewma', 'garch'])
+def test_resume_matches_full_run(exchange_returns, tmp_path, estimator):
+    values = gappy_returns(exchange_returns).values
+    months = exchange_returns.index.values
+    state_file = str(tmp_path / 'state.json')
+    reference = make_estimator(estimator, 3)
+    full = reference.run(values)
+
+    start, estimates = resume_estimator(values[:400], months[:400], estimator, state_file)
+    assert start == 0
+    size = os.path.getsize(state_file)
+    start, estimates = resume_estimator(values, months, estimator, state_file, months[399])
+    assert start == 400
+    np.testing.assert_array_equal(estimates, full[400:])
+    stored, last_row = load_estimator(state_file, last_row=True)
+    assert last_row['month'] == months[-1]
+    assert abs(os.path.getsize(state_file) - size) < 100
+    np.testing.assert_array_equal(stored.volatility(), reference.volatility())
+
+# A revised last month, stored estimates that end elsewhere or other parameters rebuild the estimator from the first
+# month
+def test_resume_rebuilds_on_mismatch(exchange_returns, tmp_path):
+    values = exchange_returns.values
+    months = exchange_returns.index.values
+    state_file = str(tmp_path / 'state.json')
+    resume_estimator(values[:400], months[:400], 'ewma', state_file)
+
+    revised = values.copy()
+    revised[399, 0] += 0.01
+    start, estimates = resume_estimator(revised, months, 'ewma', state_file, months[399])
+    assert start == 0
+    np.testing.assert_array_equal(estimates, make_estimator('ewma', 3).run(revised))
+    start, estimates = resume_estimator(revised, months, 'ewma', state_file, months[300])
+    assert start == 0
+    start, estimates = resume_estimator(revised, months, 'ewma', state_file, months[-1], halflife=6)
+    assert start == 0
+    np.testing.assert_array_equal(estimates, make_estimator('ewma', 3, halflife=6).run(revised))
+
+# Volatilities continued from the stored state and the stored estimates match a run over all months
+def test_online_volatility_resume(exchange_returns, tmp_path):
+    returns = gappy_returns(exchange_returns).reset_index()
+    columns = [1, 2, 3]
+    state_file = str(tmp_path / 'sigma.json')
+    full = online_volatility(returns, columns, 'ewma', month_col='month_id')
+
+    stored = online_volatility(returns[:400], columns, 'ewma', state_file, month_col='month_id')
+    stored.index = returns['month_id'][:400]
+    resumed = online_volatility(returns, columns, 'ewma', state_file, stored, month_col='month_id')
+    pd.testing.assert_frame_equal(resumed, full)
+
+# Walk-forward leverage continued from its stored state matches the leverage of all months computed at once
+def test_walk_forward_leverage_resume(exchange_returns, tmp_path):
+    target = exchange_returns[1]
+    portfolio = exchange_returns[[2, 3]].mean(axis=1)
+    months = exchange_returns.index.values
+    state_file = str(tmp_path / 'walk_forward.json')
+    full = walk_forward_leverage(target.values, portfolio.values, 'expanding', min_periods=36)
+
+    expected = target.expanding(36).std().shift(1)/portfolio.expanding(36).std().shift(1)
+    np.testing.assert_allclose(full, expected.values, rtol=1e-10)
+    stored = walk_forward_leverage(target.values[:500], portfolio.values[:500], 'expanding', state_file, months[:500],
+                                   min_periods=36)
+    stored = pd.Series(stored, index=months[:500])
+    np.testing.assert_array_equal(walk_forward_leverage(target.values, portfolio.values, 'expanding', state_file,
+                                                        months, stored, min_periods=36), full)
@@ -0,0 +1,53 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the dense permno x month panel against the pandas groupby implementations
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+
+from qam_calendar import portfolio_year_month
+from qam_panel import DensePanel
+
+# Rows of the synthetic panel with a gap-free monthly history
+def gap_free(crsp_panel):
+    months = crsp_panel.groupby('permno')['month_id']
+    span = months.transform('max') - months.transform('min') + 1
+    return crsp_panel[span == months.transform('size')].reset_index(drop=True)
+
+# Long frames survive a round trip through the panel
+def test_round_trip(crsp_panel):
+    df = crsp_panel[['permno', 'date', 'ret', 'prc']]
+    panel = DensePanel.from_long(df, ['ret', 'prc'])
+
+    np.testing.assert_array_equal(panel.to_rows(panel['ret']), df['ret'].values)
+    pd.testing.assert_frame_equal(panel.to_long(), df.sort_values(['permno', 'date']).reset_index(drop=True),
+                                  check_dtype=False)
+
+# Lags and window sums match groupby shift and rolling sums on histories without gaps
+def test_shift_and_rolling_sum_match_groupby(crsp_panel):
+    df = gap_free(crsp_panel)
+    df['log_ret'] = np.log1p(df['ret'].fillna(0))
+    panel = DensePanel.from_long(df, ['prc', 'log_ret'])
+
+    np.testing.assert_array_equal(panel.to_rows(panel.shift('prc', 1)), df.groupby('permno')['prc'].shift(1))
+    expected = df.groupby('permno')['log_ret'].shift(2).groupby(df['permno']).rolling(11).sum()
+    np.testing.assert_allclose(panel.to_rows(panel.rolling_sum('log_ret', 11, lag=2)),
+                               expected.reset_index(level=0, drop=True), rtol=1e-12, atol=1e-14)
+
+# Gaps are missing months of the lag, not the previous row
+def test_shift_across_a_gap():
+    df = pd.DataFrame({'permno': [1, 1, 1], 'date': pd.to_datetime(['2000-01-31', '2000-02-29', '2000-04-30']),
+                       'me': [1.0, 2.0, 4.0]})
+    panel = DensePanel.from_long(df, ['me'])
+    np.testing.assert_array_equal(panel.to_rows(panel.shift('me', 1)), [np.nan, 1.0, np.nan])
+
+# The portfolio year cumprod matches groupby(permno, Port_Year).cumprod bit for bit, gaps and NaN included
+def test_cumprod_matches_groupby(crsp_panel):
+    df = crsp_panel[['permno', 'date', 'month_id', 'retx']].copy()
+    df['1+retx'] = 1 + df['retx']
+    df['Port_Year'] = portfolio_year_month(df['month_id'].values)[0]
+    df = df.drop(index=df.index[5::13]).reset_index(drop=True)
+
+    panel = DensePanel.from_long(df, ['1+retx'])
+    result = panel.to_rows(panel.cumprod('1+retx', reset_key=portfolio_year_month(panel.months)[0]))
+    np.testing.assert_array_equal(result, df.groupby(['permno', 'Port_Year'])['1+retx'].cumprod())
@@ -0,0 +1,56 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the batched trailing covariances and ERC weights against pandas rolling estimates
+# Akhil Srivastava
+
+import warnings
+
+import numpy as np
+
+from qam_riskparity import trailing_covariance, erc_weights, sequential_erc_weights, risk_contributions
+
+# Trailing covariances of months i-36 to i-1 match pandas rolling covariances shifted by one month
+def test_trailing_covariance_matches_rolling_cov(exchange_returns):
+    cov = trailing_covariance(exchange_returns.values, 36)
+
+    expected = exchange_returns.rolling(36).cov()
+    for i, a in enumerate(exchange_returns.columns):
+        for j, b in enumerate(exchange_returns.columns):
+            rolling = expected.xs(b, level=1)[a].shift(1)
+            np.testing.assert_allclose(cov[:, i, j], rolling.values, rtol=1e-10, atol=1e-16)
+
+# With two assets the ERC weights are the inverse volatilities whatever the correlation
+def test_two_asset_erc_is_inverse_volatility(exchange_returns):
+    rets = exchange_returns[[1, 3]]
+    sigma = rets.rolling(36).std().shift(1)
+    y = erc_weights(trailing_covariance(rets.values, 36))
+
+    ratio = y/y.sum(axis=1, keepdims=True)
+    expected = (1/sigma).div((1/sigma).sum(axis=1), axis=0)
+    np.testing.assert_allclose(ratio, expected.values, rtol=1e-10)
+
+# Every asset contributes the same share of the variance, and warm starts reach the batched solution
+def test_erc_equal_risk_contributions(exchange_returns):
+    cov = trailing_covariance(exchange_returns.values, 36)
+    y = erc_weights(cov)
+    valid = ~np.isnan(cov).any(axis=(1, 2))
+
+    assert not np.isnan(y[valid]).any()
+    np.testing.assert_allclose(risk_contributions(cov[valid], y[valid]), 1/3, rtol=1e-8)
+    np.testing.assert_allclose(sequential_erc_weights(cov), y, rtol=1e-8)
+    np.testing.assert_allclose(sequential_erc_weights(cov[-12:], w0=y[-13]), y[-12:], rtol=1e-8)
+
+# Pairwise covariances of windows with missing months that are not positive definite give NaN weights without a
+# RuntimeWarning, the other months are solved as usual
+def test_erc_skips_indefinite_covariances():
+    cov = np.array([[[6.3e-3, -6.0e-4], [-6.0e-4, 4.3e-5]],
+                    [[4e-3, 1e-4], [1e-4, 1e-4]],
+                    [[np.nan, np.nan], [np.nan, np.nan]]])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        weights = erc_weights(cov)
+        sequential = sequential_erc_weights(cov)
+
+    assert np.isnan(weights[[0, 2]]).all()
+    inverse_vol = 1/np.sqrt([4e-3, 1e-4])
+    np.testing.assert_allclose(weights[1]/weights[1].sum(), inverse_vol/inverse_vol.sum(), rtol=1e-12)
+    np.testing.assert_array_equal(np.isnan(sequential), np.isnan(weights))
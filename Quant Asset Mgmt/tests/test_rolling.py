@@ -0,0 +1,47 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the trailing-window volatilities against the PS2 loop over 36-month slices
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qam_rolling import trailing_std, trailing_volatility
+
+# Exchange returns with missing months at the start of one column and scattered in another
+def gappy_returns(exchange_returns):
+    returns = exchange_returns.copy()
+    returns.iloc[:50, 0] = np.nan
+    returns.iloc[200:240:3, 1] = np.nan
+    returns.iloc[300:334, 2] = np.nan
+    return returns
+
+# Volatility of every month from the rows i-window-lag+1 to i-lag, the loop of the original PS2-Q3 (.std() of the
+# slice, NaN with fewer than min_periods returns)
+def loop_volatility(returns, window, lag=1, min_periods=2):
+    expected = pd.DataFrame(np.nan, index=returns.index, columns=returns.columns)
+    for i in range(window + lag - 1, len(returns)):
+        rows = returns[i - window - lag + 1:i - lag + 1]
+        expected.iloc[i] = rows.std().where(rows.count() >= min_periods)
+    return expected
+
+# The trailing volatility matches the loop, missing months skipped like .std()
+@pytest.mark.parametrize('window,lag', [(36, 1), (12, 2)])
+def test_trailing_volatility_matches_loop(exchange_returns, window, lag):
+    returns = gappy_returns(exchange_returns)
+    result = trailing_volatility(returns, list(returns.columns), window, lag=lag)
+
+    expected = loop_volatility(returns, window, lag)
+    np.testing.assert_array_equal(result.isna().values, expected.isna().values)
+    np.testing.assert_allclose(result.values, expected.values, rtol=1e-9, atol=1e-15)
+
+# Windows with fewer than min_periods returns are NaN, a single series gives a 1-d result
+def test_trailing_std_min_periods(exchange_returns):
+    returns = gappy_returns(exchange_returns)
+    result = trailing_std(returns.values, 36, min_periods=30)
+
+    expected = loop_volatility(returns, 36, min_periods=30)
+    np.testing.assert_array_equal(np.isnan(result), expected.isna().values)
+    np.testing.assert_allclose(result, expected.values, rtol=1e-9, atol=1e-15)
+    assert np.isnan(result[310:340, 2]).all()
+    np.testing.assert_allclose(trailing_std(returns.iloc[:, 2].values, 36, min_periods=30), result[:, 2], rtol=0)
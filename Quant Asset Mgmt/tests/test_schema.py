@@ -0,0 +1,49 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the compact CRSP schema and the memory report
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import qam_schema
+from qam_schema import apply_schema, MemoryReport, CRSP_SCHEMA
+from qam_storage import save_artifact, load_artifact
+
+# Integer columns keep their values, columns with missing values use the nullable type of the same width
+def test_apply_schema_dtypes(crsp_processed):
+    result = apply_schema(crsp_processed, CRSP_SCHEMA)
+
+    assert result['permno'].dtype == np.int32
+    assert result['permco'].dtype == pd.Int32Dtype()
+    assert result['exchcd'].dtype == pd.Int8Dtype()
+    assert result['dlstcd'].dtype == pd.Int16Dtype()
+    for col in ['permno', 'permco', 'shrcd', 'exchcd', 'shrout', 'dlstcd']:
+        np.testing.assert_array_equal(result[col].astype('float64').values, crsp_processed[col].astype('float64'))
+
+# Nullable integer columns survive a round trip through the artifact store
+def test_nullable_columns_round_trip(tmp_path, crsp_processed):
+    result = apply_schema(crsp_processed, CRSP_SCHEMA)
+    save_artifact(result, tmp_path, 'mscrsp_processed')
+    pd.testing.assert_frame_equal(load_artifact(tmp_path, 'mscrsp_processed'), result)
+
+# Columns without any value (delisting codes of a month without delistings) use the nullable type
+def test_apply_schema_all_missing():
+    df = pd.DataFrame({'permno': [10001, 10002], 'dlstcd': [None, None], 'exchcd': pd.array([None, None], dtype='Int8')})
+    result = apply_schema(df, CRSP_SCHEMA)
+
+    assert result['dlstcd'].dtype == pd.Int16Dtype()
+    assert result['exchcd'].dtype == pd.Int8Dtype()
+    assert result['dlstcd'].isna().all() and result['exchcd'].isna().all()
+
+# Values outside the range of the compact type are rejected instead of wrapping around
+def test_apply_schema_overflow():
+    with pytest.raises(ValueError, match='does not fit'):
+        apply_schema(pd.DataFrame({'exchcd': [1.0, np.nan, 300.0]}), CRSP_SCHEMA)
+
+# The memory report works where the peak RSS cannot be measured
+def test_memory_report_without_rss(monkeypatch, crsp_processed):
+    monkeypatch.setattr(qam_schema, 'peak_rss_bytes', lambda: None)
+    report = MemoryReport()
+    report.record('mscrsp_processed', crsp_processed)
+    assert report.to_frame()['peak_rss_mb'].isna().all()
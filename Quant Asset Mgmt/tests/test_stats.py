@@ -0,0 +1,39 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the vectorized performance statistics against the pandas per-column statistics
+# Akhil Srivastava
+
+import numpy as np
+
+from qam_stats import performance_stats, paired_correlation
+
+# Exchange returns with a different number of missing months at the start of every column
+def staggered_returns(exchange_returns):
+    returns = exchange_returns.copy()
+    for i in range(returns.shape[1]):
+        returns.iloc[:12*i, i] = np.nan
+    return returns
+
+# Every column's stats match the pandas stats of its own non-missing months
+def test_performance_stats_match_pandas(exchange_returns):
+    returns = staggered_returns(exchange_returns)
+    stats = performance_stats(returns)
+
+    np.testing.assert_allclose(stats['mean'], 100*12*returns.mean(), rtol=1e-12)
+    np.testing.assert_allclose(stats['vol'], 100*np.sqrt(12)*returns.std(), rtol=1e-12)
+    np.testing.assert_allclose(stats['sharpe'], np.sqrt(12)*returns.mean()/returns.std(), rtol=1e-12)
+    np.testing.assert_allclose(stats['skew'], returns.skew(), rtol=1e-10)
+    np.testing.assert_allclose(stats['kurtosis'], returns.kurt(), rtol=1e-10)
+    np.testing.assert_allclose(stats['tstat'], returns.mean()/(returns.std()/np.sqrt(returns.count())), rtol=1e-12)
+    last = returns.iloc[-60:]
+    np.testing.assert_allclose(stats['tstat_5yr'], last.mean()/(last.std()/np.sqrt(60)), rtol=1e-12)
+
+# Correlations use the months both series have, like np.corrcoef on the common months
+def test_paired_correlation_matches_corrcoef(exchange_returns):
+    returns = staggered_returns(exchange_returns)
+    reference = exchange_returns[[3, 1, 2]].values
+    corr = paired_correlation(returns.values, reference)
+
+    for i in range(3):
+        both = returns.iloc[:, i].notna().values
+        np.testing.assert_allclose(corr[i], np.corrcoef(returns.values[both, i], reference[both, i])[0, 1],
+                                   rtol=1e-12)
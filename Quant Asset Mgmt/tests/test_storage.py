@@ -0,0 +1,54 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the year-partitioned artifact store against the in-memory frames
+# Akhil Srivastava
+
+import pandas as pd
+import pytest
+
+from qam_storage import save_artifact, append_artifact, load_artifact, artifact_exists
+
+# A saved artifact loads back with the same rows, row order, dtypes and index
+def test_round_trip(tmp_path, crsp_panel):
+    df = crsp_panel.sample(frac=1.0, random_state=0)
+    save_artifact(df, tmp_path, 'panel')
+
+    assert artifact_exists(tmp_path, 'panel')
+    pd.testing.assert_frame_equal(load_artifact(tmp_path, 'panel'), df.reset_index(drop=True))
+
+    series = df.groupby('date')[['ret']].mean()
+    save_artifact(series, tmp_path, 'series')
+    pd.testing.assert_frame_equal(load_artifact(tmp_path, 'series'), series)
+
+# Column projection and date ranges match the same selection in pandas
+def test_column_and_date_selection(tmp_path, crsp_panel):
+    save_artifact(crsp_panel, tmp_path, 'panel')
+    result = load_artifact(tmp_path, 'panel', columns=['permno', 'ret'], start='1960-03-15', end='1971-06-30')
+
+    keep = (crsp_panel['date'] >= '1960-03-15') & (crsp_panel['date'] <= '1971-06-30')
+    expected = crsp_panel.loc[keep, ['permno', 'ret']].reset_index(drop=True)
+    pd.testing.assert_frame_equal(result, expected)
+
+# Appending the last months gives the same artifact as saving the whole panel
+def test_append_matches_save(tmp_path, crsp_panel):
+    df = crsp_panel.sort_values(['date', 'permno']).reset_index(drop=True)
+    cut = df['date'] >= '2023-06-01'
+    save_artifact(df[~cut], tmp_path, 'panel')
+    append_artifact(df[cut].iloc[:10], tmp_path, 'panel')
+    append_artifact(df[cut].iloc[10:], tmp_path, 'panel')
+
+    pd.testing.assert_frame_equal(load_artifact(tmp_path, 'panel'), df)
+
+# Rows without a partition year are rejected instead of being written to an invalid partition
+def test_missing_dates_are_rejected(tmp_path, crsp_panel):
+    df = crsp_panel.head(100).copy()
+    save_artifact(df, tmp_path, 'panel')
+
+    bad = df.head(3).copy()
+    bad['date'] = pd.NaT
+    with pytest.raises(ValueError, match='missing or invalid date'):
+        append_artifact(bad, tmp_path, 'panel')
+    with pytest.raises(ValueError, match='missing or invalid date'):
+        save_artifact(bad, tmp_path, 'bad')
+
+    pd.testing.assert_frame_equal(load_artifact(tmp_path, 'panel'), df)
+    assert not artifact_exists(tmp_path, 'bad')
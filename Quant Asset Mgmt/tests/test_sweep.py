@@ -0,0 +1,84 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the risk parity sweep against PS2-Q3/Q4 and a loop over the rebalance months
+# Akhil Srivastava
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from qam_calendar import year_month, year_month_id
+from qam_sweep import risk_parity_sweep, STAT_COLUMNS
+
+# PS2-Q2 layout built from the exchange returns: NYSE as the stock and NASDAQ as the bond excess returns, with
+# market values that change over time
+@pytest.fixture(scope='module')
+def universe(exchange_returns):
+    month = exchange_returns.index.values.astype(np.int64)
+    df = pd.DataFrame({'Year': year_month(month)[0], 'Month': year_month(month)[1], 'month_id': month,
+                       'Stock_lag_MV': 1000 + np.arange(len(month)),
+                       'Stock_Excess_Vw_Ret': exchange_returns[1.0].values,
+                       'Bond_lag_MV': 500 + 0.5*np.arange(len(month))[::-1],
+                       'Bond_Excess_Vw_Ret': exchange_returns[3.0].values})
+    df.loc[[5, 400], 'Bond_Excess_Vw_Ret'] = np.nan
+    return df
+
+# The 36-month, inverse volatility, monthly rebalanced rows reproduce the PS2-Q4 unlevered and levered RP rows
+def test_sweep_matches_ps2_q4(universe):
+    # The problem set script imports these at the top
+    for module in ('matplotlib', 'pandas_datareader', 'wrds'):
+        pytest.importorskip(module)
+    import PS2_706325626_code as ps2
+
+    sweep = risk_parity_sweep(universe, (36,), ('inverse_vol',), (1,), ('vw',),
+                              (ps2.min_report_year, ps2.min_report_month), (ps2.max_report_year, ps2.max_report_month),
+                              processes=1)
+    ps2_q4 = ps2.PS2_Q4(ps2.PS2_Q3(universe))
+
+    for portfolio in ['unlevered RP', 'levered RP']:
+        row = sweep[sweep['portfolio'] == portfolio].iloc[0]
+        np.testing.assert_allclose(row[list(STAT_COLUMNS.values())].values.astype(float),
+                                   ps2_q4.loc[portfolio, list(STAT_COLUMNS.values())].values, rtol=1e-9)
+        assert row['Months'] == ps2_q4.loc[portfolio, 'Months']
+
+# Unlevered and levered RP returns with the inverse volatility weights of the latest rebalance month, from a loop over
+# the months: Inputs - universe, window, rebalance frequency and volatility target ('vw' or the stock share)
+def loop_rebalanced_returns(universe, window, rebalance, vol_target):
+    stock = universe['Stock_Excess_Vw_Ret']
+    bond = universe['Bond_Excess_Vw_Ret']
+    vw = (stock*universe['Stock_lag_MV'] + bond*universe['Bond_lag_MV'])/(universe['Stock_lag_MV'] +
+                                                                         universe['Bond_lag_MV'])
+    unlevered = pd.Series(np.nan, index=universe.index)
+    port = pd.Series(np.nan, index=universe.index)
+    weights = None
+    for i in range(window, len(universe)):
+        if stock[i - window:i].count() < 2 or bond[i - window:i].count() < 2:
+            continue
+        if np.isnan([stock[i], bond[i], vw[i]]).any():
+            continue
+        # Rebalance in the months since January 1926 divisible by the frequency, hold the weights in between
+        if (universe['month_id'][i] - 1) % rebalance == 0:
+            weights = np.array([1/stock[i - window:i].std(), 1/bond[i - window:i].std()])
+        if weights is not None:
+            port[i] = weights[0]*stock[i] + weights[1]*bond[i]
+            unlevered[i] = port[i]/weights.sum()
+    target = vw if vol_target == 'vw' else vol_target*stock + (1 - vol_target)*bond
+    held = port.notna()
+    return unlevered, target[held].std()/port[held].std()*port
+
+# Quarterly and annual rebalances hold the weights of the latest rebalance month, as in the loop
+@pytest.mark.parametrize('rebalance', [3, 12])
+def test_sweep_rebalance_holds_latest_weights(universe, rebalance):
+    sweep = risk_parity_sweep(universe, (24,), ('inverse_vol',), (rebalance,), ('vw', 0.6), (1929, 1), (2010, 6),
+                              processes=1)
+    report = (universe['month_id'] >= year_month_id(1929, 1)) & (universe['month_id'] <= year_month_id(2010, 6))
+
+    for vol_target in ['vw', 0.6]:
+        unlevered, levered = loop_rebalanced_returns(universe, 24, rebalance, vol_target)
+        rows = {'unlevered RP': sweep[sweep['portfolio'] == 'unlevered RP'].iloc[0],
+                'levered RP': sweep[(sweep['portfolio'] == 'levered RP') & (sweep['vol_target'] == vol_target)].iloc[0]}
+        for portfolio, series in [('unlevered RP', unlevered[report]), ('levered RP', levered[report])]:
+            row = rows[portfolio]
+            assert row['Months'] == series.count()
+            np.testing.assert_allclose(row['Annualized Mean'], 100*12*series.mean(), rtol=1e-9)
+            np.testing.assert_allclose(row['Annualized Standard Deviation'], 100*np.sqrt(12)*series.std(), rtol=1e-9)
+            np.testing.assert_allclose(row['Skewness'], series.skew(), rtol=1e-8)
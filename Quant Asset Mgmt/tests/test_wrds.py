@@ -0,0 +1,79 @@
+# MGMTMFE 431 - Quantitative Asset Management
+# Regression tests of the partitioned WRDS extraction against a single query on the SQLite stand-in
+# Akhil Srivastava
+
+import datetime
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from qam_wrds import date_partitions, download_partitioned, SQLiteConnection, create_sqlite_standin, \
+    _checkpoint_file
+
+MSF_QUERY = "select permno, date, ret from crspq.msf where date between '{start}' and '{end}'"
+
+# SQLite stand-in serving crspq.msf built from the synthetic monthly stock file
+@pytest.fixture
+def standin(tmp_path, synthetic):
+    path = str(tmp_path / 'crspq.db')
+    create_sqlite_standin(path, {'msf': synthetic['mscrsp_raw'][['permno', 'date', 'ret']]})
+    return lambda: SQLiteConnection({'crspq': path})
+
+# Connection factory that fails on the first calls, like a dropped WRDS session
+class FlakyConnect:
+    def __init__(self, connect, failures):
+        self.connect = connect
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError('session dropped')
+        return self.connect()
+
+# The partitioned download returns the same rows as one query over the whole history
+def test_partitioned_matches_single_query(tmp_path, standin):
+    conn = standin()
+    expected = conn.raw_sql(MSF_QUERY.format(start='1925-01-01', end='2023-12-31'))
+    conn.close()
+
+    partitions = date_partitions(1925, 2023, years_per_partition=10)
+    result = download_partitioned(standin, MSF_QUERY, partitions, str(tmp_path), 'msf', max_workers=3)
+    pd.testing.assert_frame_equal(result.sort_values(['date', 'permno']).reset_index(drop=True),
+                                  expected.sort_values(['date', 'permno']).reset_index(drop=True))
+
+# Failed connection attempts are retried
+def test_connection_failures_are_retried(tmp_path, standin):
+    connect = FlakyConnect(standin, failures=2)
+    result = download_partitioned(connect, MSF_QUERY, [('2000-01-01', '2009-12-31')], str(tmp_path), 'msf',
+                                  max_workers=1, retries=2)
+    assert len(result) > 0
+    assert connect.calls == 3
+
+# Closed partitions are reused, the partition holding the fetch date and forced refreshes are fetched again
+def test_open_partitions_are_refetched(tmp_path, standin):
+    closed = ('2000-01-01', '2009-12-31')
+    today = datetime.date.today()
+    current = (str(today.year) + '-01-01', str(today.year) + '-12-31')
+    download_partitioned(standin, MSF_QUERY, [closed, current], str(tmp_path), 'msf')
+
+    connect = FlakyConnect(standin, failures=0)
+    download_partitioned(connect, MSF_QUERY, [closed, current], str(tmp_path), 'msf', max_workers=1)
+    assert connect.calls == 1
+
+    # A checkpoint fetched before the end of its partition expires as well
+    with open(_checkpoint_file(str(tmp_path), 'msf', closed) + '.json', 'w') as f:
+        json.dump({'fetched': '2009-06-30'}, f)
+    connect = FlakyConnect(standin, failures=0)
+    download_partitioned(connect, MSF_QUERY, [closed], str(tmp_path), 'msf', max_workers=1)
+    assert connect.calls == 1
+
+    connect = FlakyConnect(standin, failures=0)
+    download_partitioned(connect, MSF_QUERY, [closed], str(tmp_path), 'msf', max_workers=1)
+    assert connect.calls == 0
+    download_partitioned(connect, MSF_QUERY, [closed], str(tmp_path), 'msf', max_workers=1, refresh=True)
+    assert connect.calls == 1
+    assert os.path.exists(os.path.join(str(tmp_path), 'msf', 'manifest.json'))